@@ -0,0 +1,140 @@
+"""_summary_
+Benchmarks the goodput of an overloaded worker with and without admission control.
+
+A threaded server runs an endpoint that holds one of --pool connections of a simulated
+MongoDB pool for --service-ms milliseconds, reporting its checkouts to a
+shared.admission.PoolWaitMonitor as a MongoClient would. --clients clients call it in a
+loop with a --timeout like the gateway's, and retry after a 503 once its Retry-After
+has passed. The benchmark runs --seconds at each client count up to --clients, first
+without admission control and then with a concurrency limit of --limit, and reports the
+requests answered successfully within the timeout per second (goodput), the 503s per
+second and the 99th percentile latency of the successful requests.
+
+Usage:
+    python experiments/benchmark_admission.py --pool 4 --service-ms 20 --clients 64 \\
+        --timeout 0.25 --limit 8
+Author:
+    @TheBarzani
+"""
+
+import argparse
+import logging
+import os
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, List, Optional
+from werkzeug.serving import make_server
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+# pylint: disable=wrong-import-position
+from flask import Flask
+from pymongo import monitoring
+from shared.admission import AdmissionController, AdmissionMiddleware, PoolWaitMonitor
+
+ADDRESS = ('localhost', 27017)
+
+def create_app(pool_size: int, service_seconds: float, monitor: PoolWaitMonitor,
+               limit: Optional[int], max_pool_wait_ms: float) -> Flask:
+    """
+    Returns:
+        Flask: An application whose GET /work holds a pooled connection for the service
+               time, behind admission control when a limit is given.
+    """
+    app = Flask(__name__)
+    pool = threading.Semaphore(pool_size)
+
+    @app.route('/work')
+    def work() -> Dict[str, bool]:
+        monitor.connection_check_out_started(monitoring.ConnectionCheckOutStartedEvent(ADDRESS))
+        started = time.monotonic()
+        with pool:
+            monitor.connection_checked_out(monitoring.ConnectionCheckedOutEvent(
+                ADDRESS, 1, time.monotonic() - started))
+            time.sleep(service_seconds)
+        return {'done': True}
+
+    if limit is not None:
+        controller = AdmissionController({'read': limit, 'write': limit}, max_pool_wait_ms,
+                                         monitor)
+        app.wsgi_app = AdmissionMiddleware(app.wsgi_app, controller, [], 1)  # type: ignore
+    return app
+
+def run_clients(url: str, clients: int, seconds: float, timeout: float) -> Dict[str, float]:
+    """
+    Returns:
+        Dict[str, float]: The goodput and 503s per second and the 99th percentile latency
+                          of the successful requests in milliseconds.
+    """
+    latencies: List[float] = []
+    counts = {'shed': 0, 'timeout': 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def client() -> None:
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            try:
+                with urllib.request.urlopen(url, timeout=timeout) as response:
+                    response.read()
+                with lock:
+                    latencies.append((time.monotonic() - started) * 1000)
+            except urllib.error.HTTPError as error:
+                with lock:
+                    counts['shed'] += 1
+                time.sleep(float(error.headers.get('Retry-After', '1')))
+            except OSError:
+                with lock:
+                    counts['timeout'] += 1
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {'goodput': len(latencies) / seconds, 'shed': counts['shed'] / seconds,
+            'timeouts': counts['timeout'] / seconds,
+            'p99': (statistics.quantiles(latencies, n=100)[98] if len(latencies) > 1
+                    else float('nan'))}
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--pool', type=int, default=4, help='Connections of the pool.')
+    parser.add_argument('--service-ms', type=float, default=20,
+                        help='Milliseconds a request holds a connection.')
+    parser.add_argument('--clients', type=int, default=64, help='The largest client count.')
+    parser.add_argument('--seconds', type=float, default=5, help='Seconds per run.')
+    parser.add_argument('--timeout', type=float, default=0.25,
+                        help='Seconds after which a client gives up on a request.')
+    parser.add_argument('--limit', type=int, default=8,
+                        help='The concurrency limit of admission control.')
+    parser.add_argument('--max-pool-wait-ms', type=float, default=50,
+                        help='The pool wait bound of admission control.')
+    args = parser.parse_args()
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    capacity = args.pool / (args.service_ms / 1000)
+    print(f'Capacity: {capacity:.0f} requests/s')
+    client_counts = sorted({max(1, args.clients // 8), args.clients // 4, args.clients // 2,
+                            args.clients})
+    for limit in (None, args.limit):
+        label = 'without admission control' if limit is None else f'with a limit of {limit}'
+        print(f'\n{label}\n{"clients":>8} {"goodput/s":>10} {"503/s":>8} {"timeouts/s":>11} '
+              f'{"p99 ms":>8}')
+        for clients in client_counts:
+            app = create_app(args.pool, args.service_ms / 1000, PoolWaitMonitor(), limit,
+                             args.max_pool_wait_ms)
+            server = make_server('localhost', 0, app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            result = run_clients(f'http://localhost:{server.server_port}/work', clients,
+                                 args.seconds, args.timeout)
+            server.shutdown()
+            print(f'{clients:>8} {result["goodput"]:>10.0f} {result["shed"]:>8.0f} '
+                  f'{result["timeouts"]:>11.0f} {result["p99"]:>8.1f}')
+
+if __name__ == '__main__':
+    main()
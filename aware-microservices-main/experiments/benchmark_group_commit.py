@@ -0,0 +1,113 @@
+"""_summary_
+Benchmarks order inserts with and without the group commit writer.
+
+For each number of concurrent request threads it inserts orders one insert_one per
+thread, as the POST /orders handler does by default, and then through a GroupCommitWriter
+for each of the given windows, and reports the throughput together with the median and
+99th percentile latency of a single insert. With one thread the writer only adds its
+window to every insert; the more threads insert at once, the more of them share one
+insert_many round trip.
+
+The benchmark runs against MONGO_URI in a scratch database that is dropped afterwards.
+
+Usage:
+    python experiments/benchmark_group_commit.py --orders 20000 --threads 1,8,32,64 --windows 1,5
+Author:
+    @TheBarzani
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+load_dotenv()
+
+# pylint: disable=wrong-import-position
+from order_service.app.group_commit import GroupCommitWriter
+from shared.ids import new_id
+
+def make_order() -> Dict[str, Any]:
+    """
+    Returns an order shaped like the ones the POST /orders handler inserts.
+    """
+    return {'orderId': new_id(), 'userId': new_id(), 'orderStatus': 'under process',
+            'items': [{'itemId': 'item-1', 'quantity': 2, 'price': 9.99}],
+            'itemCount': 1, 'totalQuantity': 2, 'totalAmount': 19.98,
+            'userEmails': ['user@example.com'],
+            'deliveryAddress': {'street': '1 Main St', 'city': 'Montreal',
+                                'state': 'QC', 'postalCode': 'H1A 1A1', 'country': 'CA'}}
+
+def run(insert: Callable[[Dict[str, Any]], Any], orders: int,
+        threads: int) -> Dict[str, float]:
+    """
+    Inserts the orders from concurrent threads and measures throughput and latency.
+    """
+    latencies: List[float] = []
+    lock = threading.Lock()
+    per_thread = orders // threads
+
+    def work() -> None:
+        own = []
+        for _ in range(per_thread):
+            order = make_order()
+            started = time.perf_counter()
+            insert(order)
+            own.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(own)
+
+    workers = [threading.Thread(target=work) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {'orders/s': len(latencies) / elapsed,
+            'p50 ms': statistics.median(latencies) * 1000,
+            'p99 ms': latencies[int(len(latencies) * 0.99) - 1] * 1000}
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--orders', type=int, default=20_000)
+    parser.add_argument('--threads', default='1,8,32,64',
+                        help='comma separated numbers of concurrent threads')
+    parser.add_argument('--windows', default='1,5',
+                        help='comma separated group commit windows in milliseconds')
+    parser.add_argument('--max-batch', type=int, default=100)
+    args = parser.parse_args()
+
+    client = MongoClient(os.getenv('MONGO_URI'), maxPoolSize=200)
+    db = client['benchmark_group_commit']
+    client.drop_database(db.name)
+    collection = db['orders']
+    collection.create_index('orderId', unique=True, name='orders_orderId')
+
+    print(f"{args.orders} orders per run")
+    print(f"{'threads':>8}  {'mode':<14}{'orders/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for threads in (int(value) for value in args.threads.split(',')):
+        result = run(collection.insert_one, args.orders, threads)
+        print(f"{threads:>8}  {'insert_one':<14}{result['orders/s']:>10.0f}"
+              f"{result['p50 ms']:>10.2f}{result['p99 ms']:>10.2f}")
+        for window in (float(value) for value in args.windows.split(',')):
+            writer = GroupCommitWriter(collection, window / 1000, args.max_batch)
+            result = run(writer.insert, args.orders, threads)
+            writer.stop()
+            mode = f'group {window:g} ms'
+            print(f"{threads:>8}  {mode:<14}{result['orders/s']:>10.0f}"
+                  f"{result['p50 ms']:>10.2f}{result['p99 ms']:>10.2f}")
+        collection.delete_many({})
+
+    client.drop_database(db.name)
+
+if __name__ == "__main__":
+    main()
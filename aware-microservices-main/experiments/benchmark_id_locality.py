@@ -0,0 +1,94 @@
+"""_summary_
+Benchmarks the write locality of the identifier schemes used for orders and users.
+
+For each scheme it inserts the same number of documents into a collection with a unique
+index on the identifier, the way orders are indexed on orderId and users on userId, and
+reports the insert throughput over the whole run and over its last tenth, when the index
+is largest, together with the size of the identifier index. The schemes are the former
+string uuid1 (orders) and uuid4 (users) identifiers and the UUIDv7 based identifiers of
+shared.ids.
+
+Random keys such as uuid4 insert into any page of the index, so once the index outgrows
+the WiredTiger cache most inserts read a page from disk, while time-ordered keys always
+append to the last pages. The effect only shows once the index is larger than the cache,
+hence the default of 10 million documents per scheme; start mongod with a small
+--wiredTigerCacheSizeGB to see it with fewer documents.
+
+The benchmark runs against MONGO_URI in a scratch database that is dropped afterwards.
+
+Usage:
+    python experiments/benchmark_id_locality.py --documents 10000000 --batch-size 10000
+Author:
+    @TheBarzani
+"""
+
+import argparse
+import os
+import sys
+import time
+import uuid
+from typing import Any, Callable, Dict
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+load_dotenv()
+
+from shared.ids import new_id  # pylint: disable=wrong-import-position
+
+SCHEMES: Dict[str, Callable[[], str]] = {
+    'uuid1': lambda: str(uuid.uuid1()),
+    'uuid4': lambda: str(uuid.uuid4()),
+    'uuid7': new_id,
+}
+
+def run(db: Any, name: str, generate: Callable[[], str], documents: int,
+        batch_size: int) -> Dict[str, float]:
+    """
+    Inserts the documents of one scheme and measures the throughput and index size.
+    """
+    collection = db[f'ids_{name}']
+    collection.create_index('key', unique=True, name='key')
+    last_tenth = documents - documents // 10
+    started = time.perf_counter()
+    tail_started = started
+    inserted = 0
+    while inserted < documents:
+        count = min(batch_size, documents - inserted)
+        if inserted <= last_tenth < inserted + count:
+            tail_started = time.perf_counter()
+        collection.insert_many([{'key': generate(), 'n': inserted + i} for i in range(count)],
+                               ordered=False)
+        inserted += count
+    finished = time.perf_counter()
+
+    stats = db.command('collStats', collection.name)
+    return {'docs/s': documents / (finished - started),
+            'tail docs/s': (documents - last_tenth) / max(finished - tail_started, 1e-9),
+            'index MB': stats['indexSizes']['key'] / 2**20,
+            'key bytes': len(generate())}
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--documents', type=int, default=10_000_000)
+    parser.add_argument('--batch-size', type=int, default=10_000)
+    parser.add_argument('--schemes', default=','.join(SCHEMES),
+                        help='comma separated schemes to run')
+    args = parser.parse_args()
+
+    client = MongoClient(os.getenv('MONGO_URI'))
+    db = client['benchmark_id_locality']
+    client.drop_database(db.name)
+
+    print(f"{args.documents} documents per scheme")
+    print(f"{'scheme':<8}{'key bytes':>10}{'docs/s':>12}{'tail docs/s':>14}{'index MB':>12}")
+    for name in args.schemes.split(','):
+        result = run(db, name, SCHEMES[name], args.documents, args.batch_size)
+        print(f"{name:<8}{result['key bytes']:>10}{result['docs/s']:>12.0f}"
+              f"{result['tail docs/s']:>14.0f}{result['index MB']:>12.1f}")
+        db[f'ids_{name}'].drop()
+
+    client.drop_database(db.name)
+
+if __name__ == "__main__":
+    main()
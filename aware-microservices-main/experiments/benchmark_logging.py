@@ -0,0 +1,110 @@
+"""_summary_
+Benchmarks the time a request handler spends logging when the log sink is slow.
+
+A log collector that falls behind makes writes to stdout block. The benchmark simulates
+such a sink with a stream whose every write and flush take --sink-ms milliseconds, and
+logs the same publish message --messages times at --rate messages per second, first
+with print(..., flush=True) as the user services did, then through the queue handler of
+shared.log. It reports the median and 99th percentile time of one logging call, and
+how long the writer thread took to drain the queue after the last call.
+
+Usage:
+    python experiments/benchmark_logging.py --messages 500 --rate 200 --sink-ms 2
+Author:
+    @TheBarzani
+"""
+
+import argparse
+import io
+import logging
+import logging.handlers
+import os
+import queue
+import statistics
+import sys
+import time
+from typing import Callable, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+# pylint: disable=wrong-import-position
+from shared.log import JsonFormatter, QueueingHandler
+
+class SlowSink(io.StringIO):
+    """
+    A stream that blocks on every write and flush, like a pipe to a busy collector.
+    """
+
+    def __init__(self, delay: float) -> None:
+        super().__init__()
+        self.delay = delay
+
+    def write(self, text: str) -> int:
+        time.sleep(self.delay)
+        return super().write(text)
+
+    def flush(self) -> None:
+        time.sleep(self.delay)
+
+def timed_calls(log: Callable[[int], None], messages: int, rate: float) -> List[float]:
+    """
+    Returns:
+        List[float]: The duration of every call in milliseconds, with the calls paced at
+                     the given rate.
+    """
+    durations = []
+    started = time.perf_counter()
+    for index in range(messages):
+        delay = started + index / rate - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        call_started = time.perf_counter()
+        log(index)
+        durations.append((time.perf_counter() - call_started) * 1000)
+    return durations
+
+def report(name: str, durations: List[float]) -> None:
+    """
+    Prints the median and 99th percentile call time.
+    """
+    ordered = sorted(durations)
+    p99 = ordered[min(int(len(ordered) * 0.99), len(ordered) - 1)]
+    print(f"{name:<14} p50 {statistics.median(ordered):7.3f} ms, p99 {p99:7.3f} ms per call")
+
+def main() -> None:
+    """
+    Parses the command line and runs the benchmark.
+    """
+    parser = argparse.ArgumentParser(description='Measure logging under a slow sink.')
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--rate', type=float, default=200, help='messages per second')
+    parser.add_argument('--sink-ms', type=float, default=2)
+    args = parser.parse_args()
+    event = {'userId': 'user-1', 'userEmails': ['user@example.com'],
+             'eventType': 'user.email.updated', 'publishedAt': '2024-01-01T00:00:00+00:00'}
+
+    sink = SlowSink(args.sink_ms / 1000)
+    report('print', timed_calls(
+        lambda index: print(f"V2 Published event: {event}", file=sink, flush=True),
+        args.messages, args.rate))
+
+    records: 'queue.Queue[logging.LogRecord]' = queue.Queue(10000)
+    writer = logging.StreamHandler(SlowSink(args.sink_ms / 1000))
+    writer.setFormatter(JsonFormatter('user-service-v2'))
+    listener = logging.handlers.QueueListener(records, writer)
+    logger = logging.getLogger('benchmark.events')
+    logger.addHandler(QueueingHandler(records))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    listener.start()
+    report('queue handler', timed_calls(
+        lambda index: logger.info('Published %s event', event['eventType'],
+                                  extra={'userId': event['userId']}),
+        args.messages, args.rate))
+    drain_started = time.perf_counter()
+    listener.stop()
+    print(f"writer drained the queue {(time.perf_counter() - drain_started) * 1000:.0f} ms "
+          f"after the last call")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""_summary_
+Measures the peak Python allocation of the order listings.
+
+Against an order service started with MEMORY_DIAGNOSTICS=true, the benchmark sends
+GET /orders/?status=<status> requests one at a time, so that each is measured, then reads
+the allocation statistics of the route from GET /admin/memory, which the service serves
+directly rather than through the gateway. It reports the mean and largest peak
+allocation of the requests it sent, with the number of orders listed, and exits with an
+error when the mean exceeds --max-peak-mb, so that a regression fails a benchmark run.
+
+Usage:
+    python experiments/benchmark_memory.py --base-url http://localhost:5001 \
+        --status "under process" --requests 20 --max-peak-mb 64
+Author:
+    @TheBarzani
+"""
+
+import argparse
+import sys
+from typing import Any, Dict
+import requests
+
+ROUTE = 'GET /orders/'
+
+def route_stats(base_url: str) -> Dict[str, Any]:
+    """
+    Returns:
+        Dict[str, Any]: The allocation statistics of GET /orders/, empty before its
+                        first request.
+    """
+    response = requests.get(f'{base_url}/admin/memory', params={'limit': 0}, timeout=30)
+    if response.status_code == 404:
+        sys.exit('GET /admin/memory is not served; start the order service with '
+                 'MEMORY_DIAGNOSTICS=true')
+    response.raise_for_status()
+    return response.json()['routes'].get(ROUTE, {})
+
+def main() -> None:
+    """
+    Parses the command line and runs the benchmark.
+    """
+    parser = argparse.ArgumentParser(description='Measure the memory of order listings.')
+    parser.add_argument('--base-url', default='http://localhost:5001')
+    parser.add_argument('--status', default='under process')
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--max-peak-mb', type=float, default=0,
+                        help='fail when the mean peak exceeds it, 0 to never fail')
+    args = parser.parse_args()
+
+    before = route_stats(args.base_url)
+    orders = 0
+    for _ in range(args.requests):
+        response = requests.get(f'{args.base_url}/orders/', params={'status': args.status},
+                                timeout=60)
+        response.raise_for_status()
+        orders = len(response.json())
+    after = route_stats(args.base_url)
+
+    sampled = after.get('sampled', 0) - before.get('sampled', 0)
+    if sampled == 0:
+        sys.exit('No request was measured; is another client using the service?')
+    total = (after.get('meanPeakBytes', 0) * after.get('sampled', 0)
+             - before.get('meanPeakBytes', 0) * before.get('sampled', 0))
+    mean_mb = total / sampled / 2 ** 20
+    print(f"{sampled} of {args.requests} requests measured, {orders} orders each")
+    print(f"peak allocation mean {mean_mb:.2f} MiB, largest ever "
+          f"{after.get('peakBytes', 0) / 2 ** 20:.2f} MiB, "
+          f"{mean_mb * 2 ** 20 / max(orders, 1) / 1024:.1f} KiB per order")
+    if args.max_peak_mb and mean_mb > args.max_peak_mb:
+        sys.exit(f'Mean peak allocation {mean_mb:.2f} MiB exceeds {args.max_peak_mb} MiB')
+
+if __name__ == "__main__":
+    main()
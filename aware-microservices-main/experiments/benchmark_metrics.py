@@ -0,0 +1,97 @@
+"""_summary_
+Benchmarks the cost of the metrics instrumentation of the services.
+
+It first times the recording calls on their own: a counter increment, a histogram
+observation, and the MongoDB command listener handling a command. It then serves the same
+trivial route as a WSGI server would, with and without init_metrics(), alternating rounds
+so that both see the same machine state, and reports the added time per request, which
+the instrumentation is meant to keep within a few microseconds.
+
+Usage:
+    python experiments/benchmark_metrics.py --requests 2000 --rounds 30
+Author:
+    @TheBarzani
+"""
+
+import argparse
+import os
+import sys
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, List
+from dotenv import load_dotenv
+from flask import Flask
+from werkzeug.test import EnvironBuilder
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+load_dotenv()
+
+# pylint: disable=wrong-import-position
+from shared.metrics import MongoMetricsListener, Registry, init_metrics
+
+def per_call(function: Callable[[], None], calls: int) -> float:
+    """
+    Returns:
+        float: The time of one call in microseconds.
+    """
+    started = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter() - started) / calls * 1e6
+
+def create_app(instrumented: bool) -> Flask:
+    """
+    Returns:
+        Flask: An application with one trivial route, instrumented or not.
+    """
+    app = Flask(__name__)
+    if instrumented:
+        init_metrics(app, Registry())
+
+    @app.route('/users/<user_id>')
+    def get_user(user_id: str) -> dict:
+        return {'userId': user_id}
+
+    return app
+
+def main() -> None:
+    """
+    Parses the command line and runs the benchmark.
+    """
+    parser = argparse.ArgumentParser(description='Measure the metrics overhead.')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--rounds', type=int, default=30)
+    args = parser.parse_args()
+
+    registry = Registry()
+    counter = registry.counter('events_total', 'Events.', ('queue',))
+    histogram = registry.histogram('latency_seconds', 'Latency.', ('method', 'route', 'status'))
+    listener = MongoMetricsListener()
+    event = SimpleNamespace(duration_micros=850, command_name='find')
+    calls = args.requests * 10
+    print(f"counter inc        {per_call(lambda: counter.inc('email'), calls):.3f} us")
+    observe = per_call(lambda: histogram.observe(0.012, 'GET', '/users/<id>', '200'), calls)
+    print(f"histogram observe  {observe:.3f} us")
+    print(f"mongo listener     {per_call(lambda: listener.succeeded(event), calls):.3f} us")
+
+    environ = EnvironBuilder(path='/users/42').get_environ()
+    apps = {instrumented: create_app(instrumented) for instrumented in (False, True)}
+
+    def serve(app: Flask) -> None:
+        body = app(dict(environ), lambda status, headers, exc_info=None: None)
+        for _ in body:
+            pass
+        body.close()
+
+    timings: Dict[bool, List[float]] = {False: [], True: []}
+    for _ in range(args.rounds):
+        for instrumented, app in apps.items():
+            timings[instrumented].append(per_call(lambda app=app: serve(app), args.requests))
+    # The fastest round is the least disturbed by the rest of the machine
+    plain = min(timings[False])
+    instrumented = min(timings[True])
+    print(f"request            {plain:.1f} us plain, {instrumented:.1f} us instrumented, "
+          f"{instrumented - plain:+.1f} us per request")
+
+if __name__ == "__main__":
+    main()
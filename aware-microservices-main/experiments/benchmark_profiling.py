@@ -0,0 +1,88 @@
+"""_summary_
+Benchmarks the cost of the profiling middleware of the services.
+
+It serves the same route as a WSGI server would, doing a millisecond of CPU work per
+request, without the middleware, with it installed but sampling nothing, with every
+request sampled, and with every request profiled with cProfile. Rounds alternate so
+that every variant sees the same machine state, and the fastest round of each is
+reported with the time it adds per request. Sampling is meant to be cheap enough to run
+continuously on a share of the traffic, and cProfile only on single requests.
+
+Usage:
+    python experiments/benchmark_profiling.py --requests 200 --rounds 10
+Author:
+    @TheBarzani
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+from flask import Flask
+from werkzeug.test import EnvironBuilder
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+# pylint: disable=wrong-import-position
+from shared.profiling import Profiler, ProfilingMiddleware
+
+def create_app(profiler: Optional[Profiler]) -> Flask:
+    """
+    Returns:
+        Flask: An application with one route doing a millisecond of work, profiled by
+               the given profiler or not at all.
+    """
+    app = Flask(__name__)
+    if profiler is not None:
+        app.wsgi_app = ProfilingMiddleware(app.wsgi_app, profiler)  # type: ignore
+
+    @app.route('/orders/<order_id>')
+    def get_order(order_id: str) -> dict:
+        total = 0
+        deadline = time.perf_counter() + 0.001
+        while time.perf_counter() < deadline:
+            total += sum(range(50))
+        return {'orderId': order_id, 'total': total}
+
+    return app
+
+def main() -> None:
+    """
+    Parses the command line and runs the benchmark.
+    """
+    parser = argparse.ArgumentParser(description='Measure the profiling overhead.')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--rounds', type=int, default=10)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='profiles-')
+    apps = {'plain': create_app(None),
+            'idle': create_app(Profiler('bench', directory)),
+            'sampled': create_app(Profiler('bench', directory, sample_rate=1.0)),
+            'cProfile': create_app(Profiler('bench', directory, token='bench'))}
+    environ = EnvironBuilder(path='/orders/42', headers={'X-Profile': 'bench'}).get_environ()
+
+    def per_request(app: Flask) -> float:
+        started = time.perf_counter()
+        for _ in range(args.requests):
+            body = app(dict(environ), lambda status, headers, exc_info=None: None)
+            for _ in body:
+                pass
+            body.close()
+        return (time.perf_counter() - started) / args.requests * 1e6
+
+    timings: Dict[str, List[float]] = {name: [] for name in apps}
+    for _ in range(args.rounds):
+        for name, app in apps.items():
+            timings[name].append(per_request(app))
+    # The fastest round is the least disturbed by the rest of the machine
+    plain = min(timings['plain'])
+    for name in apps:
+        fastest = min(timings[name])
+        print(f"{name:<9} {fastest:8.1f} us per request, {fastest - plain:+8.1f} us")
+    print(f"profiles written to {directory}")
+
+if __name__ == "__main__":
+    main()
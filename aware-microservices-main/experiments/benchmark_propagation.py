@@ -0,0 +1,146 @@
+"""_summary_
+Measures how long user updates take to propagate to the orders under load.
+
+Against a running stack, the benchmark creates users with one order each, then updates
+their emails through the gateway at a fixed rate from concurrent threads. Each update
+publishes a 'user.email.updated' event that the order service applies to the order of
+the user. The benchmark reads GET /orders/propagation before and after, waits until the
+consumers have applied every update, and reports the median and 99th percentile
+publish-to-apply latency of the updates it sent, taken from the difference between the
+two histograms, together with the largest lag of the oldest unprocessed event seen while
+it ran.
+
+The order service reports the events applied by the worker that answers the request, so
+run it against a single order service worker.
+
+Usage:
+    python experiments/benchmark_propagation.py --users 200 --updates 2000 --rate 200
+Author:
+    @TheBarzani
+"""
+
+import argparse
+import itertools
+import threading
+import time
+from typing import Any, Dict, List, Optional
+import requests
+
+def create_user_with_order(base_url: str, index: int) -> str:
+    """
+    Creates a user and one order of that user.
+    Returns:
+        str: The userId.
+    """
+    address = {'street': '1 Main St', 'city': 'Montreal', 'state': 'QC',
+               'postalCode': 'H1A 1A1', 'country': 'CA'}
+    user = requests.post(f'{base_url}/users/', json={
+        'firstName': 'Bench', 'lastName': f'User{index}',
+        'emails': [f'bench{index}@example.com'], 'deliveryAddress': address,
+        'phoneNumber': '15145550100'}, timeout=10)
+    user.raise_for_status()
+    user_id = user.json()['userId']
+    requests.post(f'{base_url}/orders/', json={
+        'userId': user_id, 'items': [{'itemId': 'item-1', 'quantity': 1, 'price': 9.99}],
+        'userEmails': [f'bench{index}@example.com'], 'deliveryAddress': address,
+        'orderStatus': 'under process'}, timeout=10).raise_for_status()
+    return user_id
+
+def propagation(base_url: str) -> Dict[str, Any]:
+    """
+    Returns:
+        Dict[str, Any]: The propagation statistics of the email update queue, named
+                        '<RABBITMQ_QUEUE_NAME>.email', empty before its first event.
+    """
+    response = requests.get(f'{base_url}/orders/propagation', timeout=10)
+    response.raise_for_status()
+    return next((stats for name, stats in response.json().items()
+                 if name.endswith('.email')), {})
+
+def quantile(before: Dict[str, int], after: Dict[str, int], q: float) -> Optional[float]:
+    """
+    Estimates a quantile, in milliseconds, of the latencies recorded between two
+    cumulative histograms, by linear interpolation within its bucket.
+    """
+    bounds = list(after)
+    counts = [after[bound] - before.get(bound, 0) for bound in bounds]
+    total = counts[-1]
+    if total == 0:
+        return None
+    rank = q * total
+    previous, lower = 0, 0.0
+    for bound, count in zip(bounds, counts):
+        if count >= rank:
+            if bound == '+Inf':
+                return lower * 1000
+            share = (rank - previous) / max(count - previous, 1)
+            return (lower + (float(bound) - lower) * share) * 1000
+        previous, lower = count, float(bound)
+    return None
+
+def main() -> None:
+    """
+    Parses the command line and runs the benchmark.
+    """
+    parser = argparse.ArgumentParser(description='Measure user update propagation.')
+    parser.add_argument('--base-url', default='http://localhost:8000')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--rate', type=float, default=200, help='updates per second')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--timeout', type=float, default=300)
+    args = parser.parse_args()
+
+    user_ids = [create_user_with_order(args.base_url, index) for index in range(args.users)]
+    before = propagation(args.base_url)
+    applied_before = before.get('applied', 0)
+
+    counter = itertools.count()
+    started = time.monotonic()
+    failures: List[int] = []
+
+    def send() -> None:
+        while True:
+            index = next(counter)
+            if index >= args.updates:
+                return
+            # Pace the updates at the requested rate across all threads
+            delay = started + index / args.rate - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            user_id = user_ids[index % len(user_ids)]
+            response = requests.put(f'{args.base_url}/users/{user_id}',
+                                    json={'emails': [f'update{index}@example.com']},
+                                    timeout=10)
+            if response.status_code != 200:
+                failures.append(response.status_code)
+
+    threads = [threading.Thread(target=send) for _ in range(args.threads)]
+    for thread in threads:
+        thread.start()
+
+    max_lag = 0.0
+    deadline = time.monotonic() + args.timeout
+    after = before
+    while time.monotonic() < deadline:
+        after = propagation(args.base_url)
+        max_lag = max(max_lag, after.get('oldestUnprocessedLagMs') or 0.0)
+        done = after.get('applied', 0) - applied_before >= args.updates - len(failures)
+        if done and not any(thread.is_alive() for thread in threads):
+            break
+        time.sleep(0.5)
+    for thread in threads:
+        thread.join()
+
+    applied = after.get('applied', 0) - applied_before
+    buckets_before = before.get('histogram', {}).get('buckets', {})
+    buckets_after = after.get('histogram', {}).get('buckets', {})
+    p50 = quantile(buckets_before, buckets_after, 0.5)
+    p99 = quantile(buckets_before, buckets_after, 0.99)
+    print(f"{args.updates} updates at {args.rate:.0f}/s, {len(failures)} failed, "
+          f"{applied} applied (expected {args.updates - len(failures)})")
+    print(f"propagation p50 {p50 or 0:.1f} ms, p99 {p99 or 0:.1f} ms, "
+          f"oldest unprocessed lag up to {max_lag:.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""_summary_
+Benchmarks the two contact details storage modes of the order service.
+
+For a population of users with a fixed number of orders each, it applies user update
+events the way the consumer does in the 'embedded' mode (rewrite every order of the user)
+and in the 'snapshot' mode (one upsert into user_snapshots), and then reads the
+'under process' status bucket the way OrderList.get does in each mode. It reports the
+number of writes per event and the average time per event and per read.
+
+The benchmark runs against MONGO_URI in a scratch database that is dropped afterwards.
+
+Usage:
+    python experiments/benchmark_user_snapshots.py --users 200 --orders-per-user 50
+Author:
+    @TheBarzani
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, List
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+load_dotenv()
+
+from order_service.app.snapshots import (  # pylint: disable=wrong-import-position
+    resolve_contact_details, save_user_snapshot)
+
+STATUSES = ["under process", "shipping", "delivered"]
+
+def seed(db: Any, users: int, orders_per_user: int) -> None:
+    """
+    Creates the orders of every user, spread over the three statuses.
+    """
+    orders: List[Dict[str, Any]] = []
+    for user in range(users):
+        for index in range(orders_per_user):
+            orders.append({
+                'orderId': f'o{user}-{index}',
+                'userId': f'u{user}',
+                'userEmails': [f'user{user}@example.com'],
+                'deliveryAddress': {'street': '1 Main St', 'city': 'Montreal', 'state': 'QC',
+                                    'postalCode': 'H1H1H1', 'country': 'Canada'},
+                'orderStatus': STATUSES[index % len(STATUSES)],
+                'contactUpdatedAt': datetime(2000, 1, 1),
+            })
+    db.orders.insert_many(orders)
+    db.orders.create_index('userId')
+    db.orders.create_index('orderStatus')
+
+def event_for(user: int, round_number: int) -> Dict[str, Any]:
+    return {'userId': f'u{user}',
+            'deliveryAddress': {'street': f'{round_number} New St', 'city': 'Toronto',
+                                'state': 'ON', 'postalCode': 'M1M1M1', 'country': 'Canada'}}
+
+def apply_embedded(db: Any, event: Dict[str, Any]) -> int:
+    fields = {'deliveryAddress': event['deliveryAddress']}
+    writes = 0
+    for order in db.orders.find({'userId': event['userId']}):
+        db.orders.update_one({'orderId': order['orderId']}, {'$set': fields})
+        writes += 1
+    return writes
+
+def apply_snapshot(db: Any, event: Dict[str, Any]) -> int:
+    save_user_snapshot(db.user_snapshots, event['userId'],
+                       {'deliveryAddress': event['deliveryAddress']})
+    return 1
+
+def read_embedded(db: Any) -> int:
+    return len(list(db.orders.find({'orderStatus': 'under process'})))
+
+def read_snapshot(db: Any) -> int:
+    orders = list(db.orders.find({'orderStatus': 'under process'}))
+    return len(resolve_contact_details(db.user_snapshots, orders))
+
+def timed(function: Any, *args: Any) -> tuple:
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--orders-per-user', type=int, default=50)
+    parser.add_argument('--reads', type=int, default=50)
+    args = parser.parse_args()
+
+    client = MongoClient(os.getenv('MONGO_URI'))
+    db = client['benchmark_user_snapshots']
+    client.drop_database(db.name)
+    seed(db, args.users, args.orders_per_user)
+
+    print(f"{args.users} users x {args.orders_per_user} orders")
+    print(f"{'mode':<10}{'writes/event':>14}{'ms/event':>12}{'ms/read':>12}")
+    for mode, apply, read in (('embedded', apply_embedded, read_embedded),
+                              ('snapshot', apply_snapshot, read_snapshot)):
+        writes = 0
+        elapsed = 0.0
+        for user in range(args.users):
+            count, seconds = timed(apply, db, event_for(user, 1))
+            writes += count
+            elapsed += seconds
+        read_elapsed = sum(timed(read, db)[1] for _ in range(args.reads))
+        print(f"{mode:<10}{writes / args.users:>14.1f}{elapsed / args.users * 1000:>12.2f}"
+              f"{read_elapsed / args.reads * 1000:>12.2f}")
+
+    client.drop_database(db.name)
+
+if __name__ == "__main__":
+    main()
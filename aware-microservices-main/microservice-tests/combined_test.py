@@ -94,7 +94,8 @@ def test_fetch_orders_by_status(created_order):
     assert created_order["orderId"] in order_ids, "Created order not found in orders returned by GET"
     print(f"\n📢 GET orders by status successful. Order ID {created_order['orderId']} found in the response.")
 
-def test_validate_event_driven_user_update_propagation(created_user, created_order):
+def test_validate_event_driven_user_update_propagation(created_user, created_order,
+                                                      wait_for_order_update):
     """
     Test Case: Validate that when a user's email or delivery address is updated,
     an event is triggered that updates all linked orders.
@@ -126,28 +127,21 @@ def test_validate_event_driven_user_update_propagation(created_user, created_ord
 
     print(f"\n✅ User updated successfully! New emails: {updated_user['emails']}")
     
-    # Wait for the event-driven synchronization to propagate the update.
-    time.sleep(5)  # Adjust the delay as necessary.
-    
+    # Wait until the order service has applied both updates to the order.
+    order = wait_for_order_update(created_order["orderId"],
+                                  {"userEmails": updated_user_payload["emails"],
+                                   "deliveryAddress": updated_user_payload["deliveryAddress"]})
+    assert order["userEmails"] == updated_user_payload["emails"]
+    assert order["deliveryAddress"] == updated_user_payload["deliveryAddress"]
+
     # Retrieve orders with status 'under process'.
     get_url = f"{BASE_URL_GATEWAY}/orders?status=under process"
-    retries = 5
-    order_found = False
-    for attempt in range(retries):
-        response = requests.get(get_url)
-        if response.status_code == 200:
-            orders = response.json()
-            for order in orders:
-                if order.get("orderId") == created_order["orderId"]:
-                    order_found = True
-                    # Validate that the order's userEmails and deliveryAddress have been updated.
-                    assert order.get("userEmails") == updated_user_payload["emails"], "User emails not updated in order"
-                    assert order.get("deliveryAddress") == updated_user_payload["deliveryAddress"], "Delivery address not updated in order"
-                    print(f"\n📢 Order {order['orderId']} updated successfully with new user data.")
-                    break
-            if order_found:
-                break
-        print(f"Attempt {attempt+1}: Order update not propagated yet. Retrying in 2s...")
-        time.sleep(2)
-    
-    assert order_found, "Updated order not found after user update propagation"
+    response = requests.get(get_url)
+    assert response.status_code == 200, "GET orders by status failed"
+    orders = {order["orderId"]: order for order in response.json()}
+    assert created_order["orderId"] in orders, "Updated order not found after user update propagation"
+    order = orders[created_order["orderId"]]
+    # Validate that the order's userEmails and deliveryAddress have been updated.
+    assert order.get("userEmails") == updated_user_payload["emails"], "User emails not updated in order"
+    assert order.get("deliveryAddress") == updated_user_payload["deliveryAddress"], "Delivery address not updated in order"
+    print(f"\n📢 Order {order['orderId']} updated successfully with new user data.")
@@ -0,0 +1,61 @@
+import json
+import time
+from datetime import datetime, timezone
+import pytest
+import requests
+
+BASE_URL_GATEWAY = "http://localhost:8000"
+
+
+@pytest.fixture
+def wait_for_order_update():
+    """
+    Subscribe to the order change stream before the test runs and return a function
+    that waits until the given order holds the expected contact details. Emails and
+    delivery address changes are applied and announced by separate
+    order.details.changed events, so each field is awaited on its own, and the order
+    is read back from the API once every field has arrived. The events are sent once
+    the order service has applied the user update, so tests wait on them instead of
+    sleeping.
+    """
+    response = requests.get(f"{BASE_URL_GATEWAY}/orders/stream", stream=True, timeout=(5, 30))
+    assert response.status_code == 200, "Could not open the order stream"
+    lines = response.iter_lines(decode_unicode=True)
+
+    def wait(order_id, expected, timeout=30):
+        deadline = time.monotonic() + timeout
+        pending = dict(expected)
+        event_type = None
+        for line in lines:
+            if line.startswith("event: "):
+                event_type = line[len("event: "):]
+            elif line.startswith("data: ") and event_type == "order.details.changed":
+                data = json.loads(line[len("data: "):])
+                if data.get("orderId") != order_id:
+                    continue
+                arrived = [field for field, value in pending.items() if data.get(field) == value]
+                for field in arrived:
+                    del pending[field]
+                if arrived and data.get("publishedAt"):
+                    published_at = datetime.fromisoformat(data["publishedAt"])
+                    lag = datetime.now(timezone.utc) - published_at
+                    print(f"\n⏱️ {', '.join(arrived)} propagated in "
+                          f"{lag.total_seconds() * 1000:.0f} ms")
+                if not pending:
+                    return read_order(data["userId"], order_id)
+            if time.monotonic() > deadline:
+                break
+        pytest.fail(f"Order {order_id} did not receive {', '.join(pending)} within {timeout}s")
+
+    yield wait
+    response.close()
+
+
+def read_order(user_id, order_id):
+    """Read an order back from the API, through the listing of its user."""
+    response = requests.get(f"{BASE_URL_GATEWAY}/orders", params={"userId": user_id,
+                                                                  "limit": 100})
+    assert response.status_code == 200, "GET orders by user failed"
+    orders = {order["orderId"]: order for order in response.json()}
+    assert order_id in orders, f"Order {order_id} not found"
+    return orders[order_id]
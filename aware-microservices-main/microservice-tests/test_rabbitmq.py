@@ -1,6 +1,5 @@
 import requests
 import pytest
-import time
 
 BASE_URL_GATEWAY = "http://localhost:8000"
 
@@ -34,7 +33,8 @@ def create_order_for_user():
     print(f"\n✅ Order created successfully! Order ID: {order_data['orderId']}")
     return order_data
 
-def test_validate_event_driven_user_update_propagation(create_order_for_user):
+def test_validate_event_driven_user_update_propagation(create_order_for_user,
+                                                      wait_for_order_update):
     """
     Test Case 3: Validate Event-Driven User Update Propagation.
     
@@ -71,28 +71,21 @@ def test_validate_event_driven_user_update_propagation(create_order_for_user):
 
     print(f"\n✅ User updated successfully! New emails: {updated_user['emails']}")
     
-    # Wait for the event-driven synchronization to propagate the update
-    time.sleep(5)  # Adjust delay as necessary based on system response
-    
-    # Retrieve orders with status 'under process'
+    # Wait until the order service has applied both updates to the order.
+    order = wait_for_order_update(create_order_for_user["orderId"],
+                                  {"userEmails": updated_user_payload["emails"],
+                                   "deliveryAddress": updated_user_payload["deliveryAddress"]})
+    assert order["userEmails"] == updated_user_payload["emails"]
+    assert order["deliveryAddress"] == updated_user_payload["deliveryAddress"]
+
+    # Retrieve orders with status 'under process'.
     get_url = f"{BASE_URL_GATEWAY}/orders?status=under process"
-    retries = 5
-    order_found = False
-    for attempt in range(retries):
-        response = requests.get(get_url)
-        if response.status_code == 200:
-            orders = response.json()
-            for order in orders:
-                if order.get("orderId") == create_order_for_user["orderId"]:
-                    order_found = True
-                    # Validate that the order's userEmails and deliveryAddress have been updated
-                    assert order.get("userEmails") == updated_user_payload["emails"], "User emails not updated in order"
-                    assert order.get("deliveryAddress") == updated_user_payload["deliveryAddress"], "Delivery address not updated in order"
-                    print(f"\n📢 Order {order['orderId']} updated successfully with new user data.")
-                    break
-            if order_found:
-                break
-        print(f"Attempt {attempt+1}: Order update not propagated yet. Retrying in 2s...")
-        time.sleep(2)
-    
-    assert order_found, "Updated order not found after user update propagation"
+    response = requests.get(get_url)
+    assert response.status_code == 200, "GET orders by status failed"
+    orders = {order["orderId"]: order for order in response.json()}
+    assert create_order_for_user["orderId"] in orders, "Updated order not found after user update propagation"
+    order = orders[create_order_for_user["orderId"]]
+    # Validate that the order's userEmails and deliveryAddress have been updated.
+    assert order.get("userEmails") == updated_user_payload["emails"], "User emails not updated in order"
+    assert order.get("deliveryAddress") == updated_user_payload["deliveryAddress"], "Delivery address not updated in order"
+    print(f"\n📢 Order {order['orderId']} updated successfully with new user data.")
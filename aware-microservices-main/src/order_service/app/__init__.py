@@ -1,38 +1,153 @@
 """_summary_
 This module initializes and configures the Flask application for the order service.
 It sets up the Flask app, configures the API namespace, initializes the MongoDB 
-client, and starts a background thread to consume user update events.
+client, and starts, for every user event queue, a background controller that runs 
+a pool of event consumers sized to the backlog of that queue. It also sets up the 
+broadcaster that feeds order changes to the server-sent events stream.
 
 Functions:
-    start_event_consumer(app: Flask): Starts the event consumer within the Flask 
-                                      app context.
+    start_event_consumer(app: Flask, queue: EventQueue, stop_event: threading.Event, 
+                         latency: ApplyLatencyTracker): Starts an event consumer 
+                                      within the Flask app context.
+    start_event_consumers(app: Flask): Starts a consumer pool and controller thread 
+                                       for each user event queue.
+    collect_consumer_metrics(app: Flask): Reports the consumer counts as metrics.
+    start_order_event_broadcast(app: Flask): Sets up the order event broadcaster 
+                                             and, if configured, the fanout relay.
     create_app(): Creates and configures the Flask application, initializes 
-                  MongoDB, and starts the event consumer thread.
+                  MongoDB, and starts the event consumers.
 Athor:
     @TheBarzani
 """
 
 import threading
+from typing import Callable, List
 from flask import Flask
-from pymongo import MongoClient
 from flask_restx import Api
+from shared.admission import init_admission_control
+from shared.config.rabbitmq_config import USER_EVENT_QUEUES, EventQueue
+from shared.mongo import create_mongo_client, read_collection
+from shared.idempotency import ensure_idempotency_index_in_background
+from shared.log import configure_logging, init_request_logging
+from shared.memory import init_memory_diagnostics
+from shared.metrics import REGISTRY, MetricFamily, init_metrics
+from shared.profiling import configure_profiling, init_profiling
+from shared.round_trips import init_round_trip_accounting
+from shared.singleflight import SingleFlight, collect_metrics, report_stats_in_background
+from shared.tracing import configure_tracing, init_flask_tracing
 from order_service.app.routes import api as order_api
-from order_service.app.events import consume_user_update_events
+from order_service.app.events import consume_user_update_events, create_backlog_sampler
+from order_service.app.consumer_scaling import (ApplyLatencyTracker, ConcurrencyController,
+                                                ConsumerPool)
+from order_service.app.broadcast import FanoutRelay, OrderEventBroadcaster
+from order_service.app.indexes import ensure_indexes_in_background
+from order_service.app.rollups import ROLLUPS_COLLECTION
+from order_service.app.partitions import create_partition_router
+from order_service.app.list_cache import create_list_cache
+from order_service.app.propagation import PropagationTracker
 
-def start_event_consumer(app: Flask) -> None:
+def start_event_consumer(app: Flask, queue: EventQueue, stop_event: threading.Event,
+                         latency: ApplyLatencyTracker) -> None:
     """
     Starts the event consumer for the given Flask application.
     This function initializes the event consumer within the application context
-    and begins consuming user update events.
+    and begins consuming user update events until the stop event is set.
     Args:
         app (Flask): The Flask application instance.
+        queue (EventQueue): The event queue to consume from.
+        stop_event (threading.Event): Event that asks the consumer to stop.
+        latency (ApplyLatencyTracker): Tracker that receives the apply latency.
     Returns:
         None
     """
 
     # print("Starting event consumer...")
     with app.app_context():
-        consume_user_update_events()
+        consume_user_update_events(queue, stop_event, latency, app.propagation)
+
+def start_event_consumers(app: Flask) -> None:
+    """
+    Starts a consumer pool for every user event queue, each under its own controller 
+    thread that keeps between the queue's min_consumers and max_consumers consumers 
+    running depending on its backlog. A slow queue therefore scales on its own and 
+    does not hold up the others. The consumers and backlog samples also feed the 
+    propagation latency and lag of the queue into app.propagation.
+    Args:
+        app (Flask): The Flask application instance.
+    Returns:
+        None
+    """
+
+    app.consumer_pools = {}
+    for queue in USER_EVENT_QUEUES:
+        latency = ApplyLatencyTracker()
+        pool = ConsumerPool(lambda stop_event, queue=queue, latency=latency:
+                            start_event_consumer(app, queue, stop_event, latency))
+        sample_backlog = create_backlog_sampler(queue.name)
+
+        # The backlog samples also give the lag of the oldest unprocessed event
+        def sample(queue_name: str = queue.name,
+                   sample_backlog: Callable[[], int] = sample_backlog) -> int:
+            backlog = sample_backlog()
+            app.propagation.record_backlog(queue_name, backlog)
+            return backlog
+
+        controller = ConcurrencyController(
+            pool,
+            sample,
+            latency,
+            min_consumers=queue.min_consumers,
+            max_consumers=queue.max_consumers,
+            target_drain_seconds=app.config['CONSUMER_TARGET_DRAIN_SECONDS'],
+            scale_up_samples=app.config['CONSUMER_SCALE_UP_SAMPLES'],
+            scale_down_samples=app.config['CONSUMER_SCALE_DOWN_SAMPLES'])
+        controller_thread = threading.Thread(target=controller.run,
+                                             args=(app.config['CONSUMER_SCALE_INTERVAL'],),
+                                             daemon=True)
+        controller_thread.start()
+        app.consumer_pools[queue.name] = pool
+
+def collect_consumer_metrics(app: Flask) -> List[MetricFamily]:
+    """
+    Reports the number of consumers of every user event queue, for /metrics.
+    Args:
+        app (Flask): The Flask application instance.
+    Returns:
+        List[MetricFamily]: The consumer count of every queue.
+    """
+
+    consumers = MetricFamily('user_event_consumers', 'Consumers of the user event queue.',
+                             'gauge')
+    for queue_name, pool in getattr(app, 'consumer_pools', {}).items():
+        consumers.add({'queue': queue_name}, pool.size)
+    return [consumers]
+
+def start_order_event_broadcast(app: Flask) -> None:
+    """
+    Sets up the broadcaster that feeds order changes to the server-sent events stream.
+    When ORDER_EVENTS_EXCHANGE is configured, changes are published through a fanout 
+    exchange by a relay thread so that every worker receives them; otherwise they are 
+    only broadcast within this worker.
+    Args:
+        app (Flask): The Flask application instance.
+    Returns:
+        None
+    Raises:
+        ValueError: If ORDER_STREAM_MAX_CLIENTS is not between 1 and WORKER_THREADS - 1.
+    """
+
+    if not 0 < app.config['ORDER_STREAM_MAX_CLIENTS'] < app.config['WORKER_THREADS']:
+        # Every stream holds a request thread, so some must be left for other requests
+        raise ValueError('ORDER_STREAM_MAX_CLIENTS must be at least 1 and below '
+                         'WORKER_THREADS')
+    app.order_broadcaster = OrderEventBroadcaster(app.config['ORDER_EVENTS_HISTORY'],
+                                                  app.config['ORDER_STREAM_MAX_CLIENTS'])
+    app.order_events = app.order_broadcaster
+    if app.config['ORDER_EVENTS_EXCHANGE']:
+        relay = FanoutRelay(app.order_broadcaster, app.config['ORDER_EVENTS_EXCHANGE'],
+                            app.config['ORDER_EVENTS_HISTORY'])
+        app.order_events = relay
+        threading.Thread(target=relay.run, daemon=True).start()
 
 def create_app() -> Flask:
     """
@@ -40,24 +155,58 @@ def create_app() -> Flask:
     This function initializes the Flask application, configures it using the 
     settings from 'config.py', sets up the API namespace for order-related 
     endpoints, and initializes the MongoDB client. It also starts the event 
-    consumer in a separate thread.
+    consumers for every user event queue.
     Returns:
         Flask: The configured Flask application instance.
     """
 
     app = Flask(__name__)
     app.config.from_object('order_service.app.config.Config')
+    # Before the MongoDB clients, which record their commands while tracing is enabled
+    configure_logging('order-service', app.config)
+    configure_tracing('order-service', app.config['TRACE_EXPORT'])
+    init_flask_tracing(app)
+    init_request_logging(app)
+    init_metrics(app)
+    init_round_trip_accounting(app)
+    configure_profiling('order-service', app.config)
+    init_profiling(app)
+    init_memory_diagnostics(app)
+    # Outermost, so the requests it rejects skip everything else
+    init_admission_control(app)
     api = Api(app)
     api.add_namespace(order_api, path='/orders')
 
     # Initialize MongoDB client
     # print ("Connecting to MongoDB... ", app.config['MONGO_URI'])
-    mongo_client = MongoClient(app.config['MONGO_URI'])
+    mongo_client = create_mongo_client(app.config)
     app.mongo_client = mongo_client
     app.db = mongo_client[app.config['DATABASE_NAME']]
-    app.orders_collection = app.db['orders']
+    app.user_snapshots_collection = app.db['user_snapshots']
+    app.order_rollups_collection = app.db[ROLLUPS_COLLECTION]
+    app.idempotency_collection = app.db['idempotency_keys']
+    # The orders, hot and archived, may be partitioned across clusters by user
+    app.order_partitions = create_partition_router(app.config, mongo_client)
+    # Read-only endpoints may read from secondaries; everything else uses the primary
+    app.order_rollups_read_collection = read_collection(app.order_rollups_collection,
+                                                        app.config)
+    app.order_list_cache = create_list_cache(app.config['ORDER_LIST_CACHE_URL'],
+                                             app.config['ORDER_LIST_CACHE_TTL_SECONDS'])
+    app.order_reads = SingleFlight('orders', app.config['READ_COALESCING'])
+    report_stats_in_background([app.order_reads])
+    REGISTRY.register_collector('singleflight', lambda: collect_metrics([app.order_reads]))
+    ensure_indexes_in_background(app.db)
+    for partition in app.order_partitions.partitions:
+        if partition.db != app.db:
+            ensure_indexes_in_background(partition.db)
+    ensure_idempotency_index_in_background(app.idempotency_collection,
+                                           app.config['IDEMPOTENCY_TTL_SECONDS'])
+
+    start_order_event_broadcast(app)
 
-    # Start the event consumer in a separate thread
-    event_consumer_thread = threading.Thread(target=start_event_consumer, args=(app,), daemon=True)
-    event_consumer_thread.start()
+    # Start the event consumers under controllers that follow the queue backlogs
+    app.propagation = PropagationTracker()
+    REGISTRY.register_collector('propagation', app.propagation.collect)
+    start_event_consumers(app)
+    REGISTRY.register_collector('consumers', lambda: collect_consumer_metrics(app))
     return app
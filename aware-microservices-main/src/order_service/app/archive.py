@@ -0,0 +1,71 @@
+"""_summary_
+This module implements the hot/cold tiering of orders.
+
+Orders that were delivered more than ORDER_ARCHIVE_AFTER_DAYS ago are moved by the
+archival job (order_service.jobs.archive_orders) from the 'orders' collection into the
+'orders_archive' collection, which has the same schema and indexes. The hot collection,
+its indexes and every status query therefore only cover orders that are still active or
+recently delivered, while the archive keeps the full history. Reads include the archive
+only when asked to with the includeArchived flag.
+
+A batch is moved by first upserting the orders into the archive, keyed by orderId, and
+then deleting from the hot collection only the orders that did not change since they were
+read. Replaying a batch after an interruption is therefore harmless, and an order updated
+while it was being archived stays hot until a later run.
+
+Constants:
+    ARCHIVE_COLLECTION: The name of the archive collection.
+    SKIP_POLICY, PROPAGATE_POLICY: The ORDER_ARCHIVE_USER_UPDATES values.
+Functions:
+    archive_query(cutoff) -> Dict[str, Any]: The filter of orders due for archival.
+    archive_orders(orders_collection, archive_collection, orders) -> int: Moves a batch.
+Author:
+    @TheBarzani
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List
+from pymongo import DeleteOne, ReplaceOne
+from pymongo.collection import Collection
+
+ARCHIVE_COLLECTION = 'orders_archive'
+
+# What the user event consumer does with archived orders
+SKIP_POLICY = 'skip'
+PROPAGATE_POLICY = 'propagate'
+
+def archive_query(cutoff: datetime) -> Dict[str, Any]:
+    """
+    Returns the filter of the orders delivered before the cutoff. Orders delivered
+    before deliveredAt was recorded fall back to their last update time.
+    Args:
+        cutoff (datetime): Orders delivered before this time are due for archival.
+    Returns:
+        Dict[str, Any]: The filter document.
+    """
+    return {'orderStatus': 'delivered',
+            '$or': [{'deliveredAt': {'$lt': cutoff}},
+                    {'deliveredAt': {'$exists': False}, 'updatedAt': {'$lt': cutoff}}]}
+
+def archive_orders(orders_collection: Collection, archive_collection: Collection,
+                   orders: List[Dict[str, Any]]) -> int:
+    """
+    Moves a batch of orders from the hot collection to the archive.
+    Args:
+        orders_collection (Collection): The hot orders collection.
+        archive_collection (Collection): The archive collection.
+        orders (List[Dict[str, Any]]): The orders to move, as read from the hot collection.
+    Returns:
+        int: The number of orders removed from the hot collection.
+    """
+    if not orders:
+        return 0
+    archived_at = datetime.utcnow()
+    archive_collection.bulk_write([ReplaceOne({'orderId': order['orderId']},
+                                              {**order, 'archivedAt': archived_at},
+                                              upsert=True)
+                                   for order in orders], ordered=False)
+    result = orders_collection.bulk_write([DeleteOne({'_id': order['_id'],
+                                                      'updatedAt': order.get('updatedAt')})
+                                           for order in orders], ordered=False)
+    return result.deleted_count
@@ -0,0 +1,305 @@
+"""_summary_
+This module broadcasts order change events to the server-sent events stream of the
+order service.
+
+Every change is kept in a bounded in-process history so that stream clients can wait
+for new events instead of polling the database, and can resume from the id of the last
+event they received. With a single worker the broadcaster is used directly. When the
+ORDER_EVENTS_EXCHANGE setting is configured, changes are instead published to a RabbitMQ
+fanout exchange and a relay thread in every worker feeds them into its local
+broadcaster, so a stream client sees changes made through any worker or replica.
+
+Events from other workers arrive in any order, so their ids are assigned by the
+broadcaster on arrival: '<epoch>-<sequence>', where the sequence counts the events of
+the broadcaster and the epoch identifies the broadcaster. A client resuming with an id
+of another epoch, for example after the worker restarted, gets every retained event.
+Each worker serves at most ORDER_STREAM_MAX_CLIENTS streams, which must be fewer than its
+WORKER_THREADS, so they cannot take every thread of the worker.
+
+Classes:
+    OrderEvent: A single order change event.
+    OrderEventBroadcaster: Keeps the recent events and wakes up waiting stream clients.
+    FanoutRelay: Publishes events to a fanout exchange and relays them back locally.
+Functions:
+    publish_order_event(event_type: str, order: dict, previous_status: str = None,
+                        published_at: str = None):
+        Publishes an order change event from a request handler or the event consumer.
+Author:
+    @TheBarzani
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, replace
+from typing import Any, Deque, Dict, List, Optional
+from flask import current_app
+from shared.config.rabbitmq_config import get_connection
+
+ORDER_STATUS_CHANGED = 'order.status.changed'
+ORDER_DETAILS_CHANGED = 'order.details.changed'
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class OrderEvent:
+    """
+    A single order change event.
+    Attributes:
+        type (str): The event type, for example 'order.status.changed'.
+        data (Dict[str, Any]): The JSON payload of the event.
+        sequence (int): The position of the event in the broadcaster, 0 until published.
+        id (str): The event id sent to stream clients, '<epoch>-<sequence>'.
+    """
+    type: str
+    data: Dict[str, Any]
+    sequence: int = 0
+    id: str = ''
+
+    def matches(self, status: Optional[str]) -> bool:
+        """
+        Checks whether the event concerns orders with the given status, either before
+        or after the change.
+        Args:
+            status (Optional[str]): The status to filter on, or None for all events.
+        Returns:
+            bool: True if the event should be delivered.
+        """
+        if status is None:
+            return True
+        return status in (self.data.get('orderStatus'), self.data.get('previousStatus'))
+
+    def to_sse(self) -> str:
+        """
+        Returns:
+            str: The event encoded as a server-sent events message.
+        """
+        return f"id: {self.id}\nevent: {self.type}\ndata: {json.dumps(self.data)}\n\n"
+
+
+class OrderEventBroadcaster:
+    """
+    Keeps the most recent order events and lets stream clients wait for new ones.
+    """
+
+    def __init__(self, history: int = 1000, max_streams: int = 0) -> None:
+        """
+        Args:
+            history (int): The number of recent events kept for resuming streams.
+            max_streams (int): The streams served at once, 0 for no limit.
+        """
+        self.epoch = f"{int(time.time() * 1000):x}"
+        self.max_streams = max_streams
+        self._events: Deque[OrderEvent] = deque(maxlen=history)
+        self._sequence = 0
+        self._streams = 0
+        self._condition = threading.Condition()
+
+    def publish(self, event: OrderEvent) -> None:
+        """
+        Numbers an event in arrival order, appends it to the history and wakes up
+        waiting clients.
+        Args:
+            event (OrderEvent): The event to broadcast.
+        Returns:
+            None
+        """
+        with self._condition:
+            self._sequence += 1
+            self._events.append(replace(event, sequence=self._sequence,
+                                        id=f"{self.epoch}-{self._sequence}"))
+            self._condition.notify_all()
+
+    def position(self, event_id: Optional[str]) -> int:
+        """
+        Finds where a stream resumes.
+        Args:
+            event_id (Optional[str]): The id of the last event the client has seen.
+        Returns:
+            int: The sequence after which events are sent: the one of the id, 0 for an
+                 id of another epoch, or the latest one when the id is missing, invalid
+                 or ahead of this broadcaster.
+        """
+        with self._condition:
+            epoch, _, sequence = (event_id or '').partition('-')
+            if not sequence.isdigit():
+                return self._sequence
+            if epoch != self.epoch:
+                return 0
+            return min(int(sequence), self._sequence)
+
+    def wait_for_events(self, after: int, timeout: float) -> List[OrderEvent]:
+        """
+        Returns the events after the given position, waiting up to timeout seconds for
+        one to arrive.
+        Args:
+            after (int): The sequence of the last event the client has seen.
+            timeout (float): The maximum number of seconds to wait.
+        Returns:
+            List[OrderEvent]: The newer events in arrival order, possibly empty.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._sequence > after, timeout=timeout)
+            return [event for event in self._events if event.sequence > after]
+
+    def open_stream(self) -> bool:
+        """
+        Counts a new stream, unless max_streams are already served.
+        Returns:
+            bool: Whether the stream may be served; if so, close_stream must be called
+                  once it ends.
+        """
+        with self._condition:
+            if self.max_streams and self._streams >= self.max_streams:
+                return False
+            self._streams += 1
+            return True
+
+    def close_stream(self) -> None:
+        """
+        Releases a stream counted by open_stream.
+        """
+        with self._condition:
+            self._streams -= 1
+
+
+class FanoutRelay:
+    """
+    Publishes order events to a fanout exchange and feeds the events received from
+    that exchange into the local broadcaster. Publishing and consuming share one
+    connection that is only used by the relay thread, since pika connections are not
+    thread-safe; request handlers hand their events over through a bounded outbox that
+    drops its oldest events while the broker is unreachable.
+    """
+
+    def __init__(self, broadcaster: OrderEventBroadcaster, exchange: str,
+                 outbox: int = 1000) -> None:
+        """
+        Args:
+            broadcaster (OrderEventBroadcaster): The broadcaster of this worker.
+            exchange (str): The fanout exchange shared by the workers.
+            outbox (int): The number of events waiting for publication kept.
+        """
+        self.broadcaster = broadcaster
+        self.exchange = exchange
+        self.dropped = 0
+        self._outbox: Deque[OrderEvent] = deque(maxlen=outbox)
+        self._lock = threading.Lock()
+
+    def publish(self, event: OrderEvent) -> None:
+        """
+        Queues an event for publication without blocking the caller, dropping the
+        oldest queued event when the outbox is full.
+        Args:
+            event (OrderEvent): The event to publish.
+        Returns:
+            None
+        """
+        with self._lock:
+            if len(self._outbox) == self._outbox.maxlen:
+                self.dropped += 1
+            self._outbox.append(event)
+
+    def take(self) -> List[OrderEvent]:
+        """
+        Empties the outbox, logging the events dropped since the last call.
+        Returns:
+            List[OrderEvent]: The queued events, oldest first.
+        """
+        with self._lock:
+            events, dropped = list(self._outbox), self.dropped
+            self._outbox.clear()
+            self.dropped = 0
+        if dropped:
+            logger.warning('Dropped %d order events while the relay was behind', dropped)
+        return events
+
+    def restore(self, events: List[OrderEvent]) -> None:
+        """
+        Puts events whose publication failed back in front of the outbox, dropping the
+        oldest events beyond its size.
+        Args:
+            events (List[OrderEvent]): The events, oldest first.
+        Returns:
+            None
+        """
+        with self._lock:
+            queued = events + list(self._outbox)
+            overflow = max(len(queued) - self._outbox.maxlen, 0)
+            self.dropped += overflow
+            self._outbox.clear()
+            self._outbox.extend(queued[overflow:])
+
+    def run(self) -> None:
+        """
+        Runs the relay, reconnecting after connection failures.
+        """
+        while True:
+            try:
+                self._relay()
+            except Exception as error:  # pylint: disable=broad-except
+                logger.warning('Order event relay failed: %s', error)
+                time.sleep(5)
+
+    def _relay(self) -> None:
+        connection = get_connection()
+        channel = connection.channel()
+        channel.exchange_declare(exchange=self.exchange, exchange_type='fanout', durable=True)
+        # Every worker gets its own temporary queue that receives all events
+        declared = channel.queue_declare(queue='', exclusive=True, auto_delete=True)
+        channel.queue_bind(exchange=self.exchange, queue=declared.method.queue)
+
+        def callback(ch: Any, method: Any, properties: Any, body: bytes) -> None:
+            message = json.loads(body)
+            self.broadcaster.publish(OrderEvent(message['type'], message['data']))
+
+        channel.basic_consume(queue=declared.method.queue, on_message_callback=callback,
+                              auto_ack=True)
+        while True:
+            connection.process_data_events(time_limit=0.05)
+            events = self.take()
+            for index, event in enumerate(events):
+                try:
+                    channel.basic_publish(exchange=self.exchange, routing_key='',
+                                          body=json.dumps({'type': event.type,
+                                                           'data': event.data}))
+                except Exception:
+                    # Publish them once reconnected
+                    self.restore(events[index:])
+                    raise
+
+
+def publish_order_event(event_type: str, order: Dict[str, Any],
+                        previous_status: Optional[str] = None,
+                        published_at: Optional[str] = None) -> None:
+    """
+    Publishes an order change event to the stream clients of every worker.
+    Args:
+        event_type (str): ORDER_STATUS_CHANGED or ORDER_DETAILS_CHANGED.
+        order (Dict[str, Any]): The order after the change.
+        previous_status (Optional[str]): The status before a status transition.
+        published_at (Optional[str]): The publish time of the user update event that
+                                      caused the change, so stream clients can tell
+                                      when an update has propagated.
+    Returns:
+        None
+    Note:
+        This function must be called within an application context.
+    """
+    data: Dict[str, Any] = {
+        'orderId': order['orderId'],
+        'userId': order.get('userId'),
+        'orderStatus': order.get('orderStatus'),
+    }
+    if previous_status is not None:
+        data['previousStatus'] = previous_status
+    if published_at is not None:
+        data['publishedAt'] = published_at
+    if event_type == ORDER_DETAILS_CHANGED:
+        data['userEmails'] = order.get('userEmails')
+        data['deliveryAddress'] = order.get('deliveryAddress')
+
+    current_app.order_events.publish(OrderEvent(event_type, data))
@@ -0,0 +1,207 @@
+"""_summary_
+This module adapts the number of user update consumers in the order service to the
+backlog on the RabbitMQ queue.
+
+A ConcurrencyController periodically samples the number of ready messages on the
+queue and the average time it takes a consumer to apply one event. From these it
+estimates how long the current consumers need to drain the backlog and grows or
+shrinks a ConsumerPool between the configured bounds. Scaling up reacts after a few
+consecutive slow samples, while scaling down needs a longer run of idle samples and
+only releases one consumer at a time, so the count does not flap around a threshold.
+
+Classes:
+    ApplyLatencyTracker: Thread-safe moving average of event apply latency.
+    ConsumerPool: Starts and stops consumer threads, each with its own channel.
+    ConcurrencyController: Decides how many consumers should be running.
+Author:
+    @TheBarzani
+"""
+
+import logging
+import math
+import threading
+from typing import Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+class ApplyLatencyTracker:
+    """
+    Keeps an exponentially weighted moving average of how long it takes to apply
+    one user update event. Consumers record into it from their own threads.
+    """
+
+    def __init__(self, alpha: float = 0.2, initial: float = 0.0) -> None:
+        self._alpha = alpha
+        self._value = initial
+        self._samples = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        """
+        Records the duration of one applied event.
+        Args:
+            seconds (float): The time spent applying the event.
+        Returns:
+            None
+        """
+        with self._lock:
+            if self._samples == 0:
+                self._value = seconds
+            else:
+                self._value += self._alpha * (seconds - self._value)
+            self._samples += 1
+
+    @property
+    def value(self) -> float:
+        """
+        Returns:
+            float: The average apply latency in seconds.
+        """
+        with self._lock:
+            return self._value
+
+
+class ConsumerPool:
+    """
+    A pool of consumer threads. Every consumer is started with its own stop event,
+    which it checks between deliveries so it can cancel its subscription and close
+    its channel when the pool shrinks.
+    """
+
+    def __init__(self, start_consumer: Callable[[threading.Event], None]) -> None:
+        self._start_consumer = start_consumer
+        self._consumers: List[Tuple[threading.Thread, threading.Event]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def size(self) -> int:
+        """
+        Returns:
+            int: The number of consumers that are running and not asked to stop.
+        """
+        with self._lock:
+            self._consumers = [(thread, stop) for thread, stop in self._consumers
+                               if thread.is_alive() and not stop.is_set()]
+            return len(self._consumers)
+
+    def grow(self, count: int = 1) -> None:
+        """
+        Starts additional consumers.
+        Args:
+            count (int): The number of consumers to start.
+        Returns:
+            None
+        """
+        with self._lock:
+            for _ in range(count):
+                stop_event = threading.Event()
+                thread = threading.Thread(target=self._start_consumer, args=(stop_event,),
+                                          daemon=True)
+                thread.start()
+                self._consumers.append((thread, stop_event))
+
+    def shrink(self, count: int = 1) -> None:
+        """
+        Asks the most recently started consumers to stop. They finish the event they
+        are applying, and any prefetched but unacknowledged messages are requeued.
+        Args:
+            count (int): The number of consumers to stop.
+        Returns:
+            None
+        """
+        with self._lock:
+            for _ in range(min(count, len(self._consumers))):
+                _, stop_event = self._consumers.pop()
+                stop_event.set()
+
+    def stop(self) -> None:
+        """
+        Stops every consumer in the pool.
+        """
+        self.shrink(len(self._consumers))
+
+
+class ConcurrencyController:
+    """
+    Grows or shrinks a ConsumerPool based on the queue backlog and the apply latency.
+
+    The pool grows when the estimated time to drain the backlog with the current
+    consumers stays above target_drain_seconds for scale_up_samples consecutive
+    samples. It shrinks by one consumer when the backlog stays at or below
+    idle_backlog for scale_down_samples consecutive samples.
+    """
+
+    def __init__(self, pool: ConsumerPool, sample_backlog: Callable[[], int],
+                 latency: ApplyLatencyTracker, min_consumers: int = 1,
+                 max_consumers: int = 4, target_drain_seconds: float = 10.0,
+                 scale_up_samples: int = 2, scale_down_samples: int = 6,
+                 idle_backlog: int = 0) -> None:
+        if min_consumers < 1 or max_consumers < min_consumers:
+            raise ValueError("Consumer bounds must satisfy 1 <= min <= max")
+        self.pool = pool
+        self.sample_backlog = sample_backlog
+        self.latency = latency
+        self.min_consumers = min_consumers
+        self.max_consumers = max_consumers
+        self.target_drain_seconds = target_drain_seconds
+        self.scale_up_samples = scale_up_samples
+        self.scale_down_samples = scale_down_samples
+        self.idle_backlog = idle_backlog
+        self._up_streak = 0
+        self._down_streak = 0
+
+    def step(self) -> int:
+        """
+        Samples the backlog once and resizes the pool if needed.
+        Returns:
+            int: The number of consumers after this step.
+        """
+        size = self.pool.size
+        if size < self.min_consumers:
+            self.pool.grow(self.min_consumers - size)
+            size = self.min_consumers
+
+        backlog = self.sample_backlog()
+        drain_seconds = backlog * self.latency.value / size
+
+        if drain_seconds > self.target_drain_seconds and size < self.max_consumers:
+            self._up_streak += 1
+            self._down_streak = 0
+        elif backlog <= self.idle_backlog and size > self.min_consumers:
+            self._down_streak += 1
+            self._up_streak = 0
+        else:
+            self._up_streak = 0
+            self._down_streak = 0
+
+        if self._up_streak >= self.scale_up_samples:
+            needed = math.ceil(backlog * self.latency.value / self.target_drain_seconds)
+            target = max(size + 1, min(needed, self.max_consumers))
+            self.pool.grow(target - size)
+            size = target
+            self._up_streak = 0
+        elif self._down_streak >= self.scale_down_samples:
+            self.pool.shrink(1)
+            size -= 1
+            self._down_streak = 0
+
+        return size
+
+    def run(self, interval: float, stop_event: Optional[threading.Event] = None) -> None:
+        """
+        Runs the control loop until the stop event is set.
+        Args:
+            interval (float): Seconds between two samples.
+            stop_event (Optional[threading.Event]): Event that ends the loop.
+        Returns:
+            None
+        """
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            try:
+                self.step()
+            except Exception as error:  # pylint: disable=broad-except
+                # A broker hiccup must not kill the controller; retry on the next tick.
+                logger.warning('Consumer scaling step failed: %s', error)
+            stop_event.wait(interval)
+        self.pool.stop()
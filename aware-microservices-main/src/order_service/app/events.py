@@ -1,22 +1,183 @@
 """_summary_
-Consumes user update events from a RabbitMQ queue and updates the corresponding 
-user orders in the database.
+Consumes user update events from the RabbitMQ event queues and updates the corresponding 
+user orders in the database. Each queue in USER_EVENT_QUEUES receives one kind of user 
+change and is consumed independently. When tracing is enabled, applying an event is
+recorded as a span of the trace carried in the message headers. The consumers count the
+events they processed, failed to apply and acknowledged in the metrics of the service,
+and the MongoDB round trips of each event under the scope 'consume <queue>', under
+which a sampled fraction of the events is profiled as well.
 
 Author:
     @TheBarzani
 """
 
-import os
 import json
-from typing import Any, Dict, List, Optional
+import logging
+import time
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
 from flask import current_app
-from dotenv import load_dotenv
-from shared.config.rabbitmq_config import create_channel
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+from shared.config.rabbitmq_config import EventQueue, create_channel, drain_legacy_queue
+from shared.metrics import REGISTRY
+from shared.profiling import get_profiler
+from shared.round_trips import account_round_trips
+from shared.tracing import TRACEPARENT_HEADER, get_tracer, parse_traceparent
+from order_service.app.consumer_scaling import ApplyLatencyTracker
+from order_service.app.broadcast import ORDER_DETAILS_CHANGED, publish_order_event
+from order_service.app.archive import PROPAGATE_POLICY
+from order_service.app.list_cache import invalidate_statuses
+from order_service.app.propagation import PropagationTracker, parse_published_at
+from order_service.app.queries import iter_user_orders
+from order_service.app.rollups import country_moves, record_order_moved
+from order_service.app.snapshots import (SNAPSHOT_MODE, UNSHIPPED_STATUSES, contact_versions,
+                                         has_older_contact, older_contact_filter,
+                                         save_user_snapshot)
 
-load_dotenv()
-QUEUE_NAME = os.getenv('RABBITMQ_QUEUE_NAME')
+logger = logging.getLogger(__name__)
 
-def consume_user_update_events() -> None:
+EVENTS_PROCESSED = REGISTRY.counter('user_events_processed_total',
+                                    'User update events applied by the consumers.', ('queue',))
+EVENTS_FAILED = REGISTRY.counter('user_events_failed_total',
+                                 'User update events whose application failed.', ('queue',))
+EVENTS_ACKED = REGISTRY.counter('user_events_acked_total',
+                                'User update events acknowledged to RabbitMQ.', ('queue',))
+
+def contact_version(event: Dict[str, Any]) -> Optional[datetime]:
+    """
+    Returns:
+        Optional[datetime]: The version of the contact fields of a user update event in
+                            naive UTC, as MongoDB returns dates: the 'updatedAt' its user
+                            was written with, which the reconciliation job compares as
+                            well, else its publish time for events published before they
+                            carried one, or None for events without either.
+    """
+    version = event.get('version')
+    if isinstance(version, str):
+        try:
+            return datetime.fromisoformat(version).astimezone(timezone.utc).replace(tzinfo=None)
+        except ValueError:
+            pass
+    published_at = parse_published_at(event)
+    if published_at is None:
+        return None
+    return datetime.fromtimestamp(published_at, timezone.utc).replace(tzinfo=None)
+
+def update_orders(collection: Collection, orders: List[Dict[str, Any]],
+                  fields: Dict[str, Any], version: Optional[datetime]) -> List[Dict[str, Any]]:
+    """
+    Sets the contact fields of an update on a page of orders with one bulk write, except
+    on the orders that already hold a newer version of them, written by a consumer that
+    applied a later update of the user first. The updatedAt of the orders is bumped, so
+    the archival of an order read before the update does not delete it.
+    Args:
+        collection (Collection): The orders or archived orders collection.
+        orders (List[Dict[str, Any]]): The orders, as read before the update.
+        fields (Dict[str, Any]): The new 'userEmails' and/or 'deliveryAddress'.
+        version (Optional[datetime]): The version of the fields, None to set them on
+                                      every order.
+    Returns:
+        List[Dict[str, Any]]: The orders that were updated, as read before the update.
+    """
+    update = {**fields, 'updatedAt': datetime.utcnow()}
+    if version is None:
+        condition: Dict[str, Any] = {}
+    else:
+        orders = [order for order in orders if has_older_contact(order, fields, version)]
+        condition = older_contact_filter(fields, version)
+        update.update(contact_versions(fields, version))
+    if not orders:
+        return []
+    result = collection.bulk_write([UpdateOne({'orderId': order['orderId'], **condition},
+                                              {'$set': update})
+                                    for order in orders], ordered=False)
+    if result.matched_count < len(orders):
+        # A newer update of the user was applied since the orders were read
+        updated = {order['orderId'] for order in collection.find(
+            {'orderId': {'$in': [order['orderId'] for order in orders]},
+             **contact_versions(fields, version)}, {'orderId': 1})}
+        orders = [order for order in orders if order['orderId'] in updated]
+    return orders
+
+def apply_user_update(event: Dict[str, Any]) -> None:
+    """
+    Applies one user update event to the order service.
+    In the 'embedded' storage mode the new emails and delivery address are written 
+    into every order of the user. In the 'snapshot' mode they are written once into 
+    the user's snapshot, which unshipped orders resolve at read time. In both modes 
+    an order details change event, carrying the publish time of the user event, is 
+    published for every affected order, and the cached listings of the affected 
+    statuses are invalidated.
+    The orders of the user are read page by page with the same index-backed query as 
+    GET /orders?userId=, and each page is updated with one bulk write. In the 
+    'embedded' mode, orders whose delivery country changes are moved between the 
+    country rollups, and archived orders are updated as well only when 
+    ORDER_ARCHIVE_USER_UPDATES is 'propagate'. In the 'snapshot' mode archived orders 
+    are delivered and keep the contact details frozen into them when they shipped.
+    Updates of the same user may be applied out of order by concurrent consumers, so
+    the publish time of the event versions the fields it sets, and a field is never
+    replaced by an older version (see update_orders and save_user_snapshot).
+    Args:
+        event (Dict[str, Any]): The decoded user update event.
+    Returns:
+        None
+    """
+
+    # Extract the data
+    user_id: str = event['userId']
+    emails: Optional[List[str]] = event.get('userEmails')
+    delivery_address: Optional[Dict[str, str]] = event.get('deliveryAddress')
+
+    update_fields: Dict[str, Any] = {}
+    if emails:
+        update_fields['userEmails'] = emails
+    if delivery_address:
+        update_fields['deliveryAddress'] = delivery_address
+    if not update_fields:
+        return
+
+    partition = current_app.order_partitions.for_user(user_id)
+    orders_collection = partition.orders
+    version = contact_version(event)
+    if current_app.config['ORDER_CONTACT_MODE'] == SNAPSHOT_MODE:
+        if not save_user_snapshot(current_app.user_snapshots_collection, user_id,
+                                  update_fields, version):
+            return
+        invalidate_statuses(current_app.order_list_cache, UNSHIPPED_STATUSES)
+        for orders in iter_user_orders(orders_collection, user_id,
+                                       statuses=list(UNSHIPPED_STATUSES)):
+            for order in orders:
+                publish_order_event(ORDER_DETAILS_CHANGED, {**order, **update_fields},
+                                    published_at=event.get('publishedAt'))
+        return
+
+    for old_orders in iter_user_orders(orders_collection, user_id):
+        old_orders = update_orders(orders_collection, old_orders, update_fields, version)
+        record_order_moved(current_app.order_rollups_collection,
+                           country_moves(old_orders, delivery_address))
+        invalidate_statuses(current_app.order_list_cache,
+                            [order['orderStatus'] for order in old_orders])
+        for order in old_orders:
+            publish_order_event(ORDER_DETAILS_CHANGED, {**order, **update_fields},
+                                published_at=event.get('publishedAt'))
+
+    if current_app.config['ORDER_ARCHIVE_USER_UPDATES'] != PROPAGATE_POLICY:
+        return
+    # Archived orders are not streamed, so they are only updated
+    archive_collection = partition.archive
+    for old_orders in iter_user_orders(archive_collection, user_id):
+        old_orders = update_orders(archive_collection, old_orders, update_fields, version)
+        record_order_moved(current_app.order_rollups_collection,
+                           country_moves(old_orders, delivery_address))
+        invalidate_statuses(current_app.order_list_cache,
+                            [order['orderStatus'] for order in old_orders])
+
+def consume_user_update_events(queue: EventQueue,
+                               stop_event: Optional[threading.Event] = None,
+                               latency: Optional[ApplyLatencyTracker] = None,
+                               propagation: Optional[PropagationTracker] = None) -> None:
     """
     Consumes user update events from a RabbitMQ queue and updates the corresponding 
     orders in the database.This function sets up a RabbitMQ consumer that listens 
@@ -24,46 +185,114 @@ def consume_user_update_events() -> None:
     emails, and delivery address from the event and updates the corresponding orders
     in the database with the new information.
     The function performs the following steps:
-    1. Retrieves the RabbitMQ queue name from the application configuration.
-    2. Creates a channel and connection to the RabbitMQ server.
+    1. Creates a channel and connection to the RabbitMQ server, moves the events left
+       in the queue of the former direct exchange (see drain_legacy_queue) and applies
+       the prefetch count of the queue.
+    2. Declares the user event exchange and queues.
     3. Defines a callback function to handle incoming messages.
         - Parses the event data from the message body.
-        - Extracts the user ID, emails, and delivery address from the event.
-        - Finds all orders associated with the user ID in the database.
-        - Updates the orders with the new emails and delivery address if provided.
+        - Applies the event with apply_user_update, which updates the orders (or 
+          the user snapshot) with the new emails and delivery address if provided.
         - Acknowledges the message to remove it from the queue.
     4. Starts consuming messages from the queue using the defined callback function.
+    When a stop event is given, the consumer checks it between deliveries and, once it
+    is set, cancels its subscription and closes its connection so that prefetched
+    messages are requeued for the remaining consumers.
+    Args:
+        queue (EventQueue): The event queue to consume from.
+        stop_event (Optional[threading.Event]): Event that asks the consumer to stop.
+        latency (Optional[ApplyLatencyTracker]): Tracker that receives the time spent
+                                                 applying each event.
+        propagation (Optional[PropagationTracker]): Tracker that receives the time 
+                                                    from publishing to applying each 
+                                                    event.
     Note:
         This function assumes that the application context is available and that 
         the `current_app` object provides access to the application configuration 
         and the orders collection in the database.
-    Raises:
-        Any exceptions raised during the processing of messages will be propagated.
+    An event that fails to apply is rejected and requeued once, then dropped when it
+    fails again; malformed events are dropped at once. Either way the consumer keeps
+    consuming.
     """
 
-    channel, connection = create_channel(QUEUE_NAME)
+    channel, connection = create_channel()
+    # Events still in the queue of the former direct exchange go through the new queues
+    drain_legacy_queue(connection)
+    # Limit unacknowledged deliveries so a backlog is shared between consumers
+    channel.basic_qos(prefetch_count=queue.prefetch_count)
 
     def callback(ch: Any, method: Any, properties: Any, body: bytes) -> None:
-        event = json.loads(body)
+        started = time.perf_counter()
+        try:
+            event = json.loads(body)
+        except ValueError:
+            # A malformed event never applies, so it is dropped rather than redelivered
+            EVENTS_FAILED.inc(queue.name)
+            logger.error('Dropped malformed event from %s: %r', queue.name, body[:200])
+            ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+            return
+        # Continue the trace of the request that published the event
+        parent = parse_traceparent((properties.headers or {}).get(TRACEPARENT_HEADER))
+        with get_tracer().span(f'consume {method.routing_key}', parent, 'consumer',
+                               {'messaging.system': 'rabbitmq',
+                                'messaging.source': queue.name,
+                                'messaging.rabbitmq.routing_key': method.routing_key}):
+            try:
+                with account_round_trips(f'consume {queue.name}', current_app.config), \
+                        get_profiler().profile(f'consume {queue.name}'):
+                    apply_user_update(event)
+            except Exception:
+                EVENTS_FAILED.inc(queue.name)
+                # Retry the event once, in case the failure was transient, then drop it
+                # so that it neither stops the consumer nor comes back forever. The
+                # reconciliation job repairs the orders it left behind.
+                requeue = not method.redelivered
+                logger.exception('Failed to apply event from %s, %s', queue.name,
+                                 'requeued' if requeue else 'dropped')
+                ch.basic_nack(delivery_tag=method.delivery_tag, requeue=requeue)
+                return
+        EVENTS_PROCESSED.inc(queue.name)
+        ch.basic_ack(delivery_tag=method.delivery_tag)
+        EVENTS_ACKED.inc(queue.name)
+        if latency is not None:
+            latency.record(time.perf_counter() - started)
+        published_at = parse_published_at(event)
+        if propagation is not None and published_at is not None:
+            propagation.record_applied(queue.name, published_at)
 
-        # Extract the data
-        user_id: str = event['userId']
-        emails: Optional[List[str]] = event.get('userEmails')
-        delivery_address: Optional[str] = event.get('deliveryAddress')
+    consumer_tag = channel.basic_consume(queue=queue.name, on_message_callback=callback,
+                                         auto_ack=False)
+    if stop_event is None:
+        channel.start_consuming()
+        return
 
-        orders_collection = current_app.orders_collection
-        old_orders: List[Dict[str, Any]] = list(orders_collection.find({'userId': user_id}))
+    while not stop_event.is_set():
+        connection.process_data_events(time_limit=1)
+    channel.basic_cancel(consumer_tag)
+    connection.close()
 
-        update_fields: Dict[str, Any] = {}
-        if emails:
-            update_fields['userEmails'] = emails
-        if delivery_address:
-            update_fields['deliveryAddress'] = delivery_address
+def create_backlog_sampler(queue_name: str) -> Callable[[], int]:
+    """
+    Creates a function that returns the number of messages ready on a queue. The
+    sampler keeps its own channel open between calls and reconnects after a failure.
+    Args:
+        queue_name (str): The name of the queue to sample.
+    Returns:
+        Callable[[], int]: A function returning the current backlog of the queue.
+    """
 
-        for order in old_orders:
-            orders_collection.update_one({'orderId': order["orderId"]}, {'$set': update_fields})
+    state: Dict[str, Any] = {}
 
-        ch.basic_ack(delivery_tag=method.delivery_tag)
+    def sample() -> int:
+        if 'channel' not in state or not state['channel'].is_open:
+            state['channel'], state['connection'] = create_channel()
+        try:
+            declared = state['channel'].queue_declare(queue=queue_name, passive=True)
+        except Exception:
+            if state['connection'].is_open:
+                state['connection'].close()
+            state.clear()
+            raise
+        return declared.method.message_count
 
-    channel.basic_consume(queue=QUEUE_NAME, on_message_callback=callback, auto_ack=False)
-    channel.start_consuming()
+    return sample
@@ -0,0 +1,151 @@
+"""_summary_
+This module implements an opt-in group commit writer for order inserts.
+
+Every request thread of a worker normally pays its own insert_one round trip. With
+ORDER_GROUP_COMMIT enabled, request threads instead hand their validated order to the
+worker's GroupCommitWriter and wait. A single flusher thread collects the orders that
+arrive within ORDER_GROUP_COMMIT_WINDOW_MS of the first one, or until
+ORDER_GROUP_COMMIT_MAX_BATCH orders are waiting, and writes them with one unordered
+insert_many. Each request then receives its own outcome: the inserted _id, or the write
+error of its own document, while the other documents of the batch are still inserted.
+When the batch misses its write concern, every written document fails with the
+WriteConcernError that insert_one would have raised.
+
+The window trades latency for throughput: a lone request waits up to one window longer,
+while under concurrency many requests share one round trip. See
+experiments/benchmark_group_commit.py for measurements.
+
+Classes:
+    GroupCommitWriter: Batches concurrent inserts into one insert_many.
+Author:
+    @TheBarzani
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError, DuplicateKeyError, WriteConcernError, WriteError
+
+
+class GroupCommitWriter:
+    """
+    Inserts documents submitted by concurrent threads in batches.
+    """
+
+    def __init__(self, collection: Collection, window_seconds: float = 0.002,
+                 max_batch: int = 100) -> None:
+        """
+        Args:
+            collection (Collection): The collection to insert into.
+            window_seconds (float): How long the flusher waits for more documents after
+                                    the first one of a batch arrived.
+            max_batch (int): The number of documents that triggers an immediate flush.
+        """
+        self.collection = collection
+        self.window_seconds = window_seconds
+        self.max_batch = max_batch
+        self._queue: "queue.Queue[Tuple[Dict[str, Any], Future]]" = queue.Queue()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, document: Dict[str, Any]) -> Future:
+        """
+        Queues a document for the next batch.
+        Args:
+            document (Dict[str, Any]): The document; its _id is set once it is written.
+        Returns:
+            Future: Resolves to the inserted _id, or raises the document's WriteError.
+        """
+        future: Future = Future()
+        self._queue.put((document, future))
+        return future
+
+    def insert(self, document: Dict[str, Any], timeout: Optional[float] = None) -> Any:
+        """
+        Inserts a document with the next batch and waits for the outcome.
+        Args:
+            document (Dict[str, Any]): The document to insert.
+            timeout (Optional[float]): The maximum number of seconds to wait. The
+                                       document stays queued when the wait times out,
+                                       so it may still be written with a later batch.
+        Returns:
+            Any: The inserted _id.
+        Raises:
+            pymongo.errors.PyMongoError: If the document could not be written, or
+                                         WriteConcernError if it was written without
+                                         the required acknowledgement.
+            concurrent.futures.TimeoutError: If the timeout expired before the outcome
+                                             of the document was known.
+        """
+        return self.submit(document).result(timeout)
+
+    def stop(self) -> None:
+        """
+        Flushes the queued documents and stops the flusher thread.
+        """
+        self._stop_event.set()
+        self._thread.join()
+
+    def _collect(self) -> List[Tuple[Dict[str, Any], Future]]:
+        try:
+            batch = [self._queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.window_seconds
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        # Take whatever else is already waiting, up to a full batch
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch: List[Tuple[Dict[str, Any], Future]]) -> None:
+        documents = [document for document, _ in batch]
+        failed: Dict[int, Exception] = {}
+        unacknowledged: Optional[Exception] = None
+        try:
+            self.collection.insert_many(documents, ordered=False)
+        except BulkWriteError as error:
+            for write_error in error.details.get('writeErrors', []):
+                # Raise what insert_one would have raised for the document
+                error_class = (DuplicateKeyError if write_error.get('code') == 11000
+                               else WriteError)
+                failed[write_error['index']] = error_class(write_error.get('errmsg'),
+                                                           write_error.get('code'),
+                                                           write_error)
+            concern_errors = error.details.get('writeConcernErrors', [])
+            if concern_errors:
+                # The other documents were written, but not acknowledged as required
+                concern_error = concern_errors[-1]
+                unacknowledged = WriteConcernError(concern_error.get('errmsg'),
+                                                   concern_error.get('code'), concern_error)
+        except Exception as error:  # pylint: disable=broad-except
+            for _, future in batch:
+                future.set_exception(error)
+            return
+        for index, (document, future) in enumerate(batch):
+            if index in failed:
+                future.set_exception(failed[index])
+            elif unacknowledged is not None:
+                future.set_exception(unacknowledged)
+            else:
+                future.set_result(document['_id'])
+
+    def _run(self) -> None:
+        while not (self._stop_event.is_set() and self._queue.empty()):
+            batch = self._collect()
+            if batch:
+                self._flush(batch)
@@ -0,0 +1,114 @@
+"""_summary_
+This module defines the indexes of the order service collections and creates them
+when the service starts.
+
+The compound indexes of the 'orders' collection follow the equality, sort, range rule:
+an optional equality field (userId or orderStatus) comes first, then the field the
+results are sorted and range-filtered on (createdAt, updatedAt or totalAmount), then orderId as the tie-breaker used by keyset
+pagination. Every filter combination supported by GET /orders/search maps to one of them.
+
+The 'orders_archive' collection has the same indexes as 'orders', and the
+'order_rollups' collection is read by dimension and day range.
+
+Constants:
+    ORDER_INDEXES: The indexes of the 'orders' collection, as (name, keys, options).
+    ROLLUP_INDEXES: The indexes of the 'order_rollups' collection.
+Functions:
+    search_index_name(equality_field, sort_field) -> str: Returns the name of the index
+        serving a search with the given equality and sort fields.
+    ensure_indexes(db): Creates the indexes that do not exist yet.
+    ensure_indexes_in_background(db): Creates the indexes from a background thread, 
+        retrying until the database is reachable.
+Author:
+    @TheBarzani
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo import ASCENDING
+from pymongo.database import Database
+from pymongo.errors import PyMongoError
+
+SEARCH_SORT_FIELDS = ('createdAt', 'updatedAt', 'totalAmount')
+SEARCH_EQUALITY_FIELDS = ('userId', 'orderStatus')
+
+logger = logging.getLogger(__name__)
+
+def search_index_name(equality_field: Optional[str], sort_field: str) -> str:
+    """
+    Args:
+        equality_field (Optional[str]): 'userId', 'orderStatus' or None.
+        sort_field (str): The field the results are sorted on.
+    Returns:
+        str: The name of the index serving the search.
+    """
+    if equality_field is None:
+        return f'orders_{sort_field}'
+    return f'orders_{equality_field}_{sort_field}'
+
+def _search_indexes() -> List[Tuple[str, List[Tuple[str, int]], Dict[str, Any]]]:
+    indexes = []
+    for sort_field in SEARCH_SORT_FIELDS:
+        indexes.append((search_index_name(None, sort_field),
+                        [(sort_field, ASCENDING), ('orderId', ASCENDING)], {}))
+        for equality_field in SEARCH_EQUALITY_FIELDS:
+            indexes.append((search_index_name(equality_field, sort_field),
+                            [(equality_field, ASCENDING), (sort_field, ASCENDING),
+                             ('orderId', ASCENDING)], {}))
+    return indexes
+
+ORDER_INDEXES: List[Tuple[str, List[Tuple[str, int]], Dict[str, Any]]] = [
+    ('orders_orderId', [('orderId', ASCENDING)], {'unique': True}),
+    *_search_indexes(),
+    # Finds the delivered orders due for archival
+    ('orders_orderStatus_deliveredAt', [('orderStatus', ASCENDING), ('deliveredAt', ASCENDING)],
+     {}),
+]
+
+ROLLUP_INDEXES: List[Tuple[str, List[Tuple[str, int]], Dict[str, Any]]] = [
+    ('order_rollups_dimension_day',
+     [('dimension', ASCENDING), ('day', ASCENDING), ('value', ASCENDING)], {}),
+]
+
+# The archive has the same indexes so archived orders are searched with the same plans
+COLLECTION_INDEXES = {'orders': ORDER_INDEXES, 'orders_archive': ORDER_INDEXES,
+                      'order_rollups': ROLLUP_INDEXES}
+
+def ensure_indexes(db: Database) -> None:
+    """
+    Creates the indexes of the order service collections. Creating an index that
+    already exists with the same keys and options is a no-op.
+    Args:
+        db (Database): The order service database.
+    Returns:
+        None
+    """
+    for collection, indexes in COLLECTION_INDEXES.items():
+        for name, keys, options in indexes:
+            db[collection].create_index(keys, name=name, **options)
+
+def ensure_indexes_in_background(db: Database, retry_delay: float = 5.0) -> threading.Thread:
+    """
+    Creates the indexes from a daemon thread so the service can start before the 
+    database is reachable, retrying until it succeeds.
+    Args:
+        db (Database): The order service database.
+        retry_delay (float): Seconds to wait between attempts.
+    Returns:
+        threading.Thread: The started thread.
+    """
+
+    def run() -> None:
+        while True:
+            try:
+                ensure_indexes(db)
+                return
+            except PyMongoError as error:
+                logger.warning('Creating order indexes failed, retrying: %s', error)
+                time.sleep(retry_delay)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,206 @@
+"""_summary_
+This module implements the optional shared cache of the GET /orders?status= responses.
+
+The three status buckets are read constantly and every worker of every replica would
+otherwise query and serialize them on its own. With ORDER_LIST_CACHE_URL set, the
+serialized response of a status listing is stored in a key-value service that all
+workers and replicas reach, under a key that includes a per-status generation counter.
+Every write that can change a status listing bumps the generation of the statuses it
+touches after the write is committed: order creation, status and details updates, the
+user event consumer, and the archival and backfill jobs. A reader first reads the
+current generation and then looks up the response of that generation, so a response is
+served only until the next write to its status: staleness is bounded by the generation
+counter, not by a TTL. Entries of past generations are never read again and expire
+after ORDER_LIST_CACHE_TTL_SECONDS, which only bounds the memory they take.
+
+A reader that read the generation before a concurrent write may store a response that
+misses the write, but it stores it under the old generation, which no later reader
+uses.
+
+The cache never fails a request or a committed write: when the store is unreachable,
+readers query the database as without a cache, and writes log the error and keep the
+statuses they could not invalidate. Every later cache operation of the process first
+retries those invalidations, and no cached response is read until they succeed.
+
+Stores:
+    redis://host:port/db: A Redis server, shared by every worker and replica. The
+        generation keys have no expiry, so the server must not evict them: use the
+        volatile-lru or volatile-ttl maxmemory policy.
+    memory://: A store local to one process, for tests and single worker setups.
+
+Classes:
+    MemoryStore: In-process store with the interface of the Redis client used here.
+    OrderListCache: Versioned cache of serialized status listings.
+Functions:
+    create_list_cache(url, ttl_seconds) -> Optional[OrderListCache]: Builds the cache.
+    invalidate_statuses(cache, statuses): Bumps the generations of the given statuses.
+Author:
+    @TheBarzani
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Set, Tuple, Type
+
+KEY_PREFIX = 'orders:list'
+ORDER_STATUSES = ('under process', 'shipping', 'delivered')
+
+logger = logging.getLogger(__name__)
+
+class MemoryStore:
+    """
+    A thread-safe in-process key-value store with the get, set and incr operations of
+    the Redis client.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._values: Dict[str, Tuple[Any, Optional[float]]] = {}
+
+    def get(self, key: str) -> Any:
+        """
+        Returns:
+            Any: The value of the key, or None if it is missing or expired.
+        """
+        with self._lock:
+            value, expires_at = self._values.get(key, (None, None))
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._values[key]
+                return None
+            return value
+
+    def set(self, key: str, value: Any, ex: Optional[int] = None) -> None:
+        """
+        Stores a value, expiring after `ex` seconds when given.
+        """
+        with self._lock:
+            self._values[key] = (value, time.monotonic() + ex if ex else None)
+
+    def incr(self, key: str) -> int:
+        """
+        Returns:
+            int: The incremented value of the key, starting from 0.
+        """
+        with self._lock:
+            value = int(self._values.get(key, (0, None))[0]) + 1
+            self._values[key] = (value, None)
+            return value
+
+class OrderListCache:
+    """
+    Caches serialized status listings under per-status generations.
+    """
+
+    def __init__(self, store: Any, ttl_seconds: int = 3600,
+                 errors: Tuple[Type[Exception], ...] = ()) -> None:
+        """
+        Args:
+            store (Any): A Redis client or a MemoryStore.
+            ttl_seconds (int): Seconds after which an entry expires.
+            errors (Tuple[Type[Exception], ...]): The errors of the store that are
+                                                  logged instead of raised.
+        """
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.errors = errors
+        self._lock = threading.Lock()
+        # Statuses whose invalidation failed, retried before any other operation
+        self._pending: Set[str] = set()
+
+    def _flush(self) -> None:
+        with self._lock:
+            pending = set(self._pending)
+        for status in pending:
+            self.store.incr(f'{KEY_PREFIX}:{status}:generation')
+            with self._lock:
+                self._pending.discard(status)
+
+    def generation(self, status: str) -> Optional[int]:
+        """
+        Returns:
+            Optional[int]: The current generation of the status, 0 before its first
+                           write, or None when the cache cannot be used.
+        """
+        try:
+            self._flush()
+            return int(self.store.get(f'{KEY_PREFIX}:{status}:generation') or 0)
+        except self.errors as error:
+            logger.warning('Order list cache unavailable, reading uncached: %s', error)
+            return None
+
+    def get(self, status: str, generation: int, variant: str) -> Optional[bytes]:
+        """
+        Args:
+            status (str): The order status of the listing.
+            generation (int): The generation read before the lookup.
+            variant (str): What else the response depends on, such as the fields.
+        Returns:
+            Optional[bytes]: The serialized response, or None on a miss.
+        """
+        try:
+            return self.store.get(f'{KEY_PREFIX}:{status}:{generation}:{variant}')
+        except self.errors as error:
+            logger.warning('Order list cache lookup failed: %s', error)
+            return None
+
+    def put(self, status: str, generation: int, variant: str, body: bytes) -> None:
+        """
+        Stores a serialized response computed after reading the given generation.
+        """
+        try:
+            self.store.set(f'{KEY_PREFIX}:{status}:{generation}:{variant}', body,
+                           ex=self.ttl_seconds)
+        except self.errors as error:
+            logger.warning('Order list cache store failed: %s', error)
+
+    def invalidate(self, status: str) -> None:
+        """
+        Bumps the generation of a status, so its cached responses are no longer read.
+        If the store is unreachable the invalidation is retried by the next operation.
+        """
+        with self._lock:
+            self._pending.add(status)
+        try:
+            self._flush()
+        except self.errors as error:
+            logger.error('Order list cache invalidation of %s failed, will retry: %s',
+                         status, error)
+
+def create_list_cache(url: Optional[str], ttl_seconds: int = 3600) -> Optional[OrderListCache]:
+    """
+    Builds the cache configured by ORDER_LIST_CACHE_URL.
+    Args:
+        url (Optional[str]): 'redis://...', 'memory://', or empty to disable caching.
+        ttl_seconds (int): Seconds after which an entry expires.
+    Returns:
+        Optional[OrderListCache]: The cache, or None when caching is disabled.
+    Raises:
+        ValueError: If the URL scheme is not supported.
+        ImportError: If a Redis URL is given without the redis package installed.
+    """
+    if not url:
+        return None
+    if url.startswith('memory://'):
+        return OrderListCache(MemoryStore(), ttl_seconds)
+    if url.startswith(('redis://', 'rediss://')):
+        import redis  # pylint: disable=import-outside-toplevel
+        return OrderListCache(redis.Redis.from_url(url), ttl_seconds,
+                              (redis.exceptions.RedisError,))
+    raise ValueError(f'Unsupported ORDER_LIST_CACHE_URL: {url}')
+
+def invalidate_statuses(cache: Optional[OrderListCache], statuses: Iterable[str]) -> None:
+    """
+    Bumps the generations of the given statuses, if caching is enabled. Call it after
+    the write is committed.
+    Args:
+        cache (Optional[OrderListCache]): The cache, or None when caching is disabled.
+        statuses (Iterable[str]): The statuses whose listings the write may change.
+    Returns:
+        None
+    """
+    if cache is None:
+        return
+    for status in set(statuses):
+        if status:
+            cache.invalidate(status)
@@ -22,6 +22,19 @@ Models:
           'shipping', or 'delivered'.
         - createdAt (datetime): Timestamp of when the order was created.
         - updatedAt (datetime): Timestamp of when the order was last updated.
+        - deliveredAt (datetime): Timestamp of when the order was delivered.
+        - itemCount (int): Number of items in the order, computed on creation.
+        - totalQuantity (int): Sum of the item quantities, computed on creation.
+        - totalAmount (float): Sum of quantity times price, computed on creation.
+    OrderPage:
+        - orders (list[Order]): One page of orders.
+        - nextCursor (str): Cursor of the next page, absent on the last page.
+    OrderRollup:
+        - day (datetime): The day the orders were created.
+        - dimension (str): 'orderStatus' or 'country'.
+        - value (str): The status or country of the orders.
+        - orders (int): Number of orders.
+        - revenue (float): Sum of the totalAmount of the orders.
 Author:
     @TheBarzani
 """
@@ -56,5 +69,24 @@ order_model = api.model('Order', {
     'orderStatus': fields.String(required=True, description='Current status of the order', 
                                  enum=['under process', 'shipping', 'delivered']),
     'createdAt': fields.DateTime(description='Timestamp of when the order was created.'),
-    'updatedAt': fields.DateTime(description='Timestamp of when the order was last updated.')
+    'updatedAt': fields.DateTime(description='Timestamp of when the order was last updated.'),
+    'deliveredAt': fields.DateTime(readonly=True, description='Timestamp of when the order '+
+                                   'was delivered.'),
+    'itemCount': fields.Integer(readonly=True, description='Number of items in the order'),
+    'totalQuantity': fields.Integer(readonly=True, description='Sum of the item quantities'),
+    'totalAmount': fields.Float(readonly=True, description='Sum of quantity times price '+
+                                'of the items')
+})
+
+order_page_model = api.model('OrderPage', {
+    'orders': fields.List(fields.Nested(order_model), description='One page of orders'),
+    'nextCursor': fields.String(description='Cursor of the next page, absent on the last page')
+})
+
+rollup_model = api.model('OrderRollup', {
+    'day': fields.Date(description='The day the orders were created'),
+    'dimension': fields.String(description="'orderStatus' or 'country'"),
+    'value': fields.String(description='The status or country of the orders'),
+    'orders': fields.Integer(description='Number of orders'),
+    'revenue': fields.Float(description='Sum of the totalAmount of the orders')
 })
@@ -0,0 +1,283 @@
+"""_summary_
+This module implements the optional partitioning of orders across MongoDB clusters.
+
+By default every order lives in the 'orders' collection of MONGO_URI. When
+ORDER_PARTITIONS lists named clusters, as 'name=uri,name=uri', each user is assigned to
+one partition by consistent hashing of the userId, and all the orders of that user, hot
+and archived, live in the 'orders' and 'orders_archive' collections of that partition's
+DATABASE_NAME database. The collections of the user snapshots, the rollups and the
+idempotency keys stay in the MONGO_URI database.
+
+Operations on one user's orders go to the user's partition only: order creation, the
+listing of a user's orders and the consumer's per-user updates. Updates by orderId find
+the partition holding the order first. Status listings and searches query all the
+partitions in parallel and merge the results; since search cursors hold sort values
+rather than positions, the merged pages paginate like those of a single collection.
+
+Partitions are placed on a hash ring by name, with ORDER_PARTITION_VNODES virtual nodes
+each, so adding a partition only moves the users whose hash falls on its new ranges.
+Renaming a partition moves its users, while changing its URI does not. After adding a
+partition, run order_service.jobs.rebalance_partitions to move the orders of the users
+it took over; until it finishes, the listings of those users miss their older orders.
+
+Classes:
+    HashRing: Consistent hashing of keys onto named nodes.
+    OrderPartition: The order collections of one partition.
+    PartitionRouter: Routes order operations to their partitions.
+Functions:
+    parse_partitions(spec) -> List[Tuple[str, str]]: Reads ORDER_PARTITIONS.
+    create_partition_router(config, home_client) -> PartitionRouter: Builds the router.
+Author:
+    @TheBarzani
+"""
+
+import bisect
+import contextvars
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, Tuple, TypeVar
+from pymongo import MongoClient
+from pymongo.collection import Collection
+from pymongo.database import Database
+from shared.mongo import create_mongo_client, read_collection
+from order_service.app.archive import ARCHIVE_COLLECTION
+from order_service.app.group_commit import GroupCommitWriter
+from order_service.app.queries import SearchFilters, merge_pages, search_orders
+
+DEFAULT_PARTITION = 'default'
+T = TypeVar('T')
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+class HashRing:
+    """
+    Maps keys onto named nodes with consistent hashing.
+    """
+
+    def __init__(self, names: Sequence[str], vnodes: int = 64) -> None:
+        """
+        Args:
+            names (Sequence[str]): The names of the nodes.
+            vnodes (int): The number of points of each node on the ring.
+        """
+        points = sorted((_hash(f'{name}#{index}'), name)
+                        for name in names for index in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._names = [name for _, name in points]
+
+    def node_for(self, key: str) -> str:
+        """
+        Returns:
+            str: The name of the node owning the key: the first point at or after the
+                 hash of the key, wrapping around the ring.
+        """
+        index = bisect.bisect_left(self._hashes, _hash(key))
+        return self._names[index % len(self._names)]
+
+def parse_partitions(spec: Optional[str]) -> List[Tuple[str, str]]:
+    """
+    Reads the ORDER_PARTITIONS setting.
+    Args:
+        spec (Optional[str]): Comma separated 'name=uri' pairs.
+    Returns:
+        List[Tuple[str, str]]: The names and URIs of the partitions, empty when unset.
+    Raises:
+        ValueError: If a pair is malformed or a name or URI is repeated.
+    """
+    partitions: List[Tuple[str, str]] = []
+    for item in filter(None, (part.strip() for part in (spec or '').split(','))):
+        name, separator, uri = item.partition('=')
+        if not separator or not name or not uri:
+            raise ValueError(f'ORDER_PARTITIONS entries must be name=uri: {item}')
+        partitions.append((name.strip(), uri.strip()))
+    for position in (0, 1):
+        values = [partition[position] for partition in partitions]
+        if len(set(values)) != len(values):
+            raise ValueError('ORDER_PARTITIONS names and URIs must be unique')
+    return partitions
+
+class OrderPartition:
+    """
+    The order collections of one partition.
+    Attributes:
+        name (str): The name of the partition on the hash ring.
+        db (Database): The database of the partition.
+        orders (Collection): The hot orders, reading from the primary.
+        orders_read (Collection): The hot orders for read-only endpoints.
+        archive (Collection): The archived orders, reading from the primary.
+        archive_read (Collection): The archived orders for read-only endpoints.
+        writer (Optional[GroupCommitWriter]): The group commit writer of order inserts.
+    """
+
+    def __init__(self, name: str, db: Database, config: Mapping[str, Any]) -> None:
+        self.name = name
+        self.db = db
+        self.orders: Collection = db['orders']
+        self.archive: Collection = db[ARCHIVE_COLLECTION]
+        self.orders_read = read_collection(self.orders, config)
+        self.archive_read = read_collection(self.archive, config)
+        self.writer: Optional[GroupCommitWriter] = None
+        if config['ORDER_GROUP_COMMIT']:
+            self.writer = GroupCommitWriter(self.orders,
+                                            config['ORDER_GROUP_COMMIT_WINDOW_MS'] / 1000,
+                                            config['ORDER_GROUP_COMMIT_MAX_BATCH'])
+
+class PartitionRouter:
+    """
+    Routes order operations to the partition of their user, or to all partitions.
+    """
+
+    def __init__(self, partitions: List[OrderPartition], vnodes: int = 64,
+                 concurrency: int = 1) -> None:
+        """
+        Args:
+            partitions (List[OrderPartition]): The partitions, at least one.
+            vnodes (int): The number of points of each partition on the hash ring.
+            concurrency (int): The number of threads that may query all the partitions
+                               at once, such as the request threads of a worker.
+        """
+        self.partitions = partitions
+        self._by_name = {partition.name: partition for partition in partitions}
+        self.ring = HashRing(list(self._by_name), vnodes)
+        # One thread per partition for every concurrent caller, so a caller never waits
+        # for the queries of the others to free a thread
+        self._executor = (ThreadPoolExecutor(max_workers=max(concurrency, 1) * len(partitions),
+                                             thread_name_prefix='order-partitions')
+                          if len(partitions) > 1 else None)
+
+    def for_user(self, user_id: Optional[str]) -> OrderPartition:
+        """
+        Returns:
+            OrderPartition: The partition holding the orders of the user. Orders without
+                            a userId are kept together in one partition.
+        """
+        if len(self.partitions) == 1:
+            return self.partitions[0]
+        return self._by_name[self.ring.node_for(user_id or '')]
+
+    def map(self, function: Callable[[OrderPartition], T]) -> List[T]:
+        """
+        Calls the function on every partition, in parallel when there are several.
+        Args:
+            function (Callable[[OrderPartition], T]): The query to run on a partition.
+        Returns:
+            List[T]: The results, in the order of the partitions.
+        Raises:
+            Exception: The first exception raised by a call.
+        """
+        if self._executor is None:
+            return [function(partition) for partition in self.partitions]
+        # Each call runs in a copy of the caller's context, to keep its active trace span
+        contexts = [contextvars.copy_context() for _ in self.partitions]
+        return list(self._executor.map(lambda context, partition:
+                                       context.run(function, partition),
+                                       contexts, self.partitions))
+
+    def for_order(self, order_id: str) -> OrderPartition:
+        """
+        Finds the partition holding an order.
+        Args:
+            order_id (str): The orderId of the order.
+        Returns:
+            OrderPartition: The partition holding the hot order, or the first partition
+                            if no partition does, so the caller reports it missing.
+        """
+        if len(self.partitions) == 1:
+            return self.partitions[0]
+        found = self.map(lambda partition: partition.orders.find_one({'orderId': order_id},
+                                                                     {'_id': 1}))
+        for partition, order in zip(self.partitions, found):
+            if order is not None:
+                return partition
+        return self.partitions[0]
+
+    def find_by_status(self, status: str, projection: Optional[Dict[str, Any]] = None,
+                       include_archived: bool = False,
+                       read_only: bool = True) -> List[Dict[str, Any]]:
+        """
+        Returns the orders with a status from every partition.
+        Args:
+            status (str): The order status.
+            projection (Optional[Dict[str, Any]]): The fields to return, all by default.
+            include_archived (bool): Whether to add the archived orders.
+            read_only (bool): Whether the read may use the read-only endpoint preference.
+        Returns:
+            List[Dict[str, Any]]: The orders.
+        """
+
+        def find(partition: OrderPartition) -> List[Dict[str, Any]]:
+            orders_collection = partition.orders_read if read_only else partition.orders
+            archive = partition.archive_read if read_only else partition.archive
+            orders = list(orders_collection.find({'orderStatus': status}, projection))
+            if include_archived:
+                # An order being archived can briefly exist in both; the hot copy wins
+                hot_ids = {order.get('orderId') for order in orders}
+                orders += [order for order in archive.find({'orderStatus': status}, projection)
+                           if order.get('orderId') not in hot_ids]
+            return orders
+
+        merged: Dict[str, Dict[str, Any]] = {}
+        for orders in self.map(find):
+            for order in orders:
+                # An order being rebalanced can briefly exist in two partitions
+                merged.setdefault(order.get('orderId'), order)
+        return list(merged.values())
+
+    def search(self, filters: SearchFilters, limit: int,
+               projection: Optional[Dict[str, Any]] = None,
+               include_archived: bool = False
+               ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Searches every partition and merges their pages into one page.
+        Args:
+            filters (SearchFilters): The search filters.
+            limit (int): The maximum number of orders on the page.
+            projection (Optional[Dict[str, Any]]): The fields to return, all by default.
+            include_archived (bool): Whether to search the archived orders as well.
+        Returns:
+            Tuple[List[Dict[str, Any]], Optional[str]]: The orders and the cursor of the
+                                                        next page, or None on the last page.
+        Raises:
+            ValueError: If the cursor is malformed.
+        """
+        if filters.user_id is not None:
+            partitions = [self.for_user(filters.user_id)]
+        else:
+            partitions = self.partitions
+        if len(partitions) == 1:
+            partition = partitions[0]
+            return search_orders(partition.orders_read, filters, limit, projection,
+                                 partition.archive_read if include_archived else None)
+
+        pages = self.map(lambda partition: search_orders(
+            partition.orders_read, filters, limit, projection,
+            partition.archive_read if include_archived else None))
+        return merge_pages(pages, filters, limit)
+
+def create_partition_router(config: Mapping[str, Any],
+                            home_client: MongoClient) -> PartitionRouter:
+    """
+    Builds the router of the ORDER_PARTITIONS setting, or of the single MONGO_URI
+    partition when it is empty.
+    Args:
+        config (Mapping[str, Any]): The Flask configuration of the service.
+        home_client (MongoClient): The client of MONGO_URI, reused by a partition with
+                                   the same URI.
+    Returns:
+        PartitionRouter: The router.
+    Raises:
+        ValueError: If ORDER_PARTITIONS is malformed.
+    """
+    database_name: str = config['DATABASE_NAME']
+    specs = parse_partitions(config['ORDER_PARTITIONS'])
+    if not specs:
+        return PartitionRouter([OrderPartition(DEFAULT_PARTITION, home_client[database_name],
+                                               config)])
+    partitions = []
+    for name, uri in specs:
+        client = (home_client if uri == config['MONGO_URI']
+                  else create_mongo_client({**config, 'MONGO_URI': uri}))
+        partitions.append(OrderPartition(name, client[database_name], config))
+    return PartitionRouter(partitions, config['ORDER_PARTITION_VNODES'],
+                           config['WORKER_THREADS'])
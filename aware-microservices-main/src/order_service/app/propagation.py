@@ -0,0 +1,241 @@
+"""_summary_
+This module measures how long user updates take to propagate to the order service.
+
+The user services stamp every user update event with the time it was published
+('publishedAt', ISO 8601 in UTC). When a consumer has applied an event, its
+publish-to-apply latency, which includes the time the event waited on the queue, is
+recorded in a histogram of the event queue. The lag of the oldest unprocessed event is
+derived from the backlog samples of the consumer controller: while messages are ready
+on the queue, the oldest of them was published after the last applied event, so it has
+been waiting for at most the time elapsed since that event was published. An empty
+queue has no lag.
+
+The order service reports both per queue at GET /orders/propagation and on /metrics.
+Each worker reports the events applied by its own consumers.
+
+Classes:
+    LatencyHistogram: Cumulative histogram of latencies with quantile estimates.
+    PropagationTracker: Propagation latency and lag of every event queue.
+Functions:
+    parse_published_at(event) -> Optional[float]: Reads the publish time of an event.
+Author:
+    @TheBarzani
+"""
+
+import bisect
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence
+from shared.metrics import MetricFamily
+
+# Upper bounds of the histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+                   60.0, 300.0)
+
+def parse_published_at(event: Dict[str, Any]) -> Optional[float]:
+    """
+    Reads the publish time of a user update event.
+    Args:
+        event (Dict[str, Any]): The decoded event.
+    Returns:
+        Optional[float]: The publish time as a POSIX timestamp, or None for events
+                         published without one, or with an invalid one.
+    """
+    published_at = event.get('publishedAt')
+    if not isinstance(published_at, str):
+        return None
+    try:
+        return datetime.fromisoformat(published_at).timestamp()
+    except ValueError:
+        return None
+
+class LatencyHistogram:
+    """
+    A thread-safe histogram of latencies in fixed buckets.
+    """
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        """
+        Args:
+            buckets (Sequence[float]): The increasing upper bounds of the buckets, in
+                                       seconds. Larger values fall in an overflow bucket.
+        """
+        self.buckets = tuple(buckets)
+        self._counts: List[int] = [0] * (len(self.buckets) + 1)
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        """
+        Records one latency.
+        """
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self._count += 1
+            self._sum += seconds
+            self._max = max(self._max, seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Estimates a quantile by linear interpolation within its bucket.
+        Args:
+            q (float): The quantile, between 0 and 1.
+        Returns:
+            Optional[float]: The estimate in seconds, or None before the first latency.
+        """
+        with self._lock:
+            if self._count == 0:
+                return None
+            rank = q * self._count
+            seen = 0
+            for index, count in enumerate(self._counts):
+                if count and seen + count >= rank:
+                    lower = self.buckets[index - 1] if index > 0 else 0.0
+                    upper = self.buckets[index] if index < len(self.buckets) else self._max
+                    return min(lower + (upper - lower) * (rank - seen) / count, self._max)
+                seen += count
+            return self._max
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        Returns:
+            Dict[str, Any]: The number of latencies, their sum and maximum in seconds,
+                            and the cumulative count of every bucket by upper bound.
+        """
+        with self._lock:
+            cumulative: Dict[str, int] = {}
+            total = 0
+            for bound, count in zip([*map(str, self.buckets), '+Inf'], self._counts):
+                total += count
+                cumulative[bound] = total
+            return {'count': self._count, 'sum': self._sum, 'max': self._max,
+                    'buckets': cumulative}
+
+class _QueuePropagation:
+    def __init__(self) -> None:
+        self.latency = LatencyHistogram()
+        self.last_published_at: Optional[float] = None
+        self.last_applied_at: Optional[float] = None
+        self.backlog: Optional[int] = None
+
+class PropagationTracker:
+    """
+    Records the propagation latency and lag of every user event queue. Consumers and
+    controllers record into it from their own threads.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._queues: Dict[str, _QueuePropagation] = {}
+
+    def _queue(self, queue_name: str) -> _QueuePropagation:
+        with self._lock:
+            return self._queues.setdefault(queue_name, _QueuePropagation())
+
+    def record_applied(self, queue_name: str, published_at: float,
+                       applied_at: Optional[float] = None) -> None:
+        """
+        Records an applied event.
+        Args:
+            queue_name (str): The queue the event was consumed from.
+            published_at (float): When the event was published, as a POSIX timestamp.
+            applied_at (Optional[float]): When it was applied, now by default.
+        Returns:
+            None
+        """
+        applied_at = applied_at if applied_at is not None else time.time()
+        state = self._queue(queue_name)
+        # Clocks of different hosts may disagree slightly
+        state.latency.observe(max(applied_at - published_at, 0.0))
+        with self._lock:
+            if state.last_published_at is None or published_at > state.last_published_at:
+                state.last_published_at = published_at
+            state.last_applied_at = applied_at
+
+    def record_backlog(self, queue_name: str, backlog: int) -> None:
+        """
+        Records the number of messages ready on a queue, as sampled by its controller.
+        """
+        state = self._queue(queue_name)
+        with self._lock:
+            state.backlog = backlog
+
+    def oldest_unprocessed_lag(self, queue_name: str,
+                               now: Optional[float] = None) -> Optional[float]:
+        """
+        Args:
+            queue_name (str): The queue.
+            now (Optional[float]): The current POSIX timestamp, now by default.
+        Returns:
+            Optional[float]: An upper bound of how long the oldest ready event of the
+                             queue has been waiting, in seconds: 0 when the queue is
+                             empty, and None when it is not known yet.
+        """
+        state = self._queue(queue_name)
+        with self._lock:
+            if state.backlog == 0:
+                return 0.0
+            if state.backlog is None or state.last_published_at is None:
+                return None
+            now = now if now is not None else time.time()
+            return max(now - state.last_published_at, 0.0)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns:
+            Dict[str, Dict[str, Any]]: For every queue, the number of applied events,
+                                       the median, 99th percentile and maximum
+                                       publish-to-apply latency, the lag of the oldest
+                                       unprocessed event, in milliseconds, the last
+                                       sampled backlog, and the latency histogram.
+        """
+        def milliseconds(seconds: Optional[float]) -> Optional[float]:
+            return round(seconds * 1000, 1) if seconds is not None else None
+
+        with self._lock:
+            queues = dict(self._queues)
+        stats = {}
+        for name, state in queues.items():
+            histogram = state.latency.snapshot()
+            stats[name] = {'applied': histogram['count'],
+                           'p50Ms': milliseconds(state.latency.quantile(0.5)),
+                           'p99Ms': milliseconds(state.latency.quantile(0.99)),
+                           'maxMs': milliseconds(histogram['max'] if histogram['count']
+                                                 else None),
+                           'oldestUnprocessedLagMs': milliseconds(
+                               self.oldest_unprocessed_lag(name)),
+                           'backlog': state.backlog,
+                           'histogram': histogram}
+        return stats
+
+    def collect(self) -> List[MetricFamily]:
+        """
+        Reports the propagation of every queue as metrics, for the /metrics endpoint.
+        Returns:
+            List[MetricFamily]: The publish-to-apply latency histogram, the lag of the
+                                oldest unprocessed event and the backlog of every queue.
+        """
+        latency = MetricFamily('user_event_propagation_seconds',
+                               'Time from publishing a user update event to applying it.',
+                               'histogram')
+        lag = MetricFamily('user_event_oldest_unprocessed_lag_seconds',
+                           'Upper bound of the wait of the oldest ready user update event.',
+                           'gauge')
+        backlog = MetricFamily('user_event_queue_backlog',
+                               'User update events ready on the queue, as last sampled.',
+                               'gauge')
+        with self._lock:
+            queues = dict(self._queues)
+        for name, state in queues.items():
+            histogram = state.latency.snapshot()
+            buckets = [(float(bound), count) for bound, count in histogram['buckets'].items()]
+            latency.add_histogram({'queue': name}, buckets, histogram['sum'])
+            oldest = self.oldest_unprocessed_lag(name)
+            if oldest is not None:
+                lag.add({'queue': name}, oldest)
+            if state.backlog is not None:
+                backlog.add({'queue': name}, state.backlog)
+        return [latency, lag, backlog]
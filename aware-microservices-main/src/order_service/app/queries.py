@@ -0,0 +1,346 @@
+"""_summary_
+This module contains the order queries shared by the request handlers and the event
+consumer.
+
+Searches are paginated with keyset cursors: each page is sorted on a timestamp or the
+order total and the orderId tie-breaker, and the cursor carries the sort values of the
+last order of the page, so fetching any page costs an index seek instead of skipping
+over earlier results.
+Every search is pinned with a hint to the compound index that matches its filters (see
+order_service.app.indexes), so no supported filter combination falls back to a
+collection scan. While that index does not exist yet, for example while it is built in
+the background on a new partition, the search runs without the hint instead of failing. A search for several statuses of all users runs one query per status,
+each reading its index in sort order, and merges their pages, so no search needs an
+in-memory sort.
+
+Orders without a value for the sort field sort before every other order, as in MongoDB,
+and cursors after such an order carry a null sort value.
+
+Classes:
+    SearchFilters: The filters and sort order of an order search.
+    SearchPlan: The query, sort and index hint derived from the filters.
+Functions:
+    build_search_plan(filters) -> SearchPlan: Translates filters into a Mongo query.
+    build_search_plans(filters) -> List[SearchPlan]: The queries whose merged results
+                                                     answer a search.
+    encode_cursor(order, sort_field) -> str: Creates the cursor following an order.
+    decode_cursor(cursor) -> Tuple[Any, str]: Reads a cursor back.
+    search_orders(collection, filters, limit, ...) -> Tuple[List[dict], Optional[str]]:
+        Returns one page of orders and the cursor of the next page, optionally merged 
+        with the archived orders.
+    merge_pages(pages, filters, limit) -> Tuple[List[dict], Optional[str]]: Merges the
+        pages of the same search over several collections into one page.
+    find_user_orders(collection, user_id, ...) -> Tuple[List[dict], Optional[str]]:
+        Returns one page of the orders of a user, newest first.
+    iter_user_orders(collection, user_id, ...) -> Iterator[List[dict]]: Yields every 
+        order of a user, one page at a time.
+Author:
+    @TheBarzani
+"""
+
+import base64
+import json
+import logging
+from dataclasses import dataclass, field, replace
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from pymongo import ASCENDING, DESCENDING
+from pymongo.collection import Collection
+from pymongo.errors import OperationFailure
+from order_service.app.indexes import search_index_name
+
+logger = logging.getLogger(__name__)
+
+# The error of a query hinting an index that does not exist
+BAD_VALUE_ERROR = 2
+
+@dataclass
+class SearchFilters:
+    """
+    The filters and sort order of an order search. Range bounds are inclusive.
+    Attributes:
+        user_id (Optional[str]): Only orders of this user.
+        statuses (List[str]): Only orders in one of these statuses.
+        created_from (Optional[datetime]): Only orders created at or after this time.
+        created_to (Optional[datetime]): Only orders created at or before this time.
+        updated_from (Optional[datetime]): Only orders updated at or after this time.
+        updated_to (Optional[datetime]): Only orders updated at or before this time.
+        total_from (Optional[float]): Only orders with at least this totalAmount.
+        total_to (Optional[float]): Only orders with at most this totalAmount.
+        sort_field (str): 'createdAt', 'updatedAt' or 'totalAmount'.
+        descending (bool): Whether the newest orders come first.
+        cursor (Optional[str]): The cursor returned with the previous page.
+    """
+    user_id: Optional[str] = None
+    statuses: List[str] = field(default_factory=list)
+    created_from: Optional[datetime] = None
+    created_to: Optional[datetime] = None
+    updated_from: Optional[datetime] = None
+    updated_to: Optional[datetime] = None
+    total_from: Optional[float] = None
+    total_to: Optional[float] = None
+    sort_field: str = 'createdAt'
+    descending: bool = True
+    cursor: Optional[str] = None
+
+
+@dataclass
+class SearchPlan:
+    """
+    The Mongo query derived from SearchFilters.
+    Attributes:
+        query (Dict[str, Any]): The filter document.
+        sort (List[Tuple[str, int]]): The sort specification.
+        hint (str): The name of the index the query must use.
+    """
+    query: Dict[str, Any]
+    sort: List[Tuple[str, int]]
+    hint: str
+
+
+def encode_cursor(order: Dict[str, Any], sort_field: str) -> str:
+    """
+    Creates an opaque cursor pointing just after the given order.
+    Args:
+        order (Dict[str, Any]): The last order of a page.
+        sort_field (str): The field the page is sorted on.
+    Returns:
+        str: The cursor.
+    """
+    value = order.get(sort_field)
+    payload = [value.isoformat() if isinstance(value, datetime) else value, order['orderId']]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[Any, str]:
+    """
+    Reads a cursor created by encode_cursor.
+    Args:
+        cursor (str): The cursor.
+    Returns:
+        Tuple[Any, str]: The sort value and orderId of the last order of the previous page.
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    try:
+        value, order_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        return value, order_id
+    except (TypeError, ValueError, json.JSONDecodeError) as error:
+        raise ValueError('Invalid cursor') from error
+
+def _range(lower: Optional[Any], upper: Optional[Any]) -> Dict[str, Any]:
+    bounds = {}
+    if lower is not None:
+        bounds['$gte'] = lower
+    if upper is not None:
+        bounds['$lte'] = upper
+    return bounds
+
+def build_search_plan(filters: SearchFilters) -> SearchPlan:
+    """
+    Translates search filters into a query, sort and index hint.
+    Args:
+        filters (SearchFilters): The search filters.
+    Returns:
+        SearchPlan: The plan of the search.
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    query: Dict[str, Any] = {}
+    equality_field: Optional[str] = None
+    if filters.user_id is not None:
+        query['userId'] = filters.user_id
+        equality_field = 'userId'
+    if filters.statuses:
+        query['orderStatus'] = {'$in': filters.statuses}
+        equality_field = equality_field or 'orderStatus'
+    for name, lower, upper in (('createdAt', filters.created_from, filters.created_to),
+                               ('updatedAt', filters.updated_from, filters.updated_to),
+                               ('totalAmount', filters.total_from, filters.total_to)):
+        bounds = _range(lower, upper)
+        if bounds:
+            query[name] = bounds
+
+    direction = DESCENDING if filters.descending else ASCENDING
+    if filters.cursor:
+        value, order_id = decode_cursor(filters.cursor)
+        after = '$lt' if filters.descending else '$gt'
+        # A null sort value matches both null and missing fields, which sort first
+        keyset = [{filters.sort_field: value, 'orderId': {after: order_id}}]
+        if value is not None:
+            keyset.append({filters.sort_field: {after: value}})
+        if value is not None and filters.descending:
+            keyset.append({filters.sort_field: None})
+        elif value is None and not filters.descending:
+            keyset.append({filters.sort_field: {'$ne': None}})
+        query = {'$and': [query, {'$or': keyset}]} if query else {'$or': keyset}
+
+    return SearchPlan(query=query,
+                      sort=[(filters.sort_field, direction), ('orderId', direction)],
+                      hint=search_index_name(equality_field, filters.sort_field))
+
+def build_search_plans(filters: SearchFilters) -> List[SearchPlan]:
+    """
+    Splits a search into queries that each read their index in sort order: a search for
+    several statuses of all users gets one query per status, since an $in on the first
+    field of the index combined with the keyset condition requires a blocking sort.
+    Args:
+        filters (SearchFilters): The search filters.
+    Returns:
+        List[SearchPlan]: The plans whose merged results answer the search.
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    if filters.user_id is None and len(filters.statuses) > 1:
+        return [build_search_plan(replace(filters, statuses=[status]))
+                for status in dict.fromkeys(filters.statuses)]
+    return [build_search_plan(filters)]
+
+def _sort_key(sort_field: str) -> Callable[[Dict[str, Any]], Tuple[bool, Any, str]]:
+    def key(order: Dict[str, Any]) -> Tuple[bool, Any, str]:
+        value = order.get(sort_field)
+        # Missing values sort first, as in MongoDB
+        return value is not None, value if value is not None else 0, order['orderId']
+    return key
+
+def _find_plan(collection: Collection, plan: SearchPlan,
+               projection: Optional[Dict[str, Any]], limit: int) -> List[Dict[str, Any]]:
+    """
+    Returns:
+        List[Dict[str, Any]]: The first orders of a plan, found without its hint when the
+                              hinted index does not exist (yet).
+    """
+    try:
+        return list(collection.find(plan.query, projection).sort(plan.sort)
+                    .hint(plan.hint).limit(limit))
+    except OperationFailure as error:
+        if error.code != BAD_VALUE_ERROR or 'hint' not in str(error):
+            raise
+        logger.warning('Index %s of %s is missing, searching without it', plan.hint,
+                       collection.full_name)
+        return list(collection.find(plan.query, projection).sort(plan.sort).limit(limit))
+
+def search_orders(collection: Collection, filters: SearchFilters, limit: int,
+                  projection: Optional[Dict[str, Any]] = None,
+                  archive: Optional[Collection] = None
+                  ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Returns one page of orders matching the filters. When an archive collection is
+    given, or the search is split into several queries, the page is taken from the merge
+    of their results: each one returns its own first page after the cursor, and since
+    the cursor holds sort values rather than positions, the merged page and its cursor
+    are as valid as for a single query.
+    Args:
+        collection (Collection): The orders collection.
+        filters (SearchFilters): The search filters.
+        limit (int): The maximum number of orders on the page.
+        projection (Optional[Dict[str, Any]]): The fields to return, all by default. The
+                                               sort field and orderId are always 
+                                               returned since the cursor is built 
+                                               from them.
+        archive (Optional[Collection]): The archive collection to search as well.
+    Returns:
+        Tuple[List[Dict[str, Any]], Optional[str]]: The orders and the cursor of the next
+                                                    page, or None on the last page.
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    plans = build_search_plans(filters)
+    if projection is not None:
+        projection = {**projection, filters.sort_field: 1, 'orderId': 1}
+    # Fetch one extra order to learn whether another page follows
+    orders = [order for plan in plans
+              for order in _find_plan(collection, plan, projection, limit + 1)]
+    if archive is not None:
+        # An order being archived can briefly exist in both; the hot copy wins
+        hot_ids = {order['orderId'] for order in orders}
+        orders += [order for plan in plans
+                   for order in _find_plan(archive, plan, projection, limit + 1)
+                   if order['orderId'] not in hot_ids]
+    if archive is not None or len(plans) > 1:
+        orders.sort(key=_sort_key(filters.sort_field), reverse=filters.descending)
+    next_cursor = None
+    if len(orders) > limit:
+        orders = orders[:limit]
+        next_cursor = encode_cursor(orders[-1], filters.sort_field)
+    return orders, next_cursor
+
+def merge_pages(pages: List[Tuple[List[Dict[str, Any]], Optional[str]]],
+                filters: SearchFilters, limit: int
+                ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Merges the pages returned by search_orders for the same filters on several
+    collections, such as the order partitions, into one page. Each collection returned
+    its first orders after the same cursor, so the first `limit` orders of the merge are
+    the page of the union, and its cursor is valid for every collection.
+    Args:
+        pages (List[Tuple[List[Dict[str, Any]], Optional[str]]]): The pages and cursors.
+        filters (SearchFilters): The search filters.
+        limit (int): The maximum number of orders on the page.
+    Returns:
+        Tuple[List[Dict[str, Any]], Optional[str]]: The orders and the cursor of the next
+                                                    page, or None on the last page.
+    """
+    orders: List[Dict[str, Any]] = []
+    seen = set()
+    for page, _ in pages:
+        # An order being moved between collections can briefly exist in two of them
+        orders += [order for order in page if order['orderId'] not in seen]
+        seen.update(order['orderId'] for order in page)
+    orders.sort(key=_sort_key(filters.sort_field), reverse=filters.descending)
+    more = len(orders) > limit or any(cursor is not None for _, cursor in pages)
+    orders = orders[:limit]
+    next_cursor = encode_cursor(orders[-1], filters.sort_field) if more and orders else None
+    return orders, next_cursor
+
+def find_user_orders(collection: Collection, user_id: str, limit: int,
+                     cursor: Optional[str] = None, statuses: Optional[List[str]] = None,
+                     projection: Optional[Dict[str, Any]] = None,
+                     archive: Optional[Collection] = None
+                     ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Returns one page of the orders of a user, newest first. The page is read from the
+    (userId, createdAt, orderId) index, so its cost depends on the page size only and
+    not on the number of orders in the collection or of the user.
+    Args:
+        collection (Collection): The orders collection.
+        user_id (str): The ID of the user.
+        limit (int): The maximum number of orders on the page.
+        cursor (Optional[str]): The cursor returned with the previous page.
+        statuses (Optional[List[str]]): Only orders in one of these statuses.
+        projection (Optional[Dict[str, Any]]): The fields to return, all by default.
+        archive (Optional[Collection]): The archive collection to list as well.
+    Returns:
+        Tuple[List[Dict[str, Any]], Optional[str]]: The orders and the cursor of the next
+                                                    page, or None on the last page.
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    filters = SearchFilters(user_id=user_id, statuses=list(statuses or []), cursor=cursor)
+    return search_orders(collection, filters, limit, projection, archive)
+
+def iter_user_orders(collection: Collection, user_id: str, batch_size: int = 100,
+                     statuses: Optional[List[str]] = None,
+                     projection: Optional[Dict[str, Any]] = None
+                     ) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Yields every order of a user in pages of find_user_orders, so callers that must
+    visit all of them never hold an unbounded result in memory.
+    Args:
+        collection (Collection): The orders collection.
+        user_id (str): The ID of the user.
+        batch_size (int): The number of orders per page.
+        statuses (Optional[List[str]]): Only orders in one of these statuses.
+        projection (Optional[Dict[str, Any]]): The fields to return, all by default.
+    Returns:
+        Iterator[List[Dict[str, Any]]]: The pages of orders.
+    """
+    cursor: Optional[str] = None
+    while True:
+        orders, cursor = find_user_orders(collection, user_id, batch_size, cursor, statuses,
+                                          projection)
+        if orders:
+            yield orders
+        if cursor is None:
+            return
@@ -0,0 +1,178 @@
+"""_summary_
+This module maintains the daily order rollups served by GET /orders/analytics.
+
+The 'order_rollups' collection holds one document per day, dimension and value, for
+example the orders created on 2025-03-01 that are currently 'shipping', or the orders
+created that day that are delivered to Canada. Each document counts the orders and sums
+their totalAmount. The write paths keep the documents current with $inc updates: an
+order creation adds the order to its buckets, and a status transition or a change of
+delivery country moves it from one bucket to another within its creation day. Reading
+the analytics of a date range is therefore a short index scan over pre-aggregated
+documents, however many orders there are.
+
+rollup_pipeline() computes the same documents from the orders collection and its
+archive, which the rebuild job uses to recreate the rollups from scratch. Archiving an
+order does not change the rollups, which cover the whole history.
+
+Constants:
+    DIMENSIONS: The order fields rolled up, by dimension name.
+Functions:
+    order_dimensions(order) -> Dict[str, str]: Returns the dimension values of an order.
+    record_order_created(collection, order): Adds an order to its rollups.
+    record_order_moved(collection, moves): Moves orders between rollups of a dimension.
+    country_moves(orders, delivery_address) -> List[tuple]: Returns the rollup moves
+        caused by changing the delivery address of orders.
+    query_rollups(collection, dimension, day_from, day_to, value) -> List[dict]:
+        Returns the rollups of a dimension over a range of days.
+    rollup_pipeline() -> List[dict]: The aggregation recomputing every rollup.
+Author:
+    @TheBarzani
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+from order_service.app.archive import ARCHIVE_COLLECTION
+
+ROLLUPS_COLLECTION = 'order_rollups'
+
+# Dimension name -> path of the rolled up value in an order
+DIMENSIONS: Dict[str, str] = {
+    'orderStatus': 'orderStatus',
+    'country': 'deliveryAddress.country',
+}
+UNKNOWN_VALUE = 'unknown'
+
+# (order, dimension, old value, new value)
+RollupMove = Tuple[Dict[str, Any], str, str, str]
+
+def rollup_day(timestamp: datetime) -> datetime:
+    """
+    Returns:
+        datetime: Midnight of the day of the timestamp, which keys the rollups.
+    """
+    return datetime(timestamp.year, timestamp.month, timestamp.day)
+
+def rollup_id(day: datetime, dimension: str, value: str) -> str:
+    """
+    Returns:
+        str: The _id of the rollup of a day, dimension and value.
+    """
+    return f'{day:%Y-%m-%d}|{dimension}|{value}'
+
+def order_dimensions(order: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Args:
+        order (Dict[str, Any]): An order as stored.
+    Returns:
+        Dict[str, str]: The value of every dimension for the order.
+    """
+    status = order.get('orderStatus')
+    country = (order.get('deliveryAddress') or {}).get('country')
+    return {'orderStatus': UNKNOWN_VALUE if status is None else status,
+            'country': UNKNOWN_VALUE if country is None else country}
+
+def _increment(order: Dict[str, Any], dimension: str, value: str, sign: int) -> UpdateOne:
+    day = rollup_day(order['createdAt'])
+    return UpdateOne({'_id': rollup_id(day, dimension, value)},
+                     {'$inc': {'orders': sign, 'revenue': sign * order.get('totalAmount', 0.0)},
+                      '$setOnInsert': {'day': day, 'dimension': dimension, 'value': value}},
+                     upsert=True)
+
+def record_order_created(collection: Collection, order: Dict[str, Any]) -> None:
+    """
+    Adds a new order to the rollups of its creation day, one per dimension.
+    Args:
+        collection (Collection): The order rollups collection.
+        order (Dict[str, Any]): The order as inserted.
+    Returns:
+        None
+    """
+    collection.bulk_write([_increment(order, dimension, value, 1)
+                           for dimension, value in order_dimensions(order).items()],
+                          ordered=False)
+
+def record_order_moved(collection: Collection, moves: List[RollupMove]) -> None:
+    """
+    Moves orders from the rollup of their old value to the rollup of their new value,
+    within their creation day. Moves that do not change the value are ignored.
+    Args:
+        collection (Collection): The order rollups collection.
+        moves (List[RollupMove]): (order, dimension, old value, new value) tuples.
+    Returns:
+        None
+    """
+    operations = []
+    for order, dimension, old_value, new_value in moves:
+        if old_value != new_value and order.get('createdAt'):
+            operations.append(_increment(order, dimension, old_value, -1))
+            operations.append(_increment(order, dimension, new_value, 1))
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+
+def country_moves(orders: List[Dict[str, Any]],
+                  delivery_address: Optional[Dict[str, Any]]) -> List[RollupMove]:
+    """
+    Returns the country rollup moves caused by setting a delivery address on orders.
+    Args:
+        orders (List[Dict[str, Any]]): The orders before the change.
+        delivery_address (Optional[Dict[str, Any]]): The new delivery address, if any.
+    Returns:
+        List[RollupMove]: The moves to record.
+    """
+    if not delivery_address:
+        return []
+    new_country = order_dimensions({'deliveryAddress': delivery_address})['country']
+    return [(order, 'country', order_dimensions(order)['country'], new_country)
+            for order in orders]
+
+def query_rollups(collection: Collection, dimension: str, day_from: datetime,
+                  day_to: datetime, value: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Returns the rollups of a dimension between two days, both included, ordered by day
+    and value. Rollups whose orders all moved elsewhere are left out.
+    Args:
+        collection (Collection): The order rollups collection.
+        dimension (str): 'orderStatus' or 'country'.
+        day_from (datetime): The first day.
+        day_to (datetime): The last day.
+        value (Optional[str]): Only the rollups of this value.
+    Returns:
+        List[Dict[str, Any]]: The rollups.
+    """
+    query: Dict[str, Any] = {'dimension': dimension,
+                             'day': {'$gte': rollup_day(day_from), '$lte': rollup_day(day_to)},
+                             'orders': {'$gt': 0}}
+    if value is not None:
+        query['value'] = value
+    return list(collection.find(query, {'_id': 0}).sort([('day', 1), ('value', 1)]))
+
+def rollup_pipeline() -> List[Dict[str, Any]]:
+    """
+    Returns:
+        List[Dict[str, Any]]: An aggregation over the orders collection and its archive
+                              producing every rollup document, with the same _id as
+                              the write paths.
+    """
+    day = {'$dateTrunc': {'date': '$createdAt', 'unit': 'day'}}
+    return [
+        {'$unionWith': ARCHIVE_COLLECTION},
+        # An order being archived can briefly exist in both collections
+        {'$group': {'_id': '$orderId', 'order': {'$first': '$$ROOT'}}},
+        {'$replaceWith': '$order'},
+        {'$match': {'createdAt': {'$type': 'date'}}},
+        {'$project': {'day': day, 'revenue': {'$ifNull': ['$totalAmount', 0.0]},
+                      'values': [{'dimension': dimension,
+                                  'value': {'$ifNull': [f'${path}', UNKNOWN_VALUE]}}
+                                 for dimension, path in DIMENSIONS.items()]}},
+        {'$unwind': '$values'},
+        {'$group': {'_id': {'day': '$day', 'dimension': '$values.dimension',
+                            'value': '$values.value'},
+                    'orders': {'$sum': 1}, 'revenue': {'$sum': '$revenue'}}},
+        {'$project': {'_id': {'$concat': [
+                          {'$dateToString': {'date': '$_id.day', 'format': '%Y-%m-%d'}},
+                          '|', '$_id.dimension', '|', '$_id.value']},
+                      'day': '$_id.day', 'dimension': '$_id.dimension',
+                      'value': '$_id.value', 'orders': 1, 'revenue': 1}},
+    ]
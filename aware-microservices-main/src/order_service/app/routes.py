@@ -5,12 +5,20 @@ orders, with validation and error handling.
 
 Classes:
     OrderList(Resource): Handles the creation of new orders and retrieval of orders 
-                         by status.
+                         by status or by user.
     OrderStatus(Resource): Handles the updating of order status.
     OrderDetails(Resource): Handles the updating of order emails or delivery address.
+    OrderStream(Resource): Streams order changes as server-sent events.
+    OrderSearch(Resource): Searches orders with combinable filters.
+    OrderAnalytics(Resource): Serves the daily order rollups.
+    OrderPropagation(Resource): Reports how long user updates take to reach the orders.
 Routes:
     /orders/ (POST): Creates a new order.
-    /orders/ (GET): Retrieves orders by status.
+    /orders/ (GET): Retrieves orders by status, or one page of a user's orders.
+    /orders/search (GET): Searches orders by user, statuses, time ranges and total.
+    /orders/stream (GET): Streams order status and detail changes.
+    /orders/analytics (GET): Daily order counts and revenue by status or country.
+    /orders/propagation (GET): Propagation latency and lag of the user event queues.
     /orders/<string:id>/status (PUT): Updates the status of an existing order.
     /orders/<string:id>/details (PUT): Updates the emails or delivery address of 
                                        an existing order.
@@ -19,15 +27,60 @@ Author:
 """
 
 
-import uuid
-from flask import request, Flask, current_app
-from flask_restx import Resource, fields
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+from flask import request, Flask, Response, current_app, stream_with_context
+from flask_restx import Resource, fields, marshal
 from bson.objectid import ObjectId
-from order_service.app.models import api, order_model, delivery_address_model
+from pymongo import ReturnDocument
+from shared.ids import new_id
+from shared.idempotency import idempotent
+from order_service.app.models import (api, order_model, order_page_model, rollup_model,
+                                      delivery_address_model)
+from order_service.app.queries import SearchFilters, find_user_orders
+from order_service.app.partitions import OrderPartition, PartitionRouter
+from order_service.app.broadcast import (ORDER_DETAILS_CHANGED, ORDER_STATUS_CHANGED,
+                                         publish_order_event)
+from order_service.app.totals import compute_order_totals
+from order_service.app.list_cache import OrderListCache, invalidate_statuses
+from order_service.app.rollups import (DIMENSIONS, country_moves, query_rollups,
+                                       record_order_created, record_order_moved)
+from order_service.app.snapshots import (SNAPSHOT_MODE, UNSHIPPED_STATUSES, contact_versions,
+                                         frozen_contact_details, resolve_contact_details)
 
 # The current_app variable is a proxy to the Flask application handling the request.
 current_app: Flask
 
+def resolve_orders(orders: List[dict]) -> List[dict]:
+    """
+    Resolves the contact details of unshipped orders from the user snapshots when the 
+    order service runs in the 'snapshot' storage mode.
+    Args:
+        orders (List[dict]): The orders read from the database.
+    Returns:
+        List[dict]: The same orders, with current contact details.
+    """
+    if current_app.config['ORDER_CONTACT_MODE'] == SNAPSHOT_MODE:
+        resolve_contact_details(current_app.user_snapshots_collection, orders)
+    return orders
+
+def parse_flag(name: str) -> bool:
+    """
+    Parses an optional boolean query parameter.
+    Args:
+        name (str): The name of the query parameter.
+    Returns:
+        bool: True for 'true' or '1', False when absent, 'false' or '0'.
+    Raises:
+        werkzeug.exceptions.HTTPException: If the parameter has any other value.
+    """
+    value: str = request.args.get(name, 'false').lower()
+    if value not in ('true', '1', 'false', '0'):
+        api.abort(400, f'{name} must be true or false')
+    return value in ('true', '1')
+
 @api.route('/')
 class OrderList(Resource):
     """_summary_
@@ -35,6 +88,9 @@ class OrderList(Resource):
     """
 
     @api.expect(order_model)
+    @api.param('Idempotency-Key', 'Retries with the same key return the original response',
+               _in='header')
+    @idempotent
     @api.marshal_with(order_model, code=201)
     def post(self) -> tuple:
         """
@@ -44,9 +100,13 @@ class OrderList(Resource):
         2. Validates the presence and format of required fields.
         3. Ensures no additional fields are present in the request.
         4. Validates the structure of the 'items' and 'deliveryAddress' fields.
-        5. Generates a unique orderId for the new order.
-        6. Inserts the new order data into the database.
-        7. Retrieves and returns the newly created order.
+        5. Computes the itemCount, totalQuantity and totalAmount of the order.
+        6. Generates a unique orderId for the new order and sets its timestamps.
+        7. Inserts the new order data into the database and adds it to the daily 
+           rollups.
+        8. Retrieves and returns the newly created order.
+        A request carrying an Idempotency-Key header that was already used returns the 
+        original response instead of creating another order.
         Returns:
             tuple: A tuple containing the newly created order data and the HTTP status 
                    code 201.
@@ -92,37 +152,140 @@ class OrderList(Resource):
             if field not in delivery_address or not isinstance(delivery_address[field], str):
                 api.abort(400, f'deliveryAddress must contain a valid {field}')
 
-        orders_collection = current_app.orders_collection
+        # Store the order totals so they can be read, sorted and filtered on directly
+        try:
+            data.update(compute_order_totals(data['items']))
+        except ValueError as error:
+            api.abort(400, str(error))
+
+        # The orders of a user live in the user's partition
+        partition: OrderPartition = current_app.order_partitions.for_user(data.get('userId'))
+
+        # Generate a unique, time-ordered orderId
+        data['orderId'] = new_id()
 
-        # Generate a unique orderId
-        data['orderId'] = str(uuid.uuid1())
-        order_id: ObjectId = orders_collection.insert_one(data).inserted_id
-        order: dict = orders_collection.find_one({'_id': ObjectId(order_id)})
+        # Set createdAt and updatedAt fields automatically
+        current_time: datetime = datetime.utcnow()
+        data['createdAt'] = current_time
+        data['updatedAt'] = current_time
+        data['contactUpdatedAt'] = current_time
+        if partition.writer is not None:
+            # Share one insert_many with the orders created concurrently by this worker
+            order_id = partition.writer.insert(data)
+        else:
+            order_id = partition.orders.insert_one(data).inserted_id
+        record_order_created(current_app.order_rollups_collection, data)
+        invalidate_statuses(current_app.order_list_cache, [data['orderStatus']])
+        order: dict = partition.orders.find_one({'_id': ObjectId(order_id)})
         return order, 201
 
     @api.param('status', 'The status of the orders to retrieve')
-    @api.marshal_with(order_model, as_list=True)
-    def get(self) -> list:
+    @api.param('userId', 'Retrieve the orders of this user instead, newest first')
+    @api.param('limit', 'Orders per page of a user listing, 1 to 100 (default 20)')
+    @api.param('cursor', 'The X-Next-Cursor header of the previous page of a user listing')
+    @api.param('fields', 'Comma separated order fields to return, all by default')
+    @api.param('includeArchived', 'Also return archived orders (true or false, default false)')
+    @api.response(200, 'Success', [order_model])
+    def get(self) -> tuple:
         """
-        Handles the HTTP GET request to retrieve orders by status.
+        Handles the HTTP GET request to retrieve orders by status or by user.
         This method performs the following steps:
-        1. Parses the 'status' parameter from the request.
-        2. Retrieves orders with the specified status from the database.
-        3. Returns the list of orders.
+        1. Parses the 'status', 'userId', 'limit', 'cursor' and 'fields' parameters 
+           from the request.
+        2. With a 'userId', retrieves one page of the user's orders from the 
+           (userId, createdAt, orderId) index, optionally filtered by status, and 
+           returns the cursor of the next page in the X-Next-Cursor header.
+        3. Otherwise retrieves the orders with the specified status.
+        4. With 'includeArchived', merges in the matching orders of the archive.
+        5. Returns the list of orders, restricted to the requested fields.
+        A user's orders are read from the user's partition, while status listings 
+        query every order partition in parallel (see order_service.app.partitions).
+        Concurrent requests with identical parameters share one query (see 
+        shared.singleflight), and status listings are served from the shared list 
+        cache when it is enabled (see order_service.app.list_cache). Reads that do not 
+        fill the cache use the MONGO_READ_PREFERENCE of read-only endpoints.
         Returns:
-            list: A list of orders with the specified status.
+            tuple: A list of orders, the HTTP status code and the response headers.
         Raises:
             werkzeug.exceptions.HTTPException: If the 'status' parameter is missing 
-                                               or invalid.
+                                               without a 'userId', or if any parameter
+                                               is invalid.
         """
 
         status: str = request.args.get('status')
-        if not status or status not in ['under process', 'shipping', 'delivered']:
+        user_id: str = request.args.get('userId')
+        if status is not None and status not in ['under process', 'shipping', 'delivered']:
+            api.abort(400, 'Invalid or missing status parameter')
+        if not status and not user_id:
             api.abort(400, 'Invalid or missing status parameter')
 
-        orders_collection = current_app.orders_collection
-        orders: list = list(orders_collection.find({'orderStatus': status}))
-        return orders
+        requested_fields: List[str] = [field for field in
+                                       request.args.get('fields', '').split(',') if field]
+        for field in requested_fields:
+            if field not in order_model:
+                api.abort(400, f'Invalid field: {field}')
+        projection: Optional[dict] = None
+        if requested_fields:
+            projection = {'_id': 0, **{field: 1 for field in requested_fields}}
+            if current_app.config['ORDER_CONTACT_MODE'] == SNAPSHOT_MODE:
+                # Snapshot resolution needs these to pick the current contact details
+                projection.update({'userId': 1, 'orderStatus': 1, 'contactUpdatedAt': 1,
+                                   'contactVersions': 1})
+
+        include_archived: bool = parse_flag('includeArchived')
+        if user_id:
+            try:
+                limit: int = int(request.args.get('limit', 20))
+            except ValueError:
+                limit = 0
+            if not 1 <= limit <= 100:
+                api.abort(400, 'limit must be an integer between 1 and 100')
+
+        # Status listings are served from the shared cache while their generation holds
+        cache: Optional[OrderListCache] = None if user_id else current_app.order_list_cache
+        if cache is not None:
+            variant: str = f"{int(include_archived)}:{','.join(requested_fields)}"
+            generation: Optional[int] = cache.generation(status)
+            # An unreachable cache is bypassed
+            cache = None if generation is None else cache
+        if cache is not None:
+            body: Optional[bytes] = cache.get(status, generation, variant)
+            if body is not None:
+                return Response(body, 200, {'X-Cache': 'hit'}, mimetype='application/json')
+
+        def load() -> Tuple[list, dict]:
+            headers: dict = {}
+            partitions: PartitionRouter = current_app.order_partitions
+            if user_id:
+                partition: OrderPartition = partitions.for_user(user_id)
+                try:
+                    orders, next_cursor = find_user_orders(partition.orders_read, user_id,
+                                                           limit, request.args.get('cursor'),
+                                                           [status] if status else None,
+                                                           projection,
+                                                           partition.archive_read
+                                                           if include_archived else None)
+                except ValueError as error:
+                    api.abort(400, str(error))
+                if next_cursor:
+                    headers['X-Next-Cursor'] = next_cursor
+            else:
+                # Fill the cache from the primary, so the listing stored under a
+                # generation includes the write that bumped it
+                orders = partitions.find_by_status(status, projection, include_archived,
+                                                   read_only=cache is None)
+
+            mask: Optional[str] = ','.join(requested_fields) or None
+            orders = marshal(resolve_orders(orders), order_model, mask=mask)
+            if cache is not None:
+                cache.put(status, generation, variant, json.dumps(orders).encode())
+                headers['X-Cache'] = 'miss'
+            return orders, headers
+
+        # Identical concurrent listings share one query
+        key: tuple = ('list', *sorted(request.args.items(multi=True)))
+        orders, headers = current_app.order_reads.do(key, load)
+        return orders, 200, dict(headers)
 
 @api.route('/<string:id>/status')
 @api.response(404, 'Order not found')
@@ -154,14 +317,41 @@ class OrderStatus(Resource):
                                                                     'shipping', 'delivered']:
             api.abort(400, 'Invalid or missing orderStatus')
 
-        orders_collection = current_app.orders_collection
+        orders_collection = current_app.order_partitions.for_order(id).orders
         old_order: dict = orders_collection.find_one({'orderId': id})
         if not old_order:
             api.abort(404, "Order not found")
 
-        orders_collection.update_one({'orderId': id}, {'$set': {'orderStatus':
-            data['orderStatus']}})
+        update_fields: dict = {'orderStatus': data['orderStatus'], 'updatedAt': datetime.utcnow()}
+        if (current_app.config['ORDER_CONTACT_MODE'] == SNAPSHOT_MODE
+                and old_order['orderStatus'] in UNSHIPPED_STATUSES
+                and data['orderStatus'] not in UNSHIPPED_STATUSES):
+            # Freeze the current contact details into the order as it ships
+            update_fields.update(frozen_contact_details(current_app.user_snapshots_collection,
+                                                        old_order))
+        update: dict = {'$set': update_fields}
+        if data['orderStatus'] == 'delivered':
+            # Start the archival delay on delivery; repeated updates keep the first time
+            if old_order['orderStatus'] != 'delivered':
+                update_fields['deliveredAt'] = update_fields['updatedAt']
+        else:
+            update['$unset'] = {'deliveredAt': ''}
+
+        # The order as it was just before this update, even if another request changed
+        # it since it was read, so the rollups move it out of the right status
+        old_order = orders_collection.find_one_and_update({'orderId': id}, update,
+                                                          return_document=ReturnDocument.BEFORE)
+        if not old_order:
+            api.abort(404, "Order not found")
+        record_order_moved(current_app.order_rollups_collection,
+                           [(old_order, 'orderStatus', old_order['orderStatus'],
+                             data['orderStatus'])])
+        invalidate_statuses(current_app.order_list_cache,
+                            [old_order['orderStatus'], data['orderStatus']])
         new_order: dict = orders_collection.find_one({'orderId': id})
+        resolve_orders([old_order, new_order])
+        if new_order['orderStatus'] != old_order['orderStatus']:
+            publish_order_event(ORDER_STATUS_CHANGED, new_order, old_order['orderStatus'])
 
         return [old_order, new_order]
 
@@ -223,12 +413,266 @@ class OrderDetails(Resource):
                 if field not in delivery_address or not isinstance(delivery_address[field], str):
                     api.abort(400, f'deliveryAddress must contain a valid {field}')
 
-        orders_collection = current_app.orders_collection
+        orders_collection = current_app.order_partitions.for_order(id).orders
         old_order: dict = orders_collection.find_one({'orderId': id})
         if not old_order:
             api.abort(404, "Order not found")
 
-        orders_collection.update_one({'orderId': id}, {'$set': data})
+        current_time: datetime = datetime.utcnow()
+        # User updates published before this change no longer replace these fields
+        data.update(contact_versions(list(data), current_time))
+        data['updatedAt'] = current_time
+        data['contactUpdatedAt'] = current_time
+
+        old_order = orders_collection.find_one_and_update({'orderId': id}, {'$set': data},
+                                                          return_document=ReturnDocument.BEFORE)
+        if not old_order:
+            api.abort(404, "Order not found")
+        record_order_moved(current_app.order_rollups_collection,
+                           country_moves([old_order], data.get('deliveryAddress')))
+        invalidate_statuses(current_app.order_list_cache, [old_order['orderStatus']])
         new_order: dict = orders_collection.find_one({'orderId': id})
+        resolve_orders([old_order, new_order])
+        publish_order_event(ORDER_DETAILS_CHANGED, new_order)
 
         return [old_order, new_order]
+
+@api.route('/stream')
+class OrderStream(Resource):
+    """_summary_
+    OrderStream is a Flask-RESTful resource that pushes order changes to clients as 
+    server-sent events, so they do not have to poll GET /orders.
+    """
+    @api.param('status', 'Only stream changes of orders entering or leaving this status')
+    @api.param('lastEventId', 'Resume after this event id (the Last-Event-ID header is '
+               'used when present)')
+    @api.produces(['text/event-stream'])
+    def get(self) -> Response:
+        """
+        Streams order status transitions and detail changes as server-sent events.
+        This method performs the following steps:
+        1. Parses the optional 'status' filter and the resume position.
+        2. Answers '503 Service Unavailable' when the worker already serves 
+           ORDER_STREAM_MAX_CLIENTS streams, since every stream holds a thread.
+        3. Sends every retained event newer than the resume position.
+        4. Waits for new events and sends them as they arrive, with a keep-alive 
+           comment when nothing happened for ORDER_STREAM_HEARTBEAT_SECONDS.
+        5. Ends the stream after ORDER_STREAM_MAX_SECONDS; clients reconnect with 
+           the id of the last event they received.
+        Returns:
+            Response: A text/event-stream response.
+        Raises:
+            werkzeug.exceptions.HTTPException: If the 'status' parameter is invalid.
+        """
+
+        status: str = request.args.get('status')
+        if status is not None and status not in ['under process', 'shipping', 'delivered']:
+            api.abort(400, 'Invalid status parameter')
+
+        broadcaster = current_app.order_broadcaster
+        position: int = broadcaster.position(request.headers.get('Last-Event-ID')
+                                             or request.args.get('lastEventId'))
+        heartbeat: float = current_app.config['ORDER_STREAM_HEARTBEAT_SECONDS']
+        deadline: float = time.monotonic() + current_app.config['ORDER_STREAM_MAX_SECONDS']
+        if not broadcaster.open_stream():
+            return Response(json.dumps({'message': 'Too many order streams, retry later'}),
+                            503, {'Retry-After':
+                                  str(current_app.config['ADMISSION_RETRY_AFTER_SECONDS'])},
+                            mimetype='application/json')
+
+        def generate():
+            nonlocal position
+            yield 'retry: 3000\n\n'
+            while time.monotonic() < deadline:
+                events = broadcaster.wait_for_events(position, heartbeat)
+                if not events:
+                    yield ': keep-alive\n\n'
+                    continue
+                for event in events:
+                    position = event.sequence
+                    if event.matches(status):
+                        yield event.to_sse()
+
+        response = Response(stream_with_context(generate()), mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+        # The stream is released once the server closes the response, even if the
+        # client disconnected before the first event
+        response.call_on_close(broadcaster.close_stream)
+        return response
+
+def parse_timestamp(name: str) -> Optional[datetime]:
+    """
+    Parses an optional ISO 8601 timestamp query parameter.
+    Args:
+        name (str): The name of the query parameter.
+    Returns:
+        Optional[datetime]: The timestamp in naive UTC, or None if the parameter is 
+                            absent.
+    Raises:
+        werkzeug.exceptions.HTTPException: If the parameter is not a valid timestamp.
+    """
+    value: str = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        timestamp = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        api.abort(400, f'{name} must be an ISO 8601 timestamp')
+    # Stored timestamps are naive UTC
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+def parse_amount(name: str) -> Optional[float]:
+    """
+    Parses an optional non-negative amount query parameter.
+    Args:
+        name (str): The name of the query parameter.
+    Returns:
+        Optional[float]: The amount, or None if the parameter is absent.
+    Raises:
+        werkzeug.exceptions.HTTPException: If the parameter is not a non-negative number.
+    """
+    value: str = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        amount = float(value)
+    except ValueError:
+        amount = -1.0
+    if not amount >= 0:
+        api.abort(400, f'{name} must be a non-negative number')
+    return amount
+
+@api.route('/search')
+class OrderSearch(Resource):
+    """_summary_
+    OrderSearch is a Flask-RESTful resource for searching orders with combinable filters.
+    """
+    @api.param('userId', 'Only orders of this user')
+    @api.param('status', 'Comma separated statuses to include')
+    @api.param('createdFrom', 'Only orders created at or after this ISO 8601 timestamp')
+    @api.param('createdTo', 'Only orders created at or before this ISO 8601 timestamp')
+    @api.param('updatedFrom', 'Only orders updated at or after this ISO 8601 timestamp')
+    @api.param('updatedTo', 'Only orders updated at or before this ISO 8601 timestamp')
+    @api.param('minTotal', 'Only orders with at least this totalAmount')
+    @api.param('maxTotal', 'Only orders with at most this totalAmount')
+    @api.param('sort', "'createdAt', 'updatedAt' or 'totalAmount', prefixed by - for "
+               "descending order (default '-createdAt')")
+    @api.param('limit', 'Orders per page, 1 to 100 (default 20)')
+    @api.param('cursor', 'The nextCursor of the previous page')
+    @api.param('includeArchived', 'Also search archived orders (true or false, default false)')
+    @api.marshal_with(order_page_model)
+    def get(self) -> dict:
+        """
+        Handles the HTTP GET request to search orders.
+        This method performs the following steps:
+        1. Parses and validates the filters, sort order and page size.
+        2. Runs the search on the compound index matching the filters, starting after 
+           the cursor of the previous page if one is given, in the archive as well 
+           when 'includeArchived' is set. Without a userId filter, every order 
+           partition is searched in parallel and the pages are merged.
+        3. Returns the page of orders and the cursor of the next page.
+        Returns:
+            dict: The orders of the page and the cursor of the next page.
+        Raises:
+            werkzeug.exceptions.HTTPException: If a filter, the sort order, the limit 
+                                               or the cursor is invalid.
+        """
+
+        statuses: List[str] = [status for status in request.args.get('status', '').split(',')
+                               if status]
+        for status in statuses:
+            if status not in ['under process', 'shipping', 'delivered']:
+                api.abort(400, f'Invalid status: {status}')
+
+        sort: str = request.args.get('sort', '-createdAt')
+        if sort.lstrip('-') not in ['createdAt', 'updatedAt', 'totalAmount']:
+            api.abort(400, 'sort must be createdAt, updatedAt or totalAmount, optionally '
+                           'prefixed by -')
+
+        try:
+            limit: int = int(request.args.get('limit', 20))
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= 100:
+            api.abort(400, 'limit must be an integer between 1 and 100')
+
+        filters = SearchFilters(user_id=request.args.get('userId'),
+                                statuses=statuses,
+                                created_from=parse_timestamp('createdFrom'),
+                                created_to=parse_timestamp('createdTo'),
+                                updated_from=parse_timestamp('updatedFrom'),
+                                updated_to=parse_timestamp('updatedTo'),
+                                total_from=parse_amount('minTotal'),
+                                total_to=parse_amount('maxTotal'),
+                                sort_field=sort.lstrip('-'),
+                                descending=sort.startswith('-'),
+                                cursor=request.args.get('cursor'))
+        include_archived: bool = parse_flag('includeArchived')
+        try:
+            orders, next_cursor = current_app.order_partitions.search(
+                filters, limit, include_archived=include_archived)
+        except ValueError as error:
+            api.abort(400, str(error))
+
+        return {'orders': resolve_orders(orders), 'nextCursor': next_cursor}
+
+@api.route('/analytics')
+class OrderAnalytics(Resource):
+    """_summary_
+    OrderAnalytics is a Flask-RESTful resource serving daily order counts and revenue 
+    from the pre-aggregated order rollups.
+    """
+    @api.param('dimension', "'orderStatus' (default) or 'country'")
+    @api.param('from', 'The first day, YYYY-MM-DD (default 30 days before to)')
+    @api.param('to', 'The last day, YYYY-MM-DD (default today)')
+    @api.param('value', 'Only this status or country')
+    @api.marshal_with(rollup_model, as_list=True)
+    def get(self) -> list:
+        """
+        Handles the HTTP GET request to retrieve the daily order rollups.
+        This method performs the following steps:
+        1. Parses the dimension, the day range and the optional value.
+        2. Reads the rollups of the range, which are kept current by the write paths.
+        3. Returns one entry per day and value, with the number of orders created that 
+           day and their revenue.
+        Returns:
+            list: The rollups of the range, ordered by day and value.
+        Raises:
+            werkzeug.exceptions.HTTPException: If the dimension or a day is invalid, or 
+                                               the range is longer than 366 days.
+        """
+
+        dimension: str = request.args.get('dimension', 'orderStatus')
+        if dimension not in DIMENSIONS:
+            api.abort(400, f"dimension must be one of {', '.join(DIMENSIONS)}")
+
+        day_to: datetime = parse_timestamp('to') or datetime.utcnow()
+        day_from: datetime = parse_timestamp('from') or day_to - timedelta(days=30)
+        if day_from > day_to:
+            api.abort(400, 'from must not be after to')
+        if (day_to - day_from).days > 366:
+            api.abort(400, 'The range must not be longer than 366 days')
+
+        return query_rollups(current_app.order_rollups_read_collection, dimension, day_from,
+                             day_to, request.args.get('value'))
+
+@api.route('/propagation')
+class OrderPropagation(Resource):
+    """_summary_
+    OrderPropagation is a Flask-RESTful resource reporting how long user updates take 
+    to propagate from the user services to the orders.
+    """
+    def get(self) -> dict:
+        """
+        Handles the HTTP GET request to retrieve the propagation of user updates.
+        Returns, for every user event queue, the number of events applied by the 
+        consumers of this worker, the median, 99th percentile and maximum time from 
+        publishing an event to applying it, the lag of the oldest unprocessed event, 
+        the last sampled backlog, and the latency histogram.
+        Returns:
+            dict: The propagation statistics by queue name.
+        """
+
+        return current_app.propagation.stats()
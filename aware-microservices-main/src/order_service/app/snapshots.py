@@ -0,0 +1,143 @@
+"""_summary_
+This module implements the user snapshot storage mode of the order service.
+
+In the default 'embedded' mode every order carries its own copy of the user's emails and
+delivery address, and the event consumer rewrites that copy in every order of the user.
+In the 'snapshot' mode the consumer instead keeps one document per user in the
+'user_snapshots' collection, keyed by userId, so a user update costs a single write.
+Orders that have not shipped yet resolve their contact details from the snapshot at read
+time with one batched lookup, while orders that have shipped keep the address that was
+frozen into them when they left the 'under process' status.
+
+In both modes the consumers may apply two updates of the same user out of order, as a
+queue has several consumers. Each update therefore records the publish time of its event
+as the version of the fields it sets, in 'contactVersions', and only replaces fields of
+an older version.
+
+Functions:
+    save_user_snapshot(collection, user_id, fields, version): Upserts the snapshot of a
+                                                               user.
+    contact_versions(fields, version) -> Dict[str, datetime]: The versions to set.
+    older_contact_filter(fields, version) -> Dict[str, Any]: Matches documents whose
+                                                             fields are older.
+    has_older_contact(document, fields, version) -> bool: Whether the fields of a
+                                                           document are older.
+    resolve_contact_details(collection, orders): Applies snapshots to unshipped orders.
+    frozen_contact_details(collection, order): Returns the contact details to store in
+                                               an order when it ships.
+Author:
+    @TheBarzani
+"""
+
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+from pymongo.collection import Collection
+from pymongo.errors import DuplicateKeyError
+
+EMBEDDED_MODE = 'embedded'
+SNAPSHOT_MODE = 'snapshot'
+
+# Orders in these statuses follow the user's current contact details
+UNSHIPPED_STATUSES = ('under process',)
+CONTACT_FIELDS = ('userEmails', 'deliveryAddress')
+CONTACT_VERSIONS = 'contactVersions'
+
+def contact_versions(fields: Iterable[str], version: datetime) -> Dict[str, datetime]:
+    """
+    Returns:
+        Dict[str, datetime]: The '$set' of the version of every given contact field.
+    """
+    return {f'{CONTACT_VERSIONS}.{field}': version for field in fields}
+
+def older_contact_filter(fields: Iterable[str], version: datetime) -> Dict[str, Any]:
+    """
+    Returns:
+        Dict[str, Any]: A filter matching the documents whose given contact fields have
+                        no version or an older one.
+    """
+    return {f'{CONTACT_VERSIONS}.{field}': {'$not': {'$gte': version}} for field in fields}
+
+def has_older_contact(document: Dict[str, Any], fields: Iterable[str],
+                      version: datetime) -> bool:
+    """
+    Returns:
+        bool: Whether the given contact fields of a document have no version or an older
+              one, as older_contact_filter() matches.
+    """
+    versions = document.get(CONTACT_VERSIONS) or {}
+    return all(versions.get(field) is None or versions[field] < version for field in fields)
+
+def save_user_snapshot(collection: Collection, user_id: str, fields: Dict[str, Any],
+                       version: Optional[datetime] = None) -> bool:
+    """
+    Upserts the contact details of a user with a single write, unless the snapshot
+    already holds a newer version of them.
+    Args:
+        collection (Collection): The user snapshots collection.
+        user_id (str): The ID of the user.
+        fields (Dict[str, Any]): The changed 'userEmails' and/or 'deliveryAddress'.
+        version (Optional[datetime]): The version of the fields, None to write them
+                                      whatever the version of the snapshot.
+    Returns:
+        bool: Whether the fields were written.
+    """
+    update = {**fields, 'updatedAt': datetime.utcnow()}
+    if version is None:
+        collection.update_one({'_id': user_id}, {'$set': update}, upsert=True)
+        return True
+    try:
+        collection.update_one({'_id': user_id, **older_contact_filter(fields, version)},
+                              {'$set': {**update, **contact_versions(fields, version)}},
+                              upsert=True)
+    except DuplicateKeyError:
+        # The snapshot exists but holds a newer version, so the upsert tried to insert
+        return False
+    return True
+
+def resolve_contact_details(collection: Collection,
+                            orders: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Replaces the contact details of unshipped orders with the snapshot of their user.
+    Each field is replaced only when the snapshot holds a newer version of it than the
+    order's own, so an email update does not undo a later address change made on the
+    order. All snapshots are fetched with one query.
+    Args:
+        collection (Collection): The user snapshots collection.
+        orders (List[Dict[str, Any]]): The orders to resolve, modified in place.
+    Returns:
+        List[Dict[str, Any]]: The same orders.
+    """
+    user_ids = {order['userId'] for order in orders
+                if order.get('userId') and order.get('orderStatus') in UNSHIPPED_STATUSES}
+    if not user_ids:
+        return orders
+
+    snapshots = {snapshot['_id']: snapshot
+                 for snapshot in collection.find({'_id': {'$in': list(user_ids)}})}
+    for order in orders:
+        snapshot = snapshots.get(order.get('userId'))
+        if snapshot is None or order.get('orderStatus') not in UNSHIPPED_STATUSES:
+            continue
+        snapshot_versions = snapshot.get(CONTACT_VERSIONS) or {}
+        order_versions = order.get(CONTACT_VERSIONS) or {}
+        for field in CONTACT_FIELDS:
+            if field not in snapshot:
+                continue
+            # Snapshots written before per-field versions only carry their write time
+            snapshot_version = snapshot_versions.get(field) or snapshot['updatedAt']
+            order_version = order_versions.get(field) or order.get('contactUpdatedAt')
+            if order_version is None or snapshot_version > order_version:
+                order[field] = snapshot[field]
+    return orders
+
+def frozen_contact_details(collection: Collection, order: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Returns the contact details an order should keep once it has shipped.
+    Args:
+        collection (Collection): The user snapshots collection.
+        order (Dict[str, Any]): The order as stored, still in an unshipped status.
+    Returns:
+        Dict[str, Any]: The 'userEmails' and 'deliveryAddress' to store in the order.
+    """
+    resolved = resolve_contact_details(collection, [dict(order)])[0]
+    return {field: resolved[field] for field in CONTACT_FIELDS if field in resolved}
@@ -0,0 +1,56 @@
+"""_summary_
+This module computes the totals stored on every order when it is written.
+
+Orders keep their items as an array of quantity and price pairs. Reading the value of an
+order, or sorting and filtering orders by value, would otherwise require every reader to
+walk that array, so the totals are derived once at write time and stored next to the
+items, where they can be validated by the collection schema and indexed.
+
+Constants:
+    TOTALS_EXPRESSIONS: The same totals as aggregation expressions, used to compute them
+                        inside the database for orders written before they existed.
+Functions:
+    compute_order_totals(items) -> Dict[str, Any]: Computes the totals of an order.
+Author:
+    @TheBarzani
+"""
+
+from typing import Any, Dict, List
+
+TOTAL_FIELDS = ('itemCount', 'totalQuantity', 'totalAmount')
+
+def compute_order_totals(items: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Computes the number of items, the total quantity and the total amount of an order.
+    The amount is rounded to cents.
+    Args:
+        items (List[Dict[str, Any]]): The items of the order.
+    Returns:
+        Dict[str, Any]: The 'itemCount', 'totalQuantity' and 'totalAmount' of the order.
+    Raises:
+        ValueError: If a quantity is not a positive integer or a price is not a
+                    non-negative number.
+    """
+    total_quantity = 0
+    total_amount = 0.0
+    for item in items:
+        quantity, price = item.get('quantity'), item.get('price')
+        if isinstance(quantity, bool) or not isinstance(quantity, int) or quantity < 1:
+            raise ValueError('Each item quantity must be an integer of at least 1')
+        if isinstance(price, bool) or not isinstance(price, (int, float)) or price < 0:
+            raise ValueError('Each item price must be a non-negative number')
+        total_quantity += quantity
+        total_amount += quantity * price
+    return {'itemCount': len(items), 'totalQuantity': total_quantity,
+            'totalAmount': round(float(total_amount), 2)}
+
+_ITEMS = {'$ifNull': ['$items', []]}
+
+TOTALS_EXPRESSIONS: Dict[str, Any] = {
+    'itemCount': {'$size': _ITEMS},
+    'totalQuantity': {'$sum': '$items.quantity'},
+    'totalAmount': {'$round': [{'$toDouble': {'$sum': {'$map': {
+        'input': _ITEMS, 'as': 'item',
+        'in': {'$multiply': ['$$item.quantity', '$$item.price']}
+    }}}}, 2]}
+}
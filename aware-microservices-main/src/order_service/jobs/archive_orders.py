@@ -0,0 +1,91 @@
+"""_summary_
+Moves orders delivered more than ORDER_ARCHIVE_AFTER_DAYS ago from the 'orders'
+collection to the 'orders_archive' collection, keeping the hot collection bounded by
+the number of active and recently delivered orders while the history keeps growing in
+the archive.
+
+Orders are moved in batches read from the (orderStatus, deliveredAt) index. Each batch
+is first upserted into the archive and then deleted from the hot collection (see
+order_service.app.archive.archive_orders), so the job is idempotent: a run interrupted
+at any point is resumed by simply running it again, since the orders already moved no
+longer match and a batch copied but not deleted is copied again. A rate limit bounds
+the number of orders moved per second. When the orders are partitioned (see
+order_service.app.partitions), each partition is archived in turn, into its own archive.
+
+Usage:
+    python -m order_service.jobs.archive_orders [--days 90] [--batch-size 500]
+                                                [--rate 1000] [--dry-run]
+Author:
+    @TheBarzani
+"""
+
+import argparse
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from pymongo.database import Database
+from order_service.app.archive import ARCHIVE_COLLECTION, archive_orders, archive_query
+from order_service.app.config import Config
+from order_service.app.list_cache import OrderListCache, invalidate_statuses
+from order_service.jobs.common import (RateLimiter, get_database, get_list_cache,
+                                       get_partitions)
+
+def archive(db: Database, days: float, batch_size: int, rate: float,
+            dry_run: bool = False, cache: Optional[OrderListCache] = None) -> Dict[str, int]:
+    """
+    Archives every order delivered more than the given number of days ago.
+    Args:
+        db (Database): The order service database.
+        days (float): The number of days after delivery before an order is archived.
+        batch_size (int): The number of orders per batch.
+        rate (float): The maximum number of orders moved per second, 0 for no limit.
+        dry_run (bool): Count the orders due for archival without moving them.
+        cache (Optional[OrderListCache]): The shared list cache to invalidate, if any.
+    Returns:
+        Dict[str, int]: Counts of orders due for archival and of orders moved.
+    """
+    query = archive_query(datetime.utcnow() - timedelta(days=days))
+    if dry_run:
+        return {'due': db.orders.count_documents(query), 'archived': 0}
+
+    limiter = RateLimiter(rate)
+    totals = {'due': 0, 'archived': 0}
+    while True:
+        orders = list(db.orders.find(query).limit(batch_size))
+        if not orders:
+            break
+        limiter.acquire(len(orders))
+        archived = archive_orders(db.orders, db[ARCHIVE_COLLECTION], orders)
+        invalidate_statuses(cache, ['delivered'])
+        totals['due'] += len(orders)
+        totals['archived'] += archived
+        if archived == 0:
+            # Every order of the batch changed while it was copied; try again next run
+            break
+    return totals
+
+def main() -> None:
+    """
+    Parses the command line and runs the archival.
+    """
+    parser = argparse.ArgumentParser(description='Move delivered orders to the archive.')
+    parser.add_argument('--days', type=float, default=Config.ORDER_ARCHIVE_AFTER_DAYS,
+                        help='days after delivery before an order is archived')
+    parser.add_argument('--batch-size', type=int, default=500, help='orders per batch')
+    parser.add_argument('--rate', type=float, default=1000, help='maximum orders per second, '
+                                                                 '0 for no limit')
+    parser.add_argument('--dry-run', action='store_true', help='only count the orders')
+    args = parser.parse_args()
+
+    cache = get_list_cache()
+    totals = {'due': 0, 'archived': 0}
+    for partition in get_partitions(get_database()).partitions:
+        result = archive(partition.db, args.days, args.batch_size, args.rate, args.dry_run,
+                         cache)
+        totals = {key: totals[key] + result[key] for key in totals}
+    if args.dry_run:
+        print(f"Found {totals['due']} orders due for archival.")
+    else:
+        print(f"Archived {totals['archived']} of {totals['due']} orders due for archival.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""_summary_
+Backfills the itemCount, totalQuantity and totalAmount of orders written before the
+order service stored them.
+
+The job walks the orders in _id order with keyset pagination and, for each batch,
+computes the totals inside the database with one update using an aggregation pipeline
+(see order_service.app.totals.TOTALS_EXPRESSIONS), so the items never travel to the
+job. Progress is checkpointed after every batch, so an interrupted run resumes where it
+stopped, and a rate limit bounds the number of orders updated per second. When the
+orders are partitioned (see order_service.app.partitions), each partition is backfilled
+in turn, with its own checkpoint. The archived orders of every partition are backfilled
+after its hot orders, with a checkpoint of their own.
+
+Usage:
+    python -m order_service.jobs.backfill_totals [--batch-size 1000] [--rate 5000]
+                                                 [--all] [--dry-run] [--restart]
+Author:
+    @TheBarzani
+"""
+
+import argparse
+from typing import Any, Dict, Optional
+from pymongo.collection import Collection
+from pymongo.database import Database
+from order_service.app.archive import ARCHIVE_COLLECTION
+from order_service.app.totals import TOTALS_EXPRESSIONS
+from order_service.app.list_cache import ORDER_STATUSES, OrderListCache, invalidate_statuses
+from order_service.jobs.common import (Checkpoint, RateLimiter, get_database, get_list_cache,
+                                       get_partitions)
+
+JOB_NAME = 'backfill_totals'
+
+def backfill(db: Database, batch_size: int, rate: float, recompute: bool = False,
+             dry_run: bool = False, restart: bool = False,
+             cache: Optional[OrderListCache] = None) -> Dict[str, int]:
+    """
+    Stores the totals of every order, hot or archived, that does not have them yet.
+    Args:
+        db (Database): The order service database, or the database of a partition.
+        batch_size (int): The number of orders per batch.
+        rate (float): The maximum number of orders updated per second, 0 for no limit.
+        recompute (bool): Recompute the totals of all orders, not only missing ones.
+        dry_run (bool): Count the orders to backfill without updating them.
+        restart (bool): Ignore the checkpoint and start from the beginning.
+        cache (Optional[OrderListCache]): The shared list cache to invalidate, if any.
+    Returns:
+        Dict[str, int]: Counts of scanned and updated orders.
+    """
+    limiter = RateLimiter(rate)
+    totals = {'orders': 0, 'updated': 0}
+    # The hot orders keep the checkpoint of the runs that only backfilled them
+    for collection_name, job_name in (('orders', JOB_NAME),
+                                      (ARCHIVE_COLLECTION, f'{JOB_NAME}.{ARCHIVE_COLLECTION}')):
+        result = _backfill_collection(db[collection_name], Checkpoint(db, job_name),
+                                      batch_size, limiter, recompute, dry_run, restart, cache)
+        totals = {key: totals[key] + result[key] for key in totals}
+    return totals
+
+def _backfill_collection(collection: Collection, checkpoint: Checkpoint, batch_size: int,
+                         limiter: RateLimiter, recompute: bool, dry_run: bool, restart: bool,
+                         cache: Optional[OrderListCache]) -> Dict[str, int]:
+    """
+    Stores the totals of the orders of one collection, see backfill().
+    Returns:
+        Dict[str, int]: Counts of scanned and updated orders.
+    """
+    if restart:
+        checkpoint.clear()
+    state = checkpoint.load() or {}
+    last = None if state.get('done') else state.get('last')
+
+    missing: Dict[str, Any] = {} if recompute else {'totalAmount': {'$exists': False}}
+    totals = {'orders': 0, 'updated': 0}
+    while True:
+        query = {**missing, '_id': {'$gt': last}} if last is not None else missing
+        ids = [order['_id'] for order in
+               collection.find(query, {'_id': 1}).sort('_id', 1).limit(batch_size)]
+        if not ids:
+            break
+
+        limiter.acquire(len(ids))
+        if not dry_run:
+            result = collection.update_many({'_id': {'$in': ids}},
+                                            [{'$set': TOTALS_EXPRESSIONS}])
+            totals['updated'] += result.modified_count
+            if result.modified_count:
+                invalidate_statuses(cache, ORDER_STATUSES)
+            checkpoint.save({'last': ids[-1], 'done': False})
+        totals['orders'] += len(ids)
+        last = ids[-1]
+
+    if not dry_run:
+        checkpoint.save({'last': None, 'done': True})
+    return totals
+
+def main() -> None:
+    """
+    Parses the command line and runs the backfill.
+    """
+    parser = argparse.ArgumentParser(description='Store the totals of orders created '
+                                                 'before they were computed on write.')
+    parser.add_argument('--batch-size', type=int, default=1000, help='orders per batch')
+    parser.add_argument('--rate', type=float, default=5000, help='maximum orders per second, '
+                                                                 '0 for no limit')
+    parser.add_argument('--all', action='store_true', help='recompute the totals of every '
+                                                           'order')
+    parser.add_argument('--dry-run', action='store_true', help='only count the orders')
+    parser.add_argument('--restart', action='store_true', help='ignore the checkpoint')
+    args = parser.parse_args()
+
+    cache = get_list_cache()
+    totals = {'orders': 0, 'updated': 0}
+    for partition in get_partitions(get_database()).partitions:
+        result = backfill(partition.db, args.batch_size, args.rate, args.all, args.dry_run,
+                          args.restart, cache)
+        totals = {key: totals[key] + result[key] for key in totals}
+    if args.dry_run:
+        print(f"Found {totals['orders']} orders to backfill.")
+    else:
+        print(f"Scanned {totals['orders']} orders, updated {totals['updated']}.")
+
+if __name__ == "__main__":
+    main()
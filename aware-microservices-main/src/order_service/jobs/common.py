@@ -0,0 +1,152 @@
+"""_summary_
+Shared helpers for the maintenance jobs of the order service.
+
+The jobs run as standalone commands next to the service (for example
+`python -m order_service.jobs.reconcile_users`). They read the same configuration as the
+service, throttle themselves with a RateLimiter so they can run against production-sized
+collections, and record their progress in the 'job_checkpoints' collection so an
+interrupted run resumes where it stopped.
+
+Classes:
+    RateLimiter: A thread-safe token bucket limiting documents processed per second.
+    Checkpoint: The persisted progress of a job.
+Functions:
+    get_database() -> Database: Connects to the order service database.
+    get_list_cache() -> Optional[OrderListCache]: Connects to the shared list cache.
+    get_partitions(db) -> PartitionRouter: Connects to the order partitions.
+    split_key_ranges(collection, field, parts) -> List[Tuple[Any, Any]]: Splits the
+        values of an indexed field into contiguous ranges of similar size.
+Author:
+    @TheBarzani
+"""
+
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo import MongoClient
+from pymongo.collection import Collection
+from pymongo.database import Database
+from order_service.app.config import Config
+from order_service.app.list_cache import OrderListCache, create_list_cache
+from order_service.app.partitions import PartitionRouter, create_partition_router
+
+def get_database() -> Database:
+    """
+    Connects to the order service database.
+    Returns:
+        Database: The database named by DATABASE_NAME.
+    """
+    return MongoClient(Config.MONGO_URI)[Config.DATABASE_NAME]
+
+def get_list_cache() -> Optional[OrderListCache]:
+    """
+    Connects to the shared GET /orders?status= cache, so jobs invalidate the listings
+    they change.
+    Returns:
+        Optional[OrderListCache]: The cache, or None when ORDER_LIST_CACHE_URL is empty.
+    """
+    return create_list_cache(Config.ORDER_LIST_CACHE_URL, Config.ORDER_LIST_CACHE_TTL_SECONDS)
+
+def get_partitions(db: Database) -> PartitionRouter:
+    """
+    Connects to the partitions holding the orders (see order_service.app.partitions).
+    Args:
+        db (Database): The order service database, which is the only partition when
+                       ORDER_PARTITIONS is empty.
+    Returns:
+        PartitionRouter: The partitions of ORDER_PARTITIONS, or of the given database.
+    """
+    config = {name: getattr(Config, name) for name in dir(Config) if name.isupper()}
+    # Jobs write in batches of their own
+    config.update(ORDER_GROUP_COMMIT=False, DATABASE_NAME=db.name)
+    return create_partition_router(config, db.client)
+
+
+class RateLimiter:
+    """
+    A token bucket shared by all workers of a job. Each processed document costs one
+    token, and tokens are refilled at `rate` per second up to one second of burst.
+    A rate of 0 disables the limit.
+    """
+
+    def __init__(self, rate: float) -> None:
+        self.rate = rate
+        self._tokens = rate
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1) -> None:
+        """
+        Blocks until the given number of tokens is available and takes them.
+        Args:
+            tokens (float): The number of documents about to be processed.
+        Returns:
+            None
+        """
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                # Batches larger than the bucket may go through once it is full
+                if self._tokens >= min(tokens, self.rate):
+                    self._tokens -= tokens
+                    return
+                wait = (min(tokens, self.rate) - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class Checkpoint:
+    """
+    The progress of a job, stored as one document in the 'job_checkpoints' collection.
+    """
+
+    def __init__(self, db: Database, job_name: str) -> None:
+        self.collection: Collection = db['job_checkpoints']
+        self.job_name = job_name
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """
+        Returns:
+            Optional[Dict[str, Any]]: The saved state, or None if the job has not run.
+        """
+        return self.collection.find_one({'_id': self.job_name})
+
+    def save(self, fields: Dict[str, Any]) -> None:
+        """
+        Sets fields of the saved state, creating it if needed.
+        Args:
+            fields (Dict[str, Any]): The fields to set, dotted paths allowed.
+        Returns:
+            None
+        """
+        self.collection.update_one({'_id': self.job_name},
+                                   {'$set': {**fields, 'updatedAt': time.time()}}, upsert=True)
+
+    def clear(self) -> None:
+        """
+        Deletes the saved state so the next run starts from the beginning.
+        """
+        self.collection.delete_one({'_id': self.job_name})
+
+
+def split_key_ranges(collection: Collection, field: str, parts: int) -> List[Tuple[Any, Any]]:
+    """
+    Splits the values of a field into contiguous ranges holding a similar number of
+    documents, using the $bucketAuto aggregation stage.
+    Args:
+        collection (Collection): The collection to split.
+        field (str): The field to split on, ideally indexed.
+        parts (int): The number of ranges wanted.
+    Returns:
+        List[Tuple[Any, Any]]: (lower, upper) bounds; each range includes its lower
+                               bound and excludes its upper bound, except the last
+                               range, which includes both.
+    """
+    buckets = list(collection.aggregate([
+        {'$match': {field: {'$exists': True}}},
+        {'$bucketAuto': {'groupBy': f'${field}', 'buckets': parts}}
+    ]))
+    return [(bucket['_id']['min'], bucket['_id']['max']) for bucket in buckets]
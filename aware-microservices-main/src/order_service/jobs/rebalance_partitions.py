@@ -0,0 +1,115 @@
+"""_summary_
+Moves orders to the partition that owns their user after ORDER_PARTITIONS changed.
+
+The orders of a user live in the partition that the hash ring assigns to the userId
+(see order_service.app.partitions). Adding a partition hands it some of the ring, so the
+orders of the users it took over must be moved to it, and removing one requires moving
+its orders away while it is still reachable: list it with the new partitions for this
+job only, and drop it from the service configuration afterwards.
+
+The job walks the hot and archived orders of every partition in _id order and moves the
+orders whose user belongs to another partition batch by batch, the same way orders are
+archived: they are first upserted into the owner, keyed by orderId, and then deleted
+from the source only if they did not change since they were read. Running it again after
+an interruption is harmless, and an order updated while it was moved is moved by the
+next run. A rate limit bounds the number of orders scanned per second.
+
+Usage:
+    python -m order_service.jobs.rebalance_partitions [--batch-size 500] [--rate 2000]
+                                                      [--dry-run]
+Author:
+    @TheBarzani
+"""
+
+import argparse
+from typing import Any, Dict, List
+from pymongo import DeleteOne, ReplaceOne
+from order_service.app.archive import ARCHIVE_COLLECTION
+from order_service.app.partitions import OrderPartition, PartitionRouter
+from order_service.jobs.common import RateLimiter, get_database, get_partitions
+
+ORDER_COLLECTIONS = ('orders', ARCHIVE_COLLECTION)
+
+def move_orders(source: OrderPartition, target: OrderPartition, collection_name: str,
+                orders: List[Dict[str, Any]]) -> int:
+    """
+    Moves a batch of orders of one collection between two partitions.
+    Args:
+        source (OrderPartition): The partition holding the orders.
+        target (OrderPartition): The partition owning their users.
+        collection_name (str): 'orders' or 'orders_archive'.
+        orders (List[Dict[str, Any]]): The orders, as read from the source.
+    Returns:
+        int: The number of orders removed from the source.
+    """
+    target.db[collection_name].bulk_write([ReplaceOne({'orderId': order['orderId']}, order,
+                                                      upsert=True)
+                                           for order in orders], ordered=False)
+    unchanged = [DeleteOne({'_id': order['_id'], 'updatedAt': order.get('updatedAt')})
+                 for order in orders]
+    return source.db[collection_name].bulk_write(unchanged, ordered=False).deleted_count
+
+def rebalance(partitions: PartitionRouter, batch_size: int, rate: float,
+              dry_run: bool = False) -> Dict[str, int]:
+    """
+    Moves every order held by a partition other than the one owning its user.
+    Args:
+        partitions (PartitionRouter): The partitions, as configured after the change.
+        batch_size (int): The number of orders scanned per batch.
+        rate (float): The maximum number of orders scanned per second, 0 for no limit.
+        dry_run (bool): Count the misplaced orders without moving them.
+    Returns:
+        Dict[str, int]: Counts of scanned, misplaced and moved orders.
+    """
+    limiter = RateLimiter(rate)
+    totals = {'orders': 0, 'misplaced': 0, 'moved': 0}
+    if len(partitions.partitions) == 1:
+        return totals
+    for source in partitions.partitions:
+        for collection_name in ORDER_COLLECTIONS:
+            collection = source.db[collection_name]
+            last = None
+            while True:
+                query = {'_id': {'$gt': last}} if last is not None else {}
+                orders = list(collection.find(query).sort('_id', 1).limit(batch_size))
+                if not orders:
+                    break
+                limiter.acquire(len(orders))
+                misplaced: Dict[str, List[Dict[str, Any]]] = {}
+                for order in orders:
+                    owner = partitions.for_user(order.get('userId'))
+                    if owner.name != source.name:
+                        misplaced.setdefault(owner.name, []).append(order)
+                for name, moving in misplaced.items():
+                    totals['misplaced'] += len(moving)
+                    if not dry_run:
+                        target = next(partition for partition in partitions.partitions
+                                      if partition.name == name)
+                        totals['moved'] += move_orders(source, target, collection_name,
+                                                       moving)
+                totals['orders'] += len(orders)
+                last = orders[-1]['_id']
+    return totals
+
+def main() -> None:
+    """
+    Parses the command line and runs the rebalancing.
+    """
+    parser = argparse.ArgumentParser(description='Move orders to the partition owning '
+                                                 'their user.')
+    parser.add_argument('--batch-size', type=int, default=500, help='orders per batch')
+    parser.add_argument('--rate', type=float, default=2000, help='maximum orders scanned per '
+                                                                 'second, 0 for no limit')
+    parser.add_argument('--dry-run', action='store_true', help='only count the orders')
+    args = parser.parse_args()
+
+    totals = rebalance(get_partitions(get_database()), args.batch_size, args.rate,
+                       args.dry_run)
+    if args.dry_run:
+        print(f"Scanned {totals['orders']} orders, {totals['misplaced']} to move.")
+    else:
+        print(f"Scanned {totals['orders']} orders, moved {totals['moved']} of "
+              f"{totals['misplaced']} misplaced.")
+
+if __name__ == "__main__":
+    main()
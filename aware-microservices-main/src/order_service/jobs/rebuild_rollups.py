@@ -0,0 +1,84 @@
+"""_summary_
+Recreates the daily order rollups from the orders collection.
+
+The write paths keep the 'order_rollups' collection current incrementally. This job
+recomputes it from scratch, for example after a backfill, after orders were changed
+outside the service, or to repair drift. The rollups are computed by one aggregation
+pipeline (see order_service.app.rollups.rollup_pipeline) written with $out into a
+staging collection, which then atomically replaces the live collection, so readers never
+see a partially built result. Increments applied by the service while the pipeline runs
+are lost with the old collection, so run it when orders are quiet.
+
+When the orders are partitioned (see order_service.app.partitions), the pipeline runs on
+every partition in parallel and the partial rollups are summed into the staging
+collection. Run it outside of a rebalancing, when an order can briefly exist in two
+partitions.
+
+Usage:
+    python -m order_service.jobs.rebuild_rollups [--dry-run]
+Author:
+    @TheBarzani
+"""
+
+import argparse
+from typing import Any, Dict, Optional
+from pymongo.database import Database
+from order_service.app.indexes import ROLLUP_INDEXES
+from order_service.app.rollups import ROLLUPS_COLLECTION, rollup_pipeline
+from order_service.app.partitions import PartitionRouter
+from order_service.jobs.common import get_database, get_partitions
+
+STAGING_COLLECTION = f'{ROLLUPS_COLLECTION}_rebuild'
+
+def rebuild(db: Database, dry_run: bool = False,
+            partitions: Optional[PartitionRouter] = None) -> int:
+    """
+    Recomputes every rollup and swaps the result in place of the live rollups.
+    Args:
+        db (Database): The order service database.
+        dry_run (bool): Compute the rollups into the staging collection only.
+        partitions (Optional[PartitionRouter]): The order partitions, by default the 
+                                                order service database only.
+    Returns:
+        int: The number of rollup documents.
+    """
+    partitions = partitions or get_partitions(db)
+    db[STAGING_COLLECTION].drop()
+    staging = db[STAGING_COLLECTION]
+    if [partition.db for partition in partitions.partitions] == [db]:
+        db.orders.aggregate(rollup_pipeline() + [{'$out': STAGING_COLLECTION}],
+                            allowDiskUse=True)
+    else:
+        rollups: Dict[str, Dict[str, Any]] = {}
+        for results in partitions.map(lambda partition: list(
+                partition.orders.aggregate(rollup_pipeline(), allowDiskUse=True))):
+            for rollup in results:
+                total = rollups.setdefault(rollup['_id'], {**rollup, 'orders': 0,
+                                                           'revenue': 0.0})
+                total['orders'] += rollup['orders']
+                total['revenue'] += rollup['revenue']
+        if rollups:
+            staging.insert_many(list(rollups.values()), ordered=False)
+    for name, keys, options in ROLLUP_INDEXES:
+        staging.create_index(keys, name=name, **options)
+    count = staging.count_documents({})
+    if not dry_run:
+        staging.rename(ROLLUPS_COLLECTION, dropTarget=True)
+    return count
+
+def main() -> None:
+    """
+    Parses the command line and runs the rebuild.
+    """
+    parser = argparse.ArgumentParser(description='Recreate the daily order rollups from '
+                                                 'the orders collection.')
+    parser.add_argument('--dry-run', action='store_true',
+                        help=f'leave the result in {STAGING_COLLECTION}')
+    args = parser.parse_args()
+
+    count = rebuild(get_database(), args.dry_run)
+    target = STAGING_COLLECTION if args.dry_run else ROLLUPS_COLLECTION
+    print(f"Wrote {count} rollups to {target}.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+"""_summary_
+Reconciles the contact details held by the order service with the users collection.
+
+If a user update event is lost, for example because a consumer died or the publish
+failed after the user was written, orders keep stale emails or delivery addresses. This
+job scans the users in userId ranges, in parallel, joins each batch of users with their
+orders (or, in the 'snapshot' storage mode, their user snapshots) using one batched $in
+query, and repairs every difference with a single unordered bulk write per batch.
+Orders whose details were changed through PUT /orders/<id>/details after the user's
+last update keep them, as the order service would, and repaired orders that move to
+another delivery country are moved between the country rollups.
+
+When the orders are partitioned (see order_service.app.partitions), the users of a batch
+are grouped by partition and each group is joined with the orders of its partition.
+
+Progress is checkpointed per range after every batch, so an interrupted run resumes
+where it stopped, and a shared rate limit bounds the number of users scanned per second.
+
+Usage:
+    python -m order_service.jobs.reconcile_users [--workers 4] [--batch-size 500]
+                                                 [--rate 2000] [--dry-run] [--restart]
+Author:
+    @TheBarzani
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from pymongo import UpdateMany, UpdateOne
+from pymongo.collection import Collection
+from pymongo.database import Database
+from pymongo.errors import BulkWriteError
+from order_service.app.config import Config
+from order_service.app.list_cache import ORDER_STATUSES, OrderListCache, invalidate_statuses
+from order_service.app.partitions import OrderPartition, PartitionRouter
+from order_service.app.rollups import (ROLLUPS_COLLECTION, RollupMove, country_moves,
+                                       record_order_moved)
+from order_service.app.snapshots import (CONTACT_FIELDS, CONTACT_VERSIONS, SNAPSHOT_MODE,
+                                         UNSHIPPED_STATUSES, contact_versions,
+                                         older_contact_filter)
+from order_service.jobs.common import (Checkpoint, RateLimiter, get_database, get_list_cache,
+                                       get_partitions, split_key_ranges)
+
+JOB_NAME = 'reconcile_users'
+DUPLICATE_KEY_ERROR = 11000
+USER_PROJECTION = {'_id': 0, 'userId': 1, 'emails': 1, 'deliveryAddress': 1, 'updatedAt': 1}
+ORDER_PROJECTION = {'_id': 0, 'orderId': 1, 'userId': 1, 'userEmails': 1, 'deliveryAddress': 1,
+                    'contactUpdatedAt': 1, 'createdAt': 1, 'totalAmount': 1}
+
+def contact_fields(user: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Returns:
+        Dict[str, Any]: The contact details of a user under the order field names.
+    """
+    return {'userEmails': user.get('emails'), 'deliveryAddress': user.get('deliveryAddress')}
+
+def differs(document: Dict[str, Any], expected: Dict[str, Any]) -> bool:
+    """
+    Returns:
+        bool: True if any contact field of the document differs from the expected one.
+    """
+    return any(document.get(field) != value for field, value in expected.items())
+
+def user_updated_at(user: Dict[str, Any]) -> Optional[datetime]:
+    """
+    Returns:
+        Optional[datetime]: When the user was last updated, None if unknown.
+    """
+    updated_at = user.get('updatedAt')
+    # The v1 user service stores whatever the client sent, if anything
+    return updated_at if isinstance(updated_at, datetime) else None
+
+def order_repairs(db: Database, users: List[Dict[str, Any]]
+                  ) -> Tuple[List[Any], int, Callable[[], List[RollupMove]]]:
+    """
+    Finds the orders of a batch of users whose contact details differ from the user,
+    leaving out the orders whose details were changed after the user's last update.
+    Args:
+        db (Database): The database of the partition holding the orders of the users.
+        users (List[Dict[str, Any]]): The users of the batch.
+    Returns:
+        Tuple[List[Any], int, Callable[[], List[RollupMove]]]: The bulk write operations,
+            the number of drifted orders and a function returning, once the operations
+            are applied, the country rollup moves of the orders they repaired.
+    """
+    by_id = {user['userId']: user for user in users}
+    drifted: Dict[str, List[Dict[str, Any]]] = {}
+    for order in db.orders.find({'userId': {'$in': list(by_id)}}, ORDER_PROJECTION):
+        user = by_id[order['userId']]
+        updated_at = user_updated_at(user)
+        contact_updated_at = order.get('contactUpdatedAt')
+        if updated_at and contact_updated_at and contact_updated_at > updated_at:
+            continue
+        if differs(order, contact_fields(user)):
+            drifted.setdefault(order['userId'], []).append(order)
+
+    operations = []
+    for user_id, orders in drifted.items():
+        expected = contact_fields(by_id[user_id])
+        updated_at = user_updated_at(by_id[user_id])
+        query: Dict[str, Any] = {'userId': user_id,
+                                 'orderId': {'$in': [order['orderId'] for order in orders]}}
+        update = dict(expected)
+        if updated_at:
+            # Orders changed or updated by the consumer since they were read keep that
+            query['contactUpdatedAt'] = {'$not': {'$gt': updated_at}}
+            query.update(older_contact_filter(expected, updated_at))
+            update.update(contact_versions(expected, updated_at))
+        operations.append(UpdateMany(query, {'$set': update}))
+
+    def moves() -> List[RollupMove]:
+        candidates = [move for user_id, orders in drifted.items()
+                      for move in country_moves(orders, by_id[user_id].get('deliveryAddress'))
+                      if move[2] != move[3]]
+        if not candidates:
+            return []
+        # The repairs skip the orders updated since the scan; as in update_orders(), the
+        # orders they matched are the ones now holding the version of the user
+        versions = {order['orderId']: order.get(CONTACT_VERSIONS) or {} for order in
+                    db.orders.find({'orderId': {'$in': [move[0]['orderId']
+                                                        for move in candidates]}},
+                                   {'orderId': 1, CONTACT_VERSIONS: 1})}
+        repaired = []
+        for move in candidates:
+            updated_at = user_updated_at(by_id[move[0]['userId']])
+            order_versions = versions.get(move[0]['orderId'])
+            if order_versions is not None and (updated_at is None or all(
+                    order_versions.get(field) == updated_at for field in CONTACT_FIELDS)):
+                repaired.append(move)
+        return repaired
+
+    return operations, sum(len(orders) for orders in drifted.values()), moves
+
+def snapshot_repairs(db: Database, users: List[Dict[str, Any]]) -> Tuple[List[Any], int]:
+    """
+    Finds the user snapshots of a batch of users that are missing or differ from the user.
+    As save_user_snapshot() does, the repairs leave the snapshots holding a newer version
+    of the user's details than its 'updatedAt' as they are.
+    Args:
+        db (Database): The order service database.
+        users (List[Dict[str, Any]]): The users of the batch.
+    Returns:
+        Tuple[List[Any], int]: The bulk write operations and the number of drifted snapshots.
+    """
+    snapshots = {snapshot['_id']: snapshot for snapshot in
+                 db.user_snapshots.find({'_id': {'$in': [user['userId'] for user in users]}})}
+    operations = []
+    for user in users:
+        expected = contact_fields(user)
+        snapshot = snapshots.get(user['userId'])
+        if snapshot is not None and not differs(snapshot, expected):
+            continue
+        query: Dict[str, Any] = {'_id': user['userId']}
+        update = {**expected, 'updatedAt': datetime.utcnow()}
+        updated_at = user_updated_at(user)
+        if updated_at:
+            query.update(older_contact_filter(expected, updated_at))
+            update.update(contact_versions(expected, updated_at))
+        operations.append(UpdateOne(query, {'$set': update}, upsert=True))
+    return operations, len(operations)
+
+def apply_repairs(target: Collection, operations: List[Any]) -> None:
+    """
+    Applies repair operations with one unordered bulk write.
+    Args:
+        target (Collection): The orders or user snapshots collection.
+        operations (List[Any]): The operations.
+    Raises:
+        BulkWriteError: If an operation failed for another reason than a guarded upsert
+                        finding a newer document.
+    """
+    try:
+        target.bulk_write(operations, ordered=False)
+    except BulkWriteError as error:
+        # A guarded upsert inserts when the document exists with a newer version
+        if any(write_error['code'] != DUPLICATE_KEY_ERROR
+               for write_error in error.details.get('writeErrors', [])) \
+                or error.details.get('writeConcernErrors'):
+            raise
+
+def reconcile_range(db: Database, checkpoint: Checkpoint, index: int, bounds: Tuple[Any, Any],
+                    last: Optional[str], is_last_range: bool, limiter: RateLimiter,
+                    batch_size: int, dry_run: bool,
+                    cache: Optional[OrderListCache] = None,
+                    partitions: Optional[PartitionRouter] = None) -> Dict[str, int]:
+    """
+    Scans one userId range with keyset pagination and repairs drift batch by batch.
+    Args:
+        db (Database): The order service database.
+        checkpoint (Checkpoint): The job checkpoint.
+        index (int): The index of the range in the checkpoint.
+        bounds (Tuple[Any, Any]): The lower and upper userId of the range.
+        last (Optional[str]): The last userId processed by a previous run, if any.
+        is_last_range (bool): Whether the upper bound is included.
+        limiter (RateLimiter): The rate limit shared by all ranges.
+        batch_size (int): The number of users per batch.
+        dry_run (bool): Report drift without repairing it.
+        cache (Optional[OrderListCache]): The shared list cache to invalidate, if any.
+        partitions (Optional[PartitionRouter]): The order partitions, by default the 
+                                                order service database only.
+    Returns:
+        Dict[str, int]: Counts of scanned users and drifted documents.
+    """
+    lower, upper = bounds
+    partitions = partitions or get_partitions(db)
+    totals = {'users': 0, 'drifted': 0}
+    while True:
+        key_filter = {'$gt': last} if last is not None else {'$gte': lower}
+        key_filter['$lte' if is_last_range else '$lt'] = upper
+        users = list(db.users.find({'userId': key_filter}, USER_PROJECTION)
+                     .sort('userId', 1).limit(batch_size))
+        if not users:
+            break
+
+        limiter.acquire(len(users))
+        if Config.ORDER_CONTACT_MODE == SNAPSHOT_MODE:
+            repairs = [(db.user_snapshots, *snapshot_repairs(db, users), lambda: [],
+                        UNSHIPPED_STATUSES)]
+        else:
+            groups: Dict[str, Tuple[OrderPartition, List[Dict[str, Any]]]] = {}
+            for user in users:
+                partition = partitions.for_user(user['userId'])
+                groups.setdefault(partition.name, (partition, []))[1].append(user)
+            repairs = [(partition.orders, *order_repairs(partition.db, group), ORDER_STATUSES)
+                       for partition, group in groups.values()]
+
+        for target, operations, drifted, moves, statuses in repairs:
+            if operations and not dry_run:
+                apply_repairs(target, operations)
+                # The rollups of every partition are kept in the order service database
+                record_order_moved(db[ROLLUPS_COLLECTION], moves())
+                invalidate_statuses(cache, statuses)
+            totals['drifted'] += drifted
+
+        last = users[-1]['userId']
+        totals['users'] += len(users)
+        if not dry_run:
+            checkpoint.save({f'ranges.{index}.last': last})
+
+    if not dry_run:
+        checkpoint.save({f'ranges.{index}.done': True})
+    return totals
+
+def reconcile(db: Database, workers: int, batch_size: int, rate: float, dry_run: bool = False,
+              restart: bool = False, cache: Optional[OrderListCache] = None,
+              partitions: Optional[PartitionRouter] = None) -> Dict[str, int]:
+    """
+    Reconciles all users, resuming from the checkpoint of a previous run if there is one.
+    Args:
+        db (Database): The order service database.
+        workers (int): The number of userId ranges scanned in parallel.
+        batch_size (int): The number of users per batch.
+        rate (float): The maximum number of users scanned per second, 0 for no limit.
+        dry_run (bool): Report drift without repairing it.
+        restart (bool): Ignore the checkpoint and start from the beginning.
+        cache (Optional[OrderListCache]): The shared list cache to invalidate, if any.
+        partitions (Optional[PartitionRouter]): The order partitions, by default the 
+                                                order service database only.
+    Returns:
+        Dict[str, int]: Counts of scanned users and drifted documents.
+    """
+    partitions = partitions or get_partitions(db)
+    checkpoint = Checkpoint(db, JOB_NAME)
+    if restart:
+        checkpoint.clear()
+    state = checkpoint.load()
+    if state is None or all(item.get('done') for item in state['ranges']):
+        ranges = [{'lower': lower, 'upper': upper}
+                  for lower, upper in split_key_ranges(db.users, 'userId', workers)]
+        if not dry_run:
+            checkpoint.clear()
+            checkpoint.save({'ranges': ranges})
+    else:
+        ranges = state['ranges']
+
+    limiter = RateLimiter(rate)
+    with ThreadPoolExecutor(max_workers=max(1, len(ranges))) as executor:
+        futures = [executor.submit(reconcile_range, db, checkpoint, index,
+                                   (item['lower'], item['upper']), item.get('last'),
+                                   index == len(ranges) - 1, limiter, batch_size, dry_run,
+                                   cache, partitions)
+                   for index, item in enumerate(ranges) if not item.get('done')]
+        results = [future.result() for future in futures]
+
+    return {key: sum(result[key] for result in results) for key in ('users', 'drifted')}
+
+def main() -> None:
+    """
+    Parses the command line and runs the reconciliation.
+    """
+    parser = argparse.ArgumentParser(description='Repair order contact details that '
+                                                 'drifted from the users collection.')
+    parser.add_argument('--workers', type=int, default=4, help='userId ranges scanned in '
+                                                               'parallel')
+    parser.add_argument('--batch-size', type=int, default=500, help='users per batch')
+    parser.add_argument('--rate', type=float, default=2000, help='maximum users per second, '
+                                                                 '0 for no limit')
+    parser.add_argument('--dry-run', action='store_true', help='only report drift')
+    parser.add_argument('--restart', action='store_true', help='ignore the checkpoint')
+    args = parser.parse_args()
+
+    totals = reconcile(get_database(), args.workers, args.batch_size, args.rate,
+                       args.dry_run, args.restart, get_list_cache())
+    action = 'found' if args.dry_run else 'repaired'
+    print(f"Scanned {totals['users']} users, {action} {totals['drifted']} drifted documents.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+"""_summary_
+Admission control of the HTTP requests of a worker.
+
+When a worker receives more requests than it can serve, the extra requests do not fail;
+they wait for a thread, then for a connection of the MongoDB pool, and in the user
+services for the synchronous publish of their event, until the gateway times them out
+and clients retry them. The worker then spends its time on requests nobody waits for
+anymore, and fewer requests succeed the more it receives. Admission control rejects the
+excess up front instead, with '503 Service Unavailable' and a 'Retry-After' header, so
+the requests it admits are served at the speed of an unloaded worker.
+
+Requests are split into two classes with their own budgets, reads (GET, HEAD, OPTIONS)
+and writes, so a burst of one class cannot take every thread of the worker:
+
+- ADMISSION_READ_LIMIT and ADMISSION_WRITE_LIMIT bound the requests of each class served
+  at once by a worker, 0 for no bound. Keep their sum above the threads of a worker
+  (gunicorn --threads) and each one below it.
+- ADMISSION_MAX_POOL_WAIT_MS bounds the time requests wait for a pooled MongoDB
+  connection, 0 for no bound. Every MongoDB client of the process reports its checkouts
+  to POOL_WAIT: the wait is a moving average of the recent checkouts that halves every
+  second without new ones, or the wait of the longest waiting checkout if longer. While
+  it is above the bound and checkouts are waiting, new requests would only wait behind
+  them and are rejected; once no checkout waits, requests are admitted again. The
+  checkouts of event consumer and job threads count as well, so only bound the pool
+  wait of processes that serve requests alone.
+
+Every bound is off by default: the right limits depend on the threads and the pool of a
+deployment, so each deployment sets its own (see docker-compose.yml).
+
+Requests to ADMISSION_EXEMPT_PATHS, such as /metrics and long-lived event streams, are
+always admitted and not counted. Rejected requests are counted in
+http_requests_shed_total{class, reason} on /metrics. Run experiments/benchmark_admission.py
+to compare the goodput of an overloaded worker with and without admission control.
+
+Classes:
+    PoolWaitMonitor: Measures how long MongoDB connection checkouts wait.
+    AdmissionController: Admits requests within the budgets of their class.
+    AdmissionMiddleware: WSGI middleware rejecting the requests not admitted.
+Functions:
+    request_class(method) -> str: The class of a request.
+    init_admission_control(app): Installs the admission control configured for a service.
+Author:
+    @TheBarzani
+"""
+
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Sequence
+from flask import Flask
+from pymongo import monitoring
+from shared.metrics import REGISTRY, MetricFamily, _RecordOnClose
+
+READ_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+REQUEST_CLASSES = ('read', 'write')
+POOL_WAIT_HALF_LIFE_SECONDS = 1.0
+# The weight of a new checkout in the moving average of the pool wait
+POOL_WAIT_SMOOTHING = 0.2
+OVERLOADED_BODY = json.dumps({'message': 'Service overloaded, retry later'}).encode()
+
+REQUESTS_SHED = REGISTRY.counter('http_requests_shed_total',
+                                 'HTTP requests rejected by admission control.',
+                                 ('class', 'reason'))
+POOL_CHECKOUT_WAIT = REGISTRY.histogram('mongodb_pool_checkout_wait_seconds',
+                                        'Time spent waiting for a pooled MongoDB connection.',
+                                        ('outcome',))
+
+class PoolWaitMonitor(monitoring.ConnectionPoolListener):
+    """
+    Measures how long the connection checkouts of the MongoDB clients it listens to
+    wait, as a moving average that decays while no checkout completes.
+    """
+
+    def __init__(self, half_life_seconds: float = POOL_WAIT_HALF_LIFE_SECONDS) -> None:
+        self.half_life_seconds = half_life_seconds
+        self._lock = threading.Lock()
+        self._waiting: Dict[int, float] = {}
+        self._average = 0.0
+        self._updated = time.monotonic()
+
+    def _decayed(self, now: float) -> float:
+        return self._average * 0.5 ** ((now - self._updated) / self.half_life_seconds)
+
+    def wait_seconds(self) -> float:
+        """
+        Returns:
+            float: The recent wait of the checkouts in seconds, or the wait of the longest
+                   waiting checkout if longer.
+        """
+        now = time.monotonic()
+        with self._lock:
+            oldest = min(self._waiting.values(), default=now)
+            return max(self._decayed(now), now - oldest)
+
+    def is_congested(self, bound_seconds: float) -> bool:
+        """
+        Returns:
+            bool: Whether checkouts are waiting for a connection and the wait is above
+                  the bound.
+        """
+        if not self._waiting:
+            return False
+        return self.wait_seconds() > bound_seconds
+
+    def record(self, seconds: float) -> None:
+        """
+        Adds the wait of a completed checkout to the moving average.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._average = (self._decayed(now) * (1 - POOL_WAIT_SMOOTHING)
+                             + seconds * POOL_WAIT_SMOOTHING)
+            self._updated = now
+
+    def _finish(self, duration: Optional[float], outcome: str) -> None:
+        with self._lock:
+            started = self._waiting.pop(threading.get_ident(), None)
+        if duration is None:
+            duration = time.monotonic() - started if started is not None else 0.0
+        self.record(duration)
+        POOL_CHECKOUT_WAIT.observe(duration, outcome)
+
+    # A checkout starts and ends on the thread that needs the connection
+    def connection_check_out_started(self,
+                                     event: monitoring.ConnectionCheckOutStartedEvent) -> None:
+        with self._lock:
+            self._waiting[threading.get_ident()] = time.monotonic()
+
+    def connection_checked_out(self, event: monitoring.ConnectionCheckedOutEvent) -> None:
+        self._finish(event.duration, 'success')
+
+    def connection_check_out_failed(self,
+                                    event: monitoring.ConnectionCheckOutFailedEvent) -> None:
+        self._finish(event.duration, 'failure')
+
+    def pool_created(self, event: monitoring.PoolCreatedEvent) -> None:
+        pass
+
+    def pool_ready(self, event: monitoring.PoolReadyEvent) -> None:
+        pass
+
+    def pool_cleared(self, event: monitoring.PoolClearedEvent) -> None:
+        pass
+
+    def pool_closed(self, event: monitoring.PoolClosedEvent) -> None:
+        pass
+
+    def connection_created(self, event: monitoring.ConnectionCreatedEvent) -> None:
+        pass
+
+    def connection_ready(self, event: monitoring.ConnectionReadyEvent) -> None:
+        pass
+
+    def connection_closed(self, event: monitoring.ConnectionClosedEvent) -> None:
+        pass
+
+    def connection_checked_in(self, event: monitoring.ConnectionCheckedInEvent) -> None:
+        pass
+
+# Every MongoDB client of the process reports to it, see shared.mongo
+POOL_WAIT = PoolWaitMonitor()
+
+def request_class(method: str) -> str:
+    """
+    Returns:
+        str: 'read' for GET, HEAD and OPTIONS requests, 'write' for the others.
+    """
+    return 'read' if method in READ_METHODS else 'write'
+
+class AdmissionController:
+    """
+    Admits requests while their class is within its concurrency limit and the MongoDB
+    pool wait is within its bound.
+    """
+
+    def __init__(self, limits: Mapping[str, int], max_pool_wait_ms: float,
+                 pool_wait: PoolWaitMonitor = POOL_WAIT) -> None:
+        """
+        Args:
+            limits (Mapping[str, int]): The requests of each class served at once, 0 for
+                                        no limit.
+            max_pool_wait_ms (float): The pool wait above which requests are shed, 0 for
+                                      no bound.
+            pool_wait (PoolWaitMonitor): The monitor of the MongoDB pool wait.
+        """
+        self.limits = {name: limits.get(name, 0) for name in REQUEST_CLASSES}
+        self.max_pool_wait = max_pool_wait_ms / 1000
+        self.pool_wait = pool_wait
+        self._lock = threading.Lock()
+        self._in_flight = dict.fromkeys(REQUEST_CLASSES, 0)
+
+    def admit(self, name: str) -> Optional[str]:
+        """
+        Admits a request of a class, to be released once served.
+        Args:
+            name (str): The class of the request, 'read' or 'write'.
+        Returns:
+            Optional[str]: None when the request is admitted, otherwise why it is not:
+                           'concurrency' or 'pool_wait'.
+        """
+        limit = self.limits[name]
+        with self._lock:
+            in_flight = self._in_flight[name]
+            if limit and in_flight >= limit:
+                return 'concurrency'
+            if self.max_pool_wait and self.pool_wait.is_congested(self.max_pool_wait):
+                return 'pool_wait'
+            self._in_flight[name] = in_flight + 1
+        return None
+
+    def release(self, name: str) -> None:
+        """
+        Releases an admitted request of a class.
+        """
+        with self._lock:
+            self._in_flight[name] -= 1
+
+    def in_flight(self) -> Dict[str, int]:
+        """
+        Returns:
+            Dict[str, int]: The admitted requests of every class being served.
+        """
+        with self._lock:
+            return dict(self._in_flight)
+
+    def collect(self) -> List[MetricFamily]:
+        """
+        Returns:
+            List[MetricFamily]: The admitted requests of every class and the MongoDB pool
+                                wait, for /metrics.
+        """
+        in_flight = MetricFamily('http_requests_admitted_in_flight',
+                                 'Admitted HTTP requests being served, by class.', 'gauge')
+        for name, count in self.in_flight().items():
+            in_flight.add({'class': name}, count)
+        pool_wait = MetricFamily('mongodb_pool_wait_seconds',
+                                 'Recent wait for a pooled MongoDB connection, as used by '
+                                 'admission control.', 'gauge')
+        pool_wait.add({}, self.pool_wait.wait_seconds())
+        return [in_flight, pool_wait]
+
+class AdmissionMiddleware:
+    """
+    WSGI middleware answering the requests the controller does not admit with
+    '503 Service Unavailable' before they reach the application.
+    """
+
+    def __init__(self, wsgi_app: Callable[..., Iterable[bytes]],
+                 controller: AdmissionController, exempt_paths: Sequence[str],
+                 retry_after_seconds: int) -> None:
+        """
+        Args:
+            wsgi_app (Callable[..., Iterable[bytes]]): The application.
+            controller (AdmissionController): The controller admitting requests.
+            exempt_paths (Sequence[str]): The path prefixes always admitted.
+            retry_after_seconds (int): The Retry-After of rejected requests.
+        """
+        self.wsgi_app = wsgi_app
+        self.controller = controller
+        self.exempt_paths = tuple(exempt_paths)
+        self.headers = [('Content-Type', 'application/json'),
+                        ('Content-Length', str(len(OVERLOADED_BODY))),
+                        ('Retry-After', str(retry_after_seconds))]
+
+    def __call__(self, environ: Dict[str, Any],
+                 start_response: Callable[..., Any]) -> Iterable[bytes]:
+        if self.exempt_paths and environ.get('PATH_INFO', '').startswith(self.exempt_paths):
+            return self.wsgi_app(environ, start_response)
+        name = request_class(environ['REQUEST_METHOD'])
+        reason = self.controller.admit(name)
+        if reason is not None:
+            REQUESTS_SHED.inc(name, reason)
+            start_response('503 Service Unavailable', list(self.headers))
+            return [OVERLOADED_BODY]
+        try:
+            body = self.wsgi_app(environ, start_response)
+        except BaseException:
+            self.controller.release(name)
+            raise
+        # The request holds its slot until its response is sent
+        return _RecordOnClose(body, lambda: self.controller.release(name))
+
+def init_admission_control(app: Flask) -> None:
+    """
+    Installs the admission control configured for a service, in front of everything
+    else so rejected requests cost as little as possible; without limits requests are
+    left untouched.
+    Args:
+        app (Flask): The application.
+    Returns:
+        None
+    """
+    config = app.config
+    limits = {'read': config['ADMISSION_READ_LIMIT'], 'write': config['ADMISSION_WRITE_LIMIT']}
+    if not any(limits.values()) and not config['ADMISSION_MAX_POOL_WAIT_MS']:
+        return
+    controller = AdmissionController(limits, config['ADMISSION_MAX_POOL_WAIT_MS'])
+    REGISTRY.register_collector('admission', controller.collect)
+    exempt_paths = [path.strip() for path in config['ADMISSION_EXEMPT_PATHS'].split(',')
+                    if path.strip()]
+    app.wsgi_app = AdmissionMiddleware(app.wsgi_app, controller,  # type: ignore
+                                       exempt_paths, config['ADMISSION_RETRY_AFTER_SECONDS'])
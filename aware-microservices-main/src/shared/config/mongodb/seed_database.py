@@ -8,9 +8,13 @@ Functions:
         Seeds the users collection with sample user data.
         Returns a list of seeded user documents.
 
-    seed_orders(users: List[Dict[str, Any]]) -> None:
+    seed_orders(users: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         Seeds the orders collection with sample order data.
         Takes a list of user documents to associate orders with users.
+        Returns a list of seeded order documents.
+
+    seed_order_rollups(orders: List[Dict[str, Any]]) -> None:
+        Seeds the daily order rollups of the seeded orders.
 Author:
     @TheBarzani        
 """
@@ -21,6 +25,8 @@ from typing import List, Dict, Any
 from datetime import datetime
 from pymongo import MongoClient
 from dotenv import load_dotenv
+# The setup image copies this module alone, see the Dockerfile
+from order_service.app.totals import compute_order_totals
 
 # Load environment variables from .env
 load_dotenv()
@@ -78,7 +84,7 @@ def seed_users() -> List[Dict[str, Any]]:
     return users
 
 # Seed Orders Collection
-def seed_orders(users: List[Dict[str, Any]]) -> None:
+def seed_orders(users: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     """
     Seed the orders collection in MongoDB with sample data.
     This function generates a list of 15 orders, each containing 1 to 3 items,
@@ -89,7 +95,7 @@ def seed_orders(users: List[Dict[str, Any]]) -> None:
         users (List[Dict[str, Any]]): A list of user dictionaries. Each dictionary
                                       should contain the keys "emails" and "deliveryAddress".
     Returns:
-        None
+        List[Dict[str, Any]]: A list of dictionaries representing the seeded orders.
     Raises:
         pymongo.errors.PyMongoError: If an error occurs while inserting the orders into MongoDB.
     Example:
@@ -125,9 +131,43 @@ def seed_orders(users: List[Dict[str, Any]]) -> None:
             "createdAt": datetime.utcnow(),
             "updatedAt": datetime.utcnow()
         }
+        order.update(compute_order_totals(order["items"]))
+        if order["orderStatus"] == "delivered":
+            order["deliveredAt"] = order["updatedAt"]
         orders.append(order)
     db.orders.insert_many(orders)
     print(f"Seeded {len(orders)} orders.")
+    return orders
+
+# Seed Order Rollups Collection
+def seed_order_rollups(orders: List[Dict[str, Any]]) -> None:
+    """
+    Seed the daily order rollups that the order service keeps for GET /orders/analytics,
+    with the same document layout as order_service.app.rollups: one document per 
+    creation day, dimension and value, counting the orders and summing their totalAmount.
+
+    Args:
+        orders (List[Dict[str, Any]]): The seeded orders.
+    Returns:
+        None
+    """
+
+    print("Seeding order rollups...")
+    rollups: Dict[str, Dict[str, Any]] = {}
+    for order in orders:
+        day: datetime = datetime(order["createdAt"].year, order["createdAt"].month,
+                                 order["createdAt"].day)
+        for dimension, value in (("orderStatus", order["orderStatus"]),
+                                 ("country", order["deliveryAddress"]["country"])):
+            rollup: Dict[str, Any] = rollups.setdefault(
+                f"{day:%Y-%m-%d}|{dimension}|{value}",
+                {"day": day, "dimension": dimension, "value": value, "orders": 0,
+                 "revenue": 0.0})
+            rollup["orders"] += 1
+            rollup["revenue"] += order["totalAmount"]
+    db.order_rollups.insert_many([{"_id": rollup_id, **rollup}
+                                  for rollup_id, rollup in rollups.items()])
+    print(f"Seeded {len(rollups)} order rollups.")
 
 # Main function
 def main() -> None:
@@ -138,7 +178,8 @@ def main() -> None:
 
     print("Seeding database...")
     users: List[Dict[str, Any]] = seed_users()
-    seed_orders(users)
+    orders: List[Dict[str, Any]] = seed_orders(users)
+    seed_order_rollups(orders)
     print("Database seeding complete.")
     # Retrieve and print one user
     user: Dict[str, Any] = db.users.find_one()
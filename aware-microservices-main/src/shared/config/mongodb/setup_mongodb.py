@@ -4,7 +4,8 @@ It initializes the 'users' and 'orders' collections with appropriate schema vali
 
 Functions:
     setup_users_collection(): Initializes the 'users' collection with schema validation.
-    setup_orders_collection(): Initializes the 'orders' collection with schema validation.
+    setup_orders_collection(name): Initializes the 'orders' collection, or the 
+                                   'orders_archive' collection, with schema validation.
     main(): Main function to set up the MongoDB collections.
 
 Author:
@@ -49,6 +50,8 @@ def setup_users_collection() -> None:
     - createdAt: date (optional)
     - updatedAt: date (optional)
 
+    A unique index is created on userId.
+
     If the collection already exists or creation fails, an exception is caught and an 
     error message is printed.
     """
@@ -81,12 +84,19 @@ def setup_users_collection() -> None:
     }
 
     db.create_collection("users", validator={"$jsonSchema": user_schema}, validationLevel="strict")
+    # userIds are time-ordered, so new users append to the right edge of this index
+    db.users.create_index("userId", unique=True, name="users_userId")
 
 
 # Initialize Orders Collection
-def setup_orders_collection() -> None:
+def setup_orders_collection(name: str = "orders") -> None:
     """
-    Sets up the 'orders' collection in MongoDB with a JSON schema validator.
+    Sets up the 'orders' collection in MongoDB with a JSON schema validator. The 
+    'orders_archive' collection, which holds the orders moved out of 'orders' after 
+    delivery, is set up with the same schema.
+
+    Args:
+        name (str): The name of the collection to create.
 
     The schema for the 'orders' collection includes the following fields:
     - orderId (string): Unique identifier for the order.
@@ -107,6 +117,16 @@ def setup_orders_collection() -> None:
                             "shipping", "delivered"].
     - createdAt (date): Date when the order was created.
     - updatedAt (date): Date when the order was last updated.
+    - contactUpdatedAt (date): Date when the order's emails or delivery address were 
+                               last set on the order itself.
+    - contactVersions (object): The publish time of the user update, or the time of the
+                                order change, that last set 'userEmails' and
+                                'deliveryAddress', so older updates do not replace them.
+    - itemCount (int): Number of items in the order, at least 0.
+    - totalQuantity (int): Sum of the item quantities, at least 0.
+    - totalAmount (double): Sum of quantity times price of the items, at least 0.
+    - deliveredAt (date): Date when the order was delivered.
+    - archivedAt (date): Date when the order was moved to the archive.
 
     If the collection already exists or creation fails, an exception is caught and 
     an error message is printed.
@@ -148,23 +168,40 @@ def setup_orders_collection() -> None:
             "orderStatus": {"bsonType": "string", "enum": ["under process", "shipping",
                                                            "delivered"]},
             "createdAt": {"bsonType": "date"},
-            "updatedAt": {"bsonType": "date"}
+            "updatedAt": {"bsonType": "date"},
+            "contactUpdatedAt": {"bsonType": "date"},
+            "contactVersions": {
+                "bsonType": "object",
+                "properties": {
+                    "userEmails": {"bsonType": "date"},
+                    "deliveryAddress": {"bsonType": "date"}
+                }
+            },
+            "itemCount": {"bsonType": "int", "minimum": 0},
+            "totalQuantity": {"bsonType": "int", "minimum": 0},
+            "totalAmount": {"bsonType": "double", "minimum": 0},
+            "deliveredAt": {"bsonType": "date"},
+            "archivedAt": {"bsonType": "date"}
         }
     }
 
-    db.create_collection("orders", validator={"$jsonSchema": order_schema}, validationLevel=
+    db.create_collection(name, validator={"$jsonSchema": order_schema}, validationLevel=
                          "strict")
 
 def main() -> None:
     """
-    Main function to set up the MongoDB collections for users and orders.
+    Main function to set up the MongoDB collections for users, orders and archived 
+    orders.
     """
     print("Setting up MongoDB...")
     # Drop existing collections if they exist
     db.users.drop()
     db.orders.drop()
+    db.orders_archive.drop()
+    db.order_rollups.drop()
     setup_users_collection()
     setup_orders_collection()
+    setup_orders_collection("orders_archive")
     print("MongoDB setup complete.")
 
 if __name__ == "__main__":
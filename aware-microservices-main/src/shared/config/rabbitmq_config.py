@@ -2,23 +2,47 @@
 This module provides configuration and utility functions for connecting to a RabbitMQ server
 and creating channels with specified queues and exchanges.
 
+User change events are published to a topic exchange with one routing key per event type,
+for example 'user.email.updated' or 'user.address.updated'. Every consumer queue is described
+by an EventQueue that lists the routing keys it binds to, together with its own prefetch
+count and consumer bounds, so costly event types do not hold up cheaper ones.
+
+Before the topic exchange, user events went through the 'user_order' direct exchange to a
+single queue named RABBITMQ_QUEUE_NAME, each event carrying both the emails and the
+address. The order service consumers move the events left in that queue to the topic
+exchange with drain_legacy_queue() when they start, then delete it.
+
+Classes:
+    EventQueue: A consumer queue, its bindings, prefetch count and consumer bounds.
 Functions:
     get_connection() -> pika.BlockingConnection:
         Establishes and returns a connection to the RabbitMQ server using the provided credentials.
-    create_channel(queue_name: str) -> Tuple[pika.channel.Channel, pika.BlockingConnection]:
-        Creates a channel, declares an exchange and a queue, binds them together, and returns 
-        the channel and connection.
+    declare_user_event_topology(channel: pika.channel.Channel) -> None:
+        Declares the user event exchange and binds every queue in USER_EVENT_QUEUES to it.
+    create_channel() -> Tuple[pika.channel.Channel, pika.BlockingConnection]:
+        Creates a channel, declares the user event topology, and returns the channel and 
+        connection.
+    drain_legacy_queue(connection: pika.BlockingConnection) -> int:
+        Moves the events of the former direct exchange queue to the topic exchange.
 Environment Variables:
     RABBITMQ_HOST: The hostname of the RabbitMQ server.
     RABBITMQ_PORT: The port number of the RabbitMQ server.
     RABBITMQ_USER: The username for RabbitMQ authentication (default: 'admin').
     RABBITMQ_PASSWORD: The password for RabbitMQ authentication (default: 'admin').
+    RABBITMQ_EXCHANGE_NAME: The topic exchange for user events (default: 'user_events').
+    RABBITMQ_QUEUE_NAME: The prefix of the per-event-type queue names, required.
+    RABBITMQ_<EMAIL|ADDRESS>_QUEUE_PREFETCH: Prefetch count of the queue.
+    RABBITMQ_<EMAIL|ADDRESS>_QUEUE_MIN_CONSUMERS: Minimum consumers of the queue.
+    RABBITMQ_<EMAIL|ADDRESS>_QUEUE_MAX_CONSUMERS: Maximum consumers of the queue.
 Author:
     @TheBarzani
 """
 
+import json
 import os
-from typing import Tuple
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Tuple
 import pika
 from dotenv import load_dotenv
 load_dotenv()
@@ -27,6 +51,54 @@ RABBITMQ_HOST = os.getenv('RABBITMQ_HOST')
 RABBITMQ_PORT = int(os.getenv('RABBITMQ_PORT'))
 RABBITMQ_USER = os.getenv('RABBITMQ_USER', 'admin')
 RABBITMQ_PASSWORD = os.getenv('RABBITMQ_PASSWORD', 'admin')
+RABBITMQ_QUEUE_NAME = os.getenv('RABBITMQ_QUEUE_NAME')
+if not RABBITMQ_QUEUE_NAME:
+    # Without it every service would use queues named 'None.email' and 'None.address'
+    raise ValueError('RABBITMQ_QUEUE_NAME must be set to the prefix of the user event queues')
+
+EXCHANGE_NAME = os.getenv('RABBITMQ_EXCHANGE_NAME', 'user_events')
+EXCHANGE_TYPE = 'topic'
+# The direct exchange of the single user event queue that preceded the topic exchange
+LEGACY_EXCHANGE_NAME = 'user_order'
+LEGACY_VERSION = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Routing keys of the user change events
+USER_EMAIL_UPDATED = 'user.email.updated'
+USER_ADDRESS_UPDATED = 'user.address.updated'
+
+@dataclass(frozen=True)
+class EventQueue:
+    """
+    A durable queue bound to the user event exchange.
+    Attributes:
+        name (str): The name of the queue.
+        routing_keys (Tuple[str, ...]): The routing keys (or topic patterns) it binds to.
+        prefetch_count (int): Unacknowledged deliveries allowed per consumer.
+        min_consumers (int): The minimum number of consumers of the queue.
+        max_consumers (int): The maximum number of consumers of the queue.
+    """
+    name: str
+    routing_keys: Tuple[str, ...]
+    prefetch_count: int = 10
+    min_consumers: int = 1
+    max_consumers: int = 4
+
+def _event_queue(kind: str, routing_key: str, prefetch_count: int, min_consumers: int,
+                 max_consumers: int) -> EventQueue:
+    prefix = f'RABBITMQ_{kind.upper()}_QUEUE'
+    return EventQueue(
+        name=f'{RABBITMQ_QUEUE_NAME}.{kind}',
+        routing_keys=(routing_key,),
+        prefetch_count=int(os.getenv(f'{prefix}_PREFETCH', str(prefetch_count))),
+        min_consumers=int(os.getenv(f'{prefix}_MIN_CONSUMERS', str(min_consumers))),
+        max_consumers=int(os.getenv(f'{prefix}_MAX_CONSUMERS', str(max_consumers))))
+
+# Email changes are cheap to apply, address changes rewrite a whole sub-document
+EMAIL_QUEUE = _event_queue('email', USER_EMAIL_UPDATED, prefetch_count=20, min_consumers=1,
+                           max_consumers=2)
+ADDRESS_QUEUE = _event_queue('address', USER_ADDRESS_UPDATED, prefetch_count=10,
+                             min_consumers=1, max_consumers=4)
+USER_EVENT_QUEUES: Tuple[EventQueue, ...] = (EMAIL_QUEUE, ADDRESS_QUEUE)
 
 def get_connection() -> pika.BlockingConnection:
     """
@@ -39,25 +111,101 @@ def get_connection() -> pika.BlockingConnection:
                                                              port=RABBITMQ_PORT,
                                                              credentials=credentials))
 
-def create_channel(queue_name: str) -> Tuple[pika.channel.Channel, pika.BlockingConnection]:
+def declare_user_event_topology(channel: pika.channel.Channel) -> None:
     """
-    Creates a channel, declares an exchange and a queue, binds them together, and returns
-    the channel and connection.
+    Declares the user event exchange and every queue in USER_EVENT_QUEUES, and binds each
+    queue to the exchange with its routing keys. Publishers declare the queues as well, so
+    events published before the first consumer starts are not dropped.
     Args:
-        queue_name (str): The name of the queue and routing key for the exchange.
+        channel (pika.channel.Channel): The channel to declare the topology on.
+    Returns:
+        None
+    """
+    # Declare an exchange
+    channel.exchange_declare(exchange=EXCHANGE_NAME, exchange_type=EXCHANGE_TYPE, durable=True)
+
+    for queue in USER_EVENT_QUEUES:
+        # Declare a queue
+        channel.queue_declare(queue=queue.name, durable=True)
+
+        # Bind the queue to the exchange for each event type it handles
+        for routing_key in queue.routing_keys:
+            channel.queue_bind(exchange=EXCHANGE_NAME, queue=queue.name,
+                               routing_key=routing_key)
+
+def create_channel() -> Tuple[pika.channel.Channel, pika.BlockingConnection]:
+    """
+    Creates a channel, declares the user event exchange and queues, binds them together,
+    and returns the channel and connection.
     Returns:
         Tuple[pika.channel.Channel, pika.BlockingConnection]: A tuple containing the channel
         and connection objects.
     """
     connection = get_connection()
     channel = connection.channel()
-    # Declare an exchange
-    channel.exchange_declare(exchange="user_order", exchange_type='direct', durable=True)
-
-    # Declare a queue
-    channel.queue_declare(queue=queue_name, durable=True)
+    declare_user_event_topology(channel)
+    return channel, connection
 
-    # Bind the queue to the exchange with a routing key
-    channel.queue_bind(exchange="user_order", queue=queue_name, routing_key=queue_name)
+def split_legacy_event(event: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Splits an event of the former single queue into the events of the topic exchange.
+    Args:
+        event (Dict[str, Any]): The legacy event, with 'userId' and any of 'userEmails'
+                                and 'deliveryAddress'.
+    Returns:
+        List[Tuple[str, Dict[str, Any]]]: The routing key and body of every event.
+    """
+    events = []
+    if event.get('userEmails'):
+        events.append((USER_EMAIL_UPDATED, {'userId': event['userId'],
+                                            'userEmails': event['userEmails']}))
+    if event.get('deliveryAddress'):
+        events.append((USER_ADDRESS_UPDATED, {'userId': event['userId'],
+                                              'deliveryAddress': event['deliveryAddress']}))
+    return events
 
-    return channel, connection
+def drain_legacy_queue(connection: pika.BlockingConnection) -> int:
+    """
+    Moves the events left in the queue of the former 'user_order' direct exchange to the
+    user event exchange, then deletes that queue. The queue is unbound first so no event
+    reaches it meanwhile, and every event is acknowledged once the broker confirmed its
+    republication, so none is lost if the drain is interrupted. Since events published
+    to 'user_order' from then on are dropped, the order service must be deployed after
+    every user service publishes to the user event exchange.
+    The legacy events carry no version, so they are versioned from the epoch, one
+    millisecond apart in queue order (MongoDB keeps milliseconds): they apply to orders
+    that never received a versioned update, but never replace newer details. Several
+    consumers may drain the queue at once; it does nothing once the queue is gone.
+    Args:
+        connection (pika.BlockingConnection): The connection to drain on, with a channel
+                                              of its own.
+    Returns:
+        int: The number of legacy events moved.
+    """
+    channel = connection.channel()
+    moved = 0
+    try:
+        channel.queue_declare(queue=RABBITMQ_QUEUE_NAME, durable=True, passive=True)
+        channel.queue_unbind(queue=RABBITMQ_QUEUE_NAME, exchange=LEGACY_EXCHANGE_NAME,
+                             routing_key=RABBITMQ_QUEUE_NAME)
+        channel.confirm_delivery()
+        while True:
+            method, _, body = channel.basic_get(queue=RABBITMQ_QUEUE_NAME, auto_ack=False)
+            if method is None:
+                break
+            for routing_key, event in split_legacy_event(json.loads(body)):
+                event['eventType'] = routing_key
+                # Older than any versioned update, and later events of a user get a later
+                # version
+                event['version'] = (LEGACY_VERSION + timedelta(milliseconds=moved)).isoformat()
+                moved += 1
+                channel.basic_publish(exchange=EXCHANGE_NAME, routing_key=routing_key,
+                                      body=json.dumps(event))
+            channel.basic_ack(delivery_tag=method.delivery_tag)
+        channel.queue_delete(queue=RABBITMQ_QUEUE_NAME, if_empty=True)
+    except pika.exceptions.ChannelClosedByBroker:
+        # The queue or the exchange does not exist (anymore), or another consumer
+        # deleted the queue first
+        return moved
+    channel.close()
+    return moved
@@ -0,0 +1,188 @@
+"""_summary_
+Idempotency keys for the POST endpoints of the services.
+
+A client that times out cannot tell whether its request was applied, so it retries, and
+without protection every retry inserts another user or order. With this module a client
+sends an `Idempotency-Key` header, and the first request carrying a key claims it by
+inserting a 'pending' record whose _id is the endpoint and the key. The unique _id
+index decides which of several concurrent duplicates wins, so there is no read-then-write
+window. The winner runs the handler and stores its response in the record. Requests that
+lose the claim get the stored response back without running the handler, or a 409 while
+the winner is still running. Reusing a key with a different body is rejected with a 422.
+Storing the response is retried when it fails, and the response is returned even if it
+never gets stored, since the handler's writes are already committed.
+
+Records expire through a TTL index on createdAt. A pending record older than the pending
+timeout is considered abandoned by a crashed worker and can be claimed again.
+
+Functions:
+    idempotent(handler): Decorator making a Flask-RESTx handler honour Idempotency-Key.
+    ensure_idempotency_index(collection, ttl_seconds): Creates the TTL index.
+    ensure_idempotency_index_in_background(collection, ttl_seconds): Creates the TTL
+        index from a thread, retrying until the database is reachable.
+Author:
+    @TheBarzani
+"""
+
+import functools
+import hashlib
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional
+from flask import current_app, request
+from flask_restx import abort
+from pymongo.collection import Collection
+from pymongo.errors import DuplicateKeyError, OperationFailure, PyMongoError
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+TTL_INDEX_NAME = 'idempotency_createdAt_ttl'
+
+logger = logging.getLogger(__name__)
+
+def ensure_idempotency_index(collection: Collection, ttl_seconds: int) -> None:
+    """
+    Creates the TTL index expiring idempotency records, or updates its expiry.
+    Args:
+        collection (Collection): The idempotency keys collection.
+        ttl_seconds (int): Seconds after which a record expires.
+    Returns:
+        None
+    """
+    try:
+        collection.create_index('createdAt', name=TTL_INDEX_NAME,
+                                expireAfterSeconds=ttl_seconds)
+    except OperationFailure:
+        # The index exists with another expiry
+        collection.database.command('collMod', collection.name,
+                                    index={'name': TTL_INDEX_NAME,
+                                           'expireAfterSeconds': ttl_seconds})
+
+def ensure_idempotency_index_in_background(collection: Collection, ttl_seconds: int,
+                                           retry_delay: float = 5.0) -> threading.Thread:
+    """
+    Creates the TTL index from a daemon thread so the service can start before the
+    database is reachable, retrying until it succeeds.
+    Args:
+        collection (Collection): The idempotency keys collection.
+        ttl_seconds (int): Seconds after which a record expires.
+        retry_delay (float): Seconds to wait between attempts.
+    Returns:
+        threading.Thread: The started thread.
+    """
+
+    def run() -> None:
+        while True:
+            try:
+                ensure_idempotency_index(collection, ttl_seconds)
+                return
+            except PyMongoError as error:
+                logger.warning('Creating the idempotency index failed, retrying: %s', error)
+                time.sleep(retry_delay)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+def _claim(collection: Collection, record_id: str, fingerprint: str,
+           pending_timeout: float) -> Optional[Dict[str, Any]]:
+    """
+    Claims a key for this request.
+    Returns:
+        Optional[Dict[str, Any]]: None if this request owns the key, otherwise the
+                                  record of the request that does.
+    """
+    now = datetime.utcnow()
+    try:
+        collection.insert_one({'_id': record_id, 'state': 'pending',
+                               'fingerprint': fingerprint, 'createdAt': now})
+        return None
+    except DuplicateKeyError:
+        pass
+
+    record = collection.find_one({'_id': record_id})
+    if record is None:
+        # Expired between the insert and the read
+        return _claim(collection, record_id, fingerprint, pending_timeout)
+    if (record['state'] == 'pending' and record['fingerprint'] == fingerprint
+            and record['createdAt'] < now - timedelta(seconds=pending_timeout)):
+        # The owner died; take the key over unless another retry already did
+        taken = collection.update_one({'_id': record_id, 'state': 'pending',
+                                       'createdAt': record['createdAt']},
+                                      {'$set': {'createdAt': now}})
+        if taken.modified_count:
+            return None
+    return record
+
+def _complete(collection: Collection, record_id: str, body: Any, status: int,
+              attempts: int = 3, retry_delay: float = 0.1) -> None:
+    """
+    Stores the response of the request owning a key. The handler already committed its
+    writes, so a failure is retried, then logged rather than failing the request; the
+    key then stays pending, and the client gets a 409 for its retries until the pending
+    timeout lets one of them run the handler again.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            collection.update_one({'_id': record_id},
+                                  {'$set': {'state': 'completed', 'body': body,
+                                            'status': status}})
+            return
+        except PyMongoError as error:
+            if attempt == attempts:
+                logger.error('Storing the response of idempotency key %s failed: %s',
+                             record_id, error)
+                return
+            time.sleep(retry_delay * attempt)
+
+def idempotent(handler: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Makes a Flask-RESTx handler honour the Idempotency-Key header. Apply it above
+    marshal_with so the marshalled response is what gets stored. The application must
+    provide `idempotency_collection` and the IDEMPOTENCY_TTL_SECONDS and
+    IDEMPOTENCY_PENDING_TIMEOUT_SECONDS settings.
+    Args:
+        handler (Callable[..., Any]): The handler to wrap.
+    Returns:
+        Callable[..., Any]: The wrapped handler.
+    Raises:
+        werkzeug.exceptions.HTTPException: 400 for an invalid key, 409 while the first
+                                           request with the key is still running, and
+                                           422 when the key was used with another body.
+    """
+
+    @functools.wraps(handler)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        key: Optional[str] = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            return handler(*args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            abort(400, f'{IDEMPOTENCY_HEADER} must be 1 to {MAX_KEY_LENGTH} characters')
+
+        collection: Collection = current_app.idempotency_collection
+        record_id = f'{request.method} {request.path} {key}'
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        record = _claim(collection, record_id, fingerprint,
+                        current_app.config['IDEMPOTENCY_PENDING_TIMEOUT_SECONDS'])
+        if record is not None:
+            if record['fingerprint'] != fingerprint:
+                abort(422, f'{IDEMPOTENCY_HEADER} was already used with a different request')
+            if record['state'] == 'pending':
+                abort(409, 'A request with this idempotency key is still in progress')
+            return record['body'], record['status'], {REPLAYED_HEADER: 'true'}
+
+        try:
+            response = handler(*args, **kwargs)
+        except BaseException:
+            # Release the key so the client can retry after an error
+            collection.delete_one({'_id': record_id, 'state': 'pending'})
+            raise
+
+        body, status = (response[0], response[1]) if isinstance(response, tuple) else (response, 200)
+        _complete(collection, record_id, body, status)
+        return response
+
+    return wrapper
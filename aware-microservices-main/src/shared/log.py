@@ -0,0 +1,253 @@
+"""_summary_
+Structured logging of the services, written off the request path.
+
+configure_logging() routes the records of every logger of a process through a bounded
+in-memory queue to a background thread that formats and writes them to stdout. A request
+handler only formats the message of a record and queues it, so a log collector that
+pushes back on stdout slows the writer thread down rather than the requests. When the
+queue is full, records are dropped and counted in log_records_dropped_total on /metrics;
+warnings and errors are never dropped but wait for room instead.
+
+Each record is written as one JSON object with its time, level, logger, message, the
+service, the id of the request it was logged in ('X-Request-ID', taken from the request
+or generated and returned in the response) and the trace and span ids of the active
+span when tracing is enabled, plus the fields given in `extra`:
+
+    logger.info('Published %s event', routing_key, extra={'userId': user_id})
+
+LOG_FORMAT=text writes plain lines instead, for reading logs locally. High-volume
+messages can be sampled by logger with LOG_SAMPLING, comma separated 'logger=rate'
+pairs such as 'user_service_v2.app.events=0.01'; a rate applies to the logger and its
+children, and only to records below WARNING.
+
+Classes:
+    JsonFormatter: Formats records as JSON objects.
+    QueueingHandler: Queues records for the writer thread.
+    SamplingFilter: Keeps a fraction of the records of some loggers.
+Functions:
+    configure_logging(service_name, config): Sets up the logging of the process.
+    init_request_logging(app): Attaches a request id to the records of every request.
+    current_request_id() -> Optional[str]: The id of the request being served.
+    parse_sampling(spec) -> Dict[str, float]: Reads LOG_SAMPLING.
+Author:
+    @TheBarzani
+"""
+
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+from datetime import datetime, timezone
+from typing import Any, Dict, Mapping, Optional
+from flask import Flask, Response, g, request
+from shared.metrics import REGISTRY
+from shared.tracing import current_span
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+# Request ids taken from clients are kept short and printable
+REQUEST_ID_PATTERN = re.compile(r'^[\w.:-]{1,128}$')
+# The attributes of every LogRecord; any other attribute was passed in `extra`
+RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {'message', 'asctime',
+                                                                   'taskName'}
+QUIET_LOGGERS = ('pika',)
+
+RECORDS_DROPPED = REGISTRY.counter('log_records_dropped_total',
+                                   'Log records dropped because the log queue was full.')
+
+_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    'request_id', default=None)
+_listener: Optional[logging.handlers.QueueListener] = None
+
+def current_request_id() -> Optional[str]:
+    """
+    Returns:
+        Optional[str]: The id of the request being served, None outside of requests.
+    """
+    return _request_id.get()
+
+def parse_sampling(spec: Optional[str]) -> Dict[str, float]:
+    """
+    Reads the sample rates of LOG_SAMPLING.
+    Args:
+        spec (Optional[str]): Comma separated 'logger=rate' pairs, rates between 0 and 1.
+    Returns:
+        Dict[str, float]: The sample rate of every listed logger.
+    Raises:
+        ValueError: If a pair is malformed or a rate is out of range.
+    """
+    rates: Dict[str, float] = {}
+    for item in filter(None, (part.strip() for part in (spec or '').split(','))):
+        name, separator, rate = item.partition('=')
+        try:
+            value = float(rate)
+        except ValueError:
+            value = -1.0
+        if not separator or not name.strip() or not 0 <= value <= 1:
+            raise ValueError(f'Invalid LOG_SAMPLING entry: {item}')
+        rates[name.strip()] = value
+    return rates
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a fraction of the records below WARNING of the loggers given a sample rate,
+    and of their children.
+    """
+
+    def __init__(self, rates: Mapping[str, float]) -> None:
+        super().__init__()
+        self.rates = dict(rates)
+        self._resolved: Dict[str, float] = {}
+
+    def _rate(self, name: str) -> float:
+        rate = self._resolved.get(name)
+        if rate is None:
+            parent = name
+            while parent and parent not in self.rates:
+                parent = parent.rpartition('.')[0]
+            rate = self._resolved[name] = self.rates.get(parent, 1.0)
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+class QueueingHandler(logging.handlers.QueueHandler):
+    """
+    Queues records for the writer thread, with the request and trace ids of the
+    thread that logged them. Records below WARNING are dropped when the queue is full.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Merge the arguments now, as they may change once the handler returns
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        record.request_id = _request_id.get()
+        span = current_span()
+        record.trace_id = span.context.trace_id if span is not None else None
+        record.span_id = span.context.span_id if span is not None else None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if record.levelno >= logging.WARNING:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            RECORDS_DROPPED.inc()
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as JSON objects, one per line.
+    """
+
+    def __init__(self, service_name: str) -> None:
+        super().__init__()
+        self.service_name = service_name
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname, 'logger': record.name,
+            'message': record.getMessage(), 'service': self.service_name}
+        for key, name in (('request_id', 'requestId'), ('trace_id', 'traceId'),
+                          ('span_id', 'spanId')):
+            if getattr(record, key, None):
+                entry[name] = getattr(record, key)
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and key not in ('request_id', 'trace_id',
+                                                            'span_id'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+def configure_logging(service_name: str, config: Mapping[str, Any]) -> None:
+    """
+    Routes the records of every logger of the process through a queue to a writer
+    thread, replacing the previous setup if any.
+    Args:
+        service_name (str): The name of the service, added to every record.
+        config (Mapping[str, Any]): The Flask configuration of the service, with
+                                    LOG_LEVEL, LOG_FORMAT, LOG_QUEUE_SIZE and
+                                    LOG_SAMPLING.
+    Returns:
+        None
+    Raises:
+        ValueError: If LOG_FORMAT or LOG_SAMPLING is invalid.
+    """
+    global _listener  # pylint: disable=global-statement
+    if config['LOG_FORMAT'] not in ('json', 'text'):
+        raise ValueError("LOG_FORMAT must be 'json' or 'text'")
+    sampling = parse_sampling(config['LOG_SAMPLING'])
+
+    writer = logging.StreamHandler(sys.stdout)
+    writer.setFormatter(JsonFormatter(service_name) if config['LOG_FORMAT'] == 'json' else
+                        logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    records: 'queue.Queue[logging.LogRecord]' = queue.Queue(config['LOG_QUEUE_SIZE'])
+    handler = QueueingHandler(records)
+    if sampling:
+        handler.addFilter(SamplingFilter(sampling))
+
+    root = logging.getLogger()
+    if _listener is not None:
+        _listener.stop()
+    for previous in [h for h in root.handlers if isinstance(h, QueueingHandler)]:
+        root.removeHandler(previous)
+    root.addHandler(handler)
+    root.setLevel(config['LOG_LEVEL'].upper())
+    for name in QUIET_LOGGERS:
+        logging.getLogger(name).setLevel(logging.WARNING)
+    _listener = logging.handlers.QueueListener(records, writer)
+    _listener.start()
+
+def _stop_listener() -> None:
+    # Write the records still queued when the process exits
+    if _listener is not None:
+        _listener.stop()
+
+atexit.register(_stop_listener)
+
+def init_request_logging(app: Flask) -> None:
+    """
+    Attaches an id to the records logged while serving each request: the X-Request-ID
+    header of the request when it is valid, or a new id. The id is returned in the
+    X-Request-ID header of the response.
+    Args:
+        app (Flask): The application.
+    Returns:
+        None
+    """
+
+    @app.before_request
+    def start_request_id() -> None:
+        request_id = request.headers.get(REQUEST_ID_HEADER)
+        if request_id is None or not REQUEST_ID_PATTERN.match(request_id):
+            request_id = os.urandom(8).hex()
+        g.request_id = (request_id, _request_id.set(request_id))
+
+    @app.after_request
+    def return_request_id(response: Response) -> Response:
+        request_id, _ = g.get('request_id', (None, None))
+        if request_id is not None:
+            response.headers[REQUEST_ID_HEADER] = request_id
+        return response
+
+    @app.teardown_request
+    def end_request_id(_error: Optional[BaseException]) -> None:
+        _, token = g.pop('request_id', (None, None))
+        if token is not None:
+            _request_id.reset(token)
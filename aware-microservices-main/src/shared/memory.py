@@ -0,0 +1,263 @@
+"""_summary_
+Opt-in memory diagnostics of the service workers.
+
+A worker that builds a large response holds the documents and their marshalled copy at
+once, and the allocator rarely returns that memory to the system, so the resident size
+(RSS) of the worker grows to its largest response. Two settings help attribute and bound
+that growth:
+
+- MEMORY_DIAGNOSTICS traces Python allocations with tracemalloc, keeping
+  MEMORY_TRACE_FRAMES frames of each, and records the peak allocation of every request
+  by route, on /metrics and at GET /admin/memory. That endpoint also lists the top
+  allocation sites of the live memory. Tracing slows allocations down by a factor of
+  two or more, so it is meant for diagnosis, not for production traffic. The peak of a
+  request is only recorded when no other request ran alongside it, as tracemalloc
+  keeps one peak per process; the endpoint reports how many requests were sampled.
+- MEMORY_RSS_LIMIT_MB is a watermark on the RSS of the worker, checked after requests
+  at most once a second. Once it is crossed, a gunicorn worker asks itself to shut down
+  gracefully with SIGTERM: it finishes its requests and gunicorn starts a fresh worker.
+  Other servers only log the crossing.
+
+GET /admin/memory is served by the services directly and not routed by the gateway.
+Run experiments/benchmark_memory.py against an order service with MEMORY_DIAGNOSTICS on
+to follow the peak allocation of GET /orders/.
+
+Classes:
+    AllocationTracker: Peak allocation of the requests of every route.
+    MemoryMiddleware: WSGI middleware measuring requests and watching the RSS.
+Functions:
+    resident_memory() -> Optional[int]: The RSS of the process.
+    top_allocations(limit, group_by) -> List[Dict[str, Any]]: The top allocation sites.
+    init_memory_diagnostics(app): Installs the diagnostics configured for the service.
+Author:
+    @TheBarzani
+"""
+
+import logging
+import os
+import signal
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from flask import Flask, request
+from shared.metrics import REGISTRY, RULE_ENVIRON_KEY, MetricFamily
+
+RSS_CHECK_SECONDS = 1.0
+GROUP_BY = ('lineno', 'filename', 'traceback')
+PEAK_BUCKETS = tuple(float(2 ** power) for power in range(16, 31, 2))  # 64 KiB to 1 GiB
+
+logger = logging.getLogger(__name__)
+
+PEAK_ALLOCATION = REGISTRY.histogram('http_request_peak_allocation_bytes',
+                                     'Peak Python allocation of the HTTP requests served '
+                                     'alone, while MEMORY_DIAGNOSTICS is on.',
+                                     ('method', 'route'), PEAK_BUCKETS)
+
+def resident_memory() -> Optional[int]:
+    """
+    Returns:
+        Optional[int]: The resident set size of the process in bytes, or None where
+                       /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm', encoding='ascii') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+def top_allocations(limit: int = 20, group_by: str = 'lineno') -> List[Dict[str, Any]]:
+    """
+    Lists the sites holding the most live memory, from a tracemalloc snapshot.
+    Args:
+        limit (int): The number of sites.
+        group_by (str): 'lineno', 'filename' or 'traceback'.
+    Returns:
+        List[Dict[str, Any]]: The site, its size in bytes and number of blocks, largest
+                              first; empty while tracemalloc is off.
+    """
+    if not tracemalloc.is_tracing():
+        return []
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>')))
+    return [{'site': ' < '.join(f'{frame.filename}:{frame.lineno}'
+                                for frame in statistic.traceback),
+             'sizeBytes': statistic.size, 'count': statistic.count}
+            for statistic in snapshot.statistics(group_by)[:limit]]
+
+class AllocationTracker:
+    """
+    Records the peak allocation of the requests of every route. Since tracemalloc keeps
+    a single peak per process, only the requests that no other request overlapped are
+    measured.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._started = 0
+        self._routes: Dict[Tuple[str, str], Dict[str, int]] = {}
+
+    def start(self) -> Tuple[int, int, bool]:
+        """
+        Starts measuring a request.
+        Returns:
+            Tuple[int, int, bool]: The token to pass to finish().
+        """
+        with self._lock:
+            self._in_flight += 1
+            self._started += 1
+            alone = self._in_flight == 1
+            if alone:
+                tracemalloc.reset_peak()
+            return self._started, tracemalloc.get_traced_memory()[0], alone
+
+    def finish(self, token: Tuple[int, int, bool], method: str, route: str) -> None:
+        """
+        Records the peak allocation of a request above its starting allocation, if no
+        other request started while it ran.
+        """
+        started, traced, alone = token
+        with self._lock:
+            self._in_flight -= 1
+            stats = self._routes.setdefault((method, route), {
+                'requests': 0, 'sampled': 0, 'peakBytes': 0, 'lastPeakBytes': 0,
+                'totalPeakBytes': 0})
+            stats['requests'] += 1
+            if not alone or started != self._started:
+                return
+            peak = max(tracemalloc.get_traced_memory()[1] - traced, 0)
+            stats['sampled'] += 1
+            stats['peakBytes'] = max(stats['peakBytes'], peak)
+            stats['lastPeakBytes'] = peak
+            stats['totalPeakBytes'] += peak
+        PEAK_ALLOCATION.observe(peak, method, route)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Returns:
+            Dict[str, Dict[str, int]]: For every route, such as 'GET /orders/', the
+                                       number of requests, of measured requests, and the
+                                       largest, last and mean peak allocation in bytes.
+        """
+        with self._lock:
+            return {f'{method} {route}': {
+                        'requests': stats['requests'], 'sampled': stats['sampled'],
+                        'peakBytes': stats['peakBytes'],
+                        'lastPeakBytes': stats['lastPeakBytes'],
+                        'meanPeakBytes': stats['totalPeakBytes'] // max(stats['sampled'], 1)}
+                    for (method, route), stats in self._routes.items()}
+
+class MemoryMiddleware:
+    """
+    WSGI middleware measuring the peak allocation of requests while tracemalloc traces,
+    and recycling a gunicorn worker whose RSS crossed the watermark.
+    """
+
+    def __init__(self, wsgi_app: Callable[..., Iterable[bytes]],
+                 tracker: Optional[AllocationTracker], rss_limit: int) -> None:
+        """
+        Args:
+            wsgi_app (Callable[..., Iterable[bytes]]): The application.
+            tracker (Optional[AllocationTracker]): The tracker of the requests, None to
+                                                   measure none.
+            rss_limit (int): The RSS watermark in bytes, 0 for none.
+        """
+        self.wsgi_app = wsgi_app
+        self.tracker = tracker
+        self.rss_limit = rss_limit
+        self.recycling = False
+        self._next_check = 0.0
+
+    def __call__(self, environ: Dict[str, Any],
+                 start_response: Callable[..., Any]) -> Iterable[bytes]:
+        if self.tracker is None:
+            body = self.wsgi_app(environ, start_response)
+        else:
+            token = self.tracker.start()
+            try:
+                body = self.wsgi_app(environ, start_response)
+            finally:
+                rule = environ.get(RULE_ENVIRON_KEY)
+                self.tracker.finish(token, environ['REQUEST_METHOD'],
+                                    rule.rule if rule is not None else 'unmatched')
+        if self.rss_limit and time.monotonic() >= self._next_check:
+            self._next_check = time.monotonic() + RSS_CHECK_SECONDS
+            self.check_rss(environ.get('SERVER_SOFTWARE', ''))
+        return body
+
+    def check_rss(self, server_software: str) -> None:
+        """
+        Recycles the worker once its RSS is above the watermark: a gunicorn worker is
+        sent SIGTERM, which it handles by finishing its requests and exiting.
+        Args:
+            server_software (str): The SERVER_SOFTWARE of the WSGI environ.
+        Returns:
+            None
+        """
+        rss = resident_memory()
+        if self.recycling or rss is None or rss <= self.rss_limit:
+            return
+        if not server_software.startswith('gunicorn'):
+            logger.warning('Worker %d RSS of %d MiB is above the %d MiB watermark',
+                           os.getpid(), rss >> 20, self.rss_limit >> 20)
+            self._next_check = time.monotonic() + 60
+            return
+        self.recycling = True
+        logger.warning('Worker %d RSS of %d MiB is above the %d MiB watermark; recycling it',
+                       os.getpid(), rss >> 20, self.rss_limit >> 20)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+def collect_memory_metrics() -> List[MetricFamily]:
+    """
+    Returns:
+        List[MetricFamily]: The RSS of the process, and the traced Python allocation
+                            while tracemalloc is on.
+    """
+    families = []
+    rss = resident_memory()
+    if rss is not None:
+        resident = MetricFamily('process_resident_memory_bytes', 'Resident memory size.',
+                                'gauge')
+        resident.add({}, rss)
+        families.append(resident)
+    if tracemalloc.is_tracing():
+        traced = MetricFamily('python_traced_memory_bytes',
+                              'Python memory allocated, as traced by tracemalloc.', 'gauge')
+        traced.add({}, tracemalloc.get_traced_memory()[0])
+        families.append(traced)
+    return families
+
+def init_memory_diagnostics(app: Flask) -> None:
+    """
+    Installs the memory diagnostics configured for the service: the RSS on /metrics,
+    and when enabled, allocation tracing with GET /admin/memory, and the RSS watermark.
+    Args:
+        app (Flask): The application.
+    Returns:
+        None
+    """
+    REGISTRY.register_collector('memory', collect_memory_metrics)
+    rss_limit = app.config['MEMORY_RSS_LIMIT_MB'] * 1024 * 1024
+    tracker = None
+    if app.config['MEMORY_DIAGNOSTICS']:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(app.config['MEMORY_TRACE_FRAMES'])
+        tracker = AllocationTracker()
+
+        def memory() -> Any:
+            group_by = request.args.get('groupBy', 'lineno')
+            if group_by not in GROUP_BY:
+                return {'message': f"groupBy must be one of {', '.join(GROUP_BY)}"}, 400
+            limit = max(request.args.get('limit', 20, type=int), 0)
+            traced, peak = tracemalloc.get_traced_memory()
+            return {'rssBytes': resident_memory(), 'rssLimitBytes': rss_limit or None,
+                    'tracedBytes': traced, 'tracedPeakBytes': peak,
+                    'routes': tracker.stats(),
+                    'topAllocations': top_allocations(limit, group_by)}
+
+        app.add_url_rule('/admin/memory', 'memory', memory)
+    if tracker is not None or rss_limit:
+        app.wsgi_app = MemoryMiddleware(app.wsgi_app, tracker, rss_limit)  # type: ignore
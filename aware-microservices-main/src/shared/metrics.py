@@ -0,0 +1,401 @@
+"""_summary_
+Prometheus metrics of the services.
+
+Every service serves GET /metrics in the Prometheus text exposition format, set up by
+init_metrics(). The metrics live in the process-wide REGISTRY:
+
+    http_request_duration_seconds{method, route, status}: Latency of the HTTP requests,
+        by route template, so /users/<id> is one series however many users there are.
+    http_requests_in_flight: Requests being served, including open event streams.
+    mongodb_command_duration_seconds{command, outcome}: Latency of the MongoDB commands,
+        recorded by the command listener that shared.mongo.create_mongo_client installs.
+    amqp_publish_duration_seconds{routing_key}: Latency of publishing a user update event.
+
+Modules add their own metrics to the registry, such as the counters of the order service
+consumers, and collectors that read the state they already keep, such as the single-flight
+counters, when /metrics is served.
+
+Recording is kept cheap enough for the request path: a labelled series is looked up once
+in a dict and updated under a lock, which costs well under a microsecond, and requests
+are timed by a WSGI middleware with a single Flask request hook, as each hook costs about
+a microsecond; see experiments/benchmark_metrics.py. Each process keeps its own metrics,
+so with several gunicorn workers a scrape reports the worker that answers it.
+
+Classes:
+    Counter, Gauge, Histogram: Labelled metrics.
+    MetricFamily: The samples of one metric, as rendered on /metrics.
+    Registry: The metrics and collectors of a process.
+    MetricsMiddleware: Records the latency of the HTTP requests.
+    MongoMetricsListener: Records the latency of MongoDB commands.
+Functions:
+    init_metrics(app): Records request metrics and serves GET /metrics.
+Author:
+    @TheBarzani
+"""
+
+import bisect
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Sequence, Tuple
+from flask import Flask, Response, request
+from pymongo import monitoring
+
+# Upper bounds of the latency buckets, in seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+RULE_ENVIRON_KEY = 'metrics.url_rule'
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class MetricFamily:
+    """
+    The samples of one metric, as rendered on /metrics.
+    """
+
+    def __init__(self, name: str, documentation: str, metric_type: str) -> None:
+        """
+        Args:
+            name (str): The name of the metric.
+            documentation (str): The HELP text.
+            metric_type (str): 'counter', 'gauge' or 'histogram'.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.type = metric_type
+        self.samples: List[Tuple[str, Dict[str, str], float]] = []
+
+    def add(self, labels: Dict[str, str], value: float, suffix: str = '') -> None:
+        """
+        Adds a sample, named after the metric followed by the suffix, such as '_bucket'.
+        """
+        self.samples.append((self.name + suffix, labels, value))
+
+    def add_histogram(self, labels: Dict[str, str], buckets: Sequence[Tuple[float, int]],
+                      total: float) -> None:
+        """
+        Adds the samples of one histogram series.
+        Args:
+            labels (Dict[str, str]): The labels of the series.
+            buckets (Sequence[Tuple[float, int]]): The cumulative count of every bucket by
+                                                   upper bound, ending with infinity.
+            total (float): The sum of the observed values.
+        """
+        for bound, count in buckets:
+            self.add({**labels, 'le': _format_value(bound)}, count, '_bucket')
+        self.add(labels, total, '_sum')
+        self.add(labels, buckets[-1][1] if buckets else 0, '_count')
+
+    def render(self) -> str:
+        """
+        Returns:
+            str: The family in the Prometheus text format.
+        """
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for name, labels, value in self.samples:
+            if labels:
+                label_text = ','.join(f'{key}="{_escape(str(label))}"'
+                                      for key, label in labels.items())
+                lines.append(f'{name}{{{label_text}}} {_format_value(value)}')
+            else:
+                lines.append(f'{name} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+class _Metric:
+    type = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def _new_series(self) -> List[float]:
+        return [0.0]
+
+    def _get(self, labels: Tuple[str, ...]) -> List[float]:
+        series = self._series.get(labels)
+        if series is None:
+            if len(labels) != len(self.labelnames):
+                raise ValueError(f'{self.name} expects labels {self.labelnames}')
+            with self._lock:
+                series = self._series.setdefault(labels, self._new_series())
+        return series
+
+    def collect(self) -> MetricFamily:
+        """
+        Returns:
+            MetricFamily: The current samples of the metric.
+        """
+        family = MetricFamily(self.name, self.documentation, self.type)
+        with self._lock:
+            for labels, series in self._series.items():
+                family.add(dict(zip(self.labelnames, labels)), series[0])
+        return family
+
+class Counter(_Metric):
+    """
+    A value that only goes up, such as a number of events.
+    """
+    type = 'counter'
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        """
+        Adds to the series of the label values.
+        """
+        series = self._get(labels)
+        with self._lock:
+            series[0] += amount
+
+class Gauge(_Metric):
+    """
+    A value that goes up and down, such as a number of requests in flight.
+    """
+    type = 'gauge'
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        """
+        Adds to the series of the label values.
+        """
+        series = self._get(labels)
+        with self._lock:
+            series[0] += amount
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        """
+        Subtracts from the series of the label values.
+        """
+        series = self._get(labels)
+        with self._lock:
+            series[0] -= amount
+
+    def set(self, value: float, *labels: str) -> None:
+        """
+        Sets the series of the label values.
+        """
+        series = self._get(labels)
+        with self._lock:
+            series[0] = value
+
+class Histogram(_Metric):
+    """
+    The distribution of a value, such as a latency, in cumulative buckets.
+    """
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS) -> None:
+        """
+        Args:
+            name (str): The name of the metric.
+            documentation (str): The HELP text.
+            labelnames (Sequence[str]): The names of the labels.
+            buckets (Sequence[float]): The increasing upper bounds of the buckets.
+        """
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_series(self) -> List[float]:
+        # One count per bucket and the overflow bucket, then the sum
+        return [0.0] * (len(self.buckets) + 2)
+
+    def observe(self, value: float, *labels: str) -> None:
+        """
+        Records a value in the series of the label values.
+        """
+        series = self._get(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series[index] += 1
+            series[-1] += value
+
+    def collect(self) -> MetricFamily:
+        family = MetricFamily(self.name, self.documentation, self.type)
+        bounds = (*self.buckets, float('inf'))
+        with self._lock:
+            for labels, series in self._series.items():
+                cumulative, buckets = 0.0, []
+                for bound, count in zip(bounds, series):
+                    cumulative += count
+                    buckets.append((bound, cumulative))
+                family.add_histogram(dict(zip(self.labelnames, labels)), buckets, series[-1])
+        return family
+
+class Registry:
+    """
+    The metrics and collectors of a process.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: Dict[str, Callable[[], Iterable[MetricFamily]]] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.setdefault(metric.name, metric)
+        if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+            raise ValueError(f'Metric {metric.name} is already registered differently')
+        return existing
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        """
+        Returns:
+            Counter: The counter of that name, created on the first call.
+        """
+        return self._register(Counter(name, documentation, labelnames))  # type: ignore
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        """
+        Returns:
+            Gauge: The gauge of that name, created on the first call.
+        """
+        return self._register(Gauge(name, documentation, labelnames))  # type: ignore
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        """
+        Returns:
+            Histogram: The histogram of that name, created on the first call.
+        """
+        return self._register(Histogram(name, documentation, labelnames,  # type: ignore
+                                        buckets))
+
+    def register_collector(self, name: str,
+                           collector: Callable[[], Iterable[MetricFamily]]) -> None:
+        """
+        Adds a function called on every scrape for metrics of state kept elsewhere. A
+        collector registered again under the same name replaces the previous one.
+        """
+        with self._lock:
+            self._collectors[name] = collector
+
+    def render(self) -> str:
+        """
+        Returns:
+            str: Every metric in the Prometheus text format.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors.values())
+        families = [metric.collect() for metric in metrics]
+        for collector in collectors:
+            families.extend(collector())
+        return ''.join(family.render() for family in families)
+
+REGISTRY = Registry()
+
+MONGO_COMMAND_DURATION = REGISTRY.histogram('mongodb_command_duration_seconds',
+                                            'Latency of the MongoDB commands.',
+                                            ('command', 'outcome'))
+AMQP_PUBLISH_DURATION = REGISTRY.histogram('amqp_publish_duration_seconds',
+                                           'Latency of publishing an event to RabbitMQ.',
+                                           ('routing_key',))
+
+class _RecordOnClose:
+    """
+    A response body that records the request when the server closes it.
+    """
+    __slots__ = ('body', 'record')
+
+    def __init__(self, body: Iterable[bytes], record: Callable[[], None]) -> None:
+        self.body = body
+        self.record = record
+
+    def __iter__(self) -> Iterator[bytes]:
+        return iter(self.body)
+
+    def close(self) -> None:
+        """
+        Closes the wrapped body and records the request.
+        """
+        try:
+            close = getattr(self.body, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            self.record()
+
+class MetricsMiddleware:
+    """
+    WSGI middleware recording the latency, route template and status of every request.
+    It runs outside of Flask, around the whole request, which costs less than request
+    hooks; init_metrics() leaves the matched URL rule in the environ for it.
+    """
+
+    def __init__(self, wsgi_app: Callable[..., Iterable[bytes]], duration: Histogram,
+                 in_flight: Gauge) -> None:
+        self.wsgi_app = wsgi_app
+        self.duration = duration
+        self.in_flight = in_flight
+
+    def __call__(self, environ: Dict[str, Any],
+                 start_response: Callable[..., Any]) -> Iterable[bytes]:
+        started = time.perf_counter()
+        status = ['500']
+
+        def capture_status(status_line: str, headers: Any, exc_info: Any = None) -> Any:
+            status[0] = status_line[:3]
+            return start_response(status_line, headers, exc_info)
+
+        def record() -> None:
+            self.in_flight.dec()
+            rule = environ.get(RULE_ENVIRON_KEY)
+            self.duration.observe(time.perf_counter() - started, environ['REQUEST_METHOD'],
+                                  rule.rule if rule is not None else 'unmatched', status[0])
+
+        self.in_flight.inc()
+        try:
+            body = self.wsgi_app(environ, capture_status)
+        except BaseException:
+            record()
+            raise
+        # Streamed responses, such as the order event stream, end when they are closed
+        return _RecordOnClose(body, record)
+
+def init_metrics(app: Flask, registry: Registry = REGISTRY) -> None:
+    """
+    Records the latency of every request of the application and serves GET /metrics.
+    Args:
+        app (Flask): The application.
+        registry (Registry): The registry served on /metrics.
+    Returns:
+        None
+    """
+
+    duration = registry.histogram('http_request_duration_seconds',
+                                  'Latency of the HTTP requests.', ('method', 'route', 'status'))
+    in_flight = registry.gauge('http_requests_in_flight', 'HTTP requests being served.')
+    app.wsgi_app = MetricsMiddleware(app.wsgi_app, duration, in_flight)  # type: ignore
+
+    @app.before_request
+    def record_rule() -> None:
+        request.environ[RULE_ENVIRON_KEY] = request.url_rule
+
+    def metrics() -> Response:
+        return Response(registry.render(), content_type=CONTENT_TYPE)
+
+    app.add_url_rule('/metrics', 'metrics', metrics)
+
+class MongoMetricsListener(monitoring.CommandListener):
+    """
+    Records the latency and outcome of every MongoDB command.
+    """
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        pass
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        MONGO_COMMAND_DURATION.observe(event.duration_micros / 1e6, event.command_name,
+                                       'success')
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        MONGO_COMMAND_DURATION.observe(event.duration_micros / 1e6, event.command_name,
+                                       'failure')
@@ -0,0 +1,126 @@
+"""_summary_
+MongoDB client construction shared by the services.
+
+Each service builds its client from its Config, which sets the connection pool size,
+the timeouts and the read preference of the read-only endpoints:
+
+    MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE: Connections per server, per worker.
+    MONGO_CONNECT_TIMEOUT_MS, MONGO_SOCKET_TIMEOUT_MS, MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    MONGO_WAIT_QUEUE_TIMEOUT_MS: The timeouts of the client; 0 leaves the driver default.
+    MONGO_READ_PREFERENCE: The read preference of the read-only endpoints.
+    MONGO_MAX_STALENESS_SECONDS: How far behind the primary a secondary may be to serve
+        those reads, -1 for no bound. MongoDB requires at least 90 seconds.
+
+The client itself reads from the primary. Read-only endpoints, such as GET /users/<id>
+and GET /orders, read through the collections returned by read_collection(), which apply
+MONGO_READ_PREFERENCE, so with 'secondaryPreferred' their traffic moves to the
+secondaries of a replica set while writes, and handlers that read what they just wrote,
+stay on the primary. Such reads may miss the latest writes by up to the replication lag.
+Against a standalone server every read preference reads from that server.
+
+The client records the latency of its commands in the metrics of the service (see
+shared.metrics), counts them into the request or event that issued them and explains
+the slow ones (see shared.round_trips) and, when tracing is enabled (see
+shared.tracing), records them as spans. It also reports how long its connection
+checkouts wait to admission control (see shared.admission).
+
+Functions:
+    create_mongo_client(config) -> MongoClient: Builds the client of a service.
+    read_collection(collection, config) -> Collection: The collection of read-only
+        endpoints.
+Author:
+    @TheBarzani
+"""
+
+from typing import Any, Dict, List, Mapping
+from pymongo import MongoClient, monitoring
+from pymongo.collection import Collection
+from pymongo.read_preferences import (Nearest, Primary, PrimaryPreferred, Secondary,
+                                      SecondaryPreferred, _ServerMode)
+from shared.admission import POOL_WAIT
+from shared.metrics import MongoMetricsListener
+from shared.round_trips import RoundTripListener
+from shared.tracing import MongoSpanListener, get_tracer
+
+READ_PREFERENCES = {
+    'primary': Primary,
+    'primaryPreferred': PrimaryPreferred,
+    'secondary': Secondary,
+    'secondaryPreferred': SecondaryPreferred,
+    'nearest': Nearest,
+}
+MIN_MAX_STALENESS_SECONDS = 90
+
+def client_options(config: Mapping[str, Any]) -> Dict[str, Any]:
+    """
+    Translates the MONGO_* settings of a service into MongoClient options.
+    Args:
+        config (Mapping[str, Any]): The Flask configuration of the service.
+    Returns:
+        Dict[str, Any]: The keyword arguments of MongoClient.
+    """
+    options: Dict[str, Any] = {'maxPoolSize': config['MONGO_MAX_POOL_SIZE'],
+                               'minPoolSize': config['MONGO_MIN_POOL_SIZE']}
+    for setting, option in (('MONGO_CONNECT_TIMEOUT_MS', 'connectTimeoutMS'),
+                            ('MONGO_SOCKET_TIMEOUT_MS', 'socketTimeoutMS'),
+                            ('MONGO_SERVER_SELECTION_TIMEOUT_MS', 'serverSelectionTimeoutMS'),
+                            ('MONGO_WAIT_QUEUE_TIMEOUT_MS', 'waitQueueTimeoutMS')):
+        if config[setting]:
+            options[option] = config[setting]
+    return options
+
+def read_preference(config: Mapping[str, Any]) -> _ServerMode:
+    """
+    Builds the read preference of the read-only endpoints.
+    Args:
+        config (Mapping[str, Any]): The Flask configuration of the service.
+    Returns:
+        _ServerMode: The read preference.
+    Raises:
+        ValueError: If the mode is unknown or the staleness bound is below 90 seconds.
+    """
+    mode: str = config['MONGO_READ_PREFERENCE']
+    if mode not in READ_PREFERENCES:
+        raise ValueError(f'Unknown MONGO_READ_PREFERENCE: {mode}')
+    if mode == 'primary':
+        return Primary()
+    max_staleness: int = config['MONGO_MAX_STALENESS_SECONDS']
+    if max_staleness != -1 and max_staleness < MIN_MAX_STALENESS_SECONDS:
+        raise ValueError(f'MONGO_MAX_STALENESS_SECONDS must be -1 or at least '
+                         f'{MIN_MAX_STALENESS_SECONDS}')
+    return READ_PREFERENCES[mode](max_staleness=max_staleness)
+
+def create_mongo_client(config: Mapping[str, Any]) -> MongoClient:
+    """
+    Builds the client of a service, with its pool and timeout settings. The client
+    reads from the primary; see read_collection() for the read-only endpoints.
+    Args:
+        config (Mapping[str, Any]): The Flask configuration of the service.
+    Returns:
+        MongoClient: The client.
+    Raises:
+        ValueError: If the read preference settings are invalid.
+    """
+    # Fail at startup rather than on the first read
+    read_preference(config)
+    round_trips = RoundTripListener(config['MONGO_SLOW_QUERY_MS'])
+    listeners: List[monitoring.CommandListener] = [MongoMetricsListener(), round_trips]
+    if get_tracer().enabled:
+        listeners.append(MongoSpanListener())
+    client: MongoClient = MongoClient(config['MONGO_URI'],
+                                      event_listeners=[*listeners, POOL_WAIT],
+                                      **client_options(config))
+    round_trips.attach(client)
+    return client
+
+def read_collection(collection: Collection, config: Mapping[str, Any]) -> Collection:
+    """
+    Returns the collection to use in read-only endpoints, with the configured read
+    preference.
+    Args:
+        collection (Collection): The collection, reading from the primary.
+        config (Mapping[str, Any]): The Flask configuration of the service.
+    Returns:
+        Collection: The same collection with MONGO_READ_PREFERENCE applied.
+    """
+    return collection.with_options(read_preference=read_preference(config))
@@ -0,0 +1,312 @@
+"""_summary_
+On-demand CPU profiling of live requests and consumed events.
+
+Profiling is off unless PROFILE_DIR names a directory to write profiles to. It then
+profiles requests and events in two ways:
+
+- Triggered: a request carrying the header 'X-Profile: <PROFILE_TOKEN>' is profiled with
+  cProfile, and its statistics are written to its own '.pstats' file, named in the
+  'X-Profile-File' response header. Open it with `python -m pstats <file>` or snakeviz.
+  Without PROFILE_TOKEN no request can trigger a profile.
+- Sampled: a PROFILE_SAMPLE_RATE fraction of the requests and consumed events is
+  profiled by a sampling thread, which reads the stack of their threads every
+  PROFILE_SAMPLE_INTERVAL_MS, or every GIL switch interval (5 ms) while they hold the
+  GIL. The threads are never interrupted, so sampling costs little and can run
+  continuously. Stacks are aggregated under the route template, such as
+  'GET /orders/', or the consumer scope and written every PROFILE_FLUSH_SECONDS to a
+  '.collapsed' file, one 'frame;frame;frame count' line per stack, which flamegraph.pl
+  and speedscope read.
+
+Only the application is profiled, up to the moment it returns the response: the body of
+a streamed response, such as GET /orders/stream, is not. cProfile profiles the thread
+that enables it; on Python 3.12 and later only one cProfile may run per process, so a
+request triggered while another is being profiled is served unprofiled.
+
+Classes:
+    Profiler: Profiles requests and events of a process.
+    ProfilingMiddleware: WSGI middleware profiling triggered and sampled requests.
+Functions:
+    configure_profiling(service_name, config) -> Profiler: Sets up the profiler.
+    get_profiler() -> Profiler: Returns the profiler of the process.
+    init_profiling(app): Profiles the requests of an application when enabled.
+Author:
+    @TheBarzani
+"""
+
+import collections
+import cProfile
+import hmac
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from types import FrameType
+from typing import Any, Callable, Counter, Dict, Iterable, Mapping, Optional
+from flask import Flask
+from shared.metrics import RULE_ENVIRON_KEY
+
+PROFILE_FILE_HEADER = 'X-Profile-File'
+PROFILE_FLUSH_SECONDS = 60.0
+
+logger = logging.getLogger(__name__)
+
+class _Sampling:
+    def __init__(self, root: Optional[FrameType]) -> None:
+        # The frame that started the profile; the frames below it are not recorded
+        self.root = root
+        self.stacks: Counter[str] = collections.Counter()
+
+class Profiler:
+    """
+    Profiles the requests and events of a process, either entirely with cProfile or by
+    sampling their stacks from a background thread.
+    """
+
+    def __init__(self, service_name: str, directory: Optional[str] = None,
+                 token: Optional[str] = None, sample_rate: float = 0.0,
+                 interval_ms: float = 10.0,
+                 flush_seconds: float = PROFILE_FLUSH_SECONDS) -> None:
+        """
+        Args:
+            service_name (str): The name of the service, which prefixes the files.
+            directory (Optional[str]): Where profiles are written; None disables profiling.
+            token (Optional[str]): The value of the X-Profile header that triggers a
+                                   cProfile of a request; None to trigger none.
+            sample_rate (float): The fraction of requests and events sampled, 0 to 1.
+            interval_ms (float): Milliseconds between two stack samples.
+            flush_seconds (float): Seconds between two writes of the sampled stacks.
+        """
+        self.service_name = service_name
+        self.directory = directory
+        self.token = token
+        self.sample_rate = sample_rate if directory else 0.0
+        self.interval = interval_ms / 1000
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._sampling: Dict[int, _Sampling] = {}
+        self._stacks: Counter[str] = collections.Counter()
+        self._active = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._sequence = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        """
+        Returns:
+            bool: Whether profiles are written.
+        """
+        return self.directory is not None
+
+    def is_triggered(self, header: Optional[str]) -> bool:
+        """
+        Returns:
+            bool: Whether the X-Profile header of a request carries the token.
+        """
+        return bool(self.enabled and self.token and header
+                    and hmac.compare_digest(header.encode(), self.token.encode()))
+
+    def should_sample(self) -> bool:
+        """
+        Returns:
+            bool: Whether to sample the next request or event, at the sample rate.
+        """
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def pstats_path(self, name: str) -> str:
+        """
+        Returns:
+            str: A new path for the cProfile statistics of a request or event.
+        """
+        with self._lock:
+            self._sequence += 1
+            sequence = self._sequence
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', name).strip('_')[:80] or 'root'
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+        return os.path.join(self.directory or '', f'{self.service_name}-{slug}-{stamp}-'
+                                                  f'{os.getpid()}-{sequence}.pstats')
+
+    def start_sampling(self, root: Optional[FrameType] = None) -> None:
+        """
+        Starts sampling the stack of the current thread, from the given frame up.
+        """
+        with self._lock:
+            self._sampling[threading.get_ident()] = _Sampling(root)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self._active.set()
+
+    def stop_sampling(self, scope: str) -> None:
+        """
+        Stops sampling the current thread and adds its stacks to those of the scope.
+        """
+        with self._lock:
+            sampling = self._sampling.pop(threading.get_ident(), None)
+            if sampling is None:
+                return
+            for stack, count in sampling.stacks.items():
+                self._stacks[f'{scope};{stack}' if stack else scope] += count
+            if not self._sampling:
+                self._active.clear()
+
+    def profile(self, scope: str) -> 'ProfileBlock':
+        """
+        Returns:
+            ProfileBlock: A context manager sampling the block at the sample rate, such
+                          as a consumer callback, under the scope.
+        """
+        return ProfileBlock(self, scope)
+
+    def _sample(self) -> None:
+        frames = sys._current_frames()  # pylint: disable=protected-access
+        with self._lock:
+            for thread_id, sampling in self._sampling.items():
+                frame = frames.get(thread_id)
+                names = []
+                while frame is not None and frame is not sampling.root:
+                    names.append(f"{frame.f_globals.get('__name__', '?')}:"
+                                 f"{frame.f_code.co_name}")
+                    frame = frame.f_back
+                sampling.stacks[';'.join(reversed(names))] += 1
+
+    def flush(self) -> Optional[str]:
+        """
+        Writes the stacks sampled since the last flush to a new '.collapsed' file.
+        Returns:
+            Optional[str]: The path of the file, or None when nothing was sampled.
+        """
+        with self._lock:
+            stacks, self._stacks = self._stacks, collections.Counter()
+        if not stacks:
+            return None
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+        path = os.path.join(self.directory or '',
+                            f'{self.service_name}-{stamp}-{os.getpid()}.collapsed')
+        with open(path, 'a', encoding='utf-8') as collapsed:
+            collapsed.writelines(f'{stack} {count}\n' for stack, count in stacks.items())
+        return path
+
+    def _run(self) -> None:
+        flush_at = time.monotonic() + self.flush_seconds
+        while True:
+            # Sleep until a thread is sampled or the sampled stacks are due
+            if self._active.wait(max(flush_at - time.monotonic(), 0)):
+                time.sleep(self.interval)
+                self._sample()
+            if time.monotonic() >= flush_at:
+                try:
+                    self.flush()
+                except OSError as error:
+                    logger.warning('Writing sampled stacks failed: %s', error)
+                flush_at = time.monotonic() + self.flush_seconds
+
+class ProfileBlock:
+    """
+    Samples a block of code, at the sample rate of a profiler, under a scope.
+    """
+
+    def __init__(self, profiler: Profiler, scope: str) -> None:
+        self.profiler = profiler
+        self.scope = scope
+        self.sampled = False
+
+    def __enter__(self) -> 'ProfileBlock':
+        self.sampled = self.profiler.should_sample()
+        if self.sampled:
+            self.profiler.start_sampling(sys._getframe(1))  # pylint: disable=protected-access
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        if self.sampled:
+            self.profiler.stop_sampling(self.scope)
+
+_profiler = Profiler('service')
+
+def configure_profiling(service_name: str, config: Mapping[str, Any]) -> Profiler:
+    """
+    Sets up the profiler of the process from the PROFILE_* settings of a service.
+    Args:
+        service_name (str): The name of the service.
+        config (Mapping[str, Any]): The Flask configuration of the service.
+    Returns:
+        Profiler: The profiler, disabled when PROFILE_DIR is empty.
+    Raises:
+        ValueError: If PROFILE_SAMPLE_RATE is not between 0 and 1.
+    """
+    global _profiler  # pylint: disable=global-statement
+    if not 0 <= config['PROFILE_SAMPLE_RATE'] <= 1:
+        raise ValueError('PROFILE_SAMPLE_RATE must be between 0 and 1')
+    _profiler = Profiler(service_name, config['PROFILE_DIR'] or None,
+                         config['PROFILE_TOKEN'] or None, config['PROFILE_SAMPLE_RATE'],
+                         config['PROFILE_SAMPLE_INTERVAL_MS'])
+    return _profiler
+
+def get_profiler() -> Profiler:
+    """
+    Returns:
+        Profiler: The profiler of the process, disabled until configure_profiling().
+    """
+    return _profiler
+
+class ProfilingMiddleware:
+    """
+    WSGI middleware profiling the requests that carry the profiling token with cProfile,
+    and sampling a fraction of the others.
+    """
+
+    def __init__(self, wsgi_app: Callable[..., Iterable[bytes]], profiler: Profiler) -> None:
+        self.wsgi_app = wsgi_app
+        self.profiler = profiler
+
+    def __call__(self, environ: Dict[str, Any],
+                 start_response: Callable[..., Any]) -> Iterable[bytes]:
+        if self.profiler.is_triggered(environ.get('HTTP_X_PROFILE')):
+            return self._profile(environ, start_response)
+        if not self.profiler.should_sample():
+            return self.wsgi_app(environ, start_response)
+        self.profiler.start_sampling(sys._getframe())  # pylint: disable=protected-access
+        try:
+            return self.wsgi_app(environ, start_response)
+        finally:
+            rule = environ.get(RULE_ENVIRON_KEY)
+            self.profiler.stop_sampling(f"{environ['REQUEST_METHOD']} "
+                                        f"{rule.rule if rule is not None else 'unmatched'}")
+
+    def _profile(self, environ: Dict[str, Any],
+                 start_response: Callable[..., Any]) -> Iterable[bytes]:
+        path = self.profiler.pstats_path(f"{environ['REQUEST_METHOD']} "
+                                         f"{environ.get('PATH_INFO', '')}")
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is running in this process
+            return self.wsgi_app(environ, start_response)
+
+        def start_profiled_response(status: str, headers: Any, exc_info: Any = None) -> Any:
+            headers.append((PROFILE_FILE_HEADER, os.path.basename(path)))
+            return start_response(status, headers, exc_info)
+
+        try:
+            return self.wsgi_app(environ, start_profiled_response)
+        finally:
+            profile.disable()
+            profile.dump_stats(path)
+
+def init_profiling(app: Flask) -> None:
+    """
+    Installs the profiling middleware in the application when the profiler of the
+    process is enabled; otherwise requests are left untouched.
+    Args:
+        app (Flask): The application.
+    Returns:
+        None
+    """
+    if get_profiler().enabled:
+        app.wsgi_app = ProfilingMiddleware(app.wsgi_app, get_profiler())  # type: ignore
@@ -0,0 +1,365 @@
+"""_summary_
+Accounting of MongoDB round trips per HTTP request and per consumed event, and
+explanation of slow queries.
+
+A handler that reads a document, updates it and reads it back makes three round trips
+where one findOneAndUpdate would do, and a consumer that updates orders one by one makes
+one per order. To find such handlers, a pymongo command listener, installed by
+shared.mongo.create_mongo_client, counts the commands and the time spent in MongoDB of
+the request or event being handled:
+
+- init_round_trip_accounting() accounts every request of a Flask application under its
+  method and route template, such as 'PUT /orders/<order_id>/status'.
+- account_round_trips() accounts a block of code, such as applying one event, under a
+  given scope, such as 'consume <queue>'.
+
+Every scope reports its round trips and MongoDB time on /metrics, and as the
+'db.round_trips' attribute of the active span when tracing is enabled. A scope that
+makes more round trips than its budget logs a warning with the commands it issued. The
+budget is MONGO_ROUND_TRIP_BUDGET, 0 for none, unless MONGO_ROUND_TRIP_BUDGETS sets one
+for the scope, as comma separated 'scope=budget' pairs.
+
+A find, aggregate, count, distinct, findAndModify, update or delete slower than
+MONGO_SLOW_QUERY_MS is explained with the 'queryPlanner' verbosity, which plans the query
+without running it again, on a background thread, and logged with a summary of its
+winning plan, such as 'FETCH > IXSCAN(userId_1_createdAt_-1)'. Each query shape, the
+command, collection and filtered fields, is explained at most once every
+SLOW_QUERY_EXPLAIN_INTERVAL seconds, and only the shape is logged, not the values.
+Explaining runs extra commands against the database, so it is off unless
+MONGO_SLOW_QUERY_MS is set, as the development compose file does.
+
+Classes:
+    RoundTrips: The round trips of one scope.
+    RoundTripListener: Counts commands into the active scope and explains slow queries.
+Functions:
+    account_round_trips(scope, config): Context manager accounting a block of code.
+    init_round_trip_accounting(app): Accounts every request of an application.
+    parse_budgets(spec) -> Dict[str, int]: Reads MONGO_ROUND_TRIP_BUDGETS.
+    explain_command(command) -> Dict[str, Any]: The explain command of a query.
+    summarize_plan(explained) -> str: Summarizes the winning plan of an explain result.
+Author:
+    @TheBarzani
+"""
+
+import contextlib
+import contextvars
+import functools
+import logging
+import queue
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Tuple
+from flask import Flask, g, request
+from pymongo import MongoClient, monitoring
+from pymongo.errors import PyMongoError
+from shared.metrics import REGISTRY
+from shared.tracing import current_span
+
+EXPLAINABLE_COMMANDS = frozenset({'find', 'aggregate', 'count', 'distinct',
+                                  'findAndModify', 'update', 'delete'})
+# Fields of a command that belong to its session or transaction rather than the query
+SESSION_FIELDS = frozenset({'lsid', 'txnNumber', 'autocommit', 'startTransaction',
+                            'writeConcern', 'readConcern'})
+SLOW_QUERY_EXPLAIN_INTERVAL = 300.0
+ROUND_TRIP_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+ROUND_TRIPS = REGISTRY.histogram('mongo_round_trips',
+                                 'MongoDB commands issued per request or consumed event.',
+                                 ('scope',), ROUND_TRIP_BUCKETS)
+ROUND_TRIP_DURATION = REGISTRY.histogram('mongo_round_trip_duration_seconds',
+                                         'Time spent in MongoDB per request or consumed '
+                                         'event.', ('scope',))
+BUDGET_EXCEEDED = REGISTRY.counter('mongo_round_trip_budget_exceeded_total',
+                                   'Requests or consumed events over their round trip '
+                                   'budget.', ('scope',))
+SLOW_QUERIES = REGISTRY.counter('mongo_slow_queries_total',
+                                'MongoDB queries slower than MONGO_SLOW_QUERY_MS.',
+                                ('command',))
+
+logger = logging.getLogger(__name__)
+
+_current_round_trips: contextvars.ContextVar[Optional['RoundTrips']] = contextvars.ContextVar(
+    'current_round_trips', default=None)
+
+class RoundTrips:
+    """
+    The MongoDB commands issued by one request or consumed event. Commands may be
+    recorded from several threads, such as the partition queries of one request.
+    """
+
+    def __init__(self, scope: str) -> None:
+        self.scope = scope
+        self.count = 0
+        self.seconds = 0.0
+        self.commands: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, command_name: str, duration_micros: int) -> None:
+        """
+        Records one command.
+        """
+        with self._lock:
+            self.count += 1
+            self.seconds += duration_micros / 1e6
+            self.commands[command_name] = self.commands.get(command_name, 0) + 1
+
+    def summary(self) -> str:
+        """
+        Returns:
+            str: The number of commands of every kind, such as '2 find, 1 update'.
+        """
+        with self._lock:
+            return ', '.join(f'{count} {name}' for name, count in self.commands.items())
+
+@functools.lru_cache(maxsize=8)
+def parse_budgets(spec: Optional[str]) -> Dict[str, int]:
+    """
+    Reads the round trip budgets of MONGO_ROUND_TRIP_BUDGETS.
+    Args:
+        spec (Optional[str]): Comma separated 'scope=budget' pairs, such as
+                              'PUT /orders/<order_id>/status=1,consume orders.email=2'.
+    Returns:
+        Dict[str, int]: The budget of every listed scope. The result is cached, so it
+                        must not be modified.
+    Raises:
+        ValueError: If a pair is malformed.
+    """
+    budgets: Dict[str, int] = {}
+    for item in filter(None, (part.strip() for part in (spec or '').split(','))):
+        scope, separator, budget = item.rpartition('=')
+        if not separator or not scope.strip() or not budget.strip().isdigit():
+            raise ValueError(f'Invalid MONGO_ROUND_TRIP_BUDGETS entry: {item}')
+        budgets[scope.strip()] = int(budget)
+    return budgets
+
+def round_trip_budget(config: Mapping[str, Any], scope: str) -> int:
+    """
+    Returns:
+        int: The round trip budget of a scope, 0 for none.
+    """
+    return parse_budgets(config['MONGO_ROUND_TRIP_BUDGETS']).get(
+        scope, config['MONGO_ROUND_TRIP_BUDGET'])
+
+def _report(round_trips: RoundTrips, budget: int) -> None:
+    ROUND_TRIPS.observe(round_trips.count, round_trips.scope)
+    ROUND_TRIP_DURATION.observe(round_trips.seconds, round_trips.scope)
+    span = current_span()
+    if span is not None:
+        span.set_attribute('db.round_trips', round_trips.count)
+    if budget and round_trips.count > budget:
+        BUDGET_EXCEEDED.inc(round_trips.scope)
+        logger.warning('%s made %d MongoDB round trips (%s) in %.1f ms, over its budget '
+                       'of %d', round_trips.scope, round_trips.count, round_trips.summary(),
+                       round_trips.seconds * 1000, budget)
+
+@contextlib.contextmanager
+def account_round_trips(scope: str, config: Mapping[str, Any]) -> Iterator[RoundTrips]:
+    """
+    Accounts the MongoDB commands issued within the block under a scope, then reports
+    them and checks them against the budget of the scope.
+    Args:
+        scope (str): The name of the work, such as 'consume <queue>'.
+        config (Mapping[str, Any]): The Flask configuration of the service.
+    Yields:
+        RoundTrips: The commands recorded so far.
+    """
+    round_trips = RoundTrips(scope)
+    token = _current_round_trips.set(round_trips)
+    try:
+        yield round_trips
+    finally:
+        _current_round_trips.reset(token)
+        _report(round_trips, round_trip_budget(config, scope))
+
+def init_round_trip_accounting(app: Flask) -> None:
+    """
+    Accounts the MongoDB commands of every request of the application under its method
+    and route template. Requests that match no route are not accounted.
+    Args:
+        app (Flask): The application.
+    Returns:
+        None
+    """
+    # Fail at startup rather than on the first request
+    parse_budgets(app.config['MONGO_ROUND_TRIP_BUDGETS'])
+
+    @app.before_request
+    def start_round_trips() -> None:
+        if request.url_rule is None:
+            return
+        round_trips = RoundTrips(f'{request.method} {request.url_rule.rule}')
+        g.round_trips = (round_trips, _current_round_trips.set(round_trips))
+
+    @app.teardown_request
+    def finish_round_trips(_error: Optional[BaseException]) -> None:
+        round_trips, token = g.pop('round_trips', (None, None))
+        if round_trips is None:
+            return
+        _current_round_trips.reset(token)
+        _report(round_trips, round_trip_budget(app.config, round_trips.scope))
+
+def explain_command(command: Mapping[str, Any]) -> Dict[str, Any]:
+    """
+    Builds the explain command of a query, as issued to the server.
+    Args:
+        command (Mapping[str, Any]): The command of a CommandStartedEvent. Only the
+                                     first statement of an update or delete is kept,
+                                     since explain takes one.
+    Returns:
+        Dict[str, Any]: The explain command, with the 'queryPlanner' verbosity.
+    """
+    query = {key: value for key, value in command.items()
+             if not key.startswith('$') and key not in SESSION_FIELDS}
+    for statements in ('updates', 'deletes'):
+        if statements in query:
+            query[statements] = list(query[statements])[:1]
+    return {'explain': query, 'verbosity': 'queryPlanner'}
+
+def query_shape(database_name: str, command: Mapping[str, Any]) -> Tuple[Any, ...]:
+    """
+    Returns:
+        Tuple[Any, ...]: The database, command, collection and filtered fields of a
+                         query, or the stages of a pipeline, without their values.
+    """
+    name = next(iter(command))
+    criteria: Any = command.get('filter', command.get('query'))
+    if name == 'aggregate':
+        criteria = [next(iter(stage)) for stage in command.get('pipeline', [])]
+    elif name in ('update', 'delete'):
+        statements = list(command.get('updates', command.get('deletes', [])))
+        criteria = statements[0].get('q') if statements else None
+    fields = tuple(sorted(criteria)) if isinstance(criteria, Mapping) else tuple(criteria or ())
+    return (database_name, name, str(command.get(name)), fields)
+
+def _summarize_stage(stage: Mapping[str, Any]) -> str:
+    parts: List[str] = []
+    current: Optional[Mapping[str, Any]] = stage
+    while current is not None:
+        part = str(current.get('stage', '?'))
+        if 'indexName' in current:
+            part += f"({current['indexName']})"
+        children = [child.get('winningPlan', {}) for child in current.get('shards', [])]
+        children += list(current.get('inputStages', []))
+        if children:
+            part += '[' + ', '.join(_summarize_stage(child.get('queryPlan', child))
+                                    for child in children) + ']'
+        parts.append(part)
+        current = current.get('inputStage')
+    return ' > '.join(parts)
+
+def summarize_plan(explained: Mapping[str, Any]) -> str:
+    """
+    Summarizes the winning plan of an explain result as its stages from the root, with
+    the index of every index scan, such as 'LIMIT > FETCH > IXSCAN(orderStatus_1)'.
+    Args:
+        explained (Mapping[str, Any]): The result of an explain command.
+    Returns:
+        str: The summary, or 'unknown' if the result has no query planner section.
+    """
+    planner = explained.get('queryPlanner')
+    # Pipelines that are not entirely pushed down to the query layer start with $cursor
+    for stage in explained.get('stages', []) if planner is None else []:
+        if '$cursor' in stage:
+            planner = stage['$cursor'].get('queryPlanner')
+            break
+    if planner is None:
+        return 'unknown'
+    winning_plan = planner.get('winningPlan', {})
+    return _summarize_stage(winning_plan.get('queryPlan', winning_plan))
+
+class SlowQueryExplainer:
+    """
+    Explains slow queries from a background thread, at most once per query shape every
+    interval. Queries are dropped rather than queued without bound.
+    """
+
+    def __init__(self, interval: float = SLOW_QUERY_EXPLAIN_INTERVAL,
+                 max_queue: int = 100) -> None:
+        self.client: Optional[MongoClient] = None
+        self.interval = interval
+        self._explained: Dict[Tuple[Any, ...], float] = {}
+        self._lock = threading.Lock()
+        self._queue: 'queue.Queue[Tuple[str, Mapping[str, Any], float, str]]' = \
+            queue.Queue(max_queue)
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, database_name: str, command: Mapping[str, Any], seconds: float,
+               scope: str) -> None:
+        """
+        Queues a slow query to be explained, unless its shape was explained recently.
+        """
+        shape = query_shape(database_name, command)
+        now = time.monotonic()
+        with self._lock:
+            if now - self._explained.get(shape, -self.interval) < self.interval:
+                return
+            self._explained[shape] = now
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        try:
+            self._queue.put_nowait((database_name, command, seconds, scope))
+        except queue.Full:
+            pass
+
+    def _run(self) -> None:
+        while True:
+            database_name, command, seconds, scope = self._queue.get()
+            _, name, collection, fields = query_shape(database_name, command)
+            try:
+                explained = self.client[database_name].command(explain_command(command))
+                plan = summarize_plan(explained)
+            except PyMongoError as error:
+                plan = f'not explained ({error})'
+            logger.warning('Slow MongoDB %s on %s.%s by %s took %.1f ms in %s: %s', name,
+                           database_name, collection, ', '.join(map(str, fields)) or 'nothing',
+                           seconds * 1000, scope, plan)
+
+class RoundTripListener(monitoring.CommandListener):
+    """
+    Records every MongoDB command into the scope it was issued in, and explains the
+    queries slower than a threshold. The client the listener is installed in is
+    attached with attach().
+    """
+
+    def __init__(self, slow_query_ms: float) -> None:
+        """
+        Args:
+            slow_query_ms (float): The duration above which queries are explained, 0 to
+                                   explain none.
+        """
+        self.slow_query_micros = slow_query_ms * 1000
+        self.explainer = SlowQueryExplainer() if slow_query_ms > 0 else None
+        # Single dict operations are atomic, so the started commands need no lock
+        self._started: Dict[Tuple[int, Any], Tuple[str, Mapping[str, Any]]] = {}
+
+    def attach(self, client: MongoClient) -> None:
+        """
+        Sets the client slow queries are explained with.
+        """
+        if self.explainer is not None:
+            self.explainer.client = client
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        if self.explainer is not None and event.command_name in EXPLAINABLE_COMMANDS:
+            self._started[(event.request_id, event.connection_id)] = (event.database_name,
+                                                                      event.command)
+
+    def _finish(self, event: Any, succeeded: bool) -> None:
+        round_trips = _current_round_trips.get()
+        if round_trips is not None:
+            round_trips.record(event.command_name, event.duration_micros)
+        if self.explainer is None:
+            return
+        started = self._started.pop((event.request_id, event.connection_id), None)
+        if started is None or not succeeded or event.duration_micros < self.slow_query_micros:
+            return
+        SLOW_QUERIES.inc(event.command_name)
+        self.explainer.submit(*started, event.duration_micros / 1e6,
+                              round_trips.scope if round_trips is not None else 'background')
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._finish(event, True)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._finish(event, False)
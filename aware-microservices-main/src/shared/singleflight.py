@@ -0,0 +1,161 @@
+"""_summary_
+Request coalescing (single-flight) for the read handlers of the services.
+
+When many requests read the same popular user or the same order status bucket at once,
+each of them issues the same query. A SingleFlight group lets the first request for a key
+run the query while the requests arriving with the same key before it returns wait for it
+and share its result, or its exception. The key is released as soon as the query returns,
+so nothing is cached: a request arriving afterwards runs a new query.
+
+Coalescing happens between the threads of one worker process. Under gthread workers
+(gunicorn --threads) concurrent requests are coalesced; under sync workers a process only
+serves one request at a time, so every call runs its own query and the group only costs a
+lock acquisition. A request that joins a query already in flight may receive a result
+read a moment before it arrived, the same as if it had been served slightly earlier, and
+the READ_COALESCING setting of each service turns coalescing off for clients that need to
+read their own writes strictly.
+
+Shared results must be treated as read-only by the callers.
+
+Classes:
+    SingleFlight: Coalesces concurrent calls with the same key.
+Functions:
+    report_stats_in_background(groups, interval): Logs the counters of the groups.
+    collect_metrics(groups) -> List[MetricFamily]: The counters of the groups as metrics.
+Author:
+    @TheBarzani
+"""
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional
+from shared.metrics import MetricFamily
+
+logger = logging.getLogger(__name__)
+
+class _Call:
+    """
+    A call in flight and, once it returned, its outcome.
+    """
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one execution, and counts how
+    many executions were saved.
+    """
+
+    def __init__(self, name: str, enabled: bool = True) -> None:
+        """
+        Args:
+            name (str): The name of the group, used in the logged counters.
+            enabled (bool): False to run every call, still counting it.
+        """
+        self.name = name
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Hashable, _Call] = {}
+        self.calls = 0
+        self.executions = 0
+
+    def do(self, key: Hashable, function: Callable[[], Any]) -> Any:
+        """
+        Runs the function, unless a call with the same key is already running, in which
+        case this waits for that call and returns its outcome.
+        Args:
+            key (Hashable): Identifies the calls that are interchangeable.
+            function (Callable[[], Any]): The call to make.
+        Returns:
+            Any: The result of the function, shared with the coalesced callers.
+        Raises:
+            BaseException: Whatever the function raised.
+        """
+        with self._lock:
+            self.calls += 1
+            call = self._in_flight.get(key) if self.enabled else None
+            leader = call is None
+            if leader:
+                self.executions += 1
+                call = _Call()
+                if self.enabled:
+                    self._in_flight[key] = call
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            if self.enabled:
+                with self._lock:
+                    del self._in_flight[key]
+            call.done.set()
+        return call.result
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns:
+            Dict[str, int]: The number of calls, of executions, and of calls that were
+                            served by another call's execution.
+        """
+        with self._lock:
+            return {'calls': self.calls, 'executions': self.executions,
+                    'coalesced': self.calls - self.executions}
+
+def report_stats_in_background(groups: List[SingleFlight],
+                               interval: float = 60.0) -> threading.Thread:
+    """
+    Logs the counters of the groups from a daemon thread every interval, when they changed.
+    Args:
+        groups (List[SingleFlight]): The groups to report.
+        interval (float): Seconds between two reports.
+    Returns:
+        threading.Thread: The started thread.
+    """
+
+    def run() -> None:
+        reported: Dict[str, Dict[str, int]] = {}
+        while True:
+            time.sleep(interval)
+            for group in groups:
+                stats = group.stats()
+                if stats != reported.get(group.name):
+                    reported[group.name] = stats
+                    logger.info('Single-flight %s: %d calls, %d queries, %d coalesced',
+                                group.name, stats['calls'], stats['executions'],
+                                stats['coalesced'])
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+def collect_metrics(groups: List[SingleFlight]) -> List[MetricFamily]:
+    """
+    Reports the counters of the groups as metrics, for the /metrics endpoint.
+    Args:
+        groups (List[SingleFlight]): The groups to report.
+    Returns:
+        List[MetricFamily]: The calls, queries and coalesced calls of every group.
+    """
+    families = [MetricFamily('singleflight_calls_total', 'Reads made through the group.',
+                             'counter'),
+                MetricFamily('singleflight_executions_total', 'Queries run by the group.',
+                             'counter'),
+                MetricFamily('singleflight_coalesced_total',
+                             'Reads that shared the query of another read.', 'counter')]
+    for group in groups:
+        stats = group.stats()
+        for family, key in zip(families, ('calls', 'executions', 'coalesced')):
+            family.add({'group': group.name}, stats[key])
+    return families
@@ -0,0 +1,446 @@
+"""_summary_
+Distributed tracing with W3C Trace Context propagation.
+
+A user update crosses the gateway, a user service, RabbitMQ and the order service
+consumer before the orders change. With TRACE_EXPORT set, each service records spans of
+that path and links them into one trace:
+
+- The user services continue the trace of the `traceparent` header of an incoming
+  request (Kong forwards it unchanged), or start a new one, and return the
+  `traceresponse` header so a client can find its trace.
+- publish_user_update_event records a producer span per event and carries its
+  `traceparent` in the AMQP message headers.
+- The order service consumer continues the trace from the message headers.
+- Every MongoDB command issued while a span is active is recorded as a child span by a
+  pymongo command listener installed by shared.mongo.create_mongo_client.
+
+Spans are exported when they end, either appended as JSON lines to a local file
+(TRACE_EXPORT=file:///path/spans.jsonl) or posted in OTLP/HTTP JSON batches to a
+collector (TRACE_EXPORT=http://collector:4318/v1/traces). With TRACE_EXPORT empty
+tracing is off and every call below is a no-op.
+
+Classes:
+    SpanContext: The identifiers carried by a traceparent.
+    Span: A timed operation of a trace.
+    Tracer: Creates spans and hands them to an exporter.
+    MongoSpanListener: Records MongoDB commands as spans.
+Functions:
+    parse_traceparent(value) -> Optional[SpanContext]: Reads a traceparent header.
+    configure_tracing(service_name, export) -> Tracer: Sets up the tracer of a process.
+    get_tracer() -> Tracer: Returns the tracer of the process.
+    current_traceparent() -> Optional[str]: The traceparent of the active span.
+    message_headers() -> Optional[Dict[str, str]]: AMQP headers carrying the trace.
+    init_flask_tracing(app): Records a server span per request.
+Author:
+    @TheBarzani
+"""
+
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import urllib.request
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from flask import Flask, Response, g, request
+from pymongo import monitoring
+
+TRACEPARENT_HEADER = 'traceparent'
+TRACERESPONSE_HEADER = 'traceresponse'
+_TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+# OTLP span kinds
+SPAN_KINDS = {'internal': 1, 'server': 2, 'client': 3, 'producer': 4, 'consumer': 5}
+
+logger = logging.getLogger(__name__)
+
+_current_span: contextvars.ContextVar[Optional['Span']] = contextvars.ContextVar(
+    'current_span', default=None)
+
+class SpanContext:
+    """
+    The trace and span identifiers carried by a traceparent header.
+    """
+
+    def __init__(self, trace_id: str, span_id: str, sampled: bool = True) -> None:
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+    def traceparent(self) -> str:
+        """
+        Returns:
+            str: The traceparent header value naming this span as the parent.
+        """
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+def parse_traceparent(value: Optional[str]) -> Optional[SpanContext]:
+    """
+    Reads a version 00 traceparent header.
+    Args:
+        value (Optional[str]): The header value.
+    Returns:
+        Optional[SpanContext]: The remote parent, or None if the value is missing or
+                               invalid, in which case a new trace is started.
+    """
+    match = _TRACEPARENT.match((value or '').strip().lower())
+    if match is None:
+        return None
+    trace_id, span_id, flags = match.groups()
+    if trace_id == '0' * 32 or span_id == '0' * 16:
+        return None
+    return SpanContext(trace_id, span_id, bool(int(flags, 16) & 1))
+
+class Span:
+    """
+    A timed operation of a trace.
+    """
+
+    def __init__(self, tracer: 'Tracer', name: str, context: SpanContext,
+                 parent_span_id: Optional[str], kind: str,
+                 attributes: Optional[Dict[str, Any]] = None,
+                 start_ns: Optional[int] = None) -> None:
+        self.tracer = tracer
+        self.name = name
+        self.context = context
+        self.parent_span_id = parent_span_id
+        self.kind = kind
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        """
+        Records an attribute of the span.
+        """
+        self.attributes[key] = value
+
+    def record_error(self, error: BaseException) -> None:
+        """
+        Marks the span as failed.
+        """
+        self.error = f'{type(error).__name__}: {error}'
+
+    def end(self, end_ns: Optional[int] = None) -> None:
+        """
+        Ends the span and exports it. Ending a span twice has no effect.
+        """
+        if self.end_ns is None:
+            self.end_ns = end_ns or time.time_ns()
+            self.tracer.export(self)
+
+class FileExporter:
+    """
+    Appends spans to a file as JSON lines.
+    """
+
+    def __init__(self, path: str, service_name: str) -> None:
+        self.path = path
+        self.service_name = service_name
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, span: Span) -> None:
+        """
+        Writes one span.
+        """
+        line = json.dumps({'service': self.service_name, 'traceId': span.context.trace_id,
+                           'spanId': span.context.span_id,
+                           'parentSpanId': span.parent_span_id, 'name': span.name,
+                           'kind': span.kind, 'start': span.start_ns, 'end': span.end_ns,
+                           'durationMs': (span.end_ns - span.start_ns) / 1e6,
+                           'attributes': span.attributes, 'error': span.error},
+                          default=str)
+        with self._lock, open(self.path, 'a', encoding='utf-8') as file:
+            file.write(line + '\n')
+
+class OtlpHttpExporter:
+    """
+    Posts spans to an OTLP/HTTP collector in JSON batches from a background thread.
+    Spans are dropped rather than slowing requests down when the collector falls behind.
+    """
+
+    def __init__(self, url: str, service_name: str, max_batch: int = 512,
+                 interval: float = 1.0, max_queue: int = 10000) -> None:
+        self.url = url
+        self.service_name = service_name
+        self.max_batch = max_batch
+        self.interval = interval
+        self._queue: 'queue.Queue[Span]' = queue.Queue(max_queue)
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def export(self, span: Span) -> None:
+        """
+        Queues one span for the next batch.
+        """
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            pass
+
+    def _encode(self, spans: List[Span]) -> bytes:
+        def attributes(values: Dict[str, Any]) -> List[Dict[str, Any]]:
+            encoded = []
+            for key, value in values.items():
+                if isinstance(value, bool):
+                    encoded.append({'key': key, 'value': {'boolValue': value}})
+                elif isinstance(value, int):
+                    encoded.append({'key': key, 'value': {'intValue': str(value)}})
+                elif isinstance(value, float):
+                    encoded.append({'key': key, 'value': {'doubleValue': value}})
+                else:
+                    encoded.append({'key': key, 'value': {'stringValue': str(value)}})
+            return encoded
+
+        return json.dumps({'resourceSpans': [{
+            'resource': {'attributes': attributes({'service.name': self.service_name})},
+            'scopeSpans': [{'scope': {'name': __name__}, 'spans': [{
+                'traceId': span.context.trace_id, 'spanId': span.context.span_id,
+                'parentSpanId': span.parent_span_id or '', 'name': span.name,
+                'kind': SPAN_KINDS[span.kind], 'startTimeUnixNano': str(span.start_ns),
+                'endTimeUnixNano': str(span.end_ns), 'attributes': attributes(span.attributes),
+                'status': ({'code': 2, 'message': span.error} if span.error
+                           else {'code': 0})} for span in spans]}]}]}).encode()
+
+    def _run(self) -> None:
+        while True:
+            spans = [self._queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(spans) < self.max_batch and time.monotonic() < deadline:
+                try:
+                    spans.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            request_ = urllib.request.Request(self.url, data=self._encode(spans),
+                                              headers={'Content-Type': 'application/json'})
+            try:
+                with urllib.request.urlopen(request_, timeout=5):
+                    pass
+            except OSError as error:
+                logger.warning('Exporting %d spans failed: %s', len(spans), error)
+
+class Tracer:
+    """
+    Creates spans in the context of the active span and exports them when they end.
+    """
+
+    def __init__(self, service_name: str, exporter: Any = None) -> None:
+        """
+        Args:
+            service_name (str): The name of the service recording the spans.
+            exporter (Any): A FileExporter or OtlpHttpExporter, or None to disable tracing.
+        """
+        self.service_name = service_name
+        self.exporter = exporter
+
+    @property
+    def enabled(self) -> bool:
+        """
+        Returns:
+            bool: Whether spans are recorded.
+        """
+        return self.exporter is not None
+
+    def export(self, span: Span) -> None:
+        """
+        Hands an ended span to the exporter.
+        """
+        if self.exporter is not None and span.context.sampled:
+            self.exporter.export(span)
+
+    def start_span(self, name: str, parent: Optional[SpanContext] = None, kind: str = 'internal',
+                   attributes: Optional[Dict[str, Any]] = None,
+                   start_ns: Optional[int] = None) -> Optional[Span]:
+        """
+        Starts a span without activating it.
+        Args:
+            name (str): The name of the operation.
+            parent (Optional[SpanContext]): The remote parent; the active span by default.
+            kind (str): One of SPAN_KINDS.
+            attributes (Optional[Dict[str, Any]]): The attributes of the span.
+            start_ns (Optional[int]): The start time, now by default.
+        Returns:
+            Optional[Span]: The span, or None when tracing is disabled.
+        """
+        if not self.enabled:
+            return None
+        if parent is None:
+            active = _current_span.get()
+            parent = active.context if active is not None else None
+        span_id = os.urandom(8).hex()
+        if parent is None:
+            context = SpanContext(os.urandom(16).hex(), span_id)
+        else:
+            context = SpanContext(parent.trace_id, span_id, parent.sampled)
+        return Span(self, name, context, parent.span_id if parent else None, kind, attributes,
+                    start_ns)
+
+    @contextlib.contextmanager
+    def span(self, name: str, parent: Optional[SpanContext] = None, kind: str = 'internal',
+             attributes: Optional[Dict[str, Any]] = None) -> Iterator[Optional[Span]]:
+        """
+        Records the enclosed block as a span and makes it the active span.
+        Args:
+            name (str): The name of the operation.
+            parent (Optional[SpanContext]): The remote parent; the active span by default.
+            kind (str): One of SPAN_KINDS.
+            attributes (Optional[Dict[str, Any]]): The attributes of the span.
+        Returns:
+            Iterator[Optional[Span]]: The span, or None when tracing is disabled.
+        """
+        span = self.start_span(name, parent, kind, attributes)
+        if span is None:
+            yield None
+            return
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as error:
+            span.record_error(error)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+
+_tracer = Tracer('unknown')
+
+def configure_tracing(service_name: str, export: Optional[str]) -> Tracer:
+    """
+    Sets up the tracer of the process from the TRACE_EXPORT setting.
+    Args:
+        service_name (str): The name of the service recording the spans.
+        export (Optional[str]): 'file://<path>', an OTLP/HTTP traces URL, or empty to
+                                disable tracing.
+    Returns:
+        Tracer: The tracer, also returned by get_tracer().
+    Raises:
+        ValueError: If the export target is not supported.
+    """
+    global _tracer  # pylint: disable=global-statement
+    exporter: Any = None
+    if export:
+        if export.startswith('file://'):
+            exporter = FileExporter(export[len('file://'):], service_name)
+        elif export.startswith(('http://', 'https://')):
+            exporter = OtlpHttpExporter(export, service_name)
+        else:
+            raise ValueError(f'Unsupported TRACE_EXPORT: {export}')
+    _tracer = Tracer(service_name, exporter)
+    return _tracer
+
+def get_tracer() -> Tracer:
+    """
+    Returns:
+        Tracer: The tracer configured by configure_tracing(), disabled until then.
+    """
+    return _tracer
+
+def current_span() -> Optional[Span]:
+    """
+    Returns:
+        Optional[Span]: The active span of this thread or task, if any.
+    """
+    return _current_span.get()
+
+def current_traceparent() -> Optional[str]:
+    """
+    Returns:
+        Optional[str]: The traceparent naming the active span as parent, to send along
+                       with an outgoing request or message.
+    """
+    span = _current_span.get()
+    return span.context.traceparent() if span is not None else None
+
+def message_headers() -> Optional[Dict[str, str]]:
+    """
+    Returns:
+        Optional[Dict[str, str]]: The AMQP message headers carrying the active span as
+                                  parent, or None outside of a span.
+    """
+    traceparent = current_traceparent()
+    return {TRACEPARENT_HEADER: traceparent} if traceparent is not None else None
+
+def init_flask_tracing(app: Flask) -> None:
+    """
+    Records a server span for every request of the application, continuing the trace
+    of the incoming traceparent header.
+    Args:
+        app (Flask): The application.
+    Returns:
+        None
+    """
+
+    @app.before_request
+    def start_request_span() -> None:
+        tracer = get_tracer()
+        if not tracer.enabled:
+            return
+        route = request.url_rule.rule if request.url_rule is not None else request.path
+        span = tracer.start_span(f'{request.method} {route}',
+                                 parse_traceparent(request.headers.get(TRACEPARENT_HEADER)),
+                                 'server', {'http.method': request.method,
+                                            'http.target': request.full_path.rstrip('?')})
+        g.trace_span = (span, _current_span.set(span))
+
+    @app.after_request
+    def annotate_response(response: Response) -> Response:
+        span, _ = g.get('trace_span', (None, None))
+        if span is not None:
+            span.set_attribute('http.status_code', response.status_code)
+            if response.status_code >= 500:
+                span.error = f'HTTP {response.status_code}'
+            response.headers[TRACERESPONSE_HEADER] = span.context.traceparent()
+        return response
+
+    @app.teardown_request
+    def end_request_span(error: Optional[BaseException]) -> None:
+        span, token = g.pop('trace_span', (None, None))
+        if span is None:
+            return
+        if error is not None:
+            span.record_error(error)
+        _current_span.reset(token)
+        span.end()
+
+class MongoSpanListener(monitoring.CommandListener):
+    """
+    Records every MongoDB command issued while a span is active as its child.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._spans: Dict[Tuple[int, Any], Span] = {}
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        span = get_tracer().start_span(f'mongodb {event.command_name}', kind='client') \
+            if _current_span.get() is not None else None
+        if span is None:
+            return
+        collection = event.command.get(event.command_name)
+        span.attributes.update({'db.system': 'mongodb', 'db.name': event.database_name,
+                                'db.operation': event.command_name,
+                                'net.peer.name': f'{event.connection_id[0]}:'
+                                                 f'{event.connection_id[1]}'})
+        if isinstance(collection, str):
+            span.set_attribute('db.mongodb.collection', collection)
+        with self._lock:
+            self._spans[(event.request_id, event.connection_id)] = span
+
+    def _end(self, event: Any, error: Optional[str] = None) -> None:
+        with self._lock:
+            span = self._spans.pop((event.request_id, event.connection_id), None)
+        if span is not None:
+            span.error = error
+            span.end(span.start_ns + event.duration_micros * 1000)
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._end(event)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._end(event, str(event.failure.get('errmsg', event.failure)))
@@ -1,18 +1,49 @@
+import logging
 from flask import Flask
 from flask_restx import Api
-from user_service_v1.app.routes import api as user_api
-from pymongo import MongoClient
+from user_service_v1.app.routes import api as user_api, service_version
+from shared.admission import init_admission_control
+from shared.mongo import create_mongo_client, read_collection
+from shared.idempotency import ensure_idempotency_index_in_background
+from shared.log import configure_logging, init_request_logging
+from shared.memory import init_memory_diagnostics
+from shared.metrics import REGISTRY, init_metrics
+from shared.profiling import configure_profiling, init_profiling
+from shared.round_trips import init_round_trip_accounting
+from shared.singleflight import SingleFlight, collect_metrics, report_stats_in_background
+from shared.tracing import configure_tracing, init_flask_tracing
+
+logger = logging.getLogger(__name__)
 
 def create_app():
     app = Flask(__name__)
     app.config.from_object('user_service_v1.app.config.Config')
+    configure_logging('user-service-v1', app.config)
+    configure_tracing('user-service-v1', app.config['TRACE_EXPORT'])
+    init_flask_tracing(app)
+    init_request_logging(app)
+    logger.info('Using User Service: %s', service_version)
+    init_metrics(app)
+    init_round_trip_accounting(app)
+    configure_profiling('user-service-v1', app.config)
+    init_profiling(app)
+    init_memory_diagnostics(app)
+    # Outermost, so the requests it rejects skip everything else
+    init_admission_control(app)
     api = Api(app)
     api.add_namespace(user_api, path='/users')
     
     # Initialize MongoDB client
-    mongo_client = MongoClient(app.config['MONGO_URI'])
+    mongo_client = create_mongo_client(app.config)
     app.mongo_client = mongo_client
     app.db = mongo_client[app.config['DATABASE_NAME']]
     app.users_collection = app.db['users']
+    app.users_read_collection = read_collection(app.users_collection, app.config)
+    app.idempotency_collection = app.db['idempotency_keys']
+    app.user_reads = SingleFlight('users', app.config['READ_COALESCING'])
+    report_stats_in_background([app.user_reads])
+    REGISTRY.register_collector('singleflight', lambda: collect_metrics([app.user_reads]))
+    ensure_idempotency_index_in_background(app.idempotency_collection,
+                                           app.config['IDEMPOTENCY_TTL_SECONDS'])
     
     return app
\ No newline at end of file
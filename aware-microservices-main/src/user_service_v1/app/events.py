@@ -1,26 +1,45 @@
 import json
+import logging
+import time
+from datetime import datetime, timezone
 import pika
-from shared.config.rabbitmq_config import create_channel
-import os
-from dotenv import load_dotenv
+from shared.config.rabbitmq_config import EXCHANGE_NAME, USER_ADDRESS_UPDATED, USER_EMAIL_UPDATED, create_channel
+from shared.metrics import AMQP_PUBLISH_DURATION
+from shared.tracing import get_tracer, message_headers
 
-load_dotenv()
-QUEUE_NAME = os.getenv('RABBITMQ_QUEUE_NAME')
+logger = logging.getLogger(__name__)
 
-def publish_user_update_event(user_id, email, address):
-    channel, connection = create_channel(QUEUE_NAME)
-    event = {
-        'userId': user_id,
-        'userEmails': email,
-        'deliveryAddress': address
-    }
-    channel.basic_publish(
-        exchange="user_order",
-        routing_key=QUEUE_NAME,
-        body=json.dumps(event)
-        # properties=pika.BasicProperties(
-        #     delivery_mode=2,  # Make the message persistent
-        # )
-    )
-    print(f" V1 Published event: {event}", flush=True)
+def publish_user_update_event(user_id, email=None, address=None, version=None):
+    events = []
+    if email is not None:
+        events.append((USER_EMAIL_UPDATED, {'userId': user_id, 'userEmails': email}))
+    if address is not None:
+        events.append((USER_ADDRESS_UPDATED, {'userId': user_id, 'deliveryAddress': address}))
+    if not events:
+        return
+
+    channel, connection = create_channel()
+    tracer = get_tracer()
+    for routing_key, event in events:
+        event['eventType'] = routing_key
+        event['publishedAt'] = datetime.now(timezone.utc).isoformat()
+        if version is not None:
+            event['version'] = version.replace(tzinfo=timezone.utc).isoformat()
+        with tracer.span(f'publish {routing_key}', kind='producer',
+                         attributes={'messaging.system': 'rabbitmq',
+                                     'messaging.destination': EXCHANGE_NAME,
+                                     'messaging.rabbitmq.routing_key': routing_key}):
+            started = time.perf_counter()
+            channel.basic_publish(
+                exchange=EXCHANGE_NAME,
+                routing_key=routing_key,
+                body=json.dumps(event),
+                properties=pika.BasicProperties(
+                    headers=message_headers(),
+                    # delivery_mode=2,  # Make the message persistent
+                )
+            )
+            AMQP_PUBLISH_DURATION.observe(time.perf_counter() - started, routing_key)
+        logger.info('Published %s event', routing_key,
+                    extra={'userId': user_id, 'publishedAt': event['publishedAt']})
     connection.close()
@@ -15,7 +15,9 @@ Functions:
 from flask import request, Flask, current_app
 from flask_restx import Namespace, Resource, fields
 from bson.objectid import ObjectId
-import uuid
+from pymongo import ReturnDocument
+from shared.ids import new_id
+from shared.idempotency import idempotent
 from user_service_v1.app.models import api, user_model, delivery_address_model
 from user_service_v1.app.events import publish_user_update_event
 
@@ -23,11 +25,18 @@ from user_service_v1.app.events import publish_user_update_event
 current_app : Flask
 
 service_version = 'v1'
-print(f"Using User Service: {service_version}")
+
+# The time of the write, at least a millisecond after the previous 'updatedAt' if it
+# is a date
+NEXT_UPDATED_AT = {'$max': ['$$NOW', {'$cond': [{'$eq': [{'$type': '$updatedAt'}, 'date']},
+                                                {'$add': ['$updatedAt', 1]}, None]}]}
 
 @api.route('/')
 class UserList(Resource):
     @api.expect(user_model)
+    @api.param('Idempotency-Key', 'Retries with the same key return the original response',
+               _in='header')
+    @idempotent
     @api.marshal_with(user_model, code=201)
     def post(self) -> tuple:
         """
@@ -41,6 +50,8 @@ class UserList(Resource):
         6. Generates a unique userId for the new user.
         7. Inserts the new user data into the database.
         8. Retrieves and returns the newly created user.
+        A request carrying an Idempotency-Key header that was already used returns the 
+        original response instead of creating another user.
         Returns:
             tuple: A tuple containing the newly created user data and the HTTP status code 201.
         Raises:
@@ -80,8 +91,8 @@ class UserList(Resource):
         if existing_user:
             api.abort(400, 'One or more email addresses are already in use')
             
-        # Generate a unique userId
-        data['userId'] = str(uuid.uuid4())
+        # Generate a unique, time-ordered userId
+        data['userId'] = new_id()
         user_id: ObjectId = users_collection.insert_one(data).inserted_id
         user: dict = users_collection.find_one({'_id': ObjectId(user_id)})
         return user, 201
@@ -142,14 +153,21 @@ class User(Resource):
         if not old_user:
             api.abort(404, "User not found")
 
-        users_collection.update_one({'userId': id}, {'$set': data})
-        new_user: dict = users_collection.find_one({'userId': id})
+        # updatedAt is the version of the published events, so it is set by the write
+        # itself to follow the order of the writes, even within the same millisecond
+        new_user: dict = users_collection.find_one_and_update(
+            {'userId': id},
+            [{'$set': {**{field: {'$literal': value} for field, value in data.items()},
+                       'updatedAt': NEXT_UPDATED_AT}}],
+            return_document=ReturnDocument.AFTER)
+        if not new_user:
+            api.abort(404, "User not found")
         
-        emails = new_user["emails"]
-        deliveryAddress = new_user["deliveryAddress"]
+        emails = new_user["emails"] if 'emails' in data else None
+        deliveryAddress = new_user["deliveryAddress"] if 'deliveryAddress' in data else None
 
-        # Publish the update event
-        publish_user_update_event(id, emails, deliveryAddress)
+        # Publish an update event for each kind of change
+        publish_user_update_event(id, emails, deliveryAddress, new_user['updatedAt'])
         return [old_user, new_user]
     
     @api.marshal_with(user_model)
@@ -163,8 +181,9 @@ class User(Resource):
         Raises:
             HTTPException: If the user with the given ID is not found.
         """
-        users_collection = current_app.users_collection
-        user = users_collection.find_one({'userId': id})
+        users_collection = current_app.users_read_collection
+        # Concurrent reads of the same user share one query
+        user = current_app.user_reads.do(id, lambda: users_collection.find_one({'userId': id}))
         if not user:
             api.abort(404, "User not found")
         return user
@@ -20,8 +20,93 @@ class Config:
     Attributes:
         MONGO_URI (str): The URI for connecting to the MongoDB database.
         DATABASE_NAME (str): The name of the MongoDB database to use.
+        MONGO_MAX_POOL_SIZE (int): The maximum number of connections per server.
+        MONGO_MIN_POOL_SIZE (int): The number of connections kept open per server.
+        MONGO_CONNECT_TIMEOUT_MS (int): The connection timeout, 0 for the driver default.
+        MONGO_SOCKET_TIMEOUT_MS (int): The socket read timeout, 0 for none.
+        MONGO_SERVER_SELECTION_TIMEOUT_MS (int): How long an operation waits for a 
+                                                 suitable server, 0 for the driver default.
+        MONGO_WAIT_QUEUE_TIMEOUT_MS (int): How long an operation waits for a pooled 
+                                           connection, 0 for no limit.
+        MONGO_READ_PREFERENCE (str): The read preference of the read-only endpoints, 
+                                     such as 'primary' or 'secondaryPreferred'.
+        MONGO_MAX_STALENESS_SECONDS (int): The replication lag up to which a secondary 
+                                           serves those reads, -1 for no bound.
+        MONGO_ROUND_TRIP_BUDGET (int): The MongoDB round trips a request or consumed event 
+                                       may make before a warning is logged, 0 for no limit.
+        MONGO_ROUND_TRIP_BUDGETS (str): Comma separated 'scope=budget' overrides, such as 
+                                        'PUT /users/<user_id>=2'.
+        MONGO_SLOW_QUERY_MS (float): The duration above which queries are explained and 
+                                     logged, 0 (the default) to disable.
         RABBITMQ_QUEUE_NAME (str): The name of the RabbitMQ queue to consume events from.
+        TRACE_EXPORT (str): Where spans are exported, 'file://<path>' or an OTLP/HTTP 
+                            traces URL; empty to disable tracing.
+        PROFILE_DIR (str): The directory profiles are written to; empty to disable 
+                           profiling.
+        PROFILE_TOKEN (str): The value of the X-Profile header that profiles a request 
+                             with cProfile; empty to trigger none.
+        PROFILE_SAMPLE_RATE (float): The fraction of requests and consumed events whose 
+                                     stacks are sampled, 0 to 1.
+        PROFILE_SAMPLE_INTERVAL_MS (float): Milliseconds between two stack samples.
+        MEMORY_DIAGNOSTICS (bool): Whether allocations are traced with tracemalloc, the 
+                                   peak allocation of requests is recorded by route and 
+                                   GET /admin/memory is served.
+        MEMORY_TRACE_FRAMES (int): The frames kept of every traced allocation.
+        MEMORY_RSS_LIMIT_MB (int): The resident size above which a gunicorn worker is 
+                                   recycled, 0 for no limit.
+        LOG_LEVEL (str): The level of the records written, such as 'INFO'.
+        LOG_FORMAT (str): 'json' to write one JSON object per record, or 'text'.
+        LOG_QUEUE_SIZE (int): The records waiting for the log writer thread above which 
+                              records below WARNING are dropped.
+        LOG_SAMPLING (str): Comma separated 'logger=rate' sample rates of high-volume 
+                            loggers, such as 'user_service_v2.app.events=0.01'.
+        ADMISSION_READ_LIMIT (int): The GET, HEAD and OPTIONS requests a worker serves at 
+                                    once before it answers more with 503, 0 (the 
+                                    default) for no limit.
+        ADMISSION_WRITE_LIMIT (int): The same limit for the other requests.
+        ADMISSION_MAX_POOL_WAIT_MS (float): The recent wait for a pooled MongoDB connection 
+                                            above which requests are answered with 503, 
+                                            0 (the default) for no bound.
+        ADMISSION_RETRY_AFTER_SECONDS (int): The Retry-After of the 503 responses.
+        ADMISSION_EXEMPT_PATHS (str): Comma separated path prefixes never answered with 503.
+        READ_COALESCING (bool): Whether concurrent identical reads share one query.
+        IDEMPOTENCY_TTL_SECONDS (int): Seconds an idempotency key and its response are kept.
+        IDEMPOTENCY_PENDING_TIMEOUT_SECONDS (float): Seconds after which a key whose 
+                                                     request never completed can be 
+                                                     claimed again.
     """
     MONGO_URI = os.getenv("MONGO_URI")
     DATABASE_NAME = os.getenv("DATABASE_NAME")
+    MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+    MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+    MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "0"))
+    MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "0"))
+    MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "0"))
+    MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "0"))
+    MONGO_READ_PREFERENCE = os.getenv("MONGO_READ_PREFERENCE", "primary")
+    MONGO_MAX_STALENESS_SECONDS = int(os.getenv("MONGO_MAX_STALENESS_SECONDS", "90"))
+    MONGO_ROUND_TRIP_BUDGET = int(os.getenv("MONGO_ROUND_TRIP_BUDGET", "5"))
+    MONGO_ROUND_TRIP_BUDGETS = os.getenv("MONGO_ROUND_TRIP_BUDGETS", "")
+    MONGO_SLOW_QUERY_MS = float(os.getenv("MONGO_SLOW_QUERY_MS", "0"))
     RABBITMQ_QUEUE_NAME = os.getenv('RABBITMQ_QUEUE_NAME')
+    TRACE_EXPORT = os.getenv("TRACE_EXPORT", "")
+    PROFILE_DIR = os.getenv("PROFILE_DIR", "")
+    PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+    PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+    PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "10"))
+    MEMORY_DIAGNOSTICS = os.getenv("MEMORY_DIAGNOSTICS", "false").lower() == "true"
+    MEMORY_TRACE_FRAMES = int(os.getenv("MEMORY_TRACE_FRAMES", "1"))
+    MEMORY_RSS_LIMIT_MB = int(os.getenv("MEMORY_RSS_LIMIT_MB", "0"))
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    LOG_SAMPLING = os.getenv("LOG_SAMPLING", "")
+    ADMISSION_READ_LIMIT = int(os.getenv("ADMISSION_READ_LIMIT", "0"))
+    ADMISSION_WRITE_LIMIT = int(os.getenv("ADMISSION_WRITE_LIMIT", "0"))
+    ADMISSION_MAX_POOL_WAIT_MS = float(os.getenv("ADMISSION_MAX_POOL_WAIT_MS", "0"))
+    ADMISSION_RETRY_AFTER_SECONDS = int(os.getenv("ADMISSION_RETRY_AFTER_SECONDS", "1"))
+    ADMISSION_EXEMPT_PATHS = os.getenv("ADMISSION_EXEMPT_PATHS", "/metrics,/admin/")
+    READ_COALESCING = os.getenv("READ_COALESCING", "true").lower() == "true"
+    IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+    IDEMPOTENCY_PENDING_TIMEOUT_SECONDS = float(os.getenv("IDEMPOTENCY_PENDING_TIMEOUT_SECONDS",
+                                                          "30"))
@@ -1,43 +1,79 @@
 """__summary__
 This module handles the publishing of user update events to a RabbitMQ queue.
 
+Each kind of change is published with its own routing key on the user event topic 
+exchange, so the order service can consume email and address changes from separate 
+queues. Each message carries the W3C traceparent of its producer span in its
+headers, so the order service consumer continues the trace of the request. Every event
+also carries the 'updatedAt' of the user document written with the change as its
+'version', by which the order service orders concurrent updates of the same user.
+
 Author:
     @TheBarzani
 """
 
-import os
 import json
-from flask import current_app
-from dotenv import load_dotenv
-from shared.config.rabbitmq_config import create_channel
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Optional
+import pika
+from shared.config.rabbitmq_config import (EXCHANGE_NAME, USER_ADDRESS_UPDATED,
+                                           USER_EMAIL_UPDATED, create_channel)
+from shared.metrics import AMQP_PUBLISH_DURATION
+from shared.tracing import get_tracer, message_headers
 
-load_dotenv()
-QUEUE_NAME = os.getenv('RABBITMQ_QUEUE_NAME')
+logger = logging.getLogger(__name__)
 
-def publish_user_update_event(user_id: int, email: str, address: str) -> None:
+def publish_user_update_event(user_id: str, email: Optional[list] = None,
+                              address: Optional[dict] = None,
+                              version: Optional[datetime] = None) -> None:
     """
-    Publishes an event to notify about a user update.
+    Publishes events to notify about a user update. A 'user.email.updated' event is 
+    published when emails are given and a 'user.address.updated' event when an 
+    address is given. Every event carries the time it was published, from which the 
+    order service measures how long updates take to propagate, and the version of the
+    change.
     Args:
-        user_id (int): The ID of the user.
-        email (str): The email address of the user.
-        address (str): The delivery address of the user.
+        user_id (str): The ID of the user.
+        email (Optional[list]): The email addresses of the user, if they changed.
+        address (Optional[dict]): The delivery address of the user, if it changed.
+        version (Optional[datetime]): The 'updatedAt' of the user, in naive UTC, set by
+                                      the write of the change.
     Returns:
         None  
     """
 
-    channel, connection = create_channel(QUEUE_NAME)
-    event = {
-        'userId': user_id,
-        'userEmails': email,
-        'deliveryAddress': address
-    }
-    channel.basic_publish(
-        exchange="user_order",
-        routing_key=QUEUE_NAME,
-        body=json.dumps(event)
-        # properties=pika.BasicProperties(
-        #     delivery_mode=2,  # Make the message persistent
-        # )
-    )
-    print(f"V2 Published event: {event}", flush=True)
+    events = []
+    if email is not None:
+        events.append((USER_EMAIL_UPDATED, {'userId': user_id, 'userEmails': email}))
+    if address is not None:
+        events.append((USER_ADDRESS_UPDATED, {'userId': user_id, 'deliveryAddress': address}))
+    if not events:
+        return
+
+    channel, connection = create_channel()
+    tracer = get_tracer()
+    for routing_key, event in events:
+        event['eventType'] = routing_key
+        event['publishedAt'] = datetime.now(timezone.utc).isoformat()
+        if version is not None:
+            event['version'] = version.replace(tzinfo=timezone.utc).isoformat()
+        with tracer.span(f'publish {routing_key}', kind='producer',
+                         attributes={'messaging.system': 'rabbitmq',
+                                     'messaging.destination': EXCHANGE_NAME,
+                                     'messaging.rabbitmq.routing_key': routing_key}):
+            started = time.perf_counter()
+            channel.basic_publish(
+                exchange=EXCHANGE_NAME,
+                routing_key=routing_key,
+                body=json.dumps(event),
+                properties=pika.BasicProperties(
+                    headers=message_headers(),
+                    # delivery_mode=2,  # Make the message persistent
+                )
+            )
+            AMQP_PUBLISH_DURATION.observe(time.perf_counter() - started, routing_key)
+        logger.info('Published %s event', routing_key,
+                    extra={'userId': user_id, 'publishedAt': event['publishedAt']})
     connection.close()
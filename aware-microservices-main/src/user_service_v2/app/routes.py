@@ -18,11 +18,13 @@ Author:
     @TheBarzani
 """
 
-import uuid
 from datetime import datetime
 from bson.objectid import ObjectId
 from flask import request, Flask, current_app
+from pymongo import ReturnDocument
 from flask_restx import Resource
+from shared.ids import new_id
+from shared.idempotency import idempotent
 from user_service_v2.app.models import api, user_model
 from user_service_v2.app.events import publish_user_update_event
 
@@ -30,7 +32,11 @@ from user_service_v2.app.events import publish_user_update_event
 current_app : Flask
 
 service_version = 'v2'
-print(f"Using User Service: {service_version}")
+
+# The time of the write, at least a millisecond after the previous 'updatedAt' if it
+# is a date
+NEXT_UPDATED_AT = {'$max': ['$$NOW', {'$cond': [{'$eq': [{'$type': '$updatedAt'}, 'date']},
+                                                {'$add': ['$updatedAt', 1]}, None]}]}
 
 
 @api.route('/')
@@ -39,6 +45,9 @@ class UserList(Resource):
     Resource class to handle the creation of new users.
     """
     @api.expect(user_model)
+    @api.param('Idempotency-Key', 'Retries with the same key return the original response',
+               _in='header')
+    @idempotent
     @api.marshal_with(user_model, code=201)
     def post(self) -> tuple:
         """
@@ -52,6 +61,8 @@ class UserList(Resource):
         6. Generates a unique userId for the new user.
         7. Inserts the new user data into the database.
         8. Retrieves and returns the newly created user.
+        A request carrying an Idempotency-Key header that was already used returns the 
+        original response instead of creating another user.
         Returns:
             tuple: A tuple containing the newly created user data and the HTTP status code 201.
         Raises:
@@ -90,8 +101,8 @@ class UserList(Resource):
         if existing_user:
             api.abort(400, 'One or more email addresses are already in use')
 
-        # Generate a unique userId
-        data['userId'] = str(uuid.uuid4())
+        # Generate a unique, time-ordered userId
+        data['userId'] = new_id()
 
         # Set createdAt and updatedAt fields automatically
         current_time: datetime = datetime.utcnow()
@@ -159,18 +170,22 @@ class User(Resource):
         if not old_user:
             api.abort(404, "User not found")
 
-        # update date automatically
-        current_time = datetime.utcnow()
-        data['updatedAt'] = current_time
-
-        users_collection.update_one({'userId': id}, {'$set': data})
-        new_user: dict = users_collection.find_one({'userId': id})
+        # update date automatically, in the write itself: updatedAt is the version of the
+        # published events, so it must follow the order of the writes and move forward
+        # even for two updates in the same millisecond
+        new_user: dict = users_collection.find_one_and_update(
+            {'userId': id},
+            [{'$set': {**{field: {'$literal': value} for field, value in data.items()},
+                       'updatedAt': NEXT_UPDATED_AT}}],
+            return_document=ReturnDocument.AFTER)
+        if not new_user:
+            api.abort(404, "User not found")
 
-        emails: list = new_user["emails"]
-        delivery_address: dict = new_user["deliveryAddress"]
+        emails: list = new_user["emails"] if 'emails' in data else None
+        delivery_address: dict = new_user["deliveryAddress"] if 'deliveryAddress' in data else None
 
-        # Publish the update event
-        publish_user_update_event(id, emails, delivery_address)
+        # Publish an update event for each kind of change
+        publish_user_update_event(id, emails, delivery_address, new_user['updatedAt'])
         return [old_user, new_user]
     
     @api.marshal_with(user_model)
@@ -184,8 +199,9 @@ class User(Resource):
         Raises:
             HTTPException: If the user with the given ID is not found.
         """
-        users_collection = current_app.users_collection
-        user = users_collection.find_one({'userId': id})
+        users_collection = current_app.users_read_collection
+        # Concurrent reads of the same user share one query
+        user = current_app.user_reads.do(id, lambda: users_collection.find_one({'userId': id}))
         if not user:
             api.abort(404, "User not found")
         return user
@@ -0,0 +1,7 @@
+import os
+
+# The service modules read their broker settings at import time. Give them harmless
+# defaults so tests that only exercise in-process logic can import them.
+os.environ.setdefault("RABBITMQ_HOST", "localhost")
+os.environ.setdefault("RABBITMQ_PORT", "5672")
+os.environ.setdefault("RABBITMQ_QUEUE_NAME", "user_updates")
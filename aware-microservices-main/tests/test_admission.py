@@ -0,0 +1,119 @@
+import importlib
+import threading
+import time
+import pytest
+from flask import Flask
+from pymongo import monitoring
+from shared.admission import (AdmissionController, PoolWaitMonitor, init_admission_control,
+                              request_class)
+
+ADDRESS = ("localhost", 27017)
+CONFIG = {"ADMISSION_READ_LIMIT": 1, "ADMISSION_WRITE_LIMIT": 1,
+          "ADMISSION_MAX_POOL_WAIT_MS": 0, "ADMISSION_RETRY_AFTER_SECONDS": 2,
+          "ADMISSION_EXEMPT_PATHS": "/metrics, /admin/"}
+
+
+def test_reads_and_writes_have_separate_budgets():
+    assert [request_class(method) for method in ("GET", "HEAD", "POST", "PUT")] == [
+        "read", "read", "write", "write"]
+    controller = AdmissionController({"read": 2, "write": 1}, 0, PoolWaitMonitor())
+    assert controller.admit("read") is None
+    assert controller.admit("read") is None
+    assert controller.admit("read") == "concurrency"
+    assert controller.admit("write") is None
+    assert controller.admit("write") == "concurrency"
+    controller.release("read")
+    assert controller.admit("read") is None
+    assert controller.in_flight() == {"read": 2, "write": 1}
+
+
+def test_requests_are_shed_while_checkouts_wait_too_long():
+    monitor = PoolWaitMonitor()
+    controller = AdmissionController({}, 50, monitor)
+    started = threading.Event()
+    release = threading.Event()
+
+    def checkout():
+        monitor.connection_check_out_started(monitoring.ConnectionCheckOutStartedEvent(ADDRESS))
+        started.set()
+        release.wait(5)
+        monitor.connection_checked_out(monitoring.ConnectionCheckedOutEvent(ADDRESS, 1, 0.2))
+
+    waiter = threading.Thread(target=checkout)
+    waiter.start()
+    started.wait(5)
+    assert controller.admit("read") is None
+    time.sleep(0.06)
+    assert controller.admit("read") == "pool_wait"
+    assert controller.admit("write") == "pool_wait"
+    release.set()
+    waiter.join()
+    # The slow checkout is remembered, but with no checkout waiting requests are admitted
+    assert monitor.wait_seconds() > 0.03
+    assert controller.admit("write") is None
+
+
+def test_pool_wait_decays_without_checkouts():
+    monitor = PoolWaitMonitor(half_life_seconds=0.05)
+    monitor.record(1.0)
+    assert 0.1 < monitor.wait_seconds() <= 0.2
+    time.sleep(0.25)
+    assert monitor.wait_seconds() < 0.01
+
+
+def test_excess_requests_are_answered_with_503():
+    app = Flask(__name__)
+    app.config.update(CONFIG)
+    init_admission_control(app)
+    entered = threading.Event()
+    release = threading.Event()
+
+    @app.route("/users/<user_id>", methods=["GET", "PUT"])
+    def user(user_id):
+        entered.set()
+        release.wait(5)
+        return {"userId": user_id}
+
+    @app.route("/metrics")
+    def metrics():
+        return "ok"
+
+    client = app.test_client()
+    responses = []
+    slow = threading.Thread(target=lambda: responses.append(client.get("/users/u1")))
+    slow.start()
+    entered.wait(5)
+    rejected = client.get("/users/u2")
+    assert rejected.status_code == 503
+    assert rejected.headers["Retry-After"] == "2"
+    assert rejected.get_json() == {"message": "Service overloaded, retry later"}
+    # Exempt paths are always served
+    assert client.get("/metrics").status_code == 200
+    release.set()
+    assert client.put("/users/u3").status_code == 200
+    slow.join()
+    assert responses[0].status_code == 200
+    # A request holds its slot until the server closes its response
+    assert client.get("/users/u4").status_code == 503
+    responses[0].close()
+    assert client.get("/users/u4").status_code == 200
+
+
+def test_admission_control_is_not_installed_without_limits():
+    app = Flask(__name__)
+    wsgi_app = app.wsgi_app
+    app.config.update(CONFIG, ADMISSION_READ_LIMIT=0, ADMISSION_WRITE_LIMIT=0)
+    init_admission_control(app)
+    assert app.wsgi_app == wsgi_app
+
+
+@pytest.mark.parametrize("service", ["order_service", "user_service_v1", "user_service_v2"])
+def test_admission_control_is_off_by_default(service, monkeypatch):
+    for name in ("ADMISSION_READ_LIMIT", "ADMISSION_WRITE_LIMIT", "ADMISSION_MAX_POOL_WAIT_MS"):
+        monkeypatch.delenv(name, raising=False)
+    config = importlib.reload(importlib.import_module(f"{service}.app.config")).Config
+    app = Flask(__name__)
+    wsgi_app = app.wsgi_app
+    app.config.from_object(config)
+    init_admission_control(app)
+    assert app.wsgi_app == wsgi_app
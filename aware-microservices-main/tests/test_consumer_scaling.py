@@ -0,0 +1,111 @@
+import threading
+import pytest
+from order_service.app.consumer_scaling import (ApplyLatencyTracker, ConcurrencyController,
+                                                ConsumerPool)
+
+APPLY_SECONDS = 0.05
+TICK_SECONDS = 5
+
+
+class SimulatedBroker:
+    """A queue whose consumers each apply one event every APPLY_SECONDS."""
+
+    def __init__(self):
+        self.backlog = 0
+        self.consumers = 0
+
+    # ConsumerPool interface
+    @property
+    def size(self):
+        return self.consumers
+
+    def grow(self, count=1):
+        self.consumers += count
+
+    def shrink(self, count=1):
+        self.consumers -= count
+
+    def stop(self):
+        self.consumers = 0
+
+    def tick(self, published=0):
+        self.backlog += published
+        drained = int(self.consumers * TICK_SECONDS / APPLY_SECONDS)
+        self.backlog = max(0, self.backlog - drained)
+
+
+@pytest.fixture
+def broker():
+    return SimulatedBroker()
+
+
+@pytest.fixture
+def controller(broker):
+    latency = ApplyLatencyTracker()
+    latency.record(APPLY_SECONDS)
+    return ConcurrencyController(broker, lambda: broker.backlog, latency,
+                                 min_consumers=1, max_consumers=4,
+                                 target_drain_seconds=10, scale_up_samples=2,
+                                 scale_down_samples=3)
+
+
+def run(controller, broker, published):
+    sizes = []
+    for count in published:
+        broker.tick(count)
+        sizes.append(controller.step())
+    return sizes
+
+
+def test_starts_minimum_consumers(controller, broker):
+    controller.step()
+    assert broker.consumers == 1
+
+
+def test_bulk_backlog_scales_up_and_drains(controller, broker):
+    controller.step()
+    sizes = run(controller, broker, [2000] + [0] * 10)
+    assert max(sizes) == 4
+    assert broker.backlog == 0
+
+
+def test_scales_down_to_minimum_when_idle(controller, broker):
+    controller.step()
+    run(controller, broker, [2000] + [0] * 5)
+    sizes = run(controller, broker, [0] * 20)
+    assert sizes[-1] == 1
+    # Releases one consumer at a time
+    assert all(later >= earlier - 1 for earlier, later in zip(sizes, sizes[1:]))
+
+
+def test_steady_load_near_threshold_does_not_flap(controller, broker):
+    controller.step()
+    # Bursts that push the drain estimate just past the target for a single sample
+    sizes = run(controller, broker, [320, 0] * 20)
+    changes = sum(1 for earlier, later in zip(sizes, sizes[1:]) if earlier != later)
+    assert changes <= 2
+
+
+def test_pool_stops_consumers():
+    started = threading.Barrier(3)
+    stopped = []
+
+    def consumer(stop_event):
+        started.wait()
+        stop_event.wait()
+        stopped.append(True)
+
+    pool = ConsumerPool(consumer)
+    pool.grow(2)
+    started.wait(timeout=5)
+    assert pool.size == 2
+    pool.shrink()
+    assert pool.size == 1
+    pool.stop()
+    assert pool.size == 0
+
+
+def test_rejects_invalid_bounds(broker):
+    with pytest.raises(ValueError):
+        ConcurrencyController(broker, lambda: 0, ApplyLatencyTracker(), min_consumers=3,
+                              max_consumers=2)
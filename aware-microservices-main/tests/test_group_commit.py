@@ -0,0 +1,93 @@
+import threading
+import time
+import pytest
+from bson.objectid import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError, WriteConcernError, WriteError
+from order_service.app.group_commit import GroupCommitWriter
+
+
+class RecordingCollection:
+    """Stands in for a collection: records the batches and rejects duplicate orderIds."""
+
+    def __init__(self, latency=0.005, write_concern_error=None):
+        self.latency = latency
+        self.write_concern_error = write_concern_error
+        self.batches = []
+        self.order_ids = set()
+
+    def insert_many(self, documents, ordered=True):
+        time.sleep(self.latency)
+        self.batches.append(len(documents))
+        errors = []
+        for index, document in enumerate(documents):
+            if document["orderId"] in self.order_ids:
+                errors.append({"index": index, "code": 11000, "errmsg": "duplicate key"})
+                continue
+            self.order_ids.add(document["orderId"])
+            document["_id"] = ObjectId()
+        concern_errors = [self.write_concern_error] if self.write_concern_error else []
+        if errors or concern_errors:
+            raise BulkWriteError({"writeErrors": errors, "writeConcernErrors": concern_errors,
+                                  "nInserted": len(documents) - len(errors)})
+
+
+def insert_concurrently(writer, order_ids):
+    results = {}
+
+    def insert(order_id):
+        try:
+            results[order_id] = writer.insert({"orderId": order_id}, timeout=5)
+        except (WriteError, WriteConcernError) as error:
+            results[order_id] = error
+
+    threads = [threading.Thread(target=insert, args=(order_id,)) for order_id in order_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_inserts_share_batches():
+    collection = RecordingCollection()
+    writer = GroupCommitWriter(collection, window_seconds=0.02, max_batch=50)
+    results = insert_concurrently(writer, [f"o{i}" for i in range(100)])
+    writer.stop()
+    assert all(isinstance(result, ObjectId) for result in results.values())
+    assert sum(collection.batches) == 100
+    assert len(collection.batches) < 10
+    assert max(collection.batches) <= 50
+
+
+def test_each_request_gets_its_own_error():
+    collection = RecordingCollection()
+    collection.order_ids.add("taken")
+    writer = GroupCommitWriter(collection, window_seconds=0.02)
+    results = insert_concurrently(writer, ["a", "taken", "b"])
+    writer.stop()
+    assert isinstance(results["a"], ObjectId) and isinstance(results["b"], ObjectId)
+    assert isinstance(results["taken"], DuplicateKeyError)
+
+
+def test_write_concern_errors_fail_the_written_documents():
+    collection = RecordingCollection(write_concern_error={
+        "code": 64, "errmsg": "waiting for replication timed out"})
+    collection.order_ids.add("taken")
+    writer = GroupCommitWriter(collection, window_seconds=0.02)
+    results = insert_concurrently(writer, ["a", "taken", "b"])
+    writer.stop()
+    assert isinstance(results["taken"], DuplicateKeyError)
+    for order_id in ("a", "b"):
+        assert isinstance(results[order_id], WriteConcernError)
+        assert results[order_id].code == 64
+
+
+def test_connection_errors_fail_the_whole_batch():
+    class BrokenCollection:
+        def insert_many(self, documents, ordered=True):
+            raise ConnectionError("down")
+
+    writer = GroupCommitWriter(BrokenCollection())
+    with pytest.raises(ConnectionError):
+        writer.insert({"orderId": "o1"}, timeout=5)
+    writer.stop()
@@ -0,0 +1,134 @@
+import os
+import threading
+import time
+import pymongo
+import pytest
+from dotenv import load_dotenv
+from flask import Flask
+from flask_restx import Api, Namespace, Resource, fields
+from shared.idempotency import ensure_idempotency_index, idempotent
+
+load_dotenv()
+
+
+# Fixture for a Flask-RESTx app whose POST handler counts its executions
+@pytest.fixture
+def app():
+    client = pymongo.MongoClient(os.getenv("MONGO_URI", "mongodb://localhost:27017"),
+                                 serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command("ping")
+    except pymongo.errors.PyMongoError:
+        pytest.skip("MongoDB is not reachable")
+
+    app = Flask(__name__)
+    app.config.update(IDEMPOTENCY_TTL_SECONDS=60, IDEMPOTENCY_PENDING_TIMEOUT_SECONDS=30)
+    app.idempotency_collection = client["test_idempotency"]["idempotency_keys"]
+    ensure_idempotency_index(app.idempotency_collection, 60)
+    app.executions = []
+
+    api = Namespace("things")
+    thing_model = api.model("Thing", {"id": fields.Integer, "name": fields.String})
+
+    @api.route("/")
+    class ThingList(Resource):
+        @idempotent
+        @api.marshal_with(thing_model, code=201)
+        def post(self):
+            time.sleep(0.2)
+            app.executions.append(1)
+            return {"id": len(app.executions), "name": "thing"}, 201
+
+    Api(app).add_namespace(api, path="/things")
+    yield app
+    client.drop_database("test_idempotency")
+    client.close()
+
+
+def test_retry_returns_the_original_response(app):
+    client = app.test_client()
+    first = client.post("/things/", json={"name": "thing"}, headers={"Idempotency-Key": "k1"})
+    retry = client.post("/things/", json={"name": "thing"}, headers={"Idempotency-Key": "k1"})
+    assert first.status_code == retry.status_code == 201
+    assert retry.get_json() == first.get_json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert len(app.executions) == 1
+
+
+def test_requests_without_a_key_are_not_deduplicated(app):
+    client = app.test_client()
+    client.post("/things/", json={"name": "thing"})
+    client.post("/things/", json={"name": "thing"})
+    assert len(app.executions) == 2
+
+
+def test_key_reused_with_another_body_is_rejected(app):
+    client = app.test_client()
+    client.post("/things/", json={"name": "thing"}, headers={"Idempotency-Key": "k2"})
+    other = client.post("/things/", json={"name": "other"}, headers={"Idempotency-Key": "k2"})
+    assert other.status_code == 422
+
+
+def test_concurrent_duplicates_run_the_handler_once(app):
+    statuses = []
+
+    def post():
+        response = app.test_client().post("/things/", json={"name": "thing"},
+                                          headers={"Idempotency-Key": "k3"})
+        statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=post) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(app.executions) == 1
+    assert statuses.count(201) >= 1
+    assert set(statuses) <= {201, 409}
+
+
+class FlakyKeys:
+    """An idempotency keys collection whose first updates fail."""
+
+    def __init__(self, failures):
+        self.records = {}
+        self.failures = failures
+
+    def insert_one(self, document):
+        if document["_id"] in self.records:
+            raise pymongo.errors.DuplicateKeyError("duplicate key")
+        self.records[document["_id"]] = dict(document)
+
+    def find_one(self, query):
+        return self.records.get(query["_id"])
+
+    def update_one(self, query, update):
+        if self.failures:
+            self.failures -= 1
+            raise pymongo.errors.AutoReconnect("connection reset")
+        self.records[query["_id"]].update(update["$set"])
+
+    def delete_one(self, query):
+        self.records.pop(query["_id"], None)
+
+
+@pytest.mark.parametrize("failures, replayed", [(2, True), (3, False)])
+def test_responses_are_returned_when_storing_them_fails(failures, replayed):
+    app = Flask(__name__)
+    app.config.update(IDEMPOTENCY_PENDING_TIMEOUT_SECONDS=30)
+    app.idempotency_collection = FlakyKeys(failures)
+    executions = []
+
+    @app.route("/things/", methods=["POST"])
+    @idempotent
+    def post():
+        executions.append(1)
+        return {"id": len(executions)}, 201
+
+    client = app.test_client()
+    first = client.post("/things/", json={}, headers={"Idempotency-Key": "k1"})
+    retry = client.post("/things/", json={}, headers={"Idempotency-Key": "k1"})
+    assert first.status_code == 201 and first.get_json() == {"id": 1}
+    # The response is stored after retries, or the key stays claimed by the first request
+    assert retry.status_code == (201 if replayed else 409)
+    assert len(executions) == 1
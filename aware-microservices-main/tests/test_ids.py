@@ -0,0 +1,39 @@
+import threading
+import uuid
+from datetime import datetime, timedelta
+from shared.ids import ID_LENGTH, id_floor, id_timestamp, is_valid_id, new_id
+
+
+def test_ids_are_compact_and_valid():
+    identifier = new_id()
+    assert len(identifier) == ID_LENGTH == 26
+    assert is_valid_id(identifier)
+    assert not is_valid_id(str(uuid.uuid4()))
+
+
+def test_ids_are_strictly_increasing_as_strings():
+    identifiers = [new_id() for _ in range(20000)]
+    assert identifiers == sorted(identifiers)
+    assert len(set(identifiers)) == len(identifiers)
+
+
+def test_ids_are_unique_across_threads():
+    identifiers = []
+
+    def generate():
+        identifiers.extend(new_id() for _ in range(5000))
+
+    threads = [threading.Thread(target=generate) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(identifiers)) == 20000
+
+
+def test_ids_carry_their_creation_time():
+    before = datetime.utcnow() - timedelta(milliseconds=1)
+    identifier = new_id()
+    assert before <= id_timestamp(identifier) <= datetime.utcnow() + timedelta(seconds=1)
+    assert id_floor(before) <= identifier
+    assert identifier < id_floor(datetime.utcnow() + timedelta(seconds=5))
@@ -0,0 +1,113 @@
+import io
+import json
+import logging
+import logging.handlers
+import queue
+import time
+from types import SimpleNamespace
+import pytest
+from flask import Flask
+from shared.log import (JsonFormatter, QueueingHandler, SamplingFilter, init_request_logging,
+                        parse_sampling)
+from shared.tracing import Tracer
+
+
+def json_lines(records):
+    """Routes the records of a logger through the queue handler and the JSON formatter."""
+    handler = QueueingHandler(records)
+    logger = logging.getLogger("test_log.events")
+    logger.handlers[:] = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    return logger
+
+
+def format_queued(records):
+    formatter = JsonFormatter("user-service-v2")
+    lines = []
+    while not records.empty():
+        lines.append(json.loads(formatter.format(records.get_nowait())))
+    return lines
+
+
+def test_records_carry_their_request_and_trace_ids_and_extra_fields():
+    records = queue.Queue()
+    logger = json_lines(records)
+    app = Flask(__name__)
+    init_request_logging(app)
+
+    @app.route("/users/<user_id>", methods=["PUT"])
+    def update_user(user_id):
+        tracer = Tracer("user-service-v2", SimpleNamespace(export=lambda span: None))
+        with tracer.span("PUT /users/<user_id>"):
+            logger.info("Published %s event", "user.email.updated", extra={"userId": user_id})
+        return {"userId": user_id}
+
+    response = app.test_client().put("/users/u1", headers={"X-Request-ID": "req-1"})
+    assert response.headers["X-Request-ID"] == "req-1"
+    logger.info("Outside of requests")
+    inside, outside = format_queued(records)
+    assert inside["message"] == "Published user.email.updated event"
+    assert inside["service"] == "user-service-v2" and inside["level"] == "INFO"
+    assert inside["requestId"] == "req-1" and inside["userId"] == "u1"
+    assert len(inside["traceId"]) == 32 and len(inside["spanId"]) == 16
+    assert "requestId" not in outside and "traceId" not in outside
+
+
+def test_invalid_request_ids_are_replaced():
+    app = Flask(__name__)
+    init_request_logging(app)
+    app.add_url_rule("/users/", "users", lambda: {})
+    response = app.test_client().get("/users/", headers={"X-Request-ID": "bad id <script>"})
+    assert len(response.headers["X-Request-ID"]) == 16
+
+
+def test_arguments_are_merged_when_logged():
+    records = queue.Queue()
+    logger = json_lines(records)
+    event = {"userId": "u1"}
+    logger.info("Event %s", event)
+    event["userId"] = "changed"
+    assert format_queued(records)[0]["message"] == "Event {'userId': 'u1'}"
+
+
+def test_records_below_warning_are_dropped_when_the_queue_is_full():
+    records = queue.Queue(1)
+    logger = json_lines(records)
+    logger.info("kept")
+    logger.info("dropped")
+    assert [line["message"] for line in format_queued(records)] == ["kept"]
+
+
+def test_sampling_applies_to_child_loggers_below_warning():
+    assert parse_sampling("user_service_v2.app.events=0, order_service=0.5") == {
+        "user_service_v2.app.events": 0.0, "order_service": 0.5}
+    with pytest.raises(ValueError):
+        parse_sampling("user_service_v2.app.events=2")
+    sampling = SamplingFilter({"user_service_v2.app": 0.0})
+    record = logging.makeLogRecord({"name": "user_service_v2.app.events",
+                                    "levelno": logging.INFO})
+    assert not sampling.filter(record)
+    record.levelno = logging.WARNING
+    assert sampling.filter(record)
+    assert sampling.filter(logging.makeLogRecord({"name": "order_service.app",
+                                                  "levelno": logging.INFO}))
+
+
+def test_slow_sinks_do_not_block_the_logging_thread():
+    class SlowStream(io.StringIO):
+        def write(self, text):
+            time.sleep(0.05)
+            return super().write(text)
+
+    records = queue.Queue()
+    logger = json_lines(records)
+    listener = logging.handlers.QueueListener(records, logging.StreamHandler(SlowStream()))
+    listener.start()
+    try:
+        started = time.perf_counter()
+        for index in range(5):
+            logger.info("Event %d", index)
+        assert time.perf_counter() - started < 0.05
+    finally:
+        listener.stop()
@@ -0,0 +1,74 @@
+import tracemalloc
+from flask import Flask
+from shared.memory import AllocationTracker, MemoryMiddleware, init_memory_diagnostics
+from shared.metrics import Registry, init_metrics
+
+CONFIG = {"MEMORY_DIAGNOSTICS": True, "MEMORY_TRACE_FRAMES": 1, "MEMORY_RSS_LIMIT_MB": 0}
+
+
+def create_app(config):
+    app = Flask(__name__)
+    app.config.update(config)
+    init_metrics(app, Registry())
+    init_memory_diagnostics(app)
+
+    @app.route("/orders/")
+    def list_orders():
+        orders = [{"orderId": f"order-{index}", "items": [index] * 10} for index in range(5000)]
+        return {"count": len(orders)}
+
+    return app
+
+
+def test_diagnostics_are_off_by_default():
+    app = create_app({**CONFIG, "MEMORY_DIAGNOSTICS": False})
+    assert not isinstance(app.wsgi_app, MemoryMiddleware)
+    assert app.test_client().get("/admin/memory").status_code == 404
+
+
+def test_peak_allocation_is_recorded_by_route():
+    was_tracing = tracemalloc.is_tracing()
+    try:
+        client = create_app(CONFIG).test_client()
+        client.get("/orders/").close()
+        client.get("/orders/").close()
+        memory = client.get("/admin/memory", query_string={"limit": 5}).get_json()
+        route = memory["routes"]["GET /orders/"]
+        assert route["requests"] == route["sampled"] == 2
+        # 5000 dicts and lists outweigh a megabyte
+        assert route["peakBytes"] > 2 ** 20
+        assert 0 < len(memory["topAllocations"]) <= 5
+        assert {"site", "sizeBytes", "count"} == set(memory["topAllocations"][0])
+        assert client.get("/admin/memory", query_string={"groupBy": "x"}).status_code == 400
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+
+
+def test_overlapping_requests_are_not_measured():
+    was_tracing = tracemalloc.is_tracing()
+    tracemalloc.start()
+    try:
+        tracker = AllocationTracker()
+        first = tracker.start()
+        second = tracker.start()
+        tracker.finish(second, "GET", "/orders/")
+        tracker.finish(first, "GET", "/orders/")
+        alone = tracker.start()
+        tracker.finish(alone, "GET", "/orders/")
+        assert tracker.stats()["GET /orders/"]["requests"] == 3
+        assert tracker.stats()["GET /orders/"]["sampled"] == 1
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+
+
+def test_rss_watermark_recycles_gunicorn_workers_only(monkeypatch, caplog):
+    killed = []
+    monkeypatch.setattr("shared.memory.os.kill", lambda pid, sig: killed.append(sig))
+    middleware = MemoryMiddleware(lambda environ, start_response: [], None, rss_limit=1)
+    middleware.check_rss("Werkzeug/3.1")
+    assert not killed and "above the 0 MiB watermark" in caplog.text
+    middleware.check_rss("gunicorn/23.0.0")
+    middleware.check_rss("gunicorn/23.0.0")
+    assert len(killed) == 1 and middleware.recycling
@@ -0,0 +1,79 @@
+import pytest
+from flask import Flask
+from shared.metrics import Registry, init_metrics
+from shared.singleflight import SingleFlight, collect_metrics
+
+
+def test_counter_and_gauge_render_in_text_format():
+    registry = Registry()
+    events = registry.counter("events_total", "Events.", ("queue",))
+    events.inc("email")
+    events.inc("email", amount=2)
+    events.inc('quo"te')
+    in_flight = registry.gauge("in_flight", "In flight.")
+    in_flight.inc()
+    in_flight.inc()
+    in_flight.dec()
+    text = registry.render()
+    assert "# TYPE events_total counter\n" in text
+    assert 'events_total{queue="email"} 3\n' in text
+    assert 'events_total{queue="quo\\"te"} 1\n' in text
+    assert "in_flight 1\n" in text
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    latency = registry.histogram("latency_seconds", "Latency.", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        latency.observe(value, "/users")
+    text = registry.render()
+    assert 'latency_seconds_bucket{route="/users",le="0.1"} 1\n' in text
+    assert 'latency_seconds_bucket{route="/users",le="1"} 3\n' in text
+    assert 'latency_seconds_bucket{route="/users",le="+Inf"} 4\n' in text
+    assert 'latency_seconds_sum{route="/users"} 6.05\n' in text
+    assert 'latency_seconds_count{route="/users"} 4\n' in text
+
+
+def test_metrics_are_registered_once():
+    registry = Registry()
+    assert registry.counter("a_total", "A.") is registry.counter("a_total", "A.")
+    with pytest.raises(ValueError):
+        registry.gauge("a_total", "A.")
+    with pytest.raises(ValueError):
+        registry.counter("a_total", "A.").inc("unexpected")
+
+
+def test_collectors_are_replaced_by_name():
+    registry = Registry()
+    group = SingleFlight("users")
+    group.do("u1", lambda: None)
+    registry.register_collector("singleflight", lambda: collect_metrics([SingleFlight("old")]))
+    registry.register_collector("singleflight", lambda: collect_metrics([group]))
+    text = registry.render()
+    assert 'singleflight_calls_total{group="users"} 1\n' in text
+    assert 'group="old"' not in text
+
+
+def test_requests_are_recorded_by_route_and_status():
+    app = Flask(__name__)
+    registry = Registry()
+    init_metrics(app, registry)
+
+    @app.route("/users/<user_id>")
+    def get_user(user_id):
+        return {"userId": user_id}, 404 if user_id == "missing" else 200
+
+    client = app.test_client()
+    # Requests are recorded when the server closes their response
+    for user_id in ("1", "2", "missing"):
+        client.get(f"/users/{user_id}").close()
+    client.get("/unknown").close()
+    response = client.get("/metrics")
+    assert response.content_type.startswith("text/plain; version=0.0.4")
+    text = response.get_data(as_text=True)
+    assert ('http_request_duration_seconds_count{method="GET",route="/users/<user_id>",'
+            'status="200"} 2') in text
+    assert ('http_request_duration_seconds_count{method="GET",route="/users/<user_id>",'
+            'status="404"} 1') in text
+    assert 'route="unmatched",status="404"} 1' in text
+    assert "http_requests_in_flight 1\n" in text
@@ -0,0 +1,81 @@
+import os
+import pymongo
+import pytest
+from dotenv import load_dotenv
+from pymongo import monitoring
+from pymongo.read_preferences import Primary, SecondaryPreferred
+from shared.mongo import client_options, create_mongo_client, read_collection, read_preference
+
+load_dotenv()
+
+CONFIG = {
+    "MONGO_URI": os.getenv("MONGO_URI", "mongodb://localhost:27017"),
+    "MONGO_MAX_POOL_SIZE": 50,
+    "MONGO_MIN_POOL_SIZE": 0,
+    "MONGO_CONNECT_TIMEOUT_MS": 0,
+    "MONGO_SOCKET_TIMEOUT_MS": 0,
+    "MONGO_SERVER_SELECTION_TIMEOUT_MS": 2000,
+    "MONGO_WAIT_QUEUE_TIMEOUT_MS": 0,
+    "MONGO_READ_PREFERENCE": "secondaryPreferred",
+    "MONGO_MAX_STALENESS_SECONDS": 90,
+    "MONGO_SLOW_QUERY_MS": 0,
+}
+
+
+def test_unset_timeouts_keep_the_driver_defaults():
+    assert client_options(CONFIG) == {"maxPoolSize": 50, "minPoolSize": 0,
+                                      "serverSelectionTimeoutMS": 2000}
+
+
+def test_read_preference_settings():
+    preference = read_preference(CONFIG)
+    assert isinstance(preference, SecondaryPreferred)
+    assert preference.max_staleness == 90
+    assert isinstance(read_preference({**CONFIG, "MONGO_READ_PREFERENCE": "primary"}), Primary)
+    with pytest.raises(ValueError):
+        read_preference({**CONFIG, "MONGO_MAX_STALENESS_SECONDS": 30})
+    with pytest.raises(ValueError):
+        read_preference({**CONFIG, "MONGO_READ_PREFERENCE": "secondaryOnly"})
+
+
+class FindListener(monitoring.CommandListener):
+    def __init__(self):
+        self.servers = []
+
+    def started(self, event):
+        if event.command_name == "find":
+            self.servers.append(event.connection_id)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+# Run against a local replica set with a secondary, for example
+# MONGO_URI="mongodb://localhost:27017,localhost:27018/?replicaSet=rs0"
+def test_read_only_collections_read_from_a_secondary():
+    listener = FindListener()
+    client = pymongo.MongoClient(CONFIG["MONGO_URI"], serverSelectionTimeoutMS=2000,
+                                 event_listeners=[listener])
+    try:
+        hello = client.admin.command("hello")
+    except pymongo.errors.PyMongoError:
+        pytest.skip("MongoDB is not reachable")
+    if not hello.get("setName") or not hello.get("hosts") or len(hello["hosts"]) < 2:
+        pytest.skip("MongoDB is not a replica set with a secondary")
+
+    service_client = create_mongo_client(CONFIG)
+    assert service_client.options.pool_options.max_pool_size == 50
+    service_client.close()
+
+    collection = client["test_mongo_read_preference"]["users"]
+    collection.insert_one({"userId": "u1"})
+    primary = client.primary
+    read_collection(collection, CONFIG).find_one({"userId": "u0"})
+    collection.find_one({"userId": "u0"})
+    assert listener.servers[0] != primary
+    assert listener.servers[1] == primary
+    client.drop_database("test_mongo_read_preference")
+    client.close()
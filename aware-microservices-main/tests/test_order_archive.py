@@ -0,0 +1,96 @@
+import os
+from datetime import datetime, timedelta
+import pymongo
+import pytest
+from dotenv import load_dotenv
+from flask import Flask
+from order_service.app.archive import archive_orders, archive_query
+from order_service.app.broadcast import OrderEventBroadcaster
+from order_service.app.events import apply_user_update
+from order_service.app.indexes import ensure_indexes
+from order_service.app.partitions import DEFAULT_PARTITION, OrderPartition, PartitionRouter
+from order_service.app.queries import find_user_orders
+from order_service.jobs.archive_orders import archive
+
+load_dotenv()
+
+NOW = datetime.utcnow()
+
+
+# Fixture for a scratch database on the MongoDB from MONGO_URI
+@pytest.fixture
+def db():
+    client = pymongo.MongoClient(os.getenv("MONGO_URI", "mongodb://localhost:27017"),
+                                 serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command("ping")
+    except pymongo.errors.PyMongoError:
+        pytest.skip("MongoDB is not reachable")
+    db = client["test_order_archive"]
+    ensure_indexes(db)
+    db.orders.insert_many([
+        {
+            "orderId": f"o{i:03d}",
+            "userId": "u1",
+            "orderStatus": "delivered" if i % 2 else "shipping",
+            "createdAt": NOW - timedelta(days=200 - i),
+            "updatedAt": NOW - timedelta(days=100 - i),
+            **({"deliveredAt": NOW - timedelta(days=100 - i)} if i % 2 else {}),
+        }
+        for i in range(40)
+    ])
+    yield db
+    client.drop_database(db.name)
+    client.close()
+
+
+def test_archive_moves_only_old_deliveries_and_is_idempotent(db):
+    totals = archive(db, days=90, batch_size=3, rate=0)
+    # Delivered 100 to 61 days ago, every other order: o001, o003, ..., o009
+    assert totals["archived"] == 5
+    assert sorted(order["orderId"] for order in db.orders_archive.find()) == [
+        "o001", "o003", "o005", "o007", "o009"]
+    assert db.orders.count_documents({}) == 35
+    assert archive(db, days=90, batch_size=3, rate=0)["archived"] == 0
+
+
+def test_interrupted_batch_is_replayed_safely(db):
+    batch = list(db.orders.find(archive_query(NOW - timedelta(days=90))))
+    db.orders_archive.insert_many([dict(order) for order in batch[:2]])
+    db.orders.update_one({"orderId": batch[0]["orderId"]}, {"$set": {"updatedAt": NOW}})
+
+    assert archive_orders(db.orders, db.orders_archive, batch) == len(batch) - 1
+    assert db.orders_archive.count_documents({}) == len(batch)
+    # The order changed meanwhile stays hot until the next run
+    assert db.orders.count_documents({"orderId": batch[0]["orderId"]}) == 1
+
+
+def test_orders_updated_by_a_user_event_while_archived_stay_hot(db):
+    batch = list(db.orders.find(archive_query(NOW - timedelta(days=90))))
+    app = Flask(__name__)
+    app.config.update(ORDER_CONTACT_MODE="embedded", ORDER_ARCHIVE_USER_UPDATES="skip",
+                      MONGO_READ_PREFERENCE="primary", MONGO_MAX_STALENESS_SECONDS=90,
+                      ORDER_GROUP_COMMIT=False)
+    app.order_partitions = PartitionRouter([OrderPartition(DEFAULT_PARTITION, db, app.config)])
+    app.order_rollups_collection = db.order_rollups
+    app.order_list_cache = None
+    app.order_events = OrderEventBroadcaster()
+    with app.app_context():
+        apply_user_update({"userId": "u1", "userEmails": ["new@example.com"],
+                           "publishedAt": datetime.utcnow().isoformat() + "+00:00"})
+
+    assert archive_orders(db.orders, db.orders_archive, batch) == 0
+    assert db.orders.count_documents({"userEmails": ["new@example.com"]}) == 40
+
+
+def test_user_listing_merges_the_archive(db):
+    archive(db, days=90, batch_size=10, rate=0)
+    seen, cursor = [], None
+    while True:
+        orders, cursor = find_user_orders(db.orders, "u1", 7, cursor, archive=db.orders_archive)
+        seen.extend(order["orderId"] for order in orders)
+        if cursor is None:
+            break
+    assert seen == [f"o{i:03d}" for i in reversed(range(40))]
+    hot_only, _ = find_user_orders(db.orders, "u1", 100)
+    assert len(hot_only) == 35
@@ -0,0 +1,107 @@
+import time
+import pytest
+from order_service.app.list_cache import (MemoryStore, OrderListCache, create_list_cache,
+                                          invalidate_statuses)
+
+
+def test_entries_are_served_until_their_status_is_written():
+    cache = OrderListCache(MemoryStore())
+    generation = cache.generation("shipping")
+    assert cache.get("shipping", generation, "0:") is None
+    cache.put("shipping", generation, "0:", b"[]")
+    assert cache.get("shipping", cache.generation("shipping"), "0:") == b"[]"
+
+    invalidate_statuses(cache, ["shipping", "shipping"])
+    assert cache.generation("shipping") == generation + 1
+    assert cache.get("shipping", cache.generation("shipping"), "0:") is None
+
+
+def test_writes_only_invalidate_their_statuses():
+    cache = OrderListCache(MemoryStore())
+    for status in ("under process", "delivered"):
+        cache.put(status, 0, "0:", status.encode())
+    invalidate_statuses(cache, ["under process"])
+    assert cache.get("delivered", cache.generation("delivered"), "0:") == b"delivered"
+    assert cache.get("under process", cache.generation("under process"), "0:") is None
+
+
+def test_response_of_a_racing_reader_is_never_served():
+    cache = OrderListCache(MemoryStore())
+    generation = cache.generation("shipping")
+    # A write lands while the reader queries; the reader stores what it read
+    invalidate_statuses(cache, ["shipping"])
+    cache.put("shipping", generation, "0:", b"stale")
+    assert cache.get("shipping", cache.generation("shipping"), "0:") is None
+
+
+def test_entries_expire_but_generations_do_not():
+    store = MemoryStore()
+    cache = OrderListCache(store, ttl_seconds=1)
+    cache.invalidate("delivered")
+    cache.put("delivered", 1, "1:orderId", b"[]")
+    store._values["orders:list:delivered:1:1:orderId"] = (b"[]", time.monotonic() - 1)
+    assert cache.get("delivered", 1, "1:orderId") is None
+    assert cache.generation("delivered") == 1
+
+
+def test_create_list_cache():
+    assert create_list_cache("") is None
+    assert isinstance(create_list_cache("memory://").store, MemoryStore)
+    with pytest.raises(ValueError):
+        create_list_cache("memcached://localhost")
+    invalidate_statuses(None, ["shipping"])
+
+
+class UnreachableStore(MemoryStore):
+    """A MemoryStore that fails like a Redis client while `down` is set."""
+
+    def __init__(self):
+        super().__init__()
+        self.down = False
+
+    def get(self, key):
+        if self.down:
+            raise ConnectionError("store is down")
+        return super().get(key)
+
+    def set(self, key, value, ex=None):
+        if self.down:
+            raise ConnectionError("store is down")
+        super().set(key, value, ex)
+
+    def incr(self, key):
+        if self.down:
+            raise ConnectionError("store is down")
+        return super().incr(key)
+
+
+def test_unreachable_store_falls_back_to_uncached_reads():
+    store = UnreachableStore()
+    cache = OrderListCache(store, errors=(ConnectionError,))
+    cache.put("shipping", 0, "0:", b"[]")
+    store.down = True
+    assert cache.generation("shipping") is None
+    assert cache.get("shipping", 0, "0:") is None
+    cache.put("shipping", 0, "0:", b"[]")
+    # A committed write never fails on its invalidation
+    invalidate_statuses(cache, ["shipping"])
+
+
+def test_failed_invalidations_are_retried_before_reading():
+    store = UnreachableStore()
+    cache = OrderListCache(store, errors=(ConnectionError,))
+    cache.put("shipping", 0, "0:", b"stale")
+    store.down = True
+    invalidate_statuses(cache, ["shipping"])
+    store.down = False
+    # The entry cached before the write is not served once the store is back
+    generation = cache.generation("shipping")
+    assert generation == 1
+    assert cache.get("shipping", generation, "0:") is None
+
+
+def test_other_errors_are_raised():
+    cache = OrderListCache(UnreachableStore())
+    cache.store.down = True
+    with pytest.raises(ConnectionError):
+        cache.generation("shipping")
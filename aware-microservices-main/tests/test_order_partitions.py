@@ -0,0 +1,76 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import pytest
+from order_service.app.partitions import HashRing, PartitionRouter, parse_partitions
+from order_service.app.queries import SearchFilters, merge_pages
+
+USERS = [f"user-{i}" for i in range(5000)]
+
+
+def test_parse_partitions():
+    assert parse_partitions("") == []
+    assert parse_partitions("a=mongodb://one:27017, b=mongodb://two:27017") == [
+        ("a", "mongodb://one:27017"), ("b", "mongodb://two:27017")]
+    for spec in ("mongodb://one:27017", "a=mongodb://one,a=mongodb://two",
+                 "a=mongodb://one,b=mongodb://one"):
+        with pytest.raises(ValueError):
+            parse_partitions(spec)
+
+
+def test_ring_spreads_users_and_is_stable():
+    ring = HashRing(["p0", "p1", "p2"])
+    owners = [ring.node_for(user) for user in USERS]
+    for name in ("p0", "p1", "p2"):
+        assert 0.2 < owners.count(name) / len(USERS) < 0.47
+    assert owners == [HashRing(["p2", "p0", "p1"]).node_for(user) for user in USERS]
+
+
+def test_adding_a_partition_only_moves_users_to_it():
+    before = HashRing(["p0", "p1", "p2"])
+    after = HashRing(["p0", "p1", "p2", "p3"])
+    moved = [user for user in USERS if before.node_for(user) != after.node_for(user)]
+    assert all(after.node_for(user) == "p3" for user in moved)
+    assert 0.15 < len(moved) / len(USERS) < 0.35
+
+
+def test_merged_pages_paginate_like_one_collection():
+    start = datetime(2024, 1, 1)
+    orders = [{"orderId": f"o{i:03d}", "createdAt": start + timedelta(minutes=i)}
+              for i in range(30)]
+    partitions = [orders[0::3], orders[1::3], orders[2::3]]
+    filters = SearchFilters(descending=True)
+
+    def page(partition, cursor):
+        after = [order for order in sorted(partition, key=lambda o: o["createdAt"],
+                                           reverse=True)
+                 if cursor is None or order["createdAt"] < cursor["createdAt"]]
+        return after[:7], ("more" if len(after) > 7 else None)
+
+    seen, last = [], None
+    while True:
+        merged, cursor = merge_pages([page(partition, last) for partition in partitions],
+                                     filters, 7)
+        seen += merged
+        if cursor is None:
+            break
+        last = merged[-1]
+    assert [order["orderId"] for order in seen] == [f"o{i:03d}" for i in range(29, -1, -1)]
+
+
+def test_concurrent_callers_query_all_partitions_at_once():
+    partitions = [SimpleNamespace(name=f"p{i}") for i in range(3)]
+    callers = 4
+    router = PartitionRouter(partitions, concurrency=callers)
+    # Every query waits for all the others, so it only returns if none of them waits for
+    # a thread of the pool
+    everyone = threading.Barrier(callers * len(partitions), timeout=5)
+
+    def query(partition):
+        everyone.wait()
+        return partition.name
+
+    with ThreadPoolExecutor(max_workers=callers) as requests:
+        results = list(requests.map(lambda _: router.map(query), range(callers)))
+    assert results == [["p0", "p1", "p2"]] * callers
@@ -0,0 +1,55 @@
+import os
+from datetime import datetime, timedelta
+import pymongo
+import pytest
+from dotenv import load_dotenv
+from order_service.app.rollups import (country_moves, query_rollups, record_order_created,
+                                       record_order_moved, rollup_pipeline)
+
+load_dotenv()
+
+DAY = datetime(2025, 3, 1)
+
+
+# Fixture for a scratch database on the MongoDB from MONGO_URI
+@pytest.fixture
+def db():
+    client = pymongo.MongoClient(os.getenv("MONGO_URI", "mongodb://localhost:27017"),
+                                 serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command("ping")
+    except pymongo.errors.PyMongoError:
+        pytest.skip("MongoDB is not reachable")
+    yield client["test_order_rollups"]
+    client.drop_database("test_order_rollups")
+    client.close()
+
+
+def test_incremental_rollups_match_the_rebuild(db):
+    orders = [
+        {"orderId": f"o{i}", "orderStatus": "under process", "totalAmount": 10.0 * i,
+         "deliveryAddress": {"country": ["Canada", "USA"][i % 2]},
+         "createdAt": DAY + timedelta(hours=5 * i)}
+        for i in range(10)
+    ]
+    for order in orders:
+        db.orders.insert_one(dict(order))
+        record_order_created(db.order_rollups, order)
+
+    # Ship half of the orders and move two of them to another country
+    for order in orders[:5]:
+        db.orders.update_one({"orderId": order["orderId"]}, {"$set": {"orderStatus": "shipping"}})
+        record_order_moved(db.order_rollups, [(order, "orderStatus", "under process",
+                                               "shipping")])
+    address = {"country": "UK"}
+    db.orders.update_many({"orderId": {"$in": ["o0", "o1"]}}, {"$set": {"deliveryAddress": address}})
+    record_order_moved(db.order_rollups, country_moves(orders[:2], address))
+
+    rebuilt = {rollup["_id"]: rollup for rollup in db.orders.aggregate(rollup_pipeline())}
+    incremental = {rollup["_id"]: rollup for rollup in db.order_rollups.find({"orders": {"$gt": 0}})}
+    assert incremental == rebuilt
+
+    by_status = query_rollups(db.order_rollups, "orderStatus", DAY, DAY + timedelta(days=1))
+    assert [(rollup["day"], rollup["value"], rollup["orders"], rollup["revenue"])
+            for rollup in by_status] == [(DAY, "shipping", 5, 100.0),
+                                         (DAY + timedelta(days=1), "under process", 5, 350.0)]
@@ -0,0 +1,216 @@
+import itertools
+import os
+from datetime import datetime, timedelta
+import pymongo
+import pytest
+from dotenv import load_dotenv
+from order_service.app.indexes import ensure_indexes
+from order_service.app.queries import (SearchFilters, build_search_plan, build_search_plans,
+                                       decode_cursor, encode_cursor, find_user_orders,
+                                       iter_user_orders, search_orders)
+
+load_dotenv()
+
+NOW = datetime(2025, 3, 1)
+
+
+# Fixture for a scratch orders collection on the MongoDB from MONGO_URI
+@pytest.fixture(scope="module")
+def orders_collection():
+    client = pymongo.MongoClient(os.getenv("MONGO_URI", "mongodb://localhost:27017"),
+                                 serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command("ping")
+    except pymongo.errors.PyMongoError:
+        pytest.skip("MongoDB is not reachable")
+    db = client["test_order_search_indexes"]
+    ensure_indexes(db)
+    db.orders.insert_many([
+        {
+            "orderId": f"o{i:04d}",
+            "userId": f"u{i % 10}",
+            "orderStatus": ["under process", "shipping", "delivered"][i % 3],
+            "createdAt": NOW - timedelta(hours=i),
+            "updatedAt": NOW - timedelta(minutes=i),
+            "totalAmount": float(i % 50),
+        }
+        for i in range(300)
+    ])
+    yield db.orders
+    client.drop_database(db.name)
+    client.close()
+
+
+def filter_combinations():
+    """Every combination of the supported filters, with each sort order."""
+    options = {
+        "user_id": [None, "u1"],
+        "statuses": [[], ["shipping"], ["under process", "shipping"]],
+        "created": [None, (NOW - timedelta(days=5), NOW)],
+        "updated": [None, (NOW - timedelta(hours=2), NOW)],
+        "total": [None, (10.0, 30.0)],
+        "sort": [(field, descending) for field in ("createdAt", "updatedAt", "totalAmount")
+                 for descending in (True, False)],
+        "cursor": [False, True],
+    }
+    for values in itertools.product(*options.values()):
+        combination = dict(zip(options, values))
+        sort_field, descending = combination["sort"]
+        filters = SearchFilters(user_id=combination["user_id"],
+                                statuses=combination["statuses"],
+                                sort_field=sort_field, descending=descending)
+        if combination["created"]:
+            filters.created_from, filters.created_to = combination["created"]
+        if combination["updated"]:
+            filters.updated_from, filters.updated_to = combination["updated"]
+        if combination["total"]:
+            filters.total_from, filters.total_to = combination["total"]
+        if combination["cursor"]:
+            value = 20.0 if sort_field == "totalAmount" else NOW - timedelta(hours=3)
+            filters.cursor = encode_cursor({"orderId": "o0100", sort_field: value}, sort_field)
+        yield filters
+
+
+def plan_stages(plan):
+    """Yields the stage names of an explain() winning plan tree."""
+    yield plan["stage"]
+    for child in [plan.get("inputStage")] + plan.get("inputStages", []):
+        if child:
+            yield from plan_stages(child)
+
+
+@pytest.mark.parametrize("filters", list(filter_combinations()))
+def test_search_uses_an_index(orders_collection, filters):
+    for plan in build_search_plans(filters):
+        explain = (orders_collection.find(plan.query).sort(plan.sort).hint(plan.hint)
+                   .explain())
+        stages = list(plan_stages(explain["queryPlanner"]["winningPlan"]))
+        assert "IXSCAN" in stages
+        assert "COLLSCAN" not in stages
+        # The index provides the order, so no blocking in-memory sort is needed
+        assert "SORT" not in stages
+
+
+def test_searches_for_several_statuses_run_one_query_per_status():
+    filters = SearchFilters(statuses=["shipping", "delivered", "shipping"])
+    plans = build_search_plans(filters)
+    assert [plan.query for plan in plans] == [{"orderStatus": {"$in": ["shipping"]}},
+                                              {"orderStatus": {"$in": ["delivered"]}}]
+    assert {plan.hint for plan in plans} == {"orders_orderStatus_createdAt"}
+    # The orders of one user are filtered on status within the user's index range
+    filters.user_id = "u1"
+    assert [plan.hint for plan in build_search_plans(filters)] == ["orders_userId_createdAt"]
+
+
+class UnindexedCollection:
+    """A collection whose search indexes are still being built."""
+
+    full_name = "orders.orders"
+
+    def __init__(self, orders):
+        self.orders = orders
+
+    def find(self, query, projection=None):
+        return UnindexedCursor(self.orders)
+
+
+class UnindexedCursor:
+    def __init__(self, orders):
+        self.orders = orders
+        self.hinted = False
+
+    def sort(self, sort):
+        return self
+
+    def hint(self, index):
+        self.hinted = True
+        return self
+
+    def limit(self, limit):
+        self.orders = self.orders[:limit]
+        return self
+
+    def __iter__(self):
+        if self.hinted:
+            raise pymongo.errors.OperationFailure(
+                "error processing query: planner returned error :: caused by :: hint "
+                "provided does not correspond to an existing index", 2)
+        return iter(self.orders)
+
+
+def test_searches_run_without_missing_indexes():
+    orders = [{"orderId": f"o{i}", "createdAt": NOW - timedelta(hours=i)} for i in range(3)]
+    page, cursor = search_orders(UnindexedCollection(orders), SearchFilters(), 2,
+                                 archive=UnindexedCollection([]))
+    assert [order["orderId"] for order in page] == ["o0", "o1"]
+    assert cursor is not None
+
+
+def test_cursors_after_orders_without_a_sort_value():
+    cursor = encode_cursor({"orderId": "o1"}, "totalAmount")
+    assert decode_cursor(cursor) == (None, "o1")
+    ascending = build_search_plan(SearchFilters(sort_field="totalAmount", descending=False,
+                                                cursor=cursor))
+    assert ascending.query == {"$or": [{"totalAmount": None, "orderId": {"$gt": "o1"}},
+                                       {"totalAmount": {"$ne": None}}]}
+    # Orders without a value come last in descending order
+    descending = build_search_plan(SearchFilters(sort_field="totalAmount", cursor=cursor))
+    assert descending.query == {"$or": [{"totalAmount": None, "orderId": {"$lt": "o1"}}]}
+    after_value = build_search_plan(SearchFilters(
+        sort_field="totalAmount", cursor=encode_cursor({"orderId": "o1", "totalAmount": 5.0},
+                                                       "totalAmount")))
+    assert after_value.query == {"$or": [{"totalAmount": 5.0, "orderId": {"$lt": "o1"}},
+                                         {"totalAmount": {"$lt": 5.0}},
+                                         {"totalAmount": None}]}
+
+
+@pytest.mark.parametrize("descending", [True, False])
+def test_keyset_pages_include_orders_without_a_sort_value(orders_collection, descending):
+    orders_collection.insert_many([{"orderId": f"n{i}", "orderStatus": "shipping",
+                                    "createdAt": NOW} for i in range(5)])
+    filters = SearchFilters(statuses=["shipping"], sort_field="totalAmount",
+                            descending=descending)
+    seen = []
+    try:
+        while True:
+            orders, filters.cursor = search_orders(orders_collection, filters, limit=7)
+            seen.extend(order["orderId"] for order in orders)
+            if filters.cursor is None:
+                break
+    finally:
+        orders_collection.delete_many({"orderId": {"$regex": "^n"}})
+    assert len(seen) == len(set(seen)) == 105
+    missing = [f"n{i}" for i in range(5)]
+    assert (seen[-5:] if descending else seen[:5]) == (missing[::-1] if descending else missing)
+
+
+def test_keyset_pages_cover_all_results_once(orders_collection):
+    filters = SearchFilters(statuses=["shipping", "delivered"], sort_field="createdAt")
+    seen = []
+    while True:
+        orders, filters.cursor = search_orders(orders_collection, filters, limit=25)
+        seen.extend(order["orderId"] for order in orders)
+        if filters.cursor is None:
+            break
+    assert len(seen) == len(set(seen)) == 200
+
+
+def test_user_listing_reads_only_the_page(orders_collection):
+    orders, cursor = find_user_orders(orders_collection, "u3", 5,
+                                      projection={"_id": 0, "orderStatus": 1})
+    assert [order["orderId"] for order in orders] == ["o0003", "o0013", "o0023", "o0033",
+                                                      "o0043"]
+    assert set(orders[0]) == {"orderId", "orderStatus", "createdAt"}
+
+    filters = SearchFilters(user_id="u3", cursor=cursor)
+    plan = build_search_plan(filters)
+    stats = (orders_collection.find(plan.query).sort(plan.sort).hint(plan.hint).limit(6)
+             .explain()["executionStats"])
+    assert stats["totalDocsExamined"] <= 6
+
+
+def test_iter_user_orders_visits_every_order(orders_collection):
+    pages = list(iter_user_orders(orders_collection, "u7", batch_size=7))
+    assert [len(page) for page in pages] == [7, 7, 7, 7, 2]
+    assert len({order["orderId"] for page in pages for order in page}) == 30
+
@@ -0,0 +1,149 @@
+import threading
+import pytest
+from flask import Flask
+from flask_restx import Api
+from order_service.app.broadcast import (ORDER_STATUS_CHANGED, FanoutRelay, OrderEvent,
+                                         OrderEventBroadcaster)
+from order_service.app.routes import api as order_api
+
+CONFIG = {"ORDER_STREAM_HEARTBEAT_SECONDS": 0.05, "ORDER_STREAM_MAX_SECONDS": 0.2,
+          "ADMISSION_RETRY_AFTER_SECONDS": 1}
+
+
+def status_event(order_id, status):
+    return OrderEvent(ORDER_STATUS_CHANGED, {"orderId": order_id, "orderStatus": status})
+
+
+def test_events_are_numbered_on_arrival():
+    broadcaster = OrderEventBroadcaster(history=3)
+    for order_id in ("o1", "o2", "o3", "o4"):
+        broadcaster.publish(status_event(order_id, "shipping"))
+    events = broadcaster.wait_for_events(0, 0)
+    # The oldest event fell out of the history
+    assert [event.data["orderId"] for event in events] == ["o2", "o3", "o4"]
+    assert [event.sequence for event in events] == [2, 3, 4]
+    assert [event.id for event in events] == [f"{broadcaster.epoch}-{n}" for n in (2, 3, 4)]
+    assert broadcaster.wait_for_events(4, 0) == []
+
+
+def test_streams_resume_after_the_last_event_seen():
+    broadcaster = OrderEventBroadcaster()
+    for order_id in ("o1", "o2", "o3"):
+        broadcaster.publish(status_event(order_id, "shipping"))
+    assert broadcaster.position(f"{broadcaster.epoch}-1") == 1
+    # Missing, invalid and future ids start at the latest event
+    assert broadcaster.position(None) == 3
+    assert broadcaster.position("not-an-id") == 3
+    assert broadcaster.position(f"{broadcaster.epoch}-99") == 3
+    # Ids of another broadcaster, for example before a restart, resume from the start
+    assert broadcaster.position("0-2") == 0
+
+
+def test_waiting_clients_are_woken_by_new_events():
+    broadcaster = OrderEventBroadcaster()
+    timer = threading.Timer(0.05, broadcaster.publish, [status_event("o1", "shipping")])
+    timer.start()
+    events = broadcaster.wait_for_events(0, 5)
+    timer.join()
+    assert [event.data["orderId"] for event in events] == ["o1"]
+
+
+def test_relay_outbox_drops_the_oldest_events():
+    relay = FanoutRelay(OrderEventBroadcaster(), "order_events", outbox=2)
+    for order_id in ("o1", "o2", "o3"):
+        relay.publish(status_event(order_id, "shipping"))
+    assert relay.dropped == 1
+    assert [event.data["orderId"] for event in relay.take()] == ["o2", "o3"]
+    assert relay.dropped == 0
+    assert relay.take() == []
+
+
+
+def test_relay_keeps_the_events_it_failed_to_publish(monkeypatch):
+    from types import SimpleNamespace
+    import pika
+    from order_service.app import broadcast
+
+    published = []
+
+    class Channel:
+        def exchange_declare(self, exchange, exchange_type, durable):
+            pass
+
+        def queue_declare(self, queue, exclusive, auto_delete):
+            return SimpleNamespace(method=SimpleNamespace(queue="amq.gen"))
+
+        def queue_bind(self, exchange, queue):
+            pass
+
+        def basic_consume(self, queue, on_message_callback, auto_ack):
+            pass
+
+        def basic_publish(self, exchange, routing_key, body):
+            if len(published) == 1:
+                raise pika.exceptions.StreamLostError("Connection lost")
+            published.append(body)
+
+    connection = SimpleNamespace(channel=Channel, process_data_events=lambda time_limit: None)
+    monkeypatch.setattr(broadcast, "get_connection", lambda: connection)
+    relay = FanoutRelay(OrderEventBroadcaster(), "order_events", outbox=3)
+    for order_id in ("o1", "o2", "o3"):
+        relay.publish(status_event(order_id, "shipping"))
+    with pytest.raises(pika.exceptions.StreamLostError):
+        relay._relay()
+    # The unpublished events are published before those queued after the failure
+    relay.publish(status_event("o4", "shipping"))
+    assert len(published) == 1 and relay.dropped == 0
+    assert [event.data["orderId"] for event in relay.take()] == ["o2", "o3", "o4"]
+    # Unless the outbox is full, then the oldest are dropped
+    relay.publish(status_event("o5", "shipping"))
+    relay.restore([status_event(order_id, "shipping") for order_id in ("o2", "o3", "o4")])
+    assert relay.dropped == 1
+    assert [event.data["orderId"] for event in relay.take()] == ["o3", "o4", "o5"]
+
+
+def test_streams_leave_threads_to_other_requests():
+    from order_service.app import start_order_event_broadcast
+
+    for max_clients in (0, 8):
+        app = Flask(__name__)
+        app.config.update(ORDER_STREAM_MAX_CLIENTS=max_clients, WORKER_THREADS=8,
+                          ORDER_EVENTS_HISTORY=10, ORDER_EVENTS_EXCHANGE=None)
+        with pytest.raises(ValueError):
+            start_order_event_broadcast(app)
+
+def create_app(max_streams):
+    app = Flask(__name__)
+    app.config.update(CONFIG)
+    app.order_broadcaster = OrderEventBroadcaster(max_streams=max_streams)
+    Api(app).add_namespace(order_api, path="/orders")
+    return app
+
+
+def test_stream_sends_matching_events_after_the_resume_position():
+    app = create_app(max_streams=0)
+    broadcaster = app.order_broadcaster
+    broadcaster.publish(status_event("o1", "shipping"))
+    broadcaster.publish(status_event("o2", "delivered"))
+    broadcaster.publish(status_event("o3", "shipping"))
+    response = app.test_client().get("/orders/stream?status=shipping",
+                                     headers={"Last-Event-ID": f"{broadcaster.epoch}-1"})
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    body = response.get_data(as_text=True)
+    assert f"id: {broadcaster.epoch}-3\nevent: {ORDER_STATUS_CHANGED}\n" in body
+    assert '"o1"' not in body and '"o2"' not in body
+    assert ": keep-alive" in body
+
+
+def test_streams_beyond_the_limit_are_answered_with_503():
+    app = create_app(max_streams=1)
+    client = app.test_client()
+    first = client.get("/orders/stream", buffered=False)
+    assert first.status_code == 200
+    rejected = client.get("/orders/stream")
+    assert rejected.status_code == 503
+    assert rejected.headers["Retry-After"] == "1"
+    # Closing the stream releases its slot
+    first.close()
+    assert client.get("/orders/stream").status_code == 200
@@ -0,0 +1,63 @@
+import os
+import pymongo
+import pytest
+from dotenv import load_dotenv
+from order_service.app.totals import compute_order_totals
+from order_service.jobs.backfill_totals import backfill
+
+load_dotenv()
+
+
+def test_totals_of_an_order():
+    items = [
+        {"itemId": "item001", "quantity": 2, "price": 29.99},
+        {"itemId": "item002", "quantity": 1, "price": 49.99},
+        {"itemId": "item003", "quantity": 3, "price": 0.1},
+    ]
+    assert compute_order_totals(items) == {"itemCount": 3, "totalQuantity": 6,
+                                           "totalAmount": 110.27}
+
+
+def test_totals_of_an_empty_order():
+    assert compute_order_totals([]) == {"itemCount": 0, "totalQuantity": 0, "totalAmount": 0.0}
+
+
+@pytest.mark.parametrize("item", [
+    {"quantity": "2", "price": 1.0},
+    {"quantity": 0, "price": 1.0},
+    {"quantity": 1.5, "price": 1.0},
+    {"quantity": True, "price": 1.0},
+    {"quantity": 1, "price": "1.0"},
+    {"quantity": 1, "price": -1},
+    {"price": 1.0},
+])
+def test_invalid_items_are_rejected(item):
+    with pytest.raises(ValueError):
+        compute_order_totals([item])
+
+
+# Fixture for a scratch database on the MongoDB from MONGO_URI
+@pytest.fixture
+def db():
+    client = pymongo.MongoClient(os.getenv("MONGO_URI", "mongodb://localhost:27017"),
+                                 serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command("ping")
+    except pymongo.errors.PyMongoError:
+        pytest.skip("MongoDB is not reachable")
+    yield client["test_order_totals"]
+    client.drop_database("test_order_totals")
+    client.close()
+
+
+def test_backfill_matches_write_time_totals(db):
+    items = [{"itemId": "a", "quantity": 2, "price": 29.99},
+             {"itemId": "b", "quantity": 3, "price": 0.1}]
+    db.orders.insert_one({"orderId": "legacy", "items": items})
+    db.orders_archive.insert_one({"orderId": "archived", "items": items})
+    assert backfill(db, batch_size=50, rate=0, restart=True) == {"orders": 2, "updated": 2}
+    stored = db.orders.find_one({"orderId": "legacy"}, {"_id": 0, "items": 0, "orderId": 0})
+    assert stored == compute_order_totals(items)
+    archived = db.orders_archive.find_one({"orderId": "archived"},
+                                          {"_id": 0, "items": 0, "orderId": 0})
+    assert archived == compute_order_totals(items)
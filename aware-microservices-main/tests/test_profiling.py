@@ -0,0 +1,74 @@
+import pstats
+import time
+import pytest
+from flask import Flask
+from shared.metrics import Registry, init_metrics
+from shared.profiling import ProfilingMiddleware, Profiler, configure_profiling, init_profiling
+
+CONFIG = {"PROFILE_DIR": "", "PROFILE_TOKEN": "", "PROFILE_SAMPLE_RATE": 0.0,
+          "PROFILE_SAMPLE_INTERVAL_MS": 10.0}
+
+
+def busy_wait(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def create_app(profiler):
+    app = Flask(__name__)
+    init_metrics(app, Registry())
+    app.wsgi_app = ProfilingMiddleware(app.wsgi_app, profiler)
+
+    @app.route("/orders/<order_id>")
+    def get_order(order_id):
+        busy_wait(0.05)
+        return {"orderId": order_id}
+
+    return app
+
+
+def test_profiling_is_off_by_default():
+    app = Flask(__name__)
+    configure_profiling("order-service", CONFIG)
+    init_profiling(app)
+    assert not isinstance(app.wsgi_app, ProfilingMiddleware)
+    with pytest.raises(ValueError):
+        configure_profiling("order-service", {**CONFIG, "PROFILE_SAMPLE_RATE": 2})
+
+
+def test_requests_with_the_token_are_profiled(tmp_path):
+    app = create_app(Profiler("order-service", str(tmp_path), token="secret"))
+    client = app.test_client()
+    response = client.get("/orders/o1", headers={"X-Profile": "wrong"})
+    assert "X-Profile-File" not in response.headers
+    response = client.get("/orders/o1", headers={"X-Profile": "secret"})
+    name = response.headers["X-Profile-File"]
+    assert name.startswith("order-service-GET_orders_o1-") and name.endswith(".pstats")
+    functions = {function for _, _, function in pstats.Stats(str(tmp_path / name)).stats}
+    assert {"get_order", "busy_wait"} <= functions
+
+
+def test_sampled_requests_are_aggregated_by_route(tmp_path):
+    profiler = Profiler("order-service", str(tmp_path), sample_rate=1.0, interval_ms=1)
+    client = create_app(profiler).test_client()
+    for order_id in ("o1", "o2"):
+        client.get(f"/orders/{order_id}").close()
+    path = profiler.flush()
+    lines = open(path, encoding="utf-8").read().splitlines()
+    stacks = {line.rsplit(" ", 1)[0]: int(line.rsplit(" ", 1)[1]) for line in lines}
+    busy = [stack for stack in stacks if stack.endswith("test_profiling:busy_wait")]
+    assert busy and all(stack.startswith("GET /orders/<order_id>;") for stack in busy)
+    # CPU-bound threads hand the GIL to the sampler every switch interval, 5 ms
+    assert sum(stacks[stack] for stack in busy) >= 10
+    assert profiler.flush() is None
+
+
+def test_consumer_blocks_are_sampled_under_their_scope(tmp_path):
+    profiler = Profiler("order-service", str(tmp_path), sample_rate=1.0, interval_ms=1)
+    with profiler.profile("consume user_updates.email"):
+        busy_wait(0.03)
+    with Profiler("order-service").profile("consume user_updates.email") as block:
+        assert not block.sampled
+    stacks = open(profiler.flush(), encoding="utf-8").read()
+    assert "consume user_updates.email;test_profiling:busy_wait " in stacks
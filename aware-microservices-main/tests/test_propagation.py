@@ -0,0 +1,50 @@
+import pytest
+from order_service.app.propagation import (LatencyHistogram, PropagationTracker,
+                                           parse_published_at)
+
+
+def test_parse_published_at():
+    assert parse_published_at({"publishedAt": "2024-01-01T00:00:00+00:00"}) == 1704067200.0
+    assert parse_published_at({}) is None
+    assert parse_published_at({"publishedAt": "yesterday"}) is None
+    assert parse_published_at({"publishedAt": 1704067200}) is None
+
+
+def test_histogram_quantiles():
+    histogram = LatencyHistogram(buckets=(0.01, 0.1, 1.0))
+    assert histogram.quantile(0.5) is None
+    for _ in range(98):
+        histogram.observe(0.005)
+    histogram.observe(0.5)
+    histogram.observe(3.0)
+    assert histogram.quantile(0.5) == pytest.approx(0.01 * 50 / 98)
+    assert 0.1 < histogram.quantile(0.99) <= 1.0
+    assert histogram.quantile(1.0) == 3.0
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 100 and snapshot["max"] == 3.0
+    assert snapshot["buckets"] == {"0.01": 98, "0.1": 98, "1.0": 99, "+Inf": 100}
+
+
+def test_tracker_records_publish_to_apply_latency():
+    tracker = PropagationTracker()
+    tracker.record_applied("email", published_at=100.0, applied_at=100.02)
+    tracker.record_applied("email", published_at=101.0, applied_at=101.02)
+    # A publisher clock slightly ahead does not produce negative latencies
+    tracker.record_applied("address", published_at=200.5, applied_at=200.0)
+    stats = tracker.stats()
+    assert stats["email"]["applied"] == 2
+    assert 10 <= stats["email"]["p50Ms"] <= 25 and stats["email"]["maxMs"] == 20.0
+    assert stats["address"]["maxMs"] == 0.0
+
+
+def test_oldest_unprocessed_lag_follows_the_backlog():
+    tracker = PropagationTracker()
+    assert tracker.oldest_unprocessed_lag("email") is None
+    tracker.record_backlog("email", 0)
+    assert tracker.oldest_unprocessed_lag("email") == 0.0
+    tracker.record_backlog("email", 12)
+    assert tracker.oldest_unprocessed_lag("email") is None
+    tracker.record_applied("email", published_at=100.0, applied_at=101.0)
+    assert tracker.oldest_unprocessed_lag("email", now=105.0) == 5.0
+    tracker.record_backlog("email", 0)
+    assert tracker.oldest_unprocessed_lag("email", now=105.0) == 0.0
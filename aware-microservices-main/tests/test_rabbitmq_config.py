@@ -0,0 +1,105 @@
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime
+import pika
+from order_service.app.events import contact_version
+from shared.config.rabbitmq_config import (EXCHANGE_NAME, LEGACY_EXCHANGE_NAME,
+                                           RABBITMQ_QUEUE_NAME, USER_ADDRESS_UPDATED,
+                                           USER_EMAIL_UPDATED, drain_legacy_queue,
+                                           split_legacy_event)
+
+ADDRESS = {"street": "1 Main St", "city": "Montreal", "state": "QC", "postalCode": "H1A",
+           "country": "Canada"}
+
+
+class LegacyChannel:
+    """A channel on a broker whose legacy queue holds the given messages."""
+
+    def __init__(self, messages, exists=True):
+        self.messages = [(pika.spec.Basic.GetOk(delivery_tag=tag), None, json.dumps(message))
+                         for tag, message in enumerate(messages, 1)]
+        self.exists = exists
+        self.calls = []
+
+    def queue_declare(self, queue, durable, passive):
+        if not self.exists:
+            raise pika.exceptions.ChannelClosedByBroker(404, "NOT_FOUND")
+        self.calls.append(("declare", queue))
+
+    def queue_unbind(self, queue, exchange, routing_key):
+        self.calls.append(("unbind", queue, exchange, routing_key))
+
+    def confirm_delivery(self):
+        self.calls.append(("confirm",))
+
+    def basic_get(self, queue, auto_ack):
+        return self.messages.pop(0) if self.messages else (None, None, None)
+
+    def basic_publish(self, exchange, routing_key, body):
+        self.calls.append(("publish", exchange, routing_key, json.loads(body)))
+
+    def basic_ack(self, delivery_tag):
+        self.calls.append(("ack", delivery_tag))
+
+    def queue_delete(self, queue, if_empty):
+        self.calls.append(("delete", queue, if_empty))
+
+    def close(self):
+        self.calls.append(("close",))
+
+
+class Connection:
+    def __init__(self, channel):
+        self._channel = channel
+
+    def channel(self):
+        return self._channel
+
+
+def test_legacy_events_are_split_by_type():
+    assert split_legacy_event({"userId": "u1", "userEmails": ["a@b.c"],
+                               "deliveryAddress": ADDRESS}) == [
+        (USER_EMAIL_UPDATED, {"userId": "u1", "userEmails": ["a@b.c"]}),
+        (USER_ADDRESS_UPDATED, {"userId": "u1", "deliveryAddress": ADDRESS})]
+    assert split_legacy_event({"userId": "u1", "userEmails": None}) == []
+
+
+def test_legacy_queue_is_unbound_drained_and_deleted():
+    channel = LegacyChannel([{"userId": "u1", "userEmails": ["a@b.c"],
+                              "deliveryAddress": ADDRESS},
+                             {"userId": "u1", "userEmails": ["d@e.f"]}])
+    assert drain_legacy_queue(Connection(channel)) == 3
+    assert channel.calls[:3] == [
+        ("declare", RABBITMQ_QUEUE_NAME),
+        ("unbind", RABBITMQ_QUEUE_NAME, LEGACY_EXCHANGE_NAME, RABBITMQ_QUEUE_NAME),
+        ("confirm",)]
+    published = [call for call in channel.calls if call[0] == "publish"]
+    assert [(exchange, key) for _, exchange, key, _ in published] == [
+        (EXCHANGE_NAME, USER_EMAIL_UPDATED), (EXCHANGE_NAME, USER_ADDRESS_UPDATED),
+        (EXCHANGE_NAME, USER_EMAIL_UPDATED)]
+    # Events moved later get a later version, so they win over earlier ones, but every
+    # version is older than the ones of current updates, in MongoDB's milliseconds
+    versions = [contact_version(event) for *_, event in published]
+    assert versions == [datetime(1970, 1, 1, 0, 0, 0, 1000 * n) for n in range(3)]
+    assert not any("publishedAt" in event for *_, event in published)
+    # Each message is acknowledged after its events were published
+    assert [call[0] for call in channel.calls[3:]] == [
+        "publish", "publish", "ack", "publish", "ack", "delete", "close"]
+
+
+def test_missing_legacy_queue_is_left_alone():
+    channel = LegacyChannel([], exists=False)
+    assert drain_legacy_queue(Connection(channel)) == 0
+    assert channel.calls == []
+
+
+def test_queue_prefix_is_required():
+    env = {key: value for key, value in os.environ.items() if key != "RABBITMQ_QUEUE_NAME"}
+    env["RABBITMQ_QUEUE_NAME"] = ""
+    result = subprocess.run([sys.executable, "-c", "import shared.config.rabbitmq_config"],
+                            env=env, capture_output=True, text=True, check=False,
+                            cwd=os.path.join(os.path.dirname(__file__), "..", "src"))
+    assert result.returncode != 0
+    assert "RABBITMQ_QUEUE_NAME must be set" in result.stderr
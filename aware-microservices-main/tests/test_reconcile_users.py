@@ -0,0 +1,145 @@
+import os
+import time
+from datetime import datetime, timedelta
+import pymongo
+import pytest
+from dotenv import load_dotenv
+from order_service.app.partitions import DEFAULT_PARTITION, OrderPartition, PartitionRouter
+from order_service.jobs.common import Checkpoint, RateLimiter
+from order_service.jobs.reconcile_users import (JOB_NAME, apply_repairs, order_repairs,
+                                                reconcile, snapshot_repairs)
+
+load_dotenv()
+
+NOW = datetime(2025, 3, 1, 12, 0)
+CANADA = {"street": "1 Old St", "city": "Montreal", "state": "QC", "postalCode": "H1A",
+          "country": "Canada"}
+FRANCE = {"street": "2 New St", "city": "Paris", "state": "IDF", "postalCode": "75001",
+          "country": "France"}
+CONFIG = {"MONGO_READ_PREFERENCE": "primary", "MONGO_MAX_STALENESS_SECONDS": 90,
+          "ORDER_GROUP_COMMIT": False}
+
+
+def test_rate_limiter_spreads_batches_over_time():
+    limiter = RateLimiter(100)
+    started = time.monotonic()
+    # The bucket starts full, then refills at the rate
+    limiter.acquire(100)
+    assert time.monotonic() - started < 0.05
+    limiter.acquire(20)
+    assert 0.15 < time.monotonic() - started < 0.5
+
+
+def test_rate_limiter_lets_large_batches_through_once_full():
+    limiter = RateLimiter(10)
+    started = time.monotonic()
+    limiter.acquire(50)
+    assert time.monotonic() - started < 0.05
+    limiter.acquire(1)
+    assert time.monotonic() - started > 0.05
+
+
+def test_rate_limiter_is_disabled_by_zero():
+    limiter = RateLimiter(0)
+    started = time.monotonic()
+    for _ in range(1000):
+        limiter.acquire(1000)
+    assert time.monotonic() - started < 0.05
+
+
+# Fixture for a scratch database on the MongoDB from MONGO_URI
+@pytest.fixture
+def db():
+    client = pymongo.MongoClient(os.getenv("MONGO_URI", "mongodb://localhost:27017"),
+                                 serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command("ping")
+    except pymongo.errors.PyMongoError:
+        pytest.skip("MongoDB is not reachable")
+    yield client["test_reconcile_users"]
+    client.drop_database("test_reconcile_users")
+    client.close()
+
+
+def user(user_id, address=FRANCE):
+    return {"userId": user_id, "emails": [f"{user_id}@example.com"], "deliveryAddress": address,
+            "updatedAt": NOW}
+
+
+def order(order_id, user_id, address=CANADA, **fields):
+    return {"orderId": order_id, "userId": user_id, "orderStatus": "under process",
+            "userEmails": [f"{user_id}@example.com"], "deliveryAddress": address,
+            "totalAmount": 10.0, "createdAt": NOW - timedelta(days=1), **fields}
+
+
+def test_repairs_skip_orders_changed_after_the_user(db):
+    db.orders.insert_many([
+        order("stale", "u1"),
+        order("older change", "u1", contactUpdatedAt=NOW - timedelta(hours=1)),
+        order("newer change", "u1", contactUpdatedAt=NOW + timedelta(hours=1)),
+        order("current", "u1", address=FRANCE),
+    ])
+    operations, drifted, moves = order_repairs(db, [user("u1")])
+    assert drifted == 2
+
+    db.orders.bulk_write(operations)
+    moves = moves()
+    assert sorted(move[0]["orderId"] for move in moves) == ["older change", "stale"]
+    assert {(move[1], move[2], move[3]) for move in moves} == {("country", "Canada", "France")}
+    addresses = {document["orderId"]: document["deliveryAddress"]["country"]
+                 for document in db.orders.find()}
+    assert addresses == {"stale": "France", "older change": "France",
+                         "newer change": "Canada", "current": "France"}
+    repaired = db.orders.find_one({"orderId": "stale"})
+    assert repaired["contactVersions"] == {"userEmails": NOW, "deliveryAddress": NOW}
+
+
+def test_repairs_do_not_overwrite_newer_consumer_updates(db):
+    db.orders.insert_one(order("o1", "u1"))
+    operations, drifted, moves = order_repairs(db, [user("u1")])
+    # A newer user update reaches the order between the scan and the repair
+    db.orders.update_one({"orderId": "o1"},
+                         {"$set": {"deliveryAddress": CANADA,
+                                   "contactVersions.deliveryAddress": NOW + timedelta(1)}})
+    db.orders.bulk_write(operations)
+    assert drifted == 1
+    assert db.orders.find_one({"orderId": "o1"})["deliveryAddress"] == CANADA
+    # The order did not move to the country of the repair
+    assert moves() == []
+
+
+def test_snapshot_repairs_do_not_overwrite_newer_consumer_updates(db):
+    db.users.insert_many([user("u1"), user("u2")])
+    db.user_snapshots.insert_one({"_id": "u1", "deliveryAddress": CANADA,
+                                  "contactVersions": {"deliveryAddress": NOW + timedelta(1)}})
+    operations, drifted = snapshot_repairs(db, list(db.users.find({}, {"_id": 0})))
+    assert drifted == 2
+    apply_repairs(db.user_snapshots, operations)
+    snapshots = {snapshot["_id"]: snapshot for snapshot in db.user_snapshots.find()}
+    assert snapshots["u1"]["deliveryAddress"] == CANADA
+    assert snapshots["u2"]["deliveryAddress"] == FRANCE
+    assert snapshots["u2"]["contactVersions"] == {"userEmails": NOW, "deliveryAddress": NOW}
+
+
+def test_interrupted_run_resumes_from_the_checkpoint(db):
+    db.users.insert_many([user(f"u{i}") for i in range(6)])
+    db.orders.insert_many([order(f"o{i}", f"u{i}") for i in range(6)])
+    partitions = PartitionRouter([OrderPartition(DEFAULT_PARTITION, db, CONFIG)])
+    # A previous run stopped after u2
+    Checkpoint(db, JOB_NAME).save({"ranges": [{"lower": "u0", "upper": "u5", "last": "u2"}]})
+
+    totals = reconcile(db, workers=1, batch_size=2, rate=0, partitions=partitions)
+    assert totals == {"users": 3, "drifted": 3}
+    countries = {document["orderId"]: document["deliveryAddress"]["country"]
+                 for document in db.orders.find()}
+    assert [countries[f"o{i}"] for i in range(6)] == ["Canada"] * 3 + ["France"] * 3
+    assert Checkpoint(db, JOB_NAME).load()["ranges"] == [
+        {"lower": "u0", "upper": "u5", "last": "u5", "done": True}]
+    # The repaired orders moved to the rollups of their new country
+    day = (NOW - timedelta(days=1)).strftime("%Y-%m-%d")
+    assert db.order_rollups.find_one({"_id": f"{day}|country|France"})["orders"] == 3
+
+    # Once every range is done, the next run starts over and repairs the rest
+    assert reconcile(db, workers=2, batch_size=2, rate=0, partitions=partitions) == {
+        "users": 6, "drifted": 3}
+    assert db.orders.count_documents({"deliveryAddress.country": "France"}) == 6
@@ -0,0 +1,129 @@
+import os
+import time
+from types import SimpleNamespace
+import pymongo
+import pytest
+from dotenv import load_dotenv
+from flask import Flask
+from shared.mongo import create_mongo_client
+from shared.round_trips import (RoundTripListener, account_round_trips, explain_command,
+                                init_round_trip_accounting, parse_budgets, query_shape,
+                                summarize_plan)
+
+load_dotenv()
+
+CONFIG = {"MONGO_ROUND_TRIP_BUDGET": 2, "MONGO_ROUND_TRIP_BUDGETS": "consume orders.email=5"}
+
+
+def command_events(listener, name, command=None, duration_micros=500, request_id=1):
+    started = SimpleNamespace(command_name=name, request_id=request_id,
+                              connection_id=("localhost", 27017), database_name="orders_db",
+                              command=command or {name: "orders"})
+    listener.started(started)
+    listener.succeeded(SimpleNamespace(command_name=name, request_id=request_id,
+                                       connection_id=("localhost", 27017),
+                                       duration_micros=duration_micros))
+
+
+def test_budgets_parse_and_reject_malformed_entries():
+    assert parse_budgets("PUT /orders/<order_id>/status=1, consume orders.email=3") == {
+        "PUT /orders/<order_id>/status": 1, "consume orders.email": 3}
+    assert parse_budgets("") == {}
+    with pytest.raises(ValueError):
+        parse_budgets("GET /orders/=many")
+
+
+def test_commands_are_counted_into_the_active_scope(caplog):
+    listener = RoundTripListener(0)
+    with account_round_trips("consume orders.address", CONFIG) as round_trips:
+        for request_id in range(3):
+            command_events(listener, "find", request_id=request_id)
+        command_events(listener, "update", request_id=3)
+    # Outside of a scope nothing is counted
+    command_events(listener, "find", request_id=4)
+    assert round_trips.count == 4
+    assert round_trips.summary() == "3 find, 1 update"
+    assert "consume orders.address made 4 MongoDB round trips (3 find, 1 update)" in caplog.text
+
+
+def test_scope_budgets_override_the_default(caplog):
+    listener = RoundTripListener(0)
+    with account_round_trips("consume orders.email", CONFIG):
+        for request_id in range(4):
+            command_events(listener, "find", request_id=request_id)
+    assert "over its budget" not in caplog.text
+
+
+def test_requests_are_accounted_under_their_route(caplog):
+    app = Flask(__name__)
+    app.config.update(CONFIG)
+    init_round_trip_accounting(app)
+    listener = RoundTripListener(0)
+
+    @app.route("/orders/<order_id>/status", methods=["PUT"])
+    def update_status(order_id):
+        for request_id in range(3):
+            command_events(listener, "find", request_id=request_id)
+        return {"orderId": order_id}
+
+    app.test_client().put("/orders/o1/status").close()
+    assert "PUT /orders/<order_id>/status made 3 MongoDB round trips" in caplog.text
+
+
+def test_explain_command_drops_session_fields_and_extra_statements():
+    command = {"update": "orders", "updates": [{"q": {"orderId": "o1"}}, {"q": {"orderId": "o2"}}],
+               "ordered": False, "lsid": {"id": 1}, "txnNumber": 4, "$db": "orders_db",
+               "writeConcern": {"w": 1}}
+    assert explain_command(command) == {
+        "explain": {"update": "orders", "updates": [{"q": {"orderId": "o1"}}], "ordered": False},
+        "verbosity": "queryPlanner"}
+    assert query_shape("orders_db", command) == ("orders_db", "update", "orders", ("orderId",))
+
+
+def test_plans_are_summarized_from_the_root():
+    explained = {"queryPlanner": {"winningPlan": {
+        "stage": "LIMIT", "inputStage": {"stage": "FETCH", "inputStage": {
+            "stage": "IXSCAN", "indexName": "orderStatus_1_createdAt_-1"}}}}}
+    assert summarize_plan(explained) == "LIMIT > FETCH > IXSCAN(orderStatus_1_createdAt_-1)"
+    pipeline = {"stages": [{"$cursor": {"queryPlanner": {"winningPlan": {"queryPlan": {
+        "stage": "COLLSCAN"}}}}}, {"$group": {}}]}
+    assert summarize_plan(pipeline) == "COLLSCAN"
+    assert summarize_plan({}) == "unknown"
+
+
+def test_slow_queries_are_explained_once_per_shape():
+    listener = RoundTripListener(1)
+    submitted = []
+    listener.explainer._queue.put_nowait = submitted.append
+    listener.explainer._thread = "started"
+    command_events(listener, "find", {"find": "orders", "filter": {"userId": "u1"}}, 100)
+    command_events(listener, "find", {"find": "orders", "filter": {"userId": "u1"}}, 5000)
+    command_events(listener, "find", {"find": "orders", "filter": {"userId": "u2"}}, 5000)
+    command_events(listener, "find", {"find": "orders", "filter": {"orderStatus": "x"}}, 5000)
+    assert [command["filter"] for _, command, _, _ in submitted] == [
+        {"userId": "u1"}, {"orderStatus": "x"}]
+
+
+def test_slow_queries_are_explained_against_mongo(caplog):
+    config = {"MONGO_URI": os.getenv("MONGO_URI", "mongodb://localhost:27017"),
+              "MONGO_MAX_POOL_SIZE": 10, "MONGO_MIN_POOL_SIZE": 0,
+              "MONGO_CONNECT_TIMEOUT_MS": 0, "MONGO_SOCKET_TIMEOUT_MS": 0,
+              "MONGO_SERVER_SELECTION_TIMEOUT_MS": 2000, "MONGO_WAIT_QUEUE_TIMEOUT_MS": 0,
+              "MONGO_READ_PREFERENCE": "primary", "MONGO_MAX_STALENESS_SECONDS": 90,
+              "MONGO_SLOW_QUERY_MS": 0.001}
+    client = create_mongo_client(config)
+    try:
+        client.admin.command("ping")
+    except pymongo.errors.PyMongoError:
+        pytest.skip("MongoDB is not reachable")
+    collection = client["round_trips_test"]["orders"]
+    collection.drop()
+    collection.insert_one({"userId": "u1"})
+    list(collection.find({"userId": "u1"}))
+    deadline = time.monotonic() + 5
+    while "COLLSCAN" not in caplog.text and time.monotonic() < deadline:
+        time.sleep(0.05)
+    output = caplog.text
+    collection.drop()
+    assert "Slow MongoDB find on round_trips_test.orders by userId" in output
+    assert "COLLSCAN" in output
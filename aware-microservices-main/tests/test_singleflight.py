@@ -0,0 +1,71 @@
+import threading
+import time
+import pytest
+from shared.singleflight import SingleFlight
+
+
+def run_concurrently(group, key, function, callers):
+    results = []
+    errors = []
+
+    def call():
+        try:
+            results.append(group.do(key, function))
+        except ValueError as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=call) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def slow_query(counter, result="user", delay=0.2):
+    def query():
+        counter.append(1)
+        time.sleep(delay)
+        return result
+    return query
+
+
+def test_concurrent_calls_share_one_execution():
+    group = SingleFlight("users")
+    executions = []
+    results, _ = run_concurrently(group, "u1", slow_query(executions), 20)
+    assert results == ["user"] * 20
+    assert len(executions) == 1
+    assert group.stats() == {"calls": 20, "executions": 1, "coalesced": 19}
+
+
+def test_different_keys_and_later_calls_execute_again():
+    group = SingleFlight("users")
+    executions = []
+    group.do("u1", slow_query(executions, delay=0))
+    group.do("u2", slow_query(executions, delay=0))
+    group.do("u1", slow_query(executions, delay=0))
+    assert len(executions) == 3
+    assert group.stats()["coalesced"] == 0
+
+
+def test_errors_reach_every_coalesced_caller():
+    group = SingleFlight("orders")
+
+    def failing():
+        time.sleep(0.2)
+        raise ValueError("boom")
+
+    results, errors = run_concurrently(group, "delivered", failing, 5)
+    assert not results and len(errors) == 5
+    assert group.stats()["executions"] == 1
+    with pytest.raises(ValueError):
+        group.do("delivered", failing)
+
+
+def test_disabled_group_runs_every_call():
+    group = SingleFlight("users", enabled=False)
+    executions = []
+    run_concurrently(group, "u1", slow_query(executions, delay=0.05), 5)
+    assert len(executions) == 5
+    assert group.stats() == {"calls": 5, "executions": 5, "coalesced": 0}
@@ -0,0 +1,128 @@
+import json
+import pytest
+from flask import Flask
+from shared import tracing
+from shared.tracing import (Tracer, configure_tracing, current_traceparent, init_flask_tracing,
+                            message_headers, parse_traceparent)
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_ID = "00f067aa0ba902b7"
+TRACEPARENT = f"00-{TRACE_ID}-{PARENT_ID}-01"
+
+
+class ListExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+
+@pytest.fixture
+def exporter(monkeypatch):
+    exporter = ListExporter()
+    monkeypatch.setattr(tracing, "_tracer", Tracer("test", exporter))
+    return exporter
+
+
+def test_parse_traceparent():
+    context = parse_traceparent(TRACEPARENT)
+    assert (context.trace_id, context.span_id, context.sampled) == (TRACE_ID, PARENT_ID, True)
+    assert context.traceparent() == TRACEPARENT
+    assert not parse_traceparent(f"00-{TRACE_ID}-{PARENT_ID}-00").sampled
+    for invalid in (None, "", "garbage", f"01-{TRACE_ID}-{PARENT_ID}-01",
+                    f"00-{'0' * 32}-{PARENT_ID}-01", f"00-{TRACE_ID}-{'0' * 16}-01"):
+        assert parse_traceparent(invalid) is None
+
+
+def test_nested_spans_share_the_trace(exporter):
+    tracer = tracing.get_tracer()
+    with tracer.span("outer", parse_traceparent(TRACEPARENT)) as outer:
+        with tracer.span("inner") as inner:
+            assert current_traceparent() == inner.context.traceparent()
+            assert message_headers() == {"traceparent": inner.context.traceparent()}
+    assert current_traceparent() is None and message_headers() is None
+    assert [span.name for span in exporter.spans] == ["inner", "outer"]
+    assert inner.context.trace_id == outer.context.trace_id == TRACE_ID
+    assert inner.parent_span_id == outer.context.span_id
+    assert outer.parent_span_id == PARENT_ID
+
+
+def test_span_records_errors(exporter):
+    with pytest.raises(ValueError):
+        with tracing.get_tracer().span("failing"):
+            raise ValueError("boom")
+    assert exporter.spans[0].error == "ValueError: boom"
+
+
+def test_unsampled_traces_are_not_exported(exporter):
+    with tracing.get_tracer().span("dropped", parse_traceparent(f"00-{TRACE_ID}-{PARENT_ID}-00")):
+        assert current_traceparent().endswith("-00")
+    assert exporter.spans == []
+
+
+def test_disabled_tracing_is_a_no_op():
+    tracer = Tracer("test")
+    with tracer.span("nothing") as span:
+        assert span is None
+        assert current_traceparent() is None
+
+
+def test_flask_request_continues_incoming_trace(exporter):
+    app = Flask(__name__)
+    init_flask_tracing(app)
+
+    @app.route("/users/<user_id>")
+    def get_user(user_id):
+        return {"traceparent": current_traceparent()}
+
+    response = app.test_client().get("/users/42", headers={"traceparent": TRACEPARENT})
+    [span] = exporter.spans
+    assert span.name == "GET /users/<user_id>" and span.kind == "server"
+    assert span.parent_span_id == PARENT_ID
+    assert span.attributes["http.status_code"] == 200
+    assert response.headers["traceresponse"] == span.context.traceparent()
+    assert response.get_json()["traceparent"] == span.context.traceparent()
+
+
+def test_file_export(tmp_path, monkeypatch):
+    path = tmp_path / "traces" / "spans.jsonl"
+    monkeypatch.setattr(tracing, "_tracer", tracing.get_tracer())
+    tracer = configure_tracing("user-service-v2", f"file://{path}")
+    with tracer.span("publish user.email.updated", kind="producer", attributes={"n": 1}):
+        pass
+    [line] = path.read_text().splitlines()
+    span = json.loads(line)
+    assert span["service"] == "user-service-v2"
+    assert span["kind"] == "producer" and span["attributes"] == {"n": 1}
+    assert span["parentSpanId"] is None and span["durationMs"] >= 0
+
+
+def test_unsupported_export_is_rejected(monkeypatch):
+    monkeypatch.setattr(tracing, "_tracer", tracing.get_tracer())
+    with pytest.raises(ValueError):
+        configure_tracing("order-service", "kafka://broker")
+
+
+def test_published_events_carry_the_producer_span(exporter, monkeypatch):
+    from user_service_v2.app import events
+
+    published = []
+
+    class FakeChannel:
+        def basic_publish(self, exchange, routing_key, body, properties):
+            published.append((routing_key, properties.headers))
+
+    class FakeConnection:
+        def close(self):
+            pass
+
+    monkeypatch.setattr(events, "create_channel", lambda: (FakeChannel(), FakeConnection()))
+    with tracing.get_tracer().span("PUT /users/<user_id>", parse_traceparent(TRACEPARENT)):
+        events.publish_user_update_event("42", email=["a@example.com"],
+                                         address={"country": "CA"})
+    producers = [span for span in exporter.spans if span.kind == "producer"]
+    assert [key for key, _ in published] == ["user.email.updated", "user.address.updated"]
+    for (_, headers), span in zip(published, producers):
+        assert headers == {"traceparent": span.context.traceparent()}
+        assert span.context.trace_id == TRACE_ID
@@ -0,0 +1,145 @@
+import os
+from datetime import datetime, timedelta
+import pymongo
+import pytest
+from dotenv import load_dotenv
+from flask import Flask
+from flask_restx import Api
+from order_service.app.broadcast import OrderEventBroadcaster
+from order_service.app.partitions import DEFAULT_PARTITION, OrderPartition, PartitionRouter
+from order_service.app.routes import api as order_api
+from order_service.app.snapshots import frozen_contact_details, resolve_contact_details
+
+load_dotenv()
+
+OLD_ADDRESS = {"street": "1 Old St", "city": "Montreal", "state": "QC", "postalCode": "H1A",
+               "country": "Canada"}
+NEW_ADDRESS = {"street": "2 New St", "city": "Paris", "state": "IDF", "postalCode": "75001",
+               "country": "France"}
+NOW = datetime(2024, 5, 1, 12, 0)
+
+
+class Snapshots:
+    """The user snapshots collection, as far as resolve_contact_details reads it."""
+
+    def __init__(self, *snapshots):
+        self.snapshots = {snapshot["_id"]: snapshot for snapshot in snapshots}
+        self.queries = 0
+
+    def find(self, query):
+        self.queries += 1
+        return [self.snapshots[user_id] for user_id in query["_id"]["$in"]
+                if user_id in self.snapshots]
+
+
+def order(order_id, status="under process", contact_updated_at=None, user_id="u1"):
+    document = {"orderId": order_id, "userId": user_id, "orderStatus": status,
+                "userEmails": ["old@example.com"], "deliveryAddress": OLD_ADDRESS}
+    if contact_updated_at is not None:
+        document["contactUpdatedAt"] = contact_updated_at
+    return document
+
+
+def test_unshipped_orders_follow_the_snapshot_unless_changed_after_it():
+    snapshots = Snapshots({"_id": "u1", "userEmails": ["new@example.com"],
+                           "deliveryAddress": NEW_ADDRESS, "updatedAt": NOW})
+    orders = [order("older", contact_updated_at=NOW - timedelta(seconds=1)),
+              order("never"),
+              order("newer", contact_updated_at=NOW + timedelta(seconds=1)),
+              order("shipped", status="shipping"),
+              order("other user", user_id="u2")]
+    assert resolve_contact_details(snapshots, orders) is orders
+    resolved = {document["orderId"]: document for document in orders}
+    # The snapshot wins over order details changed before it was written
+    for order_id in ("older", "never"):
+        assert resolved[order_id]["deliveryAddress"] == NEW_ADDRESS
+        assert resolved[order_id]["userEmails"] == ["new@example.com"]
+    # Details changed on the order after the snapshot, shipped orders and users
+    # without a snapshot keep their own
+    for order_id in ("newer", "shipped", "other user"):
+        assert resolved[order_id]["deliveryAddress"] == OLD_ADDRESS
+        assert resolved[order_id]["userEmails"] == ["old@example.com"]
+    assert snapshots.queries == 1
+
+
+def test_snapshots_only_replace_the_fields_they_hold():
+    snapshots = Snapshots({"_id": "u1", "deliveryAddress": NEW_ADDRESS, "updatedAt": NOW})
+    resolved = resolve_contact_details(snapshots, [order("o1")])[0]
+    assert resolved["deliveryAddress"] == NEW_ADDRESS
+    assert resolved["userEmails"] == ["old@example.com"]
+
+
+def test_email_updates_do_not_undo_later_address_changes_on_the_order():
+    # The user changed their address, then the order's address was changed, then an
+    # email-only update of the user arrived
+    snapshots = Snapshots({"_id": "u1", "userEmails": ["new@example.com"],
+                           "deliveryAddress": OLD_ADDRESS,
+                           "contactVersions": {"deliveryAddress": NOW - timedelta(seconds=2),
+                                               "userEmails": NOW},
+                           "updatedAt": NOW})
+    stored = order("o1", contact_updated_at=NOW - timedelta(seconds=1))
+    stored["deliveryAddress"] = NEW_ADDRESS
+    stored["contactVersions"] = {"deliveryAddress": NOW - timedelta(seconds=1)}
+    resolved = resolve_contact_details(snapshots, [dict(stored)])[0]
+    assert resolved["deliveryAddress"] == NEW_ADDRESS
+    assert resolved["userEmails"] == ["new@example.com"]
+    assert frozen_contact_details(snapshots, stored) == {
+        "userEmails": ["new@example.com"], "deliveryAddress": NEW_ADDRESS}
+
+
+def test_shipped_orders_are_not_looked_up():
+    snapshots = Snapshots()
+    resolve_contact_details(snapshots, [order("o1", status="delivered")])
+    assert snapshots.queries == 0
+
+
+def test_frozen_details_do_not_modify_the_order():
+    snapshots = Snapshots({"_id": "u1", "userEmails": ["new@example.com"],
+                           "deliveryAddress": NEW_ADDRESS, "updatedAt": NOW})
+    stored = order("o1")
+    assert frozen_contact_details(snapshots, stored) == {
+        "userEmails": ["new@example.com"], "deliveryAddress": NEW_ADDRESS}
+    assert stored["deliveryAddress"] == OLD_ADDRESS
+
+
+@pytest.fixture
+def app():
+    client = pymongo.MongoClient(os.getenv("MONGO_URI", "mongodb://localhost:27017"),
+                                 serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command("ping")
+    except pymongo.errors.PyMongoError:
+        pytest.skip("MongoDB is not reachable")
+    db = client["test_user_snapshots"]
+    app = Flask(__name__)
+    app.config.update(ORDER_CONTACT_MODE="snapshot", MONGO_READ_PREFERENCE="primary",
+                      MONGO_MAX_STALENESS_SECONDS=90, ORDER_GROUP_COMMIT=False)
+    app.order_partitions = PartitionRouter([OrderPartition(DEFAULT_PARTITION, db, app.config)])
+    app.user_snapshots_collection = db.user_snapshots
+    app.order_rollups_collection = db.order_rollups
+    app.order_list_cache = None
+    app.order_broadcaster = app.order_events = OrderEventBroadcaster()
+    Api(app).add_namespace(order_api, path="/orders")
+    db.orders.insert_one({**order("o1"), "items": [], "createdAt": NOW, "updatedAt": NOW})
+    db.user_snapshots.insert_one({"_id": "u1", "userEmails": ["new@example.com"],
+                                  "deliveryAddress": NEW_ADDRESS, "updatedAt": NOW})
+    yield app
+    client.drop_database(db.name)
+    client.close()
+
+
+def test_orders_freeze_the_snapshot_when_they_ship(app):
+    client = app.test_client()
+    response = client.put("/orders/o1/status", json={"orderStatus": "shipping"})
+    assert response.status_code == 200
+    assert response.get_json()[1]["deliveryAddress"] == NEW_ADDRESS
+    db = app.order_partitions.partitions[0].db
+    stored = db.orders.find_one({"orderId": "o1"})
+    assert stored["deliveryAddress"] == NEW_ADDRESS
+    assert stored["userEmails"] == ["new@example.com"]
+    # Later user updates no longer reach the shipped order
+    db.user_snapshots.update_one({"_id": "u1"}, {"$set": {"deliveryAddress": OLD_ADDRESS,
+                                                          "updatedAt": datetime.utcnow()}})
+    response = client.put("/orders/o1/status", json={"orderStatus": "delivered"})
+    assert response.get_json()[1]["deliveryAddress"] == NEW_ADDRESS
+    assert db.orders.find_one({"orderId": "o1"})["deliveryAddress"] == NEW_ADDRESS
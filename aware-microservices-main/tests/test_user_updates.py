@@ -0,0 +1,177 @@
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+import pymongo
+import pytest
+from dotenv import load_dotenv
+from flask import Flask
+from order_service.app.broadcast import OrderEventBroadcaster
+from order_service.app.events import apply_user_update, contact_version
+from order_service.app.indexes import ensure_indexes
+from order_service.app.partitions import DEFAULT_PARTITION, OrderPartition, PartitionRouter
+from order_service.app.snapshots import has_older_contact, older_contact_filter
+
+load_dotenv()
+
+OLD_ADDRESS = {"street": "1 Old St", "city": "Montreal", "state": "QC", "postalCode": "H1A",
+               "country": "Canada"}
+NEW_ADDRESS = {"street": "2 New St", "city": "Paris", "state": "IDF", "postalCode": "75001",
+               "country": "France"}
+CONFIG = {"ORDER_ARCHIVE_USER_UPDATES": "skip", "MONGO_READ_PREFERENCE": "primary",
+          "MONGO_MAX_STALENESS_SECONDS": 90, "ORDER_GROUP_COMMIT": False}
+
+
+def address_event(address, published_at):
+    return {"userId": "u1", "deliveryAddress": address, "publishedAt": published_at.isoformat()}
+
+
+def test_contact_versions_compare_publish_times():
+    version = contact_version({"publishedAt": "2024-05-01T12:00:00+02:00"})
+    assert version == datetime(2024, 5, 1, 10, 0)
+    assert contact_version({}) is None
+    order = {"contactVersions": {"deliveryAddress": version}}
+    assert has_older_contact(order, ["deliveryAddress"], version + timedelta(seconds=1))
+    assert not has_older_contact(order, ["deliveryAddress"], version)
+    assert has_older_contact(order, ["userEmails"], version)
+    assert older_contact_filter(["userEmails"], version) == {
+        "contactVersions.userEmails": {"$not": {"$gte": version}}}
+
+
+
+def test_contact_versions_prefer_the_user_version():
+    event = {"publishedAt": "2024-05-01T12:00:05+00:00", "version": "2024-05-01T12:00:00+00:00"}
+    assert contact_version(event) == datetime(2024, 5, 1, 12, 0)
+    # Events of publishers that do not send it yet, or send an invalid one
+    assert contact_version({**event, "version": "yesterday"}) == datetime(2024, 5, 1, 12, 0, 5)
+
+
+def test_published_events_carry_the_user_version(monkeypatch):
+    from user_service_v2.app import events
+
+    published = []
+
+    class Channel:
+        def basic_publish(self, exchange, routing_key, body, properties):
+            published.append(json.loads(body))
+
+    class Connection:
+        def close(self):
+            pass
+
+    monkeypatch.setattr(events, "create_channel", lambda: (Channel(), Connection()))
+    updated_at = datetime(2024, 5, 1, 12, 0, 0, 123000)
+    events.publish_user_update_event("u1", email=["a@example.com"], address=OLD_ADDRESS,
+                                     version=updated_at)
+    assert [contact_version(event) for event in published] == [updated_at, updated_at]
+
+
+class Channel:
+    """The channel of a consumer, as far as consume_user_update_events uses it."""
+
+    def __init__(self):
+        self.callback = None
+        self.settled = []
+
+    def basic_qos(self, prefetch_count):
+        pass
+
+    def basic_consume(self, queue, on_message_callback, auto_ack):
+        self.callback = on_message_callback
+        return "consumer"
+
+    def basic_cancel(self, consumer_tag):
+        pass
+
+    def basic_ack(self, delivery_tag):
+        self.settled.append(("ack", delivery_tag))
+
+    def basic_nack(self, delivery_tag, requeue):
+        self.settled.append(("nack", delivery_tag, requeue))
+
+
+def test_failed_events_are_rejected_without_stopping_the_consumer(monkeypatch):
+    from types import SimpleNamespace
+    from order_service.app import events
+    from shared.config.rabbitmq_config import USER_EVENT_QUEUES
+
+    channel = Channel()
+    monkeypatch.setattr(events, "create_channel", lambda: (channel, SimpleNamespace(
+        close=lambda: None)))
+    monkeypatch.setattr(events, "drain_legacy_queue", lambda connection: None)
+    stop = threading.Event()
+    stop.set()
+    events.consume_user_update_events(USER_EVENT_QUEUES[0], stop)
+
+    def deliver(tag, body, redelivered=False):
+        method = SimpleNamespace(delivery_tag=tag, routing_key="user.address.updated",
+                                 redelivered=redelivered)
+        channel.callback(channel, method, SimpleNamespace(headers=None), body)
+
+    def fail(event):
+        raise RuntimeError("MongoDB is unreachable")
+
+    monkeypatch.setattr(events, "apply_user_update", fail)
+    app = Flask(__name__)
+    app.config.update(MONGO_ROUND_TRIP_BUDGET=0, MONGO_ROUND_TRIP_BUDGETS="")
+    with app.app_context():
+        deliver(1, b"{not json")
+        deliver(2, json.dumps(address_event(NEW_ADDRESS, datetime.utcnow())).encode())
+        deliver(3, json.dumps(address_event(NEW_ADDRESS, datetime.utcnow())).encode(),
+                redelivered=True)
+        monkeypatch.setattr(events, "apply_user_update", lambda event: None)
+        deliver(4, json.dumps(address_event(NEW_ADDRESS, datetime.utcnow())).encode())
+    # Malformed events are dropped at once, failing ones are retried once
+    assert channel.settled == [("nack", 1, False), ("nack", 2, True), ("nack", 3, False),
+                               ("ack", 4)]
+
+@pytest.fixture
+def app():
+    client = pymongo.MongoClient(os.getenv("MONGO_URI", "mongodb://localhost:27017"),
+                                 serverSelectionTimeoutMS=2000)
+    try:
+        client.admin.command("ping")
+    except pymongo.errors.PyMongoError:
+        pytest.skip("MongoDB is not reachable")
+    db = client["test_user_updates"]
+    ensure_indexes(db)
+    app = Flask(__name__)
+    app.config.update(CONFIG)
+    app.order_partitions = PartitionRouter([OrderPartition(DEFAULT_PARTITION, db, app.config)])
+    app.user_snapshots_collection = db.user_snapshots
+    app.order_rollups_collection = db.order_rollups
+    app.order_list_cache = None
+    app.order_events = OrderEventBroadcaster(100)
+    now = datetime.utcnow()
+    db.orders.insert_many([{"orderId": f"o{i}", "userId": "u1", "orderStatus": "under process",
+                            "userEmails": ["old@example.com"], "deliveryAddress": OLD_ADDRESS,
+                            "items": [], "createdAt": now, "updatedAt": now}
+                           for i in range(3)])
+    yield app
+    client.drop_database(db.name)
+    client.close()
+
+
+@pytest.mark.parametrize("mode", ["embedded", "snapshot"])
+def test_older_update_applied_last_does_not_win(app, mode):
+    app.config["ORDER_CONTACT_MODE"] = mode
+    published = datetime.utcnow()
+    with app.app_context():
+        apply_user_update(address_event(NEW_ADDRESS, published))
+        apply_user_update(address_event(OLD_ADDRESS, published - timedelta(seconds=1)))
+        apply_user_update({"userId": "u1", "userEmails": ["new@example.com"],
+                           "publishedAt": (published - timedelta(seconds=2)).isoformat()})
+    db = app.order_partitions.partitions[0].db
+    if mode == "snapshot":
+        snapshot = db.user_snapshots.find_one({"_id": "u1"})
+        assert snapshot["deliveryAddress"] == NEW_ADDRESS
+        assert snapshot["userEmails"] == ["new@example.com"]
+        return
+    for order in db.orders.find():
+        assert order["deliveryAddress"] == NEW_ADDRESS
+        # The fields are versioned separately, so the older email update still applies
+        assert order["userEmails"] == ["new@example.com"]
+    # Only the orders actually updated are streamed: three address and three email events
+    events = app.order_events.wait_for_events(0, 0)
+    assert len(events) == 6
+    assert all(event.data["deliveryAddress"] == NEW_ADDRESS for event in events)